@@ -1,11 +1,97 @@
 # analytics.py - Simple analytics tracking system
+import base64
+import json
 import os
+import re
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from fastapi import Request
 from database import database
 from log_capture import add_log
-from ip_analysis import ip_analyzer
+from search_filters import search_condition
+from analytics_ingest import mouse_activity_queue, page_view_queue
+from analytics_rollups import analytics_rollups, IP_TEXT
+from heavy_hitters import heavy_hitters
+from visitor_sketches import visitor_sketches
+
+
+# Tokens minted by request_instrumentation for each tracked page view
+VIEW_TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,32}$')
+
+# Largest page get_unique_visitors will return
+UNIQUE_VISITORS_MAX_LIMIT = 500
+
+# Sort field -> keyset expression. Each is paired with id as a tiebreak
+# and backed by a matching (expression, id) index; free-text columns are
+# truncated so the index entries stay within btree size limits
+RECENT_VISITS_SORT_KEYS = {
+    'timestamp': "timestamp",
+    'page_path': "page_path",
+    'ip_address': f"COALESCE({IP_TEXT}, '')",
+    'user_agent': "left(COALESCE(user_agent, ''), 256)",
+    'referer': "left(COALESCE(referer, ''), 256)",
+}
+
+
+def encode_cursor(sort_field: str, sort_order: str, value: Any,
+                  row_id: int) -> str:
+    """Pack the last row's sort key into an opaque URL-safe cursor."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps(
+        {'f': sort_field, 'o': sort_order, 'v': value, 'id': row_id},
+        separators=(',', ':')
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_field: str,
+                  sort_order: str) -> Tuple[Any, int]:
+    """Unpack a cursor into ``(sort value, id)``.
+
+    Raises ValueError if the cursor is malformed or was issued for a
+    different sort.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        field, order = payload['f'], payload['o']
+        value, row_id = payload['v'], int(payload['id'])
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid cursor: {e}") from e
+
+    if field != sort_field or order != sort_order:
+        raise ValueError("Cursor does not match the requested sort")
+    if field == 'timestamp':
+        value = datetime.fromisoformat(value)
+    return value, row_id
+
+
+def sketch_visitor_counts(estimates: Dict[Tuple[str, str], int]):
+    """Shape sketch estimates like the exact visitor count queries."""
+    visitor_counts = {
+        'unique': estimates.get(('all', ''), 0),
+        'human': estimates.get(('human', ''), 0),
+        'bot_visitors': estimates.get(('visitor_type', 'bot'), 0),
+        'confirmed_human_visitors': estimates.get(
+            ('visitor_type', 'human'), 0),
+        'datacenter_visitors': estimates.get(('datacenter', ''), 0)
+    }
+    visitor_types = sorted(
+        ({'visitor_type': value, 'count': count}
+         for (dimension, value), count in estimates.items()
+         if dimension == 'visitor_type' and value),
+        key=lambda row: row['count'], reverse=True
+    )
+    return visitor_counts, visitor_types
+
+
+def _unique_counts_info(exact: bool) -> Dict[str, Any]:
+    return {
+        'exact': exact,
+        'relative_error': (0.0 if exact
+                           else round(visitor_sketches.relative_error, 4))
+    }
 
 
 class Analytics:
@@ -13,53 +99,31 @@ class Analytics:
 
     def __init__(self):
         self.enabled = os.getenv("ANALYTICS_ENABLED", "true").lower() == "true"
+        # Exact row counts stop here; larger totals are planner estimates
+        self.count_cap = int(os.getenv("ANALYTICS_COUNT_CAP", "10000"))
 
     async def track_page_view(
         self,
         request: Request,
         page_path: str,
-        mouse_activity: bool = False
+        mouse_activity: bool = False,
+        view_token: str = None
     ):
-        """Track a page view with IP analysis and bot detection."""
+        """Queue a page view for batched IP analysis and storage."""
         if not self.enabled:
             return
 
         try:
-            # Get basic request info
-            user_agent = request.headers.get("user-agent", "")
-            referer = request.headers.get("referer", "")
-            client_ip = self._get_client_ip(request)
-
-            # Perform IP analysis WITHOUT mouse_activity dependency
-            # to avoid circular reference
-            ip_analysis = await ip_analyzer.analyze_ip_basic(
-                client_ip, user_agent
-            )
-
-            # Store in database with basic IP analysis data
-            # visitor_type will be updated later when mouse activity is known
-            query = """
-            INSERT INTO page_analytics
-            (timestamp, page_path, ip_address, user_agent, referer,
-             mouse_activity, reverse_dns, visitor_type, is_datacenter, 
-             asn, organization)
-            VALUES (:timestamp, :page_path, :ip_address, :user_agent,
-                    :referer, :mouse_activity, :reverse_dns, :visitor_type,
-                    :is_datacenter, :asn, :organization)
-            """
-
-            await database.execute(query, {
+            # Only capture request data here; IP analysis and the INSERT
+            # happen in the background ingest writer
+            page_view_queue.enqueue({
                 'timestamp': datetime.utcnow(),
                 'page_path': page_path,
-                'ip_address': client_ip,
-                'user_agent': user_agent,
-                'referer': referer,
+                'ip_address': self._get_client_ip(request),
+                'user_agent': request.headers.get("user-agent", ""),
+                'referer': request.headers.get("referer", ""),
                 'mouse_activity': mouse_activity,
-                'reverse_dns': ip_analysis.get('reverse_dns'),
-                'visitor_type': 'pending',  # Will be updated with mouse activity
-                'is_datacenter': ip_analysis.get('is_datacenter', False),
-                'asn': ip_analysis.get('asn'),
-                'organization': ip_analysis.get('organization')
+                'view_token': view_token
             })
 
         except Exception as e:
@@ -70,67 +134,15 @@ class Analytics:
                 function="track_page_view"
             )
 
-    async def track_mouse_activity(self, request: Request, page_path: str):
-        """Update existing page view record to mark mouse activity detected"""
+    def track_mouse_activity(self, view_token: str) -> bool:
+        """Queue a mouse-activity beacon for the page view that was
+        rendered with ``view_token``."""
         if not self.enabled:
-            return
-
-        try:
-            client_ip = self._get_client_ip(request)
-            
-            # First check if there are any matching records
-            check_query = """
-            SELECT timestamp, mouse_activity
-            FROM page_analytics
-            WHERE ip_address = :ip_address
-                AND page_path = :page_path
-                AND timestamp > (NOW() - INTERVAL '5 minutes')
-            ORDER BY timestamp DESC
-            LIMIT 3
-            """
-            
-            existing_records = await database.fetch_all(check_query, {
-                'ip_address': client_ip,
-                'page_path': page_path
-            })
-            
-            add_log(
-                "INFO", "analytics",
-                f"Mouse activity for {client_ip} on {page_path}: "
-                f"Found {len(existing_records)} recent records",
-                function="track_mouse_activity"
-            )
-            
-            # Update the most recent visit from this IP for this page
-            # to mark mouse activity and update visitor classification
-            query = """
-            UPDATE page_analytics
-            SET mouse_activity = TRUE,
-                visitor_type = 'human'
-            WHERE ip_address = :ip_address
-                AND page_path = :page_path
-                AND timestamp > (NOW() - INTERVAL '5 minutes')
-                AND (mouse_activity = FALSE OR mouse_activity IS NULL)
-            """
-            
-            result = await database.execute(query, {
-                'ip_address': client_ip,
-                'page_path': page_path
-            })
-            
-            add_log(
-                "INFO", "analytics",
-                f"Mouse activity update for {client_ip}: "
-                f"Updated {result} records",
-                function="track_mouse_activity"
-            )
+            return False
 
-        except Exception as e:
-            add_log(
-                "WARNING", "analytics",
-                f"Mouse activity tracking error: {str(e)}",
-                function="track_mouse_activity"
-            )
+        if not VIEW_TOKEN_PATTERN.match(view_token or ''):
+            return False
+        return mouse_activity_queue.enqueue(view_token)
 
     def _get_client_ip(self, request: Request) -> str:
         """Get client IP from request headers"""
@@ -145,64 +157,65 @@ class Analytics:
 
         return request.client.host if request.client else "unknown"
 
-    async def get_summary(self, days: int = 30) -> Dict[str, Any]:
-        """Get analytics summary for the admin dashboard."""
+    async def get_summary(self, days: int = 30,
+                          exact: bool = False) -> Dict[str, Any]:
+        """Get analytics summary for the admin dashboard.
+
+        Unique visitor counts are merged from the daily HyperLogLog
+        sketches (whole UTC days, see ``unique_counts``) unless
+        ``exact`` is set or the sketches do not cover the window yet.
+        """
         try:
             since_date = datetime.utcnow() - timedelta(days=days)
 
+            # Aggregates come from the hourly/daily rollups plus raw rows
+            # for the current partial hour
+            pages_sql, pages_params = await analytics_rollups.source_sql(
+                'pages', since_date)
+
             # Total page views
             total_views = await database.fetch_one(
-                """SELECT COUNT(*) as total FROM page_analytics
-                WHERE timestamp >= :since_date""",
-                {'since_date': since_date}
+                f"""SELECT COALESCE(SUM(views), 0) as total
+                FROM {pages_sql} pages""",
+                pages_params
             )
 
-            # Unique visitors (by IP)
-            unique_visitors = await database.fetch_one(
-                """SELECT COUNT(DISTINCT ip_address) as unique
-                FROM page_analytics WHERE timestamp >= :since_date""",
-                {'since_date': since_date}
-            )
-
-            # Human visitors (by IP with mouse activity)
-            human_visitors = await database.fetch_one(
-                """SELECT COUNT(DISTINCT ip_address) as human
-                FROM page_analytics 
-                WHERE timestamp >= :since_date AND mouse_activity = true""",
-                {'since_date': since_date}
-            )
-
-            # Visitor type breakdown
-            visitor_types = await database.fetch_all(
-                """SELECT visitor_type, COUNT(DISTINCT ip_address) as count
-                FROM page_analytics 
-                WHERE timestamp >= :since_date AND visitor_type IS NOT NULL
-                GROUP BY visitor_type
-                ORDER BY count DESC""",
-                {'since_date': since_date}
-            )
-
-            # Bot vs Human stats
-            bot_stats = await database.fetch_one(
-                """SELECT 
-                    COUNT(DISTINCT CASE WHEN visitor_type = 'bot' THEN ip_address END) as bot_visitors,
-                    COUNT(DISTINCT CASE WHEN visitor_type = 'human' THEN ip_address END) as confirmed_human_visitors,
-                    COUNT(DISTINCT CASE WHEN is_datacenter = true THEN ip_address END) as datacenter_visitors
-                FROM page_analytics 
-                WHERE timestamp >= :since_date""",
-                {'since_date': since_date}
-            )
+            # Top pages, from the in-memory tracker when it covers the
+            # window
+            tracked = heavy_hitters.top('pages', since_date)
+            if tracked is not None:
+                top_pages = [{'page_path': path, 'views': views}
+                             for path, views in tracked]
+            else:
+                top_pages = await database.fetch_all(
+                    f"""SELECT page_path, SUM(views) as views
+                    FROM {pages_sql} pages
+                    GROUP BY page_path
+                    ORDER BY views DESC
+                    LIMIT 10""",
+                    pages_params
+                )
+                top_pages = [dict(row) for row in top_pages]
 
-            # Top pages
-            top_pages = await database.fetch_all(
-                """SELECT page_path, COUNT(*) as views
-                FROM page_analytics
-                WHERE timestamp >= :since_date
-                GROUP BY page_path
-                ORDER BY views DESC
-                LIMIT 10""",
-                {'since_date': since_date}
-            )
+            # Unique, human (mouse activity), bot and datacenter visitors
+            estimates = None
+            if not exact:
+                estimates = await visitor_sketches.estimate(
+                    since_date, ['all', 'human', 'visitor_type', 'datacenter']
+                )
+            if estimates is not None:
+                visitor_counts, visitor_types = sketch_visitor_counts(
+                    estimates)
+                paths = [page['page_path'] for page in top_pages]
+                page_estimates = (await visitor_sketches.estimate(
+                    since_date, ['page'], paths) if paths else None) or {}
+                for page in top_pages:
+                    page['unique_visitors'] = page_estimates.get(
+                        ('page', page['page_path']), 0)
+            else:
+                visitor_counts, visitor_types = \
+                    await self._exact_visitor_counts(since_date, top_pages)
+            bot_stats = visitor_counts
 
             # Recent visits
             recent_visits_raw = await database.fetch_all(
@@ -225,12 +238,12 @@ class Analytics:
 
             # Daily views for chart
             daily_views_raw = await database.fetch_all(
-                """SELECT DATE(timestamp) as date, COUNT(*) as views
-                FROM page_analytics
-                WHERE timestamp >= :since_date
-                GROUP BY DATE(timestamp)
+                f"""SELECT (bucket AT TIME ZONE 'UTC')::date as date,
+                       SUM(views) as views
+                FROM {pages_sql} pages
+                GROUP BY 1
                 ORDER BY date""",
-                {'since_date': since_date}
+                pages_params
             )
             
             # Convert dates to strings for JSON serialization
@@ -243,10 +256,10 @@ class Analytics:
 
             return {
                 'total_views': total_views['total'] if total_views else 0,
-                'unique_visitors': (unique_visitors['unique']
-                                    if unique_visitors else 0),
-                'human_visitors': (human_visitors['human']
-                                   if human_visitors else 0),
+                'unique_visitors': (visitor_counts['unique']
+                                    if visitor_counts else 0),
+                'human_visitors': (visitor_counts['human']
+                                   if visitor_counts else 0),
                 'visitor_types': [dict(row) for row in visitor_types],
                 'bot_visitors': (bot_stats['bot_visitors'] 
                                 if bot_stats else 0),
@@ -257,6 +270,7 @@ class Analytics:
                 'top_pages': [dict(row) for row in top_pages],
                 'recent_visits': [dict(row) for row in recent_visits],
                 'daily_views': daily_views,
+                'unique_counts': _unique_counts_info(estimates is None),
                 'period_days': days
             }
 
@@ -281,6 +295,51 @@ class Analytics:
                 'error': str(e)
             }
 
+    async def _exact_visitor_counts(self, since_date: datetime,
+                                    top_pages: List[Dict[str, Any]]):
+        """Exact distinct-IP counts for audits; adds ``unique_visitors``
+        to each of ``top_pages``."""
+        visitors_sql, visitors_params = \
+            await analytics_rollups.source_sql('visitors', since_date)
+
+        visitor_counts = await database.fetch_one(
+            f"""SELECT
+                COUNT(DISTINCT ip_address) as unique,
+                COUNT(DISTINCT ip_address)
+                    FILTER (WHERE mouse_activity) as human,
+                COUNT(DISTINCT CASE WHEN visitor_type = 'bot' THEN ip_address END) as bot_visitors,
+                COUNT(DISTINCT CASE WHEN visitor_type = 'human' THEN ip_address END) as confirmed_human_visitors,
+                COUNT(DISTINCT CASE WHEN is_datacenter = true THEN ip_address END) as datacenter_visitors
+            FROM {visitors_sql} visitors""",
+            visitors_params
+        )
+
+        # Visitor type breakdown
+        visitor_types = await database.fetch_all(
+            f"""SELECT visitor_type, COUNT(DISTINCT ip_address) as count
+            FROM {visitors_sql} visitors
+            WHERE visitor_type != ''
+            GROUP BY visitor_type
+            ORDER BY count DESC""",
+            visitors_params
+        )
+
+        if top_pages:
+            page_counts = await database.fetch_all(
+                """SELECT page_path, COUNT(DISTINCT ip_address) as unique_visitors
+                FROM page_analytics
+                WHERE timestamp >= :since_date AND page_path = ANY(:paths)
+                GROUP BY page_path""",
+                {'since_date': since_date,
+                 'paths': [page['page_path'] for page in top_pages]}
+            )
+            uniques = {row['page_path']: row['unique_visitors']
+                       for row in page_counts}
+            for page in top_pages:
+                page['unique_visitors'] = uniques.get(page['page_path'], 0)
+
+        return visitor_counts, visitor_types
+
     async def get_recent_visits_paginated(
         self, 
         offset: int = 0, 
@@ -288,69 +347,95 @@ class Analytics:
         days: int = 30,
         search: str = None,
         sort_field: str = 'timestamp',
-        sort_order: str = 'desc'
+        sort_order: str = 'desc',
+        cursor: str = None
     ):
-        """Get paginated recent visits with search and sorting"""
+        """Get paginated recent visits with search and sorting
+
+        Pages are keyed on (sort key, id): pass the ``next_cursor`` from
+        the previous response to continue. ``offset`` is only honoured
+        when no cursor is given. The total is counted up to
+        ``count_cap`` rows and estimated by the planner beyond that.
+        """
         try:
             since_date = datetime.utcnow() - timedelta(days=days)
             
             # Validate sort parameters
-            valid_sort_fields = {
-                'timestamp', 'page_path', 'ip_address', 
-                'user_agent', 'referer'
-            }
-            if sort_field not in valid_sort_fields:
+            if sort_field not in RECENT_VISITS_SORT_KEYS:
                 sort_field = 'timestamp'
             
             if sort_order.lower() not in {'asc', 'desc'}:
                 sort_order = 'desc'
+            sort_order = sort_order.lower()
+            sort_key = RECENT_VISITS_SORT_KEYS[sort_field]
             
             # Build WHERE conditions
             where_conditions = ["timestamp >= :since_date"]
-            params = {
-                'since_date': since_date,
-                'limit': limit,
-                'offset': offset
-            }
+            params = {'since_date': since_date}
             
-            # Add search condition
-            if search:
-                where_conditions.append(
-                    "(page_path ILIKE :search OR ip_address ILIKE :search OR "
-                    "user_agent ILIKE :search OR referer ILIKE :search)"
-                )
-                params['search'] = f"%{search}%"
+            # Add search condition (trigram-indexed)
+            search_sql, search_params = search_condition(
+                'page_analytics', search)
+            if search_sql:
+                where_conditions.append(search_sql)
+                params.update(search_params)
+            
+            filter_clause = " AND ".join(where_conditions)
+            page_conditions = list(where_conditions)
+            page_params = dict(params, limit=limit + 1)
             
-            where_clause = " AND ".join(where_conditions)
+            if cursor:
+                cursor_value, cursor_id = decode_cursor(
+                    cursor, sort_field, sort_order)
+                comparison = '<' if sort_order == 'desc' else '>'
+                page_conditions.append(
+                    f"({sort_key}, id) {comparison} "
+                    f"(:cursor_value, :cursor_id)"
+                )
+                page_params.update(cursor_value=cursor_value,
+                                   cursor_id=cursor_id)
+                offset_clause = ""
+            else:
+                page_params['offset'] = offset
+                offset_clause = "OFFSET :offset"
             
-            # Get recent visits with search and sorting
+            # Get recent visits with search and sorting; one extra row
+            # tells us whether another page exists
             query = f"""
-                SELECT timestamp, page_path, ip_address, user_agent, referer,
-                       mouse_activity, visitor_type, reverse_dns, is_datacenter,
-                       asn, organization
+                SELECT id, timestamp, page_path, ip_address, user_agent,
+                       referer, mouse_activity, visitor_type, reverse_dns,
+                       is_datacenter, asn, organization,
+                       {sort_key} AS sort_value
                 FROM page_analytics
-                WHERE {where_clause}
-                ORDER BY {sort_field} {sort_order.upper()}
-                LIMIT :limit OFFSET :offset
+                WHERE {" AND ".join(page_conditions)}
+                ORDER BY {sort_key} {sort_order.upper()},
+                         id {sort_order.upper()}
+                LIMIT :limit {offset_clause}
             """
             
-            recent_visits_raw = await database.fetch_all(query, params)
+            recent_visits_raw = await database.fetch_all(query, page_params)
+            has_more = len(recent_visits_raw) > limit
+            recent_visits_raw = recent_visits_raw[:limit]
             
-            # Get total count for pagination info
-            count_query = f"""
-                SELECT COUNT(*) as total
-                FROM page_analytics
-                WHERE {where_clause}
-            """
-            count_params = {k: v for k, v in params.items() 
-                          if k not in ['limit', 'offset']}
-            total_count_result = await database.fetch_one(count_query, count_params)
-            total_count = total_count_result['total'] if total_count_result else 0
+            next_cursor = None
+            if has_more and recent_visits_raw:
+                last = recent_visits_raw[-1]
+                next_cursor = encode_cursor(
+                    sort_field, sort_order, last['sort_value'], last['id'])
+            
+            # The total only changes with the filters, so it is computed
+            # for the first page and reused by the client while scrolling
+            total_count = None
+            total_is_estimate = False
+            if not cursor:
+                total_count, total_is_estimate = await self._count_visits(
+                    filter_clause, params)
             
             # Convert timestamps to strings for JSON serialization
             recent_visits = []
             for row in recent_visits_raw:
                 row_dict = dict(row)
+                row_dict.pop('sort_value', None)
                 if row_dict['timestamp']:
                     row_dict['timestamp'] = row_dict['timestamp'].strftime(
                         '%Y-%m-%d %H:%M:%S')
@@ -359,7 +444,9 @@ class Analytics:
             return {
                 'visits': recent_visits,
                 'total_count': total_count,
-                'has_more': offset + limit < total_count
+                'total_is_estimate': total_is_estimate,
+                'has_more': has_more,
+                'next_cursor': next_cursor
             }
             
         except Exception as e:
@@ -371,44 +458,137 @@ class Analytics:
             return {
                 'visits': [],
                 'total_count': 0,
+                'total_is_estimate': False,
                 'has_more': False,
+                'next_cursor': None,
                 'error': str(e)
             }
 
-    async def get_unique_visitors(self, days: int = 7):
-        """Get unique visitors with their view counts and last visit times"""
+    async def _count_visits(self, where_clause: str,
+                            params: Dict[str, Any]) -> Tuple[int, bool]:
+        """Count matching rows, stopping at ``count_cap``.
+
+        Returns ``(total, is_estimate)``. When the cap is reached the
+        planner's row estimate is used instead of scanning further.
+        """
+        capped = await database.fetch_one(
+            f"""
+                SELECT COUNT(*) AS total FROM (
+                    SELECT 1 FROM page_analytics
+                    WHERE {where_clause}
+                    LIMIT :count_cap
+                ) capped
+            """,
+            dict(params, count_cap=self.count_cap)
+        )
+        total = capped['total'] if capped else 0
+        if total < self.count_cap:
+            return total, False
+
+        try:
+            plan_row = await database.fetch_one(
+                f"""
+                    EXPLAIN (FORMAT JSON)
+                    SELECT 1 FROM page_analytics WHERE {where_clause}
+                """,
+                params
+            )
+            plan = plan_row[0] if plan_row else None
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+        except Exception as e:
+            add_log(
+                "WARNING",
+                f"Row estimate unavailable, using capped count: {str(e)}",
+                module="analytics", function="_count_visits"
+            )
+            estimate = total
+        return max(total, estimate), True
+
+    async def get_unique_visitors(self, days: int = 7, limit: int = 100,
+                                  cursor: str = None):
+        """Get a page of unique visitors with their view counts and last
+        visit times, busiest first.
+
+        Pages are keyed on (total views, IP); pass ``next_cursor`` to
+        continue. ``total_unique`` is only computed for the first page.
+        """
         try:
             since_date = datetime.utcnow() - timedelta(days=days)
-            
-            query = """
-                SELECT 
-                    ip_address,
-                    COUNT(*) as total_views,
-                    MAX(timestamp) as last_visit
-                FROM page_analytics
-                WHERE timestamp >= :since_date
+            limit = max(1, min(limit, UNIQUE_VISITORS_MAX_LIMIT))
+            visitors_sql, params = await analytics_rollups.source_sql(
+                'visitors', since_date)
+            params = dict(params, limit=limit + 1)
+
+            having = ""
+            if cursor:
+                (cursor_views, cursor_ip), _ = decode_cursor(
+                    cursor, 'total_views', 'desc')
+                having = """HAVING SUM(views) < :cursor_views
+                    OR (SUM(views) = :cursor_views
+                        AND ip_address > :cursor_ip)"""
+                params.update(cursor_views=cursor_views, cursor_ip=cursor_ip)
+
+            rows = await database.fetch_all(
+                f"""SELECT ip_address, SUM(views) as total_views
+                FROM {visitors_sql} visitors
                 GROUP BY ip_address
-                ORDER BY total_views DESC, last_visit DESC
-            """
-            
-            visitors_raw = await database.fetch_all(query, {
-                'since_date': since_date
-            })
-            
-            # Convert timestamps to strings for JSON serialization
+                {having}
+                ORDER BY total_views DESC, ip_address
+                LIMIT :limit""",
+                params
+            )
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+
+            # Exact last visit only for this page's IPs
+            last_visits = {}
+            if rows:
+                detail_rows = await database.fetch_all(
+                    f"""SELECT {IP_TEXT} as ip_address,
+                           MAX(timestamp) as last_visit
+                    FROM page_analytics
+                    WHERE timestamp >= :since_date
+                        AND ip_address = ANY(CAST(:ips AS INET[]))
+                    GROUP BY 1""",
+                    {'since_date': since_date,
+                     'ips': [row['ip_address'] for row in rows]}
+                )
+                last_visits = {row['ip_address']: row['last_visit']
+                               for row in detail_rows}
+
             visitors = []
-            for row in visitors_raw:
+            for row in rows:
                 row_dict = dict(row)
-                if row_dict['last_visit']:
-                    row_dict['last_visit'] = row_dict['last_visit'].strftime(
-                        '%Y-%m-%d %H:%M:%S')
+                last_visit = last_visits.get(row_dict['ip_address'])
+                row_dict['last_visit'] = (
+                    last_visit.strftime('%Y-%m-%d %H:%M:%S')
+                    if last_visit else None)
                 visitors.append(row_dict)
-            
+
+            next_cursor = None
+            if has_more:
+                last = rows[-1]
+                # Aggregated rows have no id; the IP breaks ties instead
+                next_cursor = encode_cursor(
+                    'total_views', 'desc',
+                    [last['total_views'], last['ip_address']], 0)
+
+            total_unique = None
+            total_is_estimate = False
+            if not cursor:
+                total_unique, total_is_estimate = \
+                    await self._count_unique_visitors(since_date)
+
             return {
                 'visitors': visitors,
-                'total_unique': len(visitors)
+                'total_unique': total_unique,
+                'total_is_estimate': total_is_estimate,
+                'has_more': has_more,
+                'next_cursor': next_cursor
             }
-            
+
         except Exception as e:
             add_log(
                 "ERROR", "analytics",
@@ -418,54 +598,91 @@ class Analytics:
             return {
                 'visitors': [],
                 'total_unique': 0,
+                'total_is_estimate': False,
+                'has_more': False,
+                'next_cursor': None,
                 'error': str(e)
             }
 
-    async def get_top_referrers(self, days: int = 7):
-        """Get top referrers with visit counts for the specified period."""
+    async def _count_unique_visitors(self, since_date: datetime):
+        """Distinct visitor IPs since ``since_date`` and whether the
+        number is a sketch estimate."""
+        estimates = await visitor_sketches.estimate(since_date, ['all'])
+        if estimates is not None:
+            return estimates.get(('all', ''), 0), True
+        visitors_sql, params = await analytics_rollups.source_sql(
+            'visitors', since_date)
+        row = await database.fetch_one(
+            f"""SELECT COUNT(DISTINCT ip_address) as total
+            FROM {visitors_sql} visitors""",
+            params
+        )
+        return (row['total'] if row else 0), False
+
+    async def get_top_referrers(self, days: int = 7, exact: bool = False,
+                                hours: Optional[int] = None):
+        """Get top referrers with visit counts for the specified period.
+
+        ``hours``, if given, overrides ``days``. Unique visitors per
+        referrer come from the daily sketches unless ``exact`` is set or
+        the sketches do not cover the window yet.
+        """
         try:
-            cutoff_date = datetime.now() - timedelta(days=days)
-
-            query = """
-            SELECT
-                referer,
-                COUNT(*) as visit_count,
-                COUNT(DISTINCT ip_address) as unique_visitors
-            FROM page_analytics
-            WHERE timestamp >= :cutoff_date
-                AND referer IS NOT NULL
-                AND referer != ''
-                AND referer != 'Direct'
-            GROUP BY referer
-            ORDER BY visit_count DESC
-            LIMIT 10
-            """
+            cutoff_date = datetime.utcnow() - (
+                timedelta(hours=hours) if hours else timedelta(days=days))
+            referrers_sql, params = await analytics_rollups.source_sql(
+                'referrers', cutoff_date)
+
+            tracked = heavy_hitters.top('referrers', cutoff_date)
+            if tracked is not None:
+                result = [{'referrer_domain': domain, 'visit_count': views}
+                          for domain, views in tracked]
+            else:
+                result = await database.fetch_all(
+                    f"""SELECT referrer_domain, SUM(views) as visit_count
+                    FROM {referrers_sql} referrers
+                    GROUP BY referrer_domain
+                    ORDER BY visit_count DESC
+                    LIMIT 10""",
+                    params
+                )
 
-            result = await database.fetch_all(
-                query, {"cutoff_date": cutoff_date}
-            )
+            domains = [row['referrer_domain'] for row in result]
+            estimates = None
+            if not exact and domains:
+                estimates = await visitor_sketches.estimate(
+                    cutoff_date, ['referrer'], domains)
+            if estimates is not None:
+                uniques = {domain: estimates.get(('referrer', domain), 0)
+                           for domain in domains}
+            elif domains:
+                unique_rows = await database.fetch_all(
+                    f"""SELECT referrer_domain,
+                           COUNT(DISTINCT ip_address) as unique_visitors
+                    FROM {referrers_sql} referrers
+                    WHERE referrer_domain = ANY(:domains)
+                    GROUP BY referrer_domain""",
+                    dict(params, domains=domains)
+                )
+                uniques = {row['referrer_domain']: row['unique_visitors']
+                           for row in unique_rows}
+            else:
+                uniques = {}
 
             referrers = []
             for row in result:
                 row_dict = dict(row)
-                # Clean up referrer display
-                if row_dict['referer']:
-                    # Extract domain from full URL
-                    try:
-                        from urllib.parse import urlparse
-                        parsed = urlparse(row_dict['referer'])
-                        row_dict['domain'] = (
-                            parsed.netloc or row_dict['referer']
-                        )
-                    except Exception:
-                        row_dict['domain'] = row_dict['referer']
-                else:
-                    row_dict['domain'] = 'Unknown'
+                row_dict['unique_visitors'] = uniques.get(
+                    row_dict['referrer_domain'], 0)
+                domain = row_dict.pop('referrer_domain') or 'Unknown'
+                row_dict['referer'] = domain
+                row_dict['domain'] = domain
                 referrers.append(row_dict)
 
             return {
                 'referrers': referrers,
-                'total_referrers': len(referrers)
+                'total_referrers': len(referrers),
+                'unique_counts': _unique_counts_info(estimates is None)
             }
 
         except Exception as e:
@@ -480,34 +697,76 @@ class Analytics:
                 'error': str(e)
             }
 
-    async def get_top_ips(self, days: int = 7):
-        """Get top IP addresses with visit counts for the specified period."""
-        try:
-            cutoff_date = datetime.now() - timedelta(days=days)
-
-            query = """
-            SELECT
-                ip_address,
-                COUNT(*) as visit_count,
-                COUNT(DISTINCT page_path) as unique_pages,
-                visitor_type,
-                organization,
-                MAX(timestamp) as last_visit
-            FROM page_analytics
-            WHERE timestamp >= :cutoff_date
-                AND ip_address IS NOT NULL
-            GROUP BY ip_address, visitor_type, organization
-            ORDER BY visit_count DESC
-            LIMIT 10
-            """
+    async def get_top_ips(self, days: int = 7, hours: Optional[int] = None):
+        """Get top IP addresses with visit counts for the specified period.
 
-            result = await database.fetch_all(
-                query, {"cutoff_date": cutoff_date}
-            )
+        ``hours``, if given, overrides ``days``.
+        """
+        try:
+            cutoff_date = datetime.utcnow() - (
+                timedelta(hours=hours) if hours else timedelta(days=days))
+
+            tracked = heavy_hitters.top('ips', cutoff_date)
+            if tracked is not None:
+                # Type and organization are filled in from the detail
+                # lookup below
+                result = [{'ip_address': ip, 'visit_count': views}
+                          for ip, views in tracked]
+            else:
+                visitors_sql, params = await analytics_rollups.source_sql(
+                    'visitors', cutoff_date)
+                query = f"""
+                SELECT
+                    ip_address,
+                    SUM(views) as visit_count,
+                    visitor_type,
+                    organization
+                FROM {visitors_sql} visitors
+                GROUP BY ip_address, visitor_type, organization
+                ORDER BY visit_count DESC
+                LIMIT 10
+                """
+                result = await database.fetch_all(query, params)
+
+            # Distinct pages, the exact last visit and the latest
+            # classification only for the top IPs, which is an indexed
+            # lookup on ip_address
+            details = {}
+            if result:
+                ip_params = {'cutoff_date': cutoff_date}
+                placeholders = []
+                for i, row in enumerate(result):
+                    ip_params[f'ip_{i}'] = row['ip_address']
+                    placeholders.append(f':ip_{i}')
+                detail_rows = await database.fetch_all(
+                    f"""SELECT
+                        {IP_TEXT} as ip_address,
+                        COUNT(DISTINCT page_path) as unique_pages,
+                        MAX(timestamp) as last_visit,
+                        (array_agg(visitor_type ORDER BY timestamp DESC)
+                            )[1] as visitor_type,
+                        (array_agg(organization ORDER BY timestamp DESC)
+                            )[1] as organization
+                    FROM page_analytics
+                    WHERE timestamp >= :cutoff_date
+                        AND ip_address IN ({', '.join(placeholders)})
+                    GROUP BY 1""",
+                    ip_params
+                )
+                details = {row['ip_address']: row for row in detail_rows}
 
             ips = []
             for row in result:
                 row_dict = dict(row)
+                detail = details.get(row_dict['ip_address'])
+                row_dict['unique_pages'] = (
+                    detail['unique_pages'] if detail else 0
+                )
+                row_dict['last_visit'] = detail['last_visit'] if detail else None
+                for field in ('visitor_type', 'organization'):
+                    if field not in row_dict and detail:
+                        row_dict[field] = detail[field]
+                    row_dict[field] = row_dict.get(field) or None
                 if row_dict['last_visit']:
                     row_dict['last_visit'] = row_dict['last_visit'].strftime(
                         '%Y-%m-%d %H:%M:%S')
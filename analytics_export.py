@@ -0,0 +1,164 @@
+"""
+Analytics Export
+Streams page_analytics rows for a date range as NDJSON or CSV.
+
+Rows are read through a server-side cursor (``database.iterate``) and
+encoded in fixed-size batches, optionally through an incremental gzip
+compressor, so memory use does not depend on how many rows are exported.
+"""
+import csv
+import io
+import ipaddress
+import json
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from analytics_rollups import IP_TEXT
+from database import database
+from log_capture import add_log
+
+
+EXPORT_COLUMNS = (
+    'id', 'timestamp', 'page_path', 'ip_address', 'user_agent', 'referer',
+    'visitor_type', 'mouse_activity', 'is_datacenter', 'reverse_dns',
+    'asn', 'organization'
+)
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Rows encoded per chunk handed to the response
+BATCH_ROWS = 500
+
+# Spreadsheet apps treat cells starting with these as formulas
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def build_export_query(since: datetime,
+                       until: Optional[datetime] = None,
+                       page_path: Optional[str] = None,
+                       visitor_type: Optional[str] = None,
+                       ip_address: Optional[str] = None
+                       ) -> Tuple[str, Dict[str, Any]]:
+    """Build the export SELECT in (timestamp, id) order.
+
+    ``ip_address`` may be a single address or a CIDR network. Raises
+    ValueError for an invalid address.
+    """
+    conditions = ["timestamp >= :since"]
+    params: Dict[str, Any] = {'since': since}
+    if until is not None:
+        conditions.append("timestamp < :until")
+        params['until'] = until
+    if page_path:
+        conditions.append("page_path = :page_path")
+        params['page_path'] = page_path
+    if visitor_type:
+        conditions.append("visitor_type = :visitor_type")
+        params['visitor_type'] = visitor_type
+    if ip_address:
+        params['ip_address'] = str(
+            ipaddress.ip_network(ip_address, strict=False))
+        conditions.append("ip_address <<= CAST(:ip_address AS INET)")
+
+    columns = [f"{IP_TEXT} AS ip_address" if column == 'ip_address'
+               else column for column in EXPORT_COLUMNS]
+    query = (
+        f"SELECT {', '.join(columns)} FROM page_analytics "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY timestamp, id"
+    )
+    return query, params
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_ndjson(rows: Iterable[Dict[str, Any]]) -> bytes:
+    return ''.join(
+        json.dumps({column: _plain(row[column]) for column in EXPORT_COLUMNS},
+                   separators=(',', ':'), default=str) + '\n'
+        for row in rows
+    ).encode()
+
+
+def _csv_cell(value: Any) -> Any:
+    value = _plain(value)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class CsvEncoder:
+    """Reuses one buffer for every batch."""
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _take(self) -> bytes:
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def header(self) -> bytes:
+        self._writer.writerow(EXPORT_COLUMNS)
+        return self._take()
+
+    def encode(self, rows: Iterable[Dict[str, Any]]) -> bytes:
+        self._writer.writerows(
+            [_csv_cell(row[column]) for column in EXPORT_COLUMNS]
+            for row in rows
+        )
+        return self._take()
+
+
+async def export_rows(query: str, params: Dict[str, Any],
+                      fmt: str) -> AsyncIterator[bytes]:
+    """Yield encoded chunks of ``BATCH_ROWS`` rows from the cursor."""
+    csv_encoder = CsvEncoder() if fmt == 'csv' else None
+    encode = csv_encoder.encode if csv_encoder else encode_ndjson
+    if csv_encoder:
+        yield csv_encoder.header()
+
+    exported = 0
+    batch = []
+    try:
+        async for row in database.iterate(query, params):
+            batch.append(row)
+            if len(batch) >= BATCH_ROWS:
+                yield encode(batch)
+                exported += len(batch)
+                batch = []
+        if batch:
+            yield encode(batch)
+            exported += len(batch)
+    except Exception as e:
+        # Headers are already sent; cutting the stream signals failure
+        add_log(
+            "ERROR", f"Export failed after {exported} rows: {str(e)}",
+            module="analytics_export", function="export_rows"
+        )
+        raise
+
+    add_log(
+        "INFO", f"Exported {exported} page views as {fmt}",
+        module="analytics_export", function="export_rows"
+    )
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Compress a byte stream into a single gzip member on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
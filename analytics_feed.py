@@ -0,0 +1,100 @@
+"""
+Analytics Live Feed
+Fans recorded page views out to Server-Sent Event clients from a bounded
+in-process ring buffer, so watching live traffic costs no database
+queries.
+
+The ingest writer publishes each flushed batch into the shared ring and
+SSE loop of live_feed.py; event ids are ring sequence numbers. Each
+worker process has its own ring and sees the page views it ingested.
+"""
+import os
+from datetime import datetime, timezone
+from typing import (
+    Any, AsyncIterator, Callable, Dict, Iterable, Optional, Sequence
+)
+
+from live_feed import LiveFeed
+from visitor_sketches import referrer_domain
+
+
+# Page view fields sent to clients
+FEED_FIELDS = ('timestamp', 'page_path', 'ip_address', 'visitor_type',
+               'is_datacenter', 'organization')
+
+
+def feed_event(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Trim a written page_analytics row down to what the feed shows."""
+    event = {field: row.get(field) for field in FEED_FIELDS}
+    timestamp = event['timestamp']
+    if isinstance(timestamp, datetime):
+        # Ingest timestamps are naive UTC
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        event['timestamp'] = timestamp.isoformat()
+    event['referrer'] = (row.get('referrer_domain')
+                         or referrer_domain(row.get('referer')))
+    return event
+
+
+def event_filter(path_prefix: Optional[str] = None,
+                 visitor_types: Optional[Iterable[str]] = None
+                 ) -> Callable[[Dict[str, Any]], bool]:
+    """Build a per-connection predicate."""
+    types = {t for t in (visitor_types or ()) if t}
+
+    def matches(event: Dict[str, Any]) -> bool:
+        if path_prefix and not (event.get('page_path') or '').startswith(
+                path_prefix):
+            return False
+        if types and event.get('visitor_type') not in types:
+            return False
+        return True
+    return matches
+
+
+class AnalyticsFeed(LiveFeed):
+    """Bounded ring of recent page views with async readers."""
+
+    event_type = 'pageview'
+
+    def __init__(self,
+                 size: Optional[int] = None,
+                 max_clients: Optional[int] = None,
+                 heartbeat: Optional[float] = None):
+        super().__init__(
+            size or int(os.getenv("ANALYTICS_FEED_SIZE", "1000")),
+            max_clients or int(
+                os.getenv("ANALYTICS_FEED_MAX_CLIENTS", "20")),
+            heartbeat or float(os.getenv("ANALYTICS_FEED_HEARTBEAT", "15"))
+        )
+
+    def publish(self, rows: Sequence[Dict[str, Any]]):
+        """Append written page views; never blocks."""
+        self._append([feed_event(row) for row in rows])
+
+    @property
+    def last_id(self) -> int:
+        return self._seq
+
+    def subscribe(self,
+                  matches: Callable[[Dict[str, Any]], bool],
+                  is_disconnected: Callable[[], Any],
+                  last_event_id: Optional[int] = None
+                  ) -> AsyncIterator[str]:
+        """SSE frames until the client disconnects.
+
+        Reconnecting clients pass ``Last-Event-ID`` and resume from
+        there if those events are still in the ring. Pass the stream to
+        ``response``.
+        """
+        cursor = (last_event_id if last_event_id is not None
+                  and last_event_id <= self._seq else self._seq)
+        return self._stream(matches, is_disconnected, cursor)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), 'last_id': self._seq}
+
+
+# Global live feed
+analytics_feed = AnalyticsFeed()
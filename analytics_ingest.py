@@ -0,0 +1,527 @@
+"""
+Analytics Ingestion Pipeline
+Buffers page views in memory and writes them to the database in batches
+so the request path never waits on an INSERT. Batches the database
+cannot take are spooled to disk and replayed once it recovers.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+from analytics_feed import analytics_feed
+from analytics_rollups import IP_TEXT
+from database import database
+from heavy_hitters import heavy_hitters
+from log_capture import add_log
+from referrer_domains import referrer_domains
+from spool import Spool, database_breaker, spool_replayer, write_isolating
+from ttl_cache import TTLCache
+from user_agents import user_agents
+from visitor_sketches import visitor_sketches
+
+
+# Columns written to page_analytics for every buffered page view
+PAGE_VIEW_COLUMNS = (
+    'timestamp', 'page_path', 'ip_address', 'user_agent', 'referer',
+    'mouse_activity', 'reverse_dns', 'visitor_type', 'is_datacenter',
+    'asn', 'organization', 'view_token', 'referrer_domain_id',
+    'user_agent_id'
+)
+
+OVERFLOW_POLICIES = {'drop_newest', 'drop_oldest'}
+
+# Returned by mouse-activity updates so the human sketches can be updated
+ACTIVITY_RETURNING = f"{IP_TEXT} AS ip_address, timestamp"
+
+
+class PageViewIngestQueue:
+    """Bounded in-process queue with a background batch writer.
+
+    The middleware calls ``enqueue`` which never awaits. A single writer
+    task enriches the buffered events with IP analysis and flushes them as
+    one multi-row INSERT when either ``batch_size`` events are waiting or
+    ``flush_interval`` seconds have elapsed since the last flush.
+    """
+
+    def __init__(self,
+                 max_size: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 overflow_policy: Optional[str] = None):
+        self.max_size = max_size or int(
+            os.getenv("ANALYTICS_QUEUE_SIZE", "10000"))
+        self.batch_size = batch_size or int(
+            os.getenv("ANALYTICS_BATCH_SIZE", "200"))
+        self.flush_interval = flush_interval or float(
+            os.getenv("ANALYTICS_FLUSH_INTERVAL", "2.0"))
+        policy = (overflow_policy or os.getenv(
+            "ANALYTICS_OVERFLOW_POLICY", "drop_newest")).lower()
+        self.overflow_policy = (
+            policy if policy in OVERFLOW_POLICIES else 'drop_newest'
+        )
+
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        # view token -> buffered event, so activity beacons that arrive
+        # before the flush are applied in memory
+        self._by_token: Dict[str, Dict[str, Any]] = {}
+        # view token -> page_analytics.id for recently written rows
+        self.view_ids = TTLCache(
+            max_entries=int(os.getenv("ANALYTICS_VIEW_ID_CACHE_SIZE",
+                                      "50000")),
+            default_ttl=float(os.getenv("ANALYTICS_VIEW_TOKEN_TTL", "1800"))
+        )
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.counters = {
+            'queued': 0,
+            'flushed': 0,
+            'dropped': 0,
+            'rejected': 0,
+            'failed': 0,
+            'spooled': 0,
+            'batches': 0
+        }
+        self.last_flush_at: Optional[float] = None
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+
+    def enqueue(self, event: Dict[str, Any]) -> bool:
+        """Buffer a page view without blocking.
+
+        Returns False when the event was rejected by the overflow policy.
+        """
+        if self._stopping:
+            self.counters['dropped'] += 1
+            return False
+
+        if len(self._buffer) >= self.max_size:
+            self.counters['dropped'] += 1
+            if self.overflow_policy == 'drop_newest':
+                return False
+            # drop_oldest: make room by discarding the oldest event
+            self._by_token.pop(
+                self._buffer.popleft().get('view_token'), None)
+
+        self._buffer.append(event)
+        if event.get('view_token'):
+            self._by_token[event['view_token']] = event
+        self.counters['queued'] += 1
+
+        if len(self._buffer) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+        return True
+
+    def mark_buffered_activity(self, view_token: str) -> bool:
+        """Flag a still-buffered page view as having human activity.
+
+        Returns False if the view has already been handed to the writer.
+        """
+        event = self._by_token.get(view_token)
+        if event is None:
+            return False
+        event['mouse_activity'] = True
+        return True
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Start the background writer on the running event loop."""
+        if self._writer_task and not self._writer_task.done():
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._writer_task = asyncio.create_task(self._run_writer())
+
+    async def stop(self):
+        """Stop accepting events and drain everything still buffered."""
+        self._stopping = True
+        if self._wakeup:
+            self._wakeup.set()
+        if self._writer_task:
+            try:
+                await self._writer_task
+            except Exception as e:
+                print(f"Analytics ingest writer stopped with error: {e}")
+            self._writer_task = None
+
+        # Guaranteed drain even if the writer never started
+        while self._buffer:
+            if not await self.flush():
+                break
+
+    async def _run_writer(self):
+        """Flush on a size or time trigger until stopped."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while self._buffer:
+                await self.flush()
+                if len(self._buffer) < self.batch_size:
+                    break
+
+    # ------------------------------------------------------------------
+    # Consumer side
+    # ------------------------------------------------------------------
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            event = self._buffer.popleft()
+            self._by_token.pop(event.get('view_token'), None)
+            batch.append(event)
+        return batch
+
+    async def flush(self) -> bool:
+        """Write one batch to the database, or spool it while the database
+        is unavailable. Returns False if the batch was lost."""
+        batch = self._take_batch()
+        if not batch:
+            return True
+
+        try:
+            rows = await self._enrich(batch)
+            rows = await self._write_or_spool(rows)
+            if not rows:
+                return False
+            visitor_sketches.observe(rows)
+            heavy_hitters.observe(rows)
+            analytics_feed.publish(rows)
+            self.counters['batches'] += 1
+            self.last_flush_at = time.time()
+            return True
+        except Exception as e:
+            self.counters['failed'] += len(batch)
+            add_log(
+                "WARNING",
+                f"Failed to flush {len(batch)} page views: {str(e)}",
+                module="analytics_ingest", function="flush"
+            )
+            return False
+
+    async def _write_or_spool(
+            self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert the rows unless the breaker is open; fall back to the
+        spool. Returns the rows that were written or spooled."""
+        unwritten = rows
+        rejected: List[Dict[str, Any]] = []
+        if database_breaker.allow():
+            # Rows the database refuses are dropped on their own
+            rejected, unwritten, error = await write_isolating(
+                self._write_rows, rows)
+            if rejected:
+                self.counters['rejected'] += len(rejected)
+                add_log(
+                    "WARNING",
+                    f"Dropped {len(rejected)} page views the database "
+                    f"rejected",
+                    module="analytics_ingest", function="flush"
+                )
+            if error is None:
+                database_breaker.record_success()
+            else:
+                database_breaker.record_error(error)
+                add_log(
+                    "WARNING",
+                    f"Spooling {len(unwritten)} page views: {str(error)}",
+                    module="analytics_ingest", function="flush"
+                )
+            self.counters['flushed'] += (
+                len(rows) - len(rejected) - len(unwritten))
+
+        left_out = {id(row) for row in rejected + unwritten}
+        stored = [row for row in rows if id(row) not in left_out]
+        if unwritten:
+            # Counted in the sketches now; the replay only writes the rows
+            spooled = await asyncio.to_thread(page_view_spool.append,
+                                              unwritten)
+            self.counters['spooled'] += spooled
+            if spooled:
+                stored.extend(unwritten)
+            else:
+                self.counters['failed'] += len(unwritten)
+        return stored
+
+    async def _enrich(self,
+                      batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Attach IP analysis to each buffered event."""
+        from ip_analysis import ip_analyzer
+
+        analyses = await asyncio.gather(
+            *(ip_analyzer.analyze_ip_basic(
+                event['ip_address'], event['user_agent'])
+              for event in batch),
+            return_exceptions=True
+        )
+
+        rows = []
+        for event, analysis in zip(batch, analyses):
+            if isinstance(analysis, Exception):
+                analysis = {}
+            rows.append({
+                'timestamp': event['timestamp'],
+                'page_path': event['page_path'],
+                'ip_address': event['ip_address'],
+                'user_agent': event['user_agent'],
+                'referer': event['referer'],
+                'mouse_activity': event.get('mouse_activity', False),
+                'reverse_dns': analysis.get('reverse_dns'),
+                # Verified crawlers and mouse activity are conclusive;
+                # everything else is scored by visitor_reclassifier
+                'visitor_type': (
+                    'bot' if analysis.get('verified_crawler')
+                    else 'human' if event.get('mouse_activity')
+                    else 'pending'
+                ),
+                'is_datacenter': analysis.get('is_datacenter', False),
+                'asn': analysis.get('asn'),
+                'organization': analysis.get('organization'),
+                'view_token': event.get('view_token')
+            })
+        return rows
+
+    async def _write_rows(self, rows: List[Dict[str, Any]]):
+        """Resolve dimension ids, insert all rows with a single multi-row
+        INSERT statement and remember the ids of rows that carry a view
+        token."""
+        await user_agents.assign(rows)
+        async with database.transaction():
+            # Domain counters only move if the page views are written
+            await referrer_domains.assign(rows)
+            query, values = build_multi_row_insert(
+                'page_analytics', PAGE_VIEW_COLUMNS, rows
+            )
+            if not any(row.get('view_token') for row in rows):
+                await database.execute(query, values)
+                return
+
+            written = await database.fetch_all(
+                f"{query} RETURNING id, view_token", values
+            )
+        for row in written:
+            if row['view_token']:
+                self.view_ids.set(row['view_token'], row['id'])
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue counters for the admin dashboard."""
+        return {
+            **self.counters,
+            'pending': len(self._buffer),
+            'max_size': self.max_size,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'overflow_policy': self.overflow_policy,
+            'writer_running': bool(
+                self._writer_task and not self._writer_task.done()
+            ),
+            'last_flush_at': self.last_flush_at
+        }
+
+
+class MouseActivityQueue:
+    """Coalesces mouse-activity beacons and applies them in batches.
+
+    Beacons carry the view token rendered into the page. Views still in
+    the page-view buffer are flagged in memory; written views are updated
+    by primary key through ``PageViewIngestQueue.view_ids``, and tokens
+    not cached by this worker fall back to the indexed view_token column.
+    A token that matches nothing yet (its page view is mid-flush) is
+    retried on the next few flushes.
+    """
+
+    def __init__(self,
+                 page_views: PageViewIngestQueue,
+                 max_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 max_attempts: int = 3):
+        self.page_views = page_views
+        self.max_size = max_size or int(
+            os.getenv("MOUSE_ACTIVITY_QUEUE_SIZE", "10000"))
+        self.flush_interval = flush_interval or float(
+            os.getenv("MOUSE_ACTIVITY_FLUSH_INTERVAL", "2.0"))
+        self.max_attempts = max_attempts
+        self.max_view_age = float(
+            os.getenv("MOUSE_ACTIVITY_MAX_VIEW_AGE", "86400"))
+
+        # view token -> attempts so far; duplicates coalesce for free
+        self._pending: Dict[str, int] = {}
+        self._writer_task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+        self.counters = {
+            'received': 0,
+            'in_memory': 0,
+            'by_id': 0,
+            'by_token': 0,
+            'expired': 0,
+            'dropped': 0,
+            'batches': 0
+        }
+
+    def enqueue(self, view_token: str) -> bool:
+        """Record a beacon without blocking."""
+        self.counters['received'] += 1
+        if view_token in self._pending:
+            return True
+        if self.page_views.mark_buffered_activity(view_token):
+            self.counters['in_memory'] += 1
+            return True
+        if len(self._pending) >= self.max_size:
+            self.counters['dropped'] += 1
+            return False
+        self._pending[view_token] = 0
+        return True
+
+    def start(self):
+        if self._writer_task and not self._writer_task.done():
+            return
+        self._stopping = asyncio.Event()
+        self._writer_task = asyncio.create_task(self._run_writer())
+
+    async def stop(self):
+        if self._stopping:
+            self._stopping.set()
+        if self._writer_task:
+            try:
+                await self._writer_task
+            except Exception as e:
+                print(f"Mouse activity writer stopped with error: {e}")
+            self._writer_task = None
+        await self.flush()
+
+    async def _run_writer(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """Apply every pending beacon. Returns False on failure."""
+        if not self._pending:
+            return True
+
+        pending, self._pending = self._pending, {}
+        ids: List[int] = []
+        tokens: List[str] = []
+        for token in pending:
+            if self.page_views.mark_buffered_activity(token):
+                self.counters['in_memory'] += 1
+                continue
+            found, row_id = self.page_views.view_ids.lookup(token)
+            if found:
+                ids.append(row_id)
+            else:
+                tokens.append(token)
+
+        # Beacons only follow recent views; the bound prunes page_analytics
+        # down to the newest partitions
+        since = datetime.now(timezone.utc) - timedelta(
+            seconds=self.max_view_age)
+        ok = True
+        try:
+            if ids:
+                rows = await database.fetch_all(
+                    f"""UPDATE page_analytics
+                    SET mouse_activity = TRUE, visitor_type = 'human'
+                    WHERE id = ANY(:ids) AND timestamp >= :since
+                    RETURNING {ACTIVITY_RETURNING}""",
+                    {'ids': ids, 'since': since}
+                )
+                visitor_sketches.observe_activity(rows)
+                self.counters['by_id'] += len(ids)
+
+            matched = set()
+            if tokens:
+                rows = await database.fetch_all(
+                    f"""UPDATE page_analytics
+                    SET mouse_activity = TRUE, visitor_type = 'human'
+                    WHERE view_token = ANY(:tokens) AND timestamp >= :since
+                    RETURNING view_token, {ACTIVITY_RETURNING}""",
+                    {'tokens': tokens, 'since': since}
+                )
+                visitor_sketches.observe_activity(rows)
+                matched = {row['view_token'] for row in rows}
+                self.counters['by_token'] += len(matched)
+            self.counters['batches'] += 1
+        except Exception as e:
+            ok = False
+            add_log(
+                "WARNING",
+                f"Failed to apply {len(pending)} mouse activity beacons: "
+                f"{str(e)}",
+                module="analytics_ingest", function="MouseActivityQueue.flush"
+            )
+            matched = set()
+            tokens = list(pending)
+
+        # Unmatched tokens are usually views that were mid-flush
+        for token in tokens:
+            if token in matched:
+                continue
+            attempts = pending[token] + 1
+            if attempts < self.max_attempts:
+                self._pending.setdefault(token, attempts)
+            else:
+                self.counters['expired'] += 1
+        return ok
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'pending': len(self._pending),
+            'flush_interval': self.flush_interval,
+            'writer_running': bool(
+                self._writer_task and not self._writer_task.done()
+            )
+        }
+
+
+def build_multi_row_insert(table: str,
+                           columns: tuple,
+                           rows: List[Dict[str, Any]]):
+    """Build a multi-row INSERT with uniquely named bind parameters."""
+    placeholders = []
+    values = {}
+    for i, row in enumerate(rows):
+        names = []
+        for column in columns:
+            name = f"{column}_{i}"
+            names.append(f":{name}")
+            values[name] = row.get(column)
+        placeholders.append(f"({', '.join(names)})")
+
+    query = (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES {', '.join(placeholders)}"
+    )
+    return query, values
+
+
+# Global ingest queues
+page_view_queue = PageViewIngestQueue()
+mouse_activity_queue = MouseActivityQueue(page_view_queue)
+
+# Spooled rows replay through the same dimension lookups and INSERT
+page_view_spool = Spool('page_analytics')
+spool_replayer.register(page_view_spool, page_view_queue._write_rows)
@@ -0,0 +1,353 @@
+"""
+Analytics Rollups
+Maintains hourly and daily aggregates of page_analytics so dashboard
+queries scale with the number of hours in the window instead of the
+number of page views.
+
+A background job copies every complete hour into the hourly tables,
+rebuilds the daily tables from them, and advances a watermark. The last
+few hours are recomputed on every run to absorb late visitor_type
+updates from mouse activity. Readers combine daily buckets, hourly
+buckets and raw rows past the watermark (normally just the current
+partial hour) through ``source_sql``.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import database
+from log_capture import add_log
+
+
+# Strip the /32 mask if ip_address is stored as INET
+IP_TEXT = "split_part(ip_address::text, '/', 1)"
+
+# Host of a referer URL: userinfo skipped, IPv6 brackets removed
+_REFERRER_HOST = (
+    "btrim(lower(substring(referer from "
+    "'^[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^/?#]*@)?(\\[[^]/?#]*\\]|[^/?#:]+)'"
+    ")), '[]')"
+)
+
+# SQL form of visitor_sketches.referrer_domain, for rows written before
+# ingest started resolving referrer_domain_id; NULL past the DNS limits
+REFERRER_DOMAIN = (
+    f"(CASE WHEN length({_REFERRER_HOST}) <= 253 "
+    f"AND {_REFERRER_HOST} !~ '[^.]{{64}}' THEN {_REFERRER_HOST} END)"
+)
+
+# Raw page views joined to their normalized referrer domain
+REFERRER_SOURCE = (
+    "page_analytics JOIN referrer_domains rd "
+    "ON rd.id = page_analytics.referrer_domain_id"
+)
+
+# Rollup name -> dimension columns with the raw page_analytics expression
+# that produces each one, plus extra filters for raw rows and, where it
+# is not plain page_analytics, the FROM clause raw rows are read from
+ROLLUPS: Dict[str, Dict[str, Any]] = {
+    'pages': {
+        'dims': [('page_path', 'page_path')],
+        'where': ''
+    },
+    'visitors': {
+        'dims': [
+            ('ip_address', IP_TEXT),
+            ('visitor_type', "COALESCE(visitor_type, '')"),
+            ('is_datacenter', "COALESCE(is_datacenter, FALSE)"),
+            ('mouse_activity', "COALESCE(mouse_activity, FALSE)"),
+            ('organization', "COALESCE(organization, '')"),
+        ],
+        'where': "AND ip_address IS NOT NULL"
+    },
+    'referrers': {
+        'dims': [
+            ('referrer_domain', 'rd.domain'),
+            ('ip_address', IP_TEXT),
+        ],
+        'where': "AND ip_address IS NOT NULL",
+        'source': REFERRER_SOURCE
+    },
+}
+
+WATERMARK_NAME = 'page_analytics'
+# Arbitrary constant shared by all workers so only one refreshes at a time
+ADVISORY_LOCK_KEY = 736_201_906
+
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def floor_hour(value: datetime) -> datetime:
+    return _utc(value).replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(value: datetime) -> datetime:
+    return _utc(value).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ceil_day(value: datetime) -> datetime:
+    day = floor_day(value)
+    return day if day == _utc(value) else day + timedelta(days=1)
+
+
+class AnalyticsRollups:
+    """Refreshes the rollup tables and builds read queries over them."""
+
+    def __init__(self,
+                 interval: Optional[float] = None,
+                 recompute_hours: Optional[int] = None):
+        self.interval = interval or float(
+            os.getenv("ANALYTICS_ROLLUP_INTERVAL", "300"))
+        self.recompute_hours = recompute_hours or int(
+            os.getenv("ANALYTICS_ROLLUP_RECOMPUTE_HOURS", "2"))
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self.last_refresh: Optional[Dict[str, Any]] = None
+
+    # ------------------------------------------------------------------
+    # Background job
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._stopping:
+            self._stopping.set()
+        if self._task:
+            try:
+                await self._task
+            except Exception as e:
+                print(f"Analytics rollup job stopped with error: {e}")
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.refresh()
+            except Exception as e:
+                add_log(
+                    "ERROR", f"Rollup refresh failed: {str(e)}",
+                    module="analytics_rollups", function="_run"
+                )
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    # ------------------------------------------------------------------
+    # Refresh
+    # ------------------------------------------------------------------
+
+    async def get_watermark(self) -> Optional[datetime]:
+        row = await database.fetch_one(
+            """SELECT rolled_up_to FROM analytics_rollup_state
+            WHERE name = :name""",
+            {'name': WATERMARK_NAME}
+        )
+        return _utc(row['rolled_up_to']) if row else None
+
+    async def refresh(self, since: Optional[datetime] = None) -> int:
+        """Roll up every complete hour from ``since`` (or the watermark
+        minus the recompute window) up to the current hour.
+
+        Passing ``since`` rebuilds history, e.g. after a backfill or a
+        bulk re-classification. Returns the number of hours processed.
+        """
+        now_row = await database.fetch_one("SELECT NOW() AS now")
+        current_hour = floor_hour(now_row['now'])
+
+        if since is not None:
+            start = floor_hour(since)
+        else:
+            watermark = await self.get_watermark()
+            if watermark is not None:
+                start = min(
+                    watermark,
+                    current_hour - timedelta(hours=self.recompute_hours)
+                )
+            else:
+                first = await database.fetch_one(
+                    "SELECT MIN(timestamp) AS first FROM page_analytics"
+                )
+                start = (floor_hour(first['first'])
+                         if first and first['first'] else current_hour)
+
+        hours = 0
+        chunk_start = start
+        # Process at most a day per transaction so a first-time backfill
+        # never holds one huge transaction open
+        while chunk_start < current_hour:
+            chunk_end = min(chunk_start + timedelta(days=1), current_hour)
+            if not await self._refresh_chunk(chunk_start, chunk_end):
+                break
+            hours += int((chunk_end - chunk_start).total_seconds() // 3600)
+            chunk_start = chunk_end
+
+        if chunk_start >= current_hour:
+            await self._set_watermark(current_hour)
+
+        self.last_refresh = {
+            'from': start.isoformat(),
+            'to': chunk_start.isoformat(),
+            'hours': hours,
+            'at': datetime.now(timezone.utc).isoformat()
+        }
+        return hours
+
+    async def _refresh_chunk(self, start: datetime, end: datetime) -> bool:
+        day_start = floor_day(start)
+        day_end = ceil_day(end)
+
+        async with database.transaction():
+            locked = await database.fetch_one(
+                "SELECT pg_try_advisory_xact_lock(:key) AS locked",
+                {'key': ADVISORY_LOCK_KEY}
+            )
+            if not locked or not locked['locked']:
+                # Another worker is refreshing right now
+                return False
+
+            for name, spec in ROLLUPS.items():
+                dims = [column for column, _ in spec['dims']]
+                exprs = [expr for _, expr in spec['dims']]
+                hourly = f"analytics_hourly_{name}"
+                daily = f"analytics_daily_{name}"
+
+                await database.execute(
+                    f"""DELETE FROM {hourly}
+                    WHERE bucket >= :start AND bucket < :end""",
+                    {'start': start, 'end': end}
+                )
+                await database.execute(
+                    f"""INSERT INTO {hourly} (bucket, {', '.join(dims)}, views)
+                    SELECT date_trunc('hour', timestamp), {', '.join(exprs)},
+                           COUNT(*)
+                    FROM {raw_source(name)}
+                    WHERE timestamp >= :start AND timestamp < :end
+                    {spec['where']}
+                    GROUP BY 1, {', '.join(str(i + 2) for i in range(len(dims)))}""",
+                    {'start': start, 'end': end}
+                )
+
+                # Daily buckets are rebuilt from the hourly rows
+                await database.execute(
+                    f"""DELETE FROM {daily}
+                    WHERE bucket >= :start AND bucket < :end""",
+                    {'start': day_start, 'end': day_end}
+                )
+                await database.execute(
+                    f"""INSERT INTO {daily} (bucket, {', '.join(dims)}, views)
+                    SELECT date_trunc('day', bucket AT TIME ZONE 'UTC')
+                               AT TIME ZONE 'UTC',
+                           {', '.join(dims)}, SUM(views)
+                    FROM {hourly}
+                    WHERE bucket >= :start AND bucket < :end
+                    GROUP BY 1, {', '.join(dims)}""",
+                    {'start': day_start, 'end': day_end}
+                )
+        return True
+
+    async def _set_watermark(self, value: datetime):
+        await database.execute(
+            """INSERT INTO analytics_rollup_state (name, rolled_up_to)
+            VALUES (:name, :value)
+            ON CONFLICT (name) DO UPDATE SET
+                rolled_up_to = EXCLUDED.rolled_up_to,
+                updated_at = NOW()""",
+            {'name': WATERMARK_NAME, 'value': value}
+        )
+
+    # ------------------------------------------------------------------
+    # Read side
+    # ------------------------------------------------------------------
+
+    async def source_sql(self, name: str,
+                         since: datetime) -> Tuple[str, Dict[str, Any]]:
+        """Build a ``(bucket, <dims>, views)`` subquery covering
+        ``[since, now)`` for the named rollup.
+
+        Complete days come from the daily table, complete hours from the
+        hourly table and anything past the watermark from raw rows. With
+        rollups in play the window starts at the hour containing
+        ``since``.
+        """
+        try:
+            watermark = await self.get_watermark()
+        except Exception:
+            # Rollup tables not migrated yet; answer from raw rows
+            watermark = None
+        return build_source_sql(name, _utc(since), watermark)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'interval': self.interval,
+            'recompute_hours': self.recompute_hours,
+            'running': bool(self._task and not self._task.done()),
+            'last_refresh': self.last_refresh
+        }
+
+
+def raw_source(name: str) -> str:
+    """FROM clause that raw rows for the named rollup are read from."""
+    return ROLLUPS[name].get('source', 'page_analytics')
+
+
+def build_source_sql(name: str, since: datetime,
+                     watermark: Optional[datetime]
+                     ) -> Tuple[str, Dict[str, Any]]:
+    """Assemble the UNION ALL of rollup ranges and raw rows."""
+    spec = ROLLUPS[name]
+    dims = [column for column, _ in spec['dims']]
+    raw_dims = [f"{expr} AS {column}" for column, expr in spec['dims']]
+
+    ranges: List[Tuple[str, datetime, datetime]] = []
+    raw_start = since
+    if watermark is not None and watermark > floor_hour(since):
+        since_hour = floor_hour(since)
+        first_day = ceil_day(since_hour)
+        cutoff_day = floor_day(watermark)
+        if first_day >= cutoff_day:
+            ranges.append(('hourly', since_hour, watermark))
+        else:
+            ranges.append(('hourly', since_hour, first_day))
+            ranges.append(('daily', first_day, cutoff_day))
+            ranges.append(('hourly', cutoff_day, watermark))
+        raw_start = watermark
+
+    parts = []
+    params: Dict[str, Any] = {}
+    for i, (granularity, start, end) in enumerate(ranges):
+        if start >= end:
+            continue
+        params[f"{name}_start_{i}"] = start
+        params[f"{name}_end_{i}"] = end
+        parts.append(
+            f"SELECT bucket, {', '.join(dims)}, views "
+            f"FROM analytics_{granularity}_{name} "
+            f"WHERE bucket >= :{name}_start_{i} AND bucket < :{name}_end_{i}"
+        )
+
+    params[f"{name}_raw_start"] = raw_start
+    parts.append(
+        f"SELECT date_trunc('hour', timestamp) AS bucket, "
+        f"{', '.join(raw_dims)}, 1 AS views "
+        f"FROM {raw_source(name)} "
+        f"WHERE timestamp >= :{name}_raw_start {spec['where']}"
+    )
+
+    return f"({' UNION ALL '.join(parts)})", params
+
+
+# Global rollup manager
+analytics_rollups = AnalyticsRollups()
@@ -12,6 +12,7 @@ from auth import require_admin_auth
 from database import database
 from log_capture import add_log, log_with_context
 from schema_dump import generate_schema_dump
+from search_filters import search_condition
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -86,12 +87,10 @@ async def get_logs_data(
         where_conditions.append("portfolio_id = :portfolio_id")
         params["portfolio_id"] = PORTFOLIO_ID
 
-        if search:
-            where_conditions.append(
-                "(message ILIKE :search OR module ILIKE :search OR "
-                "function ILIKE :search)"
-            )
-            params["search"] = f"%{search}%"
+        search_sql, search_params = search_condition('app_log', search)
+        if search_sql:
+            where_conditions.append(search_sql)
+            params.update(search_params)
 
         if level:
             where_conditions.append("LOWER(level) = LOWER(:level)")
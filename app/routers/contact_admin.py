@@ -11,6 +11,7 @@ from typing import Optional
 
 from auth import require_admin_auth
 from database import database
+from search_filters import search_condition
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -60,15 +61,11 @@ async def get_contact_submissions_data(
     where_conditions = []
     params = {}
 
-    # Search filter
-    if search:
-        where_conditions.append("""
-            (name ILIKE :search
-             OR email ILIKE :search
-             OR subject ILIKE :search
-             OR message ILIKE :search)
-        """)
-        params["search"] = f"%{search}%"
+    # Search filter (trigram-indexed)
+    search_sql, search_params = search_condition('contact_messages', search)
+    if search_sql:
+        where_conditions.append(search_sql)
+        params.update(search_params)
 
     # Status filter
     if status == "read":
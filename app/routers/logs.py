@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Request, Depends
+from fastapi import APIRouter, Request, Depends, HTTPException
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
+import asyncio
 import time
 import json
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from auth import require_admin_auth
 from database import database
+from error_groups import error_groups
+from log_archive import log_archive
+from log_feed import log_feed
 from log_capture import add_log
+from log_levels import log_levels
+from log_sink import log_sink
+from search_filters import search_condition
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -42,7 +49,8 @@ async def get_logs_data(
     search: Optional[str] = None,
     level: Optional[str] = None,
     module: Optional[str] = None,
-    time_filter: Optional[str] = None
+    time_filter: Optional[str] = None,
+    include_archive: bool = True
 ):
     """Get log data for endless scrolling logs interface"""
     if page is not None:
@@ -71,12 +79,10 @@ async def get_logs_data(
         where_conditions.append("portfolio_id = :portfolio_id")
         params["portfolio_id"] = PORTFOLIO_ID
 
-        if search:
-            where_conditions.append(
-                "(message ILIKE :search OR module ILIKE :search OR "
-                "function ILIKE :search)"
-            )
-            params["search"] = f"%{search}%"
+        search_sql, search_params = search_condition('app_log', search)
+        if search_sql:
+            where_conditions.append(search_sql)
+            params.update(search_params)
 
         if level:
             where_conditions.append("LOWER(level) = LOWER(:level)")
@@ -87,17 +93,32 @@ async def get_logs_data(
             params["module"] = module
 
         if time_filter:
-            interval = {
-                "1h": "1 hour", "24h": "24 hours", "7d": "7 days"
+            window = {
+                "1h": timedelta(hours=1), "24h": timedelta(hours=24),
+                "7d": timedelta(days=7)
             }.get(time_filter)
-            if interval:
-                where_conditions.append(
-                    f"timestamp >= NOW() - INTERVAL '{interval}'"
-                )
+            if window:
+                # A bound value lets the planner prune app_log partitions
+                where_conditions.append("timestamp >= :since")
+                params["since"] = datetime.now(timezone.utc) - window
 
         where_clause = ("WHERE " + " AND ".join(where_conditions)
                         if where_conditions else "")
 
+        # Archived rows are older than every row still in app_log, so
+        # by timestamp they extend the table at one end: after it when
+        # newest first, before it when oldest first
+        use_archive = include_archive and sort_field == "timestamp"
+        descending = sort_order.lower() == "desc"
+        archived, archive_total = [], 0
+        if use_archive and not descending:
+            archived, archive_total = await asyncio.to_thread(
+                log_archive.search, PORTFOLIO_ID, search, level, module,
+                params.get("since"), offset, limit, False
+            )
+            params["offset"] = max(0, offset - archive_total)
+            params["limit"] = limit - len(archived)
+
         count_query = f"SELECT COUNT(*) as count FROM app_log {where_clause}"
         count_params = {
             k: v for k, v in params.items() if k not in ['limit', 'offset']
@@ -106,15 +127,36 @@ async def get_logs_data(
         total_count = count_result['count'] if count_result else 0
 
         order_clause = f"ORDER BY {sort_field} {sort_order.upper()}"
+        # Grouped errors keep their traceback on error_groups; it is
+        # joined back for the page being shown only
         logs_query = f"""
-            SELECT timestamp, level, message, module, function, line,
-                   user, extra, ip_address, traceback
-            FROM app_log {where_clause} {order_clause}
-            LIMIT :limit OFFSET :offset
+            SELECT l.timestamp, l.level, l.message, l.module, l.function,
+                   l.line, l."user", l.extra, l.ip_address,
+                   COALESCE(l.traceback, g.traceback) AS traceback,
+                   l.error_group_id
+            FROM (
+                SELECT timestamp, level, message, module, function, line,
+                       "user", extra, ip_address, traceback, error_group_id
+                FROM app_log {where_clause} {order_clause}
+                LIMIT :limit OFFSET :offset
+            ) l
+            LEFT JOIN error_groups g ON g.id = l.error_group_id
+            ORDER BY l.{sort_field} {sort_order.upper()}
         """
         logs = await database.fetch_all(logs_query, params)
         logs_data = [dict(log) for log in logs]
 
+        if use_archive and descending:
+            archived, archive_total = await asyncio.to_thread(
+                log_archive.search, PORTFOLIO_ID, search, level, module,
+                params.get("since"), max(0, offset - total_count),
+                limit - len(logs_data), True
+            )
+            logs_data += archived
+        elif archived:
+            logs_data = archived + logs_data
+        total_count += archive_total
+
         return JSONResponse({
             "status": "success",
             "logs": json.loads(
@@ -131,8 +173,8 @@ async def get_logs_data(
         })
     except Exception as e:
         add_log(
-            "ERROR", "logs_endpoint", f"Failed to fetch logs: {e}",
-            extra=traceback.format_exc()
+            "ERROR", f"Failed to fetch logs: {e}",
+            module="logs_endpoint", extra=traceback.format_exc()
         )
         return JSONResponse(
             {"status": "error", "message": f"Failed to fetch logs: {e}"},
@@ -140,6 +182,139 @@ async def get_logs_data(
         )
 
 
+@router.get("/logs/stream")
+async def stream_logs(
+    request: Request,
+    level: Optional[str] = None,
+    module: Optional[str] = None,
+    search: Optional[str] = None,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Push new log entries as Server-Sent Events, filtered like
+    /logs/data; reconnects resume after ``Last-Event-ID``"""
+    try:
+        last_event_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_event_id = None
+    response = log_feed.response(log_feed.subscribe(
+        request.is_disconnected, level, module, search, last_event_id))
+    if response is None:
+        raise HTTPException(status_code=503,
+                            detail="Too many live log clients")
+    return response
+
+
+@router.get("/logs/groups")
+async def get_error_groups(
+    request: Request,
+    limit: int = 50,
+    sort: str = "last_seen",
+    admin: dict = Depends(require_admin_auth)
+):
+    """Distinct errors with occurrence counts for the grouped logs view"""
+    try:
+        groups = await error_groups.recent(min(max(limit, 1), 200), sort)
+        return JSONResponse({
+            "status": "success",
+            "groups": json.loads(json.dumps(groups, default=str))
+        })
+    except Exception as e:
+        return JSONResponse(
+            {"status": "error", "message": f"Failed to fetch groups: {e}"},
+            status_code=500
+        )
+
+
+@router.get("/logs/groups/{group_id}")
+async def get_error_group(
+    request: Request,
+    group_id: int,
+    admin: dict = Depends(require_admin_auth)
+):
+    """One error group with its traceback and hourly occurrences"""
+    group = await error_groups.detail(group_id)
+    if group is None:
+        return JSONResponse(
+            {"status": "error", "message": "Error group not found"},
+            status_code=404
+        )
+    return JSONResponse({
+        "status": "success",
+        "group": json.loads(json.dumps(group, default=str))
+    })
+
+
+@router.get("/logs/sink-stats")
+async def get_log_sink_stats(
+    request: Request,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Queued, written and dropped counters for the batched log writer"""
+    return JSONResponse({
+        **log_sink.stats(),
+        'error_groups': error_groups.stats(),
+        'archive': log_archive.stats(),
+        'live_feed': log_feed.stats()
+    })
+
+
+@router.get("/logs/level")
+async def get_log_level(
+    request: Request,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Current runtime log levels"""
+    levels = log_levels.levels()
+    return JSONResponse({"current_level": levels["default"], **levels})
+
+
+@router.post("/logs/level")
+async def set_log_level(
+    request: Request,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Change the default level, or one module's level, without a
+    restart. ``level`` may be null to make a module inherit again."""
+    data = await request.json()
+    level = data.get("level")
+    module = (data.get("module") or "").strip() or None
+    try:
+        if level is None and module:
+            log_levels.clear_level(module)
+        else:
+            log_levels.set_level(level, module)
+    except ValueError as e:
+        return JSONResponse(
+            {"status": "error", "message": str(e)}, status_code=400
+        )
+
+    saved = await log_levels.save()
+    target = module or "default"
+    new_level = log_levels.levels()["modules"].get(
+        module, "inherit") if module else log_levels.levels()["default"]
+    add_log(
+        "INFO", f"Admin ({admin.get('email', 'unknown')}) set {target} "
+        f"log level to {new_level}", "logs_admin", function="set_log_level"
+    )
+    return JSONResponse({
+        "status": "success",
+        "module": module,
+        "new_level": new_level,
+        "persisted": saved,
+        "message": (f"Log level for {target} set to {new_level}"
+                    + ("" if saved else " (not persisted)"))
+    })
+
+
+@router.get("/logs/levels")
+async def get_log_level_stats(
+    request: Request,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Levels with emitted and suppressed counters per module"""
+    return JSONResponse(log_levels.stats())
+
+
 @router.post("/logs/clear")
 async def clear_logs(
     request: Request,
@@ -149,14 +324,20 @@ async def clear_logs(
     try:
         user_email = admin.get("email", "unknown")
         add_log(
-            "INFO", "logs_admin",
-            f"Admin ({user_email}) cleared all application logs",
-            function="clear_logs"
-        )
-        await database.execute("DELETE FROM app_log")
-        return JSONResponse(
-            {"status": "success", "message": "All logs cleared successfully"}
+            "INFO", f"Admin ({user_email}) cleared all application logs",
+            module="logs_admin", function="clear_logs"
         )
+        # Empties every partition without a row-by-row DELETE; error
+        # groups only describe logged entries, so they go too
+        await database.execute(
+            "TRUNCATE app_log, error_group_occurrences, error_groups")
+        # Archived partitions are part of "all logs" too
+        segments = await asyncio.to_thread(log_archive.clear)
+        return JSONResponse({
+            "status": "success",
+            "message": "All logs cleared successfully",
+            "archived_segments_removed": segments
+        })
     except Exception as e:
         return JSONResponse(
             {"status": "error", "message": f"Failed to clear logs: {e}"},
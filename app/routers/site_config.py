@@ -74,6 +74,14 @@ CONFIG_CATEGORIES = {
             "homepage_about_text", "work_page_title", "work_page_subtitle",
             "projects_page_title", "projects_page_subtitle"
         ]
+    },
+    "retention": {
+        "title": "Data Retention",
+        "description": "Days of raw analytics and application logs to keep",
+        "icon": "🗄️",
+        "configs": [
+            "analytics_retention_days", "log_retention_days"
+        ]
     }
 }
 
@@ -1,15 +1,50 @@
 // Global variables for analytics
 let allVisits = [];
 let filteredVisits = [];
-let currentOffset = 0;
+let nextCursor = null;
 let pageSize = 50;
 let isLoading = false;
 let hasMoreVisits = true;
 let intersectionObserver;
 let backendTotalCount = 0;
+let totalIsEstimate = false;
 let currentSortField = 'timestamp';
 let currentSortOrder = 'desc';
 
+// Search contract with search_filters.py: terms shorter than
+// SEARCH_MIN_LENGTH are ignored by the server, so they are never sent,
+// and typing is debounced before a request goes out
+const SEARCH_MIN_LENGTH = 3;
+const SEARCH_DEBOUNCE_MS = 300;
+let lastSearchTerm = '';
+
+// Current search term, or '' when it is too short to search
+function currentSearchTerm() {
+    const value = document.getElementById('searchBox').value.trim();
+    return value.length >= SEARCH_MIN_LENGTH ? value : '';
+}
+
+// Show a hint while the term is too short to search
+function updateSearchStatus() {
+    const status = document.getElementById('searchStatus');
+    const length = document.getElementById('searchBox').value.trim().length;
+    if (length > 0 && length < SEARCH_MIN_LENGTH) {
+        status.textContent = `Type at least ${SEARCH_MIN_LENGTH} characters to search`;
+        status.style.display = 'block';
+    } else {
+        status.style.display = 'none';
+    }
+}
+
+// Reload only when the effective search term changed
+function onSearchInput(reload) {
+    updateSearchStatus();
+    const term = currentSearchTerm();
+    if (term === lastSearchTerm) return;
+    lastSearchTerm = term;
+    reload();
+}
+
 // Toggle collapsible sections
 window.toggleSection = function (sectionId) {
     const content = document.getElementById(sectionId);
@@ -31,37 +66,49 @@ window.toggleSection = function (sectionId) {
     }
 };
 
-// Show unique visitors popup
-window.showUniqueVisitorsPopup = async function () {
-    const modal = document.getElementById('uniqueVisitorsModal');
+// Cursor for the next page of the unique visitors popup
+let uniqueVisitorsCursor = null;
+
+function uniqueVisitorsDays() {
+    const timeFilter = document.getElementById('timeFilter').value;
+    return timeFilter === '1h' ? 0.04 :
+        timeFilter === '24h' ? 1 :
+            timeFilter === '7d' ? 7 :
+                timeFilter === '30d' ? 30 : 7;
+}
+
+// Fetch one page of unique visitors and append it to the popup table
+async function loadUniqueVisitorsPage() {
     const loading = document.getElementById('uniqueVisitorsLoading');
     const tbody = document.getElementById('uniqueVisitorsTableBody');
+    const moreBtn = document.getElementById('uniqueVisitorsMoreBtn');
 
-    // Show modal and loading state
-    modal.style.display = 'block';
     loading.style.display = 'block';
-    tbody.innerHTML = '';
+    moreBtn.style.display = 'none';
 
     try {
-        // Get current time filter
-        const timeFilter = document.getElementById('timeFilter').value;
-        const days = timeFilter === '1h' ? 0.04 :
-            timeFilter === '24h' ? 1 :
-                timeFilter === '7d' ? 7 :
-                    timeFilter === '30d' ? 30 : 7;
+        const params = new URLSearchParams({ days: uniqueVisitorsDays(), limit: 100 });
+        if (uniqueVisitorsCursor) params.append('cursor', uniqueVisitorsCursor);
 
-        const response = await fetch(`/admin/analytics/unique-visitors?days=${days}`);
+        const response = await fetch(`/admin/analytics/unique-visitors?${params}`);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
         const data = await response.json();
 
+        if (data.total_unique !== null && data.total_unique !== undefined) {
+            document.getElementById('uniqueVisitorsTotal').textContent =
+                `${data.total_is_estimate ? '~' : ''}${data.total_unique} unique IPs`;
+        }
+
         // Populate table
         data.visitors.forEach(visitor => {
             const row = document.createElement('tr');
-            const lastVisit = new Date(visitor.last_visit);
-            const formattedLastVisit = lastVisit.toLocaleDateString() + ' ' + lastVisit.toLocaleTimeString();
+            const formattedLastVisit = visitor.last_visit
+                ? new Date(visitor.last_visit).toLocaleDateString() + ' ' +
+                  new Date(visitor.last_visit).toLocaleTimeString()
+                : '';
 
             row.innerHTML = `
                 <td>${visitor.ip_address}</td>
@@ -71,12 +118,29 @@ window.showUniqueVisitorsPopup = async function () {
             tbody.appendChild(row);
         });
 
+        uniqueVisitorsCursor = data.next_cursor;
+        moreBtn.style.display = data.has_more ? 'block' : 'none';
+
     } catch (error) {
         console.error('Error loading unique visitors:', error);
         tbody.innerHTML = '<tr><td colspan="3" style="text-align: center; color: red;">Error loading visitor data</td></tr>';
     } finally {
         loading.style.display = 'none';
     }
+}
+
+// Show unique visitors popup
+window.showUniqueVisitorsPopup = async function () {
+    document.getElementById('uniqueVisitorsModal').style.display = 'block';
+    document.getElementById('uniqueVisitorsTableBody').innerHTML = '';
+    document.getElementById('uniqueVisitorsTotal').textContent = '';
+    uniqueVisitorsCursor = null;
+    await loadUniqueVisitorsPage();
+};
+
+// Load the next page of unique visitors
+window.loadMoreUniqueVisitors = function () {
+    loadUniqueVisitorsPage();
 };
 
 // Close unique visitors popup
@@ -86,7 +150,7 @@ window.closeUniqueVisitorsPopup = function () {
 
 // Refresh analytics data
 window.refreshAnalytics = function () {
-    currentOffset = 0;
+    nextCursor = null;
     allVisits = [];
     filteredVisits = [];
     hasMoreVisits = true;
@@ -97,6 +161,8 @@ window.refreshAnalytics = function () {
 // Clear filters
 window.clearFilters = function () {
     document.getElementById('searchBox').value = '';
+    lastSearchTerm = '';
+    updateSearchStatus();
     document.getElementById('timeFilter').value = '7d';
     reloadVisitsWithFilters();
 };
@@ -128,14 +194,16 @@ async function loadVisits(append = false) {
     try {
         // Build URL with sorting and filter parameters
         const params = new URLSearchParams({
-            offset: append ? currentOffset : 0,
             limit: pageSize,
             sort_field: currentSortField,
             sort_order: currentSortOrder
         });
 
+        // Continue from the last row of the previous page
+        if (append && nextCursor) params.append('cursor', nextCursor);
+
         // Add filter parameters
-        const searchValue = document.getElementById('searchBox').value.trim();
+        const searchValue = currentSearchTerm();
         const timeFilter = document.getElementById('timeFilter').value;
 
         if (searchValue) params.append('search', searchValue);
@@ -158,21 +226,23 @@ async function loadVisits(append = false) {
         if (!append) {
             allVisits = [];
             filteredVisits = [];
-            currentOffset = 0;
         }
 
-        if (data.visits && data.visits.length > 0) {
-            backendTotalCount = data.total_count || 0;
+        // Totals are only computed for the first page of a query
+        if (data.total_count !== null && data.total_count !== undefined) {
+            backendTotalCount = data.total_count;
+            totalIsEstimate = !!data.total_is_estimate;
+        }
 
+        if (data.visits && data.visits.length > 0) {
             if (append) {
                 allVisits = allVisits.concat(data.visits);
             } else {
                 allVisits = data.visits;
-                currentOffset = 0; // Reset offset for fresh loads
             }
 
-            currentOffset += data.visits.length;
-            hasMoreVisits = data.has_more;
+            nextCursor = data.next_cursor || null;
+            hasMoreVisits = data.has_more && nextCursor !== null;
 
             // Since backend handles filtering, filtered visits = all loaded visits
             filteredVisits = allVisits;
@@ -276,7 +346,7 @@ function updateDisplay() {
 
 // Reload visits with current filters
 function reloadVisitsWithFilters() {
-    currentOffset = 0;
+    nextCursor = null;
     allVisits = [];
     filteredVisits = [];
     hasMoreVisits = true;
@@ -320,7 +390,9 @@ function getTimeAgo(date) {
 
 // Update stats
 function updateStats() {
-    document.getElementById('totalCount').textContent = `Total: ${backendTotalCount}`;
+    const totalLabel = totalIsEstimate ?
+        `~${backendTotalCount.toLocaleString()}` : backendTotalCount;
+    document.getElementById('totalCount').textContent = `Total: ${totalLabel}`;
     document.getElementById('filteredVisits').textContent = `Loaded: ${allVisits.length}`;
 
     // Count unique IPs
@@ -649,7 +721,7 @@ function initializeAnalyticsAdmin(dailyViewsData) {
 
     // Setup filter event listeners
     document.getElementById('searchBox').addEventListener('input',
-        debounce(reloadVisitsWithFilters, 500));
+        debounce(() => onSearchInput(reloadVisitsWithFilters), SEARCH_DEBOUNCE_MS));
     document.getElementById('timeFilter').addEventListener('change', reloadVisitsWithFilters);
 
     // Draw the daily views chart
@@ -659,6 +731,55 @@ function initializeAnalyticsAdmin(dailyViewsData) {
 
     // Initial load of visits
     loadVisits();
+
+    // Live traffic over Server-Sent Events
+    connectLiveFeed();
+}
+
+// Most page views kept in the live traffic list
+const LIVE_FEED_MAX_ITEMS = 50;
+
+// Subscribe to /admin/analytics/stream; EventSource reconnects on its
+// own and resumes from the last event id it saw
+function connectLiveFeed() {
+    const list = document.getElementById('liveFeedList');
+    const status = document.getElementById('liveFeedStatus');
+    if (!list || !window.EventSource) return;
+
+    const source = new EventSource('/admin/analytics/stream');
+
+    source.onopen = () => {
+        status.textContent = 'live';
+        status.classList.add('connected');
+    };
+
+    source.onerror = () => {
+        status.textContent = 'reconnecting';
+        status.classList.remove('connected');
+    };
+
+    source.addEventListener('pageview', (event) => {
+        const view = JSON.parse(event.data);
+        const item = document.createElement('li');
+        const time = document.createElement('span');
+        time.className = 'live-feed-time';
+        time.textContent = new Date(view.timestamp).toLocaleTimeString();
+        const detail = document.createElement('span');
+        detail.textContent = [
+            view.page_path, view.ip_address, view.visitor_type,
+            view.referrer ? `via ${view.referrer}` : ''
+        ].filter(Boolean).join(' · ');
+        item.append(time, detail);
+        list.prepend(item);
+        while (list.children.length > LIVE_FEED_MAX_ITEMS) {
+            list.lastElementChild.remove();
+        }
+    });
+
+    source.addEventListener('skipped', (event) => {
+        const { missed } = JSON.parse(event.data);
+        console.warn(`Live feed skipped ${missed} page views`);
+    });
 }
 
 // Export for use in template
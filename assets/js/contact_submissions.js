@@ -10,6 +10,40 @@ let backendTotalCount = 0;
 let currentSortField = 'created_at';
 let currentSortOrder = 'desc';
 
+// Search contract with search_filters.py: terms shorter than
+// SEARCH_MIN_LENGTH are ignored by the server, so they are never sent,
+// and typing is debounced before a request goes out
+const SEARCH_MIN_LENGTH = 3;
+const SEARCH_DEBOUNCE_MS = 300;
+let lastSearchTerm = '';
+
+// Current search term, or '' when it is too short to search
+function currentSearchTerm() {
+    const value = document.getElementById('searchBox').value.trim();
+    return value.length >= SEARCH_MIN_LENGTH ? value : '';
+}
+
+// Show a hint while the term is too short to search
+function updateSearchStatus() {
+    const status = document.getElementById('searchStatus');
+    const length = document.getElementById('searchBox').value.trim().length;
+    if (length > 0 && length < SEARCH_MIN_LENGTH) {
+        status.textContent = `Type at least ${SEARCH_MIN_LENGTH} characters to search`;
+        status.style.display = 'block';
+    } else {
+        status.style.display = 'none';
+    }
+}
+
+// Reload only when the effective search term changed
+function onSearchInput(reload) {
+    updateSearchStatus();
+    const term = currentSearchTerm();
+    if (term === lastSearchTerm) return;
+    lastSearchTerm = term;
+    reload();
+}
+
 window.refreshSubmissions = function() {
     currentOffset = 0;
     allSubmissions = [];
@@ -87,6 +121,8 @@ window.toggleReadStatus = async function(submissionId, currentStatus) {
 
 window.clearFilters = function() {
     document.getElementById('searchBox').value = '';
+    lastSearchTerm = '';
+    updateSearchStatus();
     document.getElementById('statusFilter').value = '';
     document.getElementById('timeFilter').value = '';
     reloadSubmissionsWithFilters();
@@ -128,7 +164,7 @@ async function loadSubmissions(append = false) {
         });
 
         // Add filter parameters
-        const searchValue = document.getElementById('searchBox').value.trim();
+        const searchValue = currentSearchTerm();
         const statusFilter = document.getElementById('statusFilter').value;
         const timeFilter = document.getElementById('timeFilter').value;
 
@@ -325,10 +361,10 @@ function reloadSubmissionsWithFilters() {
 // Setup event listeners
 function setupEventListeners() {
     // Search box
-    document.getElementById('searchBox').addEventListener('keyup', debounce(() => {
-        applyFilters();
+    document.getElementById('searchBox').addEventListener('input', debounce(() => {
+        onSearchInput(applyFilters);
         updateClearFiltersButtonVisibility();
-    }, 300));
+    }, SEARCH_DEBOUNCE_MS));
 
     // Filter dropdowns
     document.getElementById('statusFilter').addEventListener('change', () => {
@@ -10,6 +10,40 @@ let backendTotalCount = 0;
 let currentSortField = 'timestamp'; // Default sort field
 let currentSortOrder = 'desc'; // Default to newest first
 
+// Search contract with search_filters.py: terms shorter than
+// SEARCH_MIN_LENGTH are ignored by the server, so they are never sent,
+// and typing is debounced before a request goes out
+const SEARCH_MIN_LENGTH = 3;
+const SEARCH_DEBOUNCE_MS = 300;
+let lastSearchTerm = '';
+
+// Current search term, or '' when it is too short to search
+function currentSearchTerm() {
+    const value = document.getElementById('searchBox').value.trim();
+    return value.length >= SEARCH_MIN_LENGTH ? value : '';
+}
+
+// Show a hint while the term is too short to search
+function updateSearchStatus() {
+    const status = document.getElementById('searchStatus');
+    const length = document.getElementById('searchBox').value.trim().length;
+    if (length > 0 && length < SEARCH_MIN_LENGTH) {
+        status.textContent = `Type at least ${SEARCH_MIN_LENGTH} characters to search`;
+        status.style.display = 'block';
+    } else {
+        status.style.display = 'none';
+    }
+}
+
+// Reload only when the effective search term changed
+function onSearchInput(reload) {
+    updateSearchStatus();
+    const term = currentSearchTerm();
+    if (term === lastSearchTerm) return;
+    lastSearchTerm = term;
+    reload();
+}
+
 window.refreshLogs = function() {
     currentOffset = 0;
     allLogs = [];
@@ -43,6 +77,8 @@ window.clearLogs = async function() {
 
 window.clearFilters = function() {
     document.getElementById('searchBox').value = '';
+    lastSearchTerm = '';
+    updateSearchStatus();
     document.getElementById('levelFilter').value = '';
     document.getElementById('moduleFilter').value = '';
     document.getElementById('timeFilter').value = '';
@@ -86,7 +122,7 @@ async function loadLogs(append = false) {
         });
         
         // Add filter parameters
-        const searchValue = document.getElementById('searchBox').value.trim();
+        const searchValue = currentSearchTerm();
         const levelFilter = document.getElementById('levelFilter').value;
         const moduleFilter = document.getElementById('moduleFilter').value;
         const timeFilter = document.getElementById('timeFilter').value;
@@ -173,6 +209,8 @@ function reloadWithFilters() {
 // Apply filters by reloading data from backend
 function applyFilters() {
     reloadWithFilters();
+    // The live tail filters on the server, so it reconnects with the new values
+    if (liveSource) startLiveTail();
 }
 
 // Update the table display
@@ -189,6 +227,7 @@ function updateDisplay() {
     
     filteredLogs.forEach((log, index) => {
         const row = document.createElement('tr');
+        if (log.archived) row.classList.add('log-archived');
         // Compute age
         const now = Date.now();
         const logTime = new Date(log.timestamp).getTime();
@@ -244,6 +283,7 @@ function renderLogs() {
     
     filteredLogs.forEach(log => {
         const row = document.createElement('tr');
+        if (log.archived) row.classList.add('log-archived');
         const dateStr = new Date(log.timestamp).toLocaleDateString();
         const timeStr = new Date(log.timestamp).toLocaleTimeString([], {hour: '2-digit', minute:'2-digit', second:'2-digit'});
         
@@ -367,10 +407,10 @@ function reloadWithFilters() {
 // Setup event listeners
 function setupEventListeners() {
     // Search box
-    document.getElementById('searchBox').addEventListener('keyup', debounce(() => {
-        applyFilters();
+    document.getElementById('searchBox').addEventListener('input', debounce(() => {
+        onSearchInput(applyFilters);
         updateClearFiltersButtonVisibility();
-    }, 300));
+    }, SEARCH_DEBOUNCE_MS));
     
     // Filter dropdowns - reload data from backend when filters change
     document.getElementById('levelFilter').addEventListener('change', () => {
@@ -385,6 +425,16 @@ function setupEventListeners() {
         applyFilters();
         updateClearFiltersButtonVisibility();
     });
+    document.getElementById('viewMode').addEventListener('change', function() {
+        setViewMode(this.value);
+    });
+    document.getElementById('liveTail').addEventListener('change', function() {
+        if (this.checked) {
+            startLiveTail();
+        } else {
+            stopLiveTail();
+        }
+    });
     
     // Column sorting
     document.querySelectorAll('.logs-table th[data-sort]').forEach(th => {
@@ -578,6 +628,11 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Setup log level change handler
     setupLogLevelHandler();
+    document.getElementById('logVolumePanel').addEventListener('toggle', function() {
+        if (this.open) {
+            loadLogVolume();
+        }
+    });
     
     // Recalculate on window resize
     window.addEventListener('resize', debounce(calculateAndSetTableHeight, 100));
@@ -618,12 +673,18 @@ async function setLogLevel(level) {
                 'Cache-Control': 'no-cache, no-store, must-revalidate',
                 'Pragma': 'no-cache'
             },
-            body: JSON.stringify({ level: level })
+            body: JSON.stringify({
+                level: level === 'INHERIT' ? null : level,
+                module: document.getElementById('logLevelModule').value.trim() || null
+            })
         });
         
         if (response.ok) {
             const data = await response.json();
-            document.getElementById('logLevelValue').textContent = data.new_level;
+            if (!data.module) {
+                document.getElementById('logLevelValue').textContent = data.new_level;
+            }
+            loadLogVolume();
             
             // Show success message briefly
             const levelDisplay = document.getElementById('currentLogLevel');
@@ -657,7 +718,13 @@ function setupLogLevelHandler() {
     logLevelSelect.addEventListener('change', function() {
         const newLevel = this.value;
         if (newLevel) {
-            if (confirm(`Change runtime log level to ${newLevel}?`)) {
+            const module = document.getElementById('logLevelModule').value.trim();
+            if (newLevel === 'INHERIT' && !module) {
+                alert('Enter a module to make it inherit the default level');
+                this.value = '';
+                return;
+            }
+            if (confirm(`Change runtime log level for ${module || 'the default'} to ${newLevel}?`)) {
                 setLogLevel(newLevel);
             } else {
                 // Reset selection if cancelled
@@ -667,6 +734,28 @@ function setupLogLevelHandler() {
     });
 }
 
+// Emitted and suppressed counts per module from /logs/levels
+async function loadLogVolume() {
+    const tbody = document.getElementById('logVolumeTableBody');
+    if (!document.getElementById('logVolumePanel').open) return;
+    try {
+        const response = await fetch('/logs/levels', {
+            headers: { 'Cache-Control': 'no-cache, no-store, must-revalidate' }
+        });
+        const data = await response.json();
+        tbody.innerHTML = Object.entries(data.counters || {}).map(([module, counts]) => `
+            <tr>
+                <td class="log-module">${escapeHtml(module)}</td>
+                <td><span class="log-level log-level-${escapeHtml(counts.level)}">${escapeHtml(counts.level)}</span></td>
+                <td class="error-group-count">${counts.emitted}</td>
+                <td class="error-group-count">${counts.suppressed}</td>
+            </tr>
+        `).join('');
+    } catch (error) {
+        console.error('Failed to load log volume:', error);
+    }
+}
+
 // Toggle message expansion for long messages
 // Global function for message expansion
 window.toggleMessageExpand = function(button) {
@@ -713,3 +802,175 @@ function truncateMessage(message, isTraceback = false) {
     }
     return message.substring(0, 300) + '...';
 }
+
+// Grouped errors view: one row per distinct error from /logs/groups,
+// so it loads the same amount of data however often an error recurs
+function setViewMode(mode) {
+    const grouped = mode === 'groups';
+    document.getElementById('logsTableContainer').style.display = grouped ? 'none' : '';
+    document.getElementById('logsStats').style.display = grouped ? 'none' : '';
+    document.getElementById('errorGroupsContainer').style.display = grouped ? '' : 'none';
+    if (grouped) {
+        loadErrorGroups();
+    }
+}
+
+async function loadErrorGroups() {
+    const tbody = document.getElementById('errorGroupsTableBody');
+    try {
+        const response = await fetch('/logs/groups?limit=100', {
+            headers: {
+                'Cache-Control': 'no-cache, no-store, must-revalidate',
+                'Pragma': 'no-cache'
+            }
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.message || response.statusText);
+        }
+        renderErrorGroups(data.groups || []);
+    } catch (error) {
+        console.error('Failed to load error groups:', error);
+        tbody.innerHTML = `<tr><td colspan="7" class="error">Failed to load error groups: ${escapeHtml(error.message)}</td></tr>`;
+    }
+}
+
+function formatGroupTime(value) {
+    const date = new Date(value);
+    return `${date.toLocaleDateString()} ${date.toLocaleTimeString([], {hour: '2-digit', minute: '2-digit', second: '2-digit'})}`;
+}
+
+function renderErrorGroups(groups) {
+    const tbody = document.getElementById('errorGroupsTableBody');
+    if (groups.length === 0) {
+        tbody.innerHTML = '<tr><td colspan="7" class="no-more-logs">No errors recorded</td></tr>';
+        return;
+    }
+    tbody.innerHTML = '';
+    groups.forEach(group => {
+        const row = document.createElement('tr');
+        row.className = 'error-group-row';
+        row.dataset.groupId = group.id;
+        const where = [group.module, group.function].filter(Boolean).join('.');
+        row.innerHTML = `
+            <td class="log-timestamp">${formatGroupTime(group.last_seen)}</td>
+            <td class="log-timestamp">${formatGroupTime(group.first_seen)}</td>
+            <td class="error-group-count">${escapeHtml(String(group.occurrences))}</td>
+            <td class="error-group-count">${escapeHtml(String(group.last_24h))}</td>
+            <td><span class="log-level log-level-${group.kind === 'http' ? 'WARNING' : 'ERROR'}">${escapeHtml(group.error_type)}</span></td>
+            <td class="log-message"><span class="message-text">${escapeHtml(truncateMessage(group.message || ''))}</span></td>
+            <td class="log-function">${escapeHtml(where)}</td>
+        `;
+        row.addEventListener('click', () => toggleErrorGroupDetail(row));
+        tbody.appendChild(row);
+    });
+}
+
+async function toggleErrorGroupDetail(row) {
+    const next = row.nextElementSibling;
+    if (next && next.classList.contains('error-group-detail')) {
+        next.remove();
+        return;
+    }
+    const detail = document.createElement('tr');
+    detail.className = 'error-group-detail';
+    detail.innerHTML = '<td colspan="7" class="loading">Loading...</td>';
+    row.after(detail);
+    try {
+        const response = await fetch(`/logs/groups/${row.dataset.groupId}`);
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.message || response.statusText);
+        }
+        const group = data.group;
+        const hours = (group.hours || [])
+            .map(hour => `${formatGroupTime(hour.hour)}: ${hour.occurrences}`)
+            .join('\n');
+        detail.innerHTML = `
+            <td colspan="7">
+                <pre class="error-group-traceback">${escapeHtml(group.traceback || group.message || '')}</pre>
+                ${group.sample_extra ? `<pre class="error-group-sample">${escapeHtml(JSON.stringify(group.sample_extra, null, 2))}</pre>` : ''}
+                ${hours ? `<pre class="error-group-hours">${escapeHtml(hours)}</pre>` : ''}
+            </td>
+        `;
+    } catch (error) {
+        detail.innerHTML = `<td colspan="7" class="error">Failed to load error group: ${escapeHtml(error.message)}</td>`;
+    }
+}
+
+// Live tail over /logs/stream: the server pushes newly written entries,
+// filtered with the grid's level, module and search values, so watching
+// logs runs no queries. EventSource reconnects on its own and sends the
+// last event id, which the server uses to fill the gap.
+const LIVE_TAIL_FLUSH_MS = 250;
+let liveSource = null;
+let livePending = [];
+let liveFlushTimer = null;
+
+function liveTailParams() {
+    const params = new URLSearchParams();
+    const searchValue = currentSearchTerm();
+    const levelFilter = document.getElementById('levelFilter').value;
+    const moduleFilter = document.getElementById('moduleFilter').value;
+    if (searchValue) params.append('search', searchValue);
+    if (levelFilter) params.append('level', levelFilter);
+    if (moduleFilter) params.append('module', moduleFilter);
+    return params;
+}
+
+function setLiveTailStatus(text, connected) {
+    const status = document.getElementById('liveTailStatus');
+    status.textContent = text;
+    status.classList.toggle('connected', connected);
+}
+
+function stopLiveTail() {
+    if (liveSource) {
+        liveSource.close();
+        liveSource = null;
+    }
+    livePending = [];
+    setLiveTailStatus('off', false);
+}
+
+function startLiveTail() {
+    stopLiveTail();
+    if (!window.EventSource) return;
+
+    liveSource = new EventSource(`/logs/stream?${liveTailParams()}`);
+    setLiveTailStatus('connecting', false);
+    liveSource.onopen = () => setLiveTailStatus('live', true);
+    liveSource.onerror = () => setLiveTailStatus('reconnecting', false);
+
+    liveSource.addEventListener('log', (event) => {
+        livePending.push(JSON.parse(event.data));
+        if (!liveFlushTimer) {
+            liveFlushTimer = setTimeout(flushLiveTail, LIVE_TAIL_FLUSH_MS);
+        }
+    });
+
+    liveSource.addEventListener('skipped', (event) => {
+        const { missed } = JSON.parse(event.data);
+        console.warn(missed === null
+            ? 'Live tail skipped older entries'
+            : `Live tail skipped ${missed} entries`);
+    });
+}
+
+// Prepend the entries received since the last flush in one render; they
+// only belong at the top of a newest-first grid
+function flushLiveTail() {
+    liveFlushTimer = null;
+    const entries = livePending.reverse();
+    livePending = [];
+    if (!entries.length || currentSortField !== 'timestamp' || currentSortOrder !== 'desc') {
+        return;
+    }
+    allLogs = entries.concat(allLogs);
+    filteredLogs = allLogs;
+    // Keep infinite scroll's offset aligned with the rows now above it
+    currentOffset += entries.length;
+    backendTotalCount += entries.length;
+    updateDisplay();
+    updateStats();
+}
@@ -9,6 +9,10 @@
     let mouseActivityDetected = false;
     let pageLoadTime = Date.now();
     let currentPath = window.location.pathname;
+
+    // Token identifying this page view, rendered by the server
+    const viewToken = document.currentScript ?
+        document.currentScript.dataset.viewToken : '';
     
     // Debounce function to prevent excessive API calls
     function debounce(func, wait) {
@@ -31,17 +35,30 @@
         
         mouseActivityDetected = true;
         
-        // Send analytics update via fetch API
+        // Untracked pages (admin, errors) have no view to update
+        if (!viewToken) {
+            return;
+        }
+        
+        const payload = JSON.stringify({
+            view_token: viewToken,
+            page_path: currentPath,
+            session_duration: Date.now() - pageLoadTime
+        });
+        
+        // sendBeacon survives navigation and never blocks the page
+        if (navigator.sendBeacon &&
+            navigator.sendBeacon('/analytics/mouse-activity', payload)) {
+            return;
+        }
+        
         fetch('/analytics/mouse-activity', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({
-                page_path: currentPath,
-                timestamp: new Date().toISOString(),
-                session_duration: Date.now() - pageLoadTime
-            })
+            body: payload,
+            keepalive: true
         }).catch(function(error) {
             // Silently handle errors - don't break the page
             console.debug('Mouse activity tracking failed:', error);
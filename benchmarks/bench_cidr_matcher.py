@@ -0,0 +1,84 @@
+"""
+Microbenchmark: compiled CIDRMatcher vs. the original linear scan in
+IPAnalyzer.is_known_bot_network
+
+Usage:
+    python benchmarks/bench_cidr_matcher.py [extra_networks] [lookups]
+"""
+import ipaddress
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cidr_matcher import CIDRMatcher  # noqa: E402
+
+
+DEFAULT_NETWORKS = [
+    '66.249.64.0/19', '64.233.160.0/19', '172.217.0.0/16',
+    '40.77.167.0/24', '157.55.39.0/24', '40.76.0.0/16',
+    '104.16.0.0/12', '162.158.0.0/15', '173.245.48.0/20',
+    '198.41.128.0/17', '54.0.0.0/8', '52.0.0.0/8',
+    '104.131.0.0/16', '159.89.0.0/16', '178.62.0.0/16',
+    '108.61.0.0/16', '149.28.0.0/16',
+]
+
+
+def legacy_is_known_bot_network(networks, ip_address):
+    """The pre-compilation implementation, kept verbatim for comparison."""
+    try:
+        ip = ipaddress.ip_address(ip_address)
+        for network in networks:
+            if ip in ipaddress.ip_network(network):
+                return True
+        return False
+    except (ValueError, ipaddress.AddressValueError):
+        return False
+
+
+def synthetic_networks(count, seed=7):
+    rng = random.Random(seed)
+    networks = []
+    for _ in range(count):
+        prefix = rng.choice((16, 20, 22, 24))
+        address = rng.getrandbits(32) & ~((1 << (32 - prefix)) - 1)
+        networks.append(f"{ipaddress.IPv4Address(address)}/{prefix}")
+    return networks
+
+
+def main():
+    extra = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    networks = DEFAULT_NETWORKS + synthetic_networks(extra)
+    rng = random.Random(11)
+    ips = [str(ipaddress.IPv4Address(rng.getrandbits(32)))
+           for _ in range(lookups)]
+
+    matcher = CIDRMatcher(networks)
+    mismatches = sum(
+        legacy_is_known_bot_network(networks, ip) != matcher.contains(ip)
+        for ip in ips[:200]
+    )
+
+    legacy_s = timeit.timeit(
+        lambda: [legacy_is_known_bot_network(networks, ip) for ip in ips],
+        number=1
+    )
+    compiled_s = min(timeit.repeat(
+        lambda: [matcher.contains(ip) for ip in ips], number=1, repeat=5
+    ))
+
+    print(f"networks: {len(networks)} "
+          f"(merged into {len(matcher)} intervals)")
+    print(f"lookups:  {lookups}")
+    print(f"legacy:   {legacy_s / lookups * 1e6:9.2f} us/lookup")
+    print(f"compiled: {compiled_s / lookups * 1e6:9.2f} us/lookup")
+    print(f"speedup:  {legacy_s / compiled_s:9.1f}x")
+    print(f"mismatches vs legacy (first 200): {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
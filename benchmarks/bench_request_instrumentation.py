@@ -0,0 +1,153 @@
+"""
+Microbenchmark: per-request middleware overhead on ``GET /`` for the
+pure-ASGI RequestInstrumentationMiddleware vs. the previous stack of
+AnalyticsMiddleware (BaseHTTPMiddleware) plus the ``log_non_200_responses``
+and ``log_requests`` HTTP middlewares
+
+Requests are driven straight through the ASGI callable, so the numbers
+are middleware cost plus a trivial endpoint, without any server or
+network overhead. Logging goes to os.devnull at INFO, as the file
+handler in main.py would.
+
+Usage:
+    python benchmarks/bench_request_instrumentation.py [requests]
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.responses import HTMLResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+from analytics import analytics  # noqa: E402
+from request_instrumentation import (  # noqa: E402
+    EXCLUDED_PATHS, EXCLUDED_PREFIXES, RequestInstrumentationMiddleware
+)
+
+
+logger = logging.getLogger('portfoliosite')
+
+
+async def homepage(request):
+    return HTMLResponse("<html><body>" + "x" * 4096 + "</body></html>")
+
+
+async def noop_track_page_view(request, page_path, mouse_activity=False):
+    """Keeps the ingest queue out of the measurement for both stacks."""
+
+
+class LegacyAnalyticsMiddleware(BaseHTTPMiddleware):
+    """The tracking decision of the old AnalyticsMiddleware."""
+
+    async def dispatch(self, request, call_next):
+        path = request.url.path
+        response = await call_next(request)
+        content_type = response.headers.get("content-type", "")
+        excluded = path in EXCLUDED_PATHS or any(
+            path.startswith(prefix) for prefix in EXCLUDED_PREFIXES)
+        if (request.method == "GET" and 200 <= response.status_code < 400
+                and not excluded
+                and not content_type.startswith(("text/css", "image/"))):
+            await analytics.track_page_view(request, path)
+        return response
+
+
+async def legacy_log_non_200(request, call_next):
+    response = await call_next(request)
+    if response.status_code != 200:
+        logger.warning(f"{response.status_code} RESPONSE for {request.url}")
+    return response
+
+
+async def legacy_log_requests(request, call_next):
+    start_time = time.time()
+    logger.info("=== Incoming Request ===")
+    logger.info(f"Method: {request.method}")
+    logger.info(f"URL: {str(request.url)}")
+    logger.info(f"Client IP: {request.client.host if request.client else 'unknown'}")
+    logger.info(f"Headers: {dict(request.headers)}")
+    response = await call_next(request)
+    logger.info(f"Response status: {response.status_code}")
+    logger.info(f"Process time: {time.time() - start_time:.4f}s")
+    return response
+
+
+def build_app(middleware):
+    return Starlette(routes=[Route("/", homepage)], middleware=middleware)
+
+
+LEGACY = [
+    Middleware(BaseHTTPMiddleware, dispatch=legacy_log_requests),
+    Middleware(BaseHTTPMiddleware, dispatch=legacy_log_non_200),
+    Middleware(LegacyAnalyticsMiddleware),
+]
+PURE_ASGI = [
+    Middleware(RequestInstrumentationMiddleware, log_non_200=True,
+               access_log=True, track_analytics=True, timing_header=False),
+]
+
+
+SCOPE = {
+    "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+    "method": "GET", "scheme": "http", "path": "/", "raw_path": b"/",
+    "root_path": "", "query_string": b"", "server": ("testserver", 80),
+    "client": ("203.0.113.7", 50000),
+    "headers": [
+        (b"host", b"testserver"),
+        (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) Firefox/131.0"),
+        (b"accept", b"text/html"),
+        (b"referer", b"https://www.google.com/"),
+    ],
+}
+
+
+async def drive(app, count):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(count):
+        await app(dict(SCOPE), receive, send)
+    return (time.perf_counter() - start) / count
+
+
+async def run(count):
+    bare = await drive(build_app([]), count)
+    legacy = await drive(build_app(LEGACY), count)
+    pure = await drive(build_app(PURE_ASGI), count)
+
+    print(f"requests per stack:      {count}")
+    print(f"no middleware:           {bare * 1e6:8.1f} us/request")
+    print(f"legacy (3 middlewares):  {legacy * 1e6:8.1f} us/request "
+          f"(+{(legacy - bare) * 1e6:.1f})")
+    print(f"pure ASGI (1 layer):     {pure * 1e6:8.1f} us/request "
+          f"(+{(pure - bare) * 1e6:.1f})")
+    if pure > bare:
+        print(f"overhead reduction:      "
+              f"{(legacy - bare) / (pure - bare):.1f}x")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    handler = logging.FileHandler(os.devnull)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    analytics.track_page_view = noop_track_page_view
+
+    asyncio.run(run(count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark: substring search over page_analytics with and without the
+pg_trgm index from sql/14_add_trigram_search_indexes.sql
+
+Loads a synthetic page_analytics-shaped table (one million rows by
+default) into the database named by DATABASE_URL, then prints the plan
+shape and execution time from EXPLAIN (ANALYZE, FORMAT JSON) for:
+
+    legacy    per-column ILIKEs OR-ed together (the old grid query)
+    rewritten the search_filters expression, before the index exists
+    indexed   the same expression with the GIN trigram index
+
+The scratch table is dropped afterwards. Requires pg_trgm.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_trigram_search.py [rows] [term]
+"""
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import database  # noqa: E402
+from search_filters import (  # noqa: E402
+    SEARCH_EXPRESSIONS, search_condition
+)
+
+
+TABLE = 'bench_trgm_page_analytics'
+
+LEGACY_CONDITION = (
+    "(page_path ILIKE :search OR ip_address::text ILIKE :search OR "
+    "user_agent ILIKE :search OR referer ILIKE :search)"
+)
+
+
+async def load_fixture(rows: int):
+    await database.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    await database.execute(
+        f"""CREATE TABLE {TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            page_path TEXT NOT NULL,
+            ip_address INET,
+            user_agent TEXT,
+            referer TEXT
+        )"""
+    )
+    await database.execute(
+        f"""INSERT INTO {TABLE}
+            (timestamp, page_path, ip_address, user_agent, referer)
+        SELECT NOW() - g * INTERVAL '1 second',
+               '/' || (ARRAY['projects', 'work', 'about', 'blog',
+                             'contact'])[1 + g % 5] || '/' || (g % 5000),
+               ('10.' || (g >> 16) % 256 || '.' || (g >> 8) % 256 || '.'
+                || g % 256)::inet,
+               'Mozilla/5.0 (' || (ARRAY['Windows NT 10.0', 'Macintosh',
+                                         'X11; Linux x86_64',
+                                         'iPhone'])[1 + g % 4]
+               || ') build/' || md5(g::text),
+               CASE WHEN g % 3 = 0 THEN 'https://'
+                    || (ARRAY['google.com', 'news.ycombinator.com',
+                              'github.com'])[1 + (g / 3) % 3]
+                    || '/?q=' || (g % 997) END
+        FROM generate_series(1, :rows) AS g""",
+        {'rows': rows}
+    )
+    await database.execute(f"ANALYZE {TABLE}")
+
+
+async def explain(label: str, condition: str, params: dict):
+    row = await database.fetch_one(
+        f"""EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+        SELECT id FROM {TABLE} WHERE {condition}
+        ORDER BY timestamp DESC LIMIT 50""",
+        params
+    )
+    plan = row[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]
+
+    nodes = []
+
+    def walk(node):
+        name = node['Node Type']
+        if node.get('Index Name'):
+            name += f" on {node['Index Name']}"
+        nodes.append(name)
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan['Plan'])
+    print(f"{label:>10}: {plan['Execution Time']:9.1f} ms  "
+          f"{' > '.join(nodes)}")
+
+
+async def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    term = sys.argv[2] if len(sys.argv) > 2 else 'build/3f2a'
+
+    await database.connect()
+    try:
+        await database.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        print(f"Loading {rows} rows into {TABLE}...")
+        await load_fixture(rows)
+
+        condition, params = search_condition('page_analytics', term)
+        await explain('legacy', LEGACY_CONDITION, params)
+        await explain('rewritten', condition, params)
+
+        await database.execute(
+            f"""CREATE INDEX {TABLE}_search_trgm ON {TABLE}
+            USING gin (({SEARCH_EXPRESSIONS['page_analytics']})
+                       gin_trgm_ops)"""
+        )
+        await database.execute(f"ANALYZE {TABLE}")
+        await explain('indexed', condition, params)
+    finally:
+        await database.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        await database.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
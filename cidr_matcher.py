@@ -0,0 +1,104 @@
+"""
+Compiled CIDR Matcher
+Turns lists of network strings into merged, sorted integer intervals so
+membership checks are a single bisect instead of a linear scan
+"""
+import bisect
+import ipaddress
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from log_capture import add_log
+
+
+class CIDRMatcher:
+    """Matches IP addresses against a fixed set of IPv4/IPv6 networks.
+
+    Networks are parsed once at construction, converted to inclusive
+    ``(start, end)`` integer intervals, and overlapping or adjacent
+    intervals are merged. A lookup parses the address once and bisects
+    the interval starts for its address family.
+    """
+
+    def __init__(self, networks: Iterable[str] = ()):
+        self.v4_starts: List[int] = []
+        self.v4_ends: List[int] = []
+        self.v6_starts: List[int] = []
+        self.v6_ends: List[int] = []
+        self.invalid: List[str] = []
+        self.compile(networks)
+
+    def compile(self, networks: Iterable[str]):
+        """(Re)build the interval tables from network strings."""
+        v4: List[Tuple[int, int]] = []
+        v6: List[Tuple[int, int]] = []
+        invalid = []
+
+        for network in networks:
+            try:
+                parsed = ipaddress.ip_network(network.strip(), strict=False)
+            except ValueError:
+                invalid.append(network)
+                continue
+            interval = (int(parsed.network_address),
+                        int(parsed.broadcast_address))
+            (v4 if parsed.version == 4 else v6).append(interval)
+
+        self.v4_starts, self.v4_ends = _merge(v4)
+        self.v6_starts, self.v6_ends = _merge(v6)
+        self.invalid = invalid
+
+    def contains(self, ip_address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return False
+        return self.contains_int(int(ip), ip.version)
+
+    def contains_int(self, value: int, version: int = 4) -> bool:
+        if version == 4:
+            starts, ends = self.v4_starts, self.v4_ends
+        else:
+            starts, ends = self.v6_starts, self.v6_ends
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+    def __contains__(self, ip_address: str) -> bool:
+        return self.contains(ip_address)
+
+    def __len__(self) -> int:
+        return len(self.v4_starts) + len(self.v6_starts)
+
+
+def _merge(intervals: List[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+    """Sort and merge overlapping or adjacent inclusive intervals."""
+    starts: List[int] = []
+    ends: List[int] = []
+    for start, end in sorted(intervals):
+        if ends and start <= ends[-1] + 1:
+            if end > ends[-1]:
+                ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+def load_networks_file(path: Optional[str]) -> List[str]:
+    """Read one network per line; blank lines and ``#`` comments are
+    ignored. A missing file yields an empty list."""
+    if not path or not os.path.exists(path):
+        return []
+
+    networks = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                network = line.split('#', 1)[0].strip()
+                if network:
+                    networks.append(network)
+    except OSError as e:
+        add_log("WARNING",
+                f"Failed to read network list {path}: {str(e)}",
+                module="cidr_matcher", function="load_networks_file")
+    return networks
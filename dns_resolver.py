@@ -0,0 +1,190 @@
+"""
+Non-blocking DNS Resolver
+Reverse DNS lookups off the event loop with caching, request coalescing,
+a hard timeout budget and forward-confirmed crawler verification
+"""
+import asyncio
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from ttl_cache import TTLCache
+
+
+# Crawlers that publish forward-confirmed reverse DNS verification.
+# Maps hostname suffix -> crawler name.
+VERIFIED_CRAWLER_DOMAINS = {
+    '.googlebot.com': 'googlebot',
+    '.google.com': 'googlebot',
+    '.googleusercontent.com': 'googlebot',
+    '.search.msn.com': 'bingbot',
+}
+
+# User-agent tokens that claim to be one of the crawlers above
+CRAWLER_UA_CLAIMS = {
+    'googlebot': 'googlebot',
+    'google-inspectiontool': 'googlebot',
+    'bingbot': 'bingbot',
+    'adidxbot': 'bingbot',
+}
+
+
+class AsyncDNSResolver:
+    """Resolves PTR records without blocking the event loop.
+
+    Lookups run in a small dedicated thread pool so slow resolvers never
+    occupy the default executor. Positive and negative answers are cached
+    with separate TTLs, and concurrent lookups for the same IP share one
+    in-flight future.
+    """
+
+    def __init__(self,
+                 timeout: Optional[float] = None,
+                 positive_ttl: Optional[float] = None,
+                 negative_ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None,
+                 max_workers: Optional[int] = None):
+        self.timeout = timeout or float(os.getenv("DNS_TIMEOUT", "1.0"))
+        self.positive_ttl = positive_ttl or float(
+            os.getenv("DNS_POSITIVE_TTL", "3600"))
+        self.negative_ttl = negative_ttl or float(
+            os.getenv("DNS_NEGATIVE_TTL", "300"))
+        max_entries = max_entries or int(
+            os.getenv("DNS_CACHE_SIZE", "10000"))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv("DNS_WORKERS", "4")),
+            thread_name_prefix="dns"
+        )
+
+        self._ptr_cache = TTLCache(max_entries=max_entries)
+        self._crawler_cache = TTLCache(max_entries=max_entries)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.counters = {
+            'lookups': 0,
+            'coalesced': 0,
+            'timeouts': 0,
+            'errors': 0
+        }
+
+    async def reverse(self, ip_address: str) -> Optional[str]:
+        """Return the lowercase PTR hostname for an IP, or None."""
+        found, hostname = self._ptr_cache.lookup(ip_address)
+        if found:
+            return hostname
+
+        inflight = self._inflight.get(ip_address)
+        if inflight is not None:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(inflight)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[ip_address] = future
+        try:
+            hostname = await self._lookup_ptr(ip_address)
+            ttl = self.positive_ttl if hostname else self.negative_ttl
+            self._ptr_cache.set(ip_address, hostname, ttl=ttl)
+            future.set_result(hostname)
+            return hostname
+        except BaseException as e:
+            # Never leave coalesced waiters hanging
+            if not future.done():
+                future.set_result(None)
+            if isinstance(e, Exception):
+                return None
+            raise
+        finally:
+            self._inflight.pop(ip_address, None)
+
+    async def _lookup_ptr(self, ip_address: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        self.counters['lookups'] += 1
+        try:
+            result = await asyncio.wait_for(
+                loop.run_in_executor(
+                    self._executor, socket.gethostbyaddr, ip_address
+                ),
+                timeout=self.timeout
+            )
+            return result[0].lower().rstrip('.')
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            return None
+        except (socket.herror, socket.gaierror, OSError, UnicodeError):
+            self.counters['errors'] += 1
+            return None
+
+    async def forward_confirms(self, hostname: str,
+                               ip_address: str) -> bool:
+        """Check that ``hostname`` resolves back to ``ip_address``."""
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(
+                loop.getaddrinfo(hostname, None),
+                timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            return False
+        except (socket.gaierror, OSError, UnicodeError):
+            self.counters['errors'] += 1
+            return False
+
+        return any(info[4][0] == ip_address for info in infos)
+
+    async def verify_crawler(self, ip_address: str,
+                             hostname: Optional[str] = None
+                             ) -> Optional[str]:
+        """Return the crawler name if the IP passes forward-confirmed
+        reverse DNS for a known crawler domain, otherwise None.
+
+        Verdicts are cached for the positive TTL so a crawler is verified
+        once rather than on every hit.
+        """
+        found, verdict = self._crawler_cache.lookup(ip_address)
+        if found:
+            return verdict
+
+        if hostname is None:
+            hostname = await self.reverse(ip_address)
+
+        verdict = None
+        crawler = crawler_for_hostname(hostname)
+        if crawler and await self.forward_confirms(hostname, ip_address):
+            verdict = crawler
+
+        self._crawler_cache.set(ip_address, verdict, ttl=self.positive_ttl)
+        return verdict
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **self.counters,
+            'inflight': len(self._inflight),
+            'ptr_cache': self._ptr_cache.stats(),
+            'crawler_cache': self._crawler_cache.stats()
+        }
+
+
+def crawler_for_hostname(hostname: Optional[str]) -> Optional[str]:
+    """Map a PTR hostname to a verifiable crawler name by domain suffix."""
+    if not hostname:
+        return None
+    for suffix, crawler in VERIFIED_CRAWLER_DOMAINS.items():
+        if hostname.endswith(suffix):
+            return crawler
+    return None
+
+
+def claimed_crawler(user_agent: str) -> Optional[str]:
+    """Return the crawler a user-agent string claims to be, if any."""
+    user_agent_lower = (user_agent or '').lower()
+    for token, crawler in CRAWLER_UA_CLAIMS.items():
+        if token in user_agent_lower:
+            return crawler
+    return None
+
+
+# Global resolver instance
+dns_resolver = AsyncDNSResolver()
@@ -0,0 +1,391 @@
+"""
+Error Groups
+Fingerprints errors in the log stream so each distinct failure is stored
+once instead of once per occurrence.
+
+Entries with a traceback are keyed by exception type plus their frame
+stack, normalized to module-relative paths and function names so line
+numbers, install prefixes and messages do not split a group. HTTP error
+entries without a traceback are keyed by status, method and path with
+ids masked. The log writer calls ``group`` inside its transaction: one
+upsert per batch records the groups and their hourly occurrence counts,
+and the app_log rows are written with ``error_group_id`` in place of the
+traceback and request headers.
+
+Entries the log rate limiter suppresses are never written, but they are
+still counted: ``count_suppressed`` keeps them per group and hour in
+memory, and the next upsert adds them to the occurrence counts.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+_FRAME = re.compile(
+    r'^\s*File "(?P<path>[^"]+)", line \d+, in (?P<function>\S+)', re.M)
+_EXCEPTION_TYPE = re.compile(r'^(?P<type>[A-Za-z_][\w.]*)(?::|$)')
+# Install-specific prefixes: site-packages, the stdlib and this checkout
+_LIBRARY_PREFIX = re.compile(
+    r'^.*[/\\](?:(?:site|dist)-packages|python\d+(?:\.\d+)?)[/\\]')
+_ROOT = os.path.dirname(os.path.abspath(__file__)) + os.sep
+# Numeric, UUID and long hex path segments
+_PATH_ID = re.compile(
+    r'/(?:\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+    r'|[0-9a-f]{16,})(?=/|$)', re.I)
+
+# extra keys repeated by every occurrence; kept once on the group
+SAMPLE_EXTRA_KEYS = (
+    'headers', 'request_headers', 'response_headers',
+    'response_body_preview'
+)
+
+# Longest message kept as a group's sample
+MAX_MESSAGE_LENGTH = 1000
+
+SORT_COLUMNS = {'last_seen', 'occurrences', 'first_seen'}
+
+# Groups and hourly buckets by key, as collected for one upsert
+Groups = Dict[str, Dict[str, Any]]
+Hours = Dict[Tuple[str, datetime], Dict[str, Any]]
+
+
+def normalize_frame_path(path: str) -> str:
+    if path.startswith(_ROOT):
+        return path[len(_ROOT):]
+    return _LIBRARY_PREFIX.sub('', path)
+
+
+def frame_stack(traceback_text: str) -> List[str]:
+    """``path:function`` for every frame, outermost first."""
+    return [
+        f"{normalize_frame_path(match['path'])}:{match['function']}"
+        for match in _FRAME.finditer(traceback_text)
+    ]
+
+
+def exception_type(traceback_text: str) -> Optional[str]:
+    """Type of the final exception in a formatted traceback."""
+    for line in reversed(traceback_text.strip().splitlines()):
+        if line and not line[0].isspace():
+            match = _EXCEPTION_TYPE.match(line)
+            return match['type'] if match else None
+    return None
+
+
+def normalize_url_path(url: str) -> str:
+    return _PATH_ID.sub('/:id', urlsplit(url or '').path) or '/'
+
+
+def _extra(entry: Dict[str, Any]) -> Dict[str, Any]:
+    extra = entry.get('extra')
+    if isinstance(extra, str):
+        try:
+            extra = json.loads(extra)
+        except ValueError:
+            return {}
+    return extra if isinstance(extra, dict) else {}
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def fingerprint_entry(
+        entry: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """``(fingerprint, kind, error_type)`` for an app_log entry, or None
+    if it is not an error."""
+    traceback_text = entry.get('traceback')
+    if traceback_text:
+        error_type = exception_type(traceback_text) or 'Error'
+        frames = frame_stack(traceback_text)
+        return (_digest('exception', error_type, *frames),
+                'exception', error_type)
+
+    extra = _extra(entry)
+    status = extra.get('status_code')
+    if isinstance(status, int) and status >= 400:
+        error_type = f"HTTP {status}"
+        method = extra.get('method') or extra.get('request_method') or ''
+        path = normalize_url_path(extra.get('url')
+                                  or extra.get('request_url'))
+        return (_digest('http', error_type, method, path,
+                        entry.get('function') or ''),
+                'http', error_type)
+    return None
+
+
+def compact(entry: Dict[str, Any], group_id: int) -> Dict[str, Any]:
+    """Copy of an entry with the text stored on its group removed."""
+    extra = _extra(entry)
+    trimmed = {key: value for key, value in extra.items()
+               if key not in SAMPLE_EXTRA_KEYS}
+    return {
+        **entry,
+        'traceback': None,
+        'extra': json.dumps(trimmed) if trimmed else None,
+        'error_group_id': group_id
+    }
+
+
+def _hour(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class ErrorGroups:
+    """Deduplicates error entries for the log writer."""
+
+    def __init__(self, max_pending: Optional[int] = None):
+        self.max_pending = max_pending or int(
+            os.getenv("ERROR_GROUPS_MAX_PENDING", "1000"))
+        # Suppressed occurrences not yet upserted; the rate limiter runs
+        # on logging threads
+        self._lock = threading.Lock()
+        self._pending_groups: Groups = {}
+        self._pending_hours: Hours = {}
+        self.counters = {
+            'grouped': 0,
+            'suppressed': 0,
+            'uncounted': 0,
+            'upserts': 0
+        }
+
+    def count_suppressed(self, entry: Dict[str, Any]) -> bool:
+        """Count an entry the rate limiter dropped toward its group.
+        Returns False if it is not an error or could not be kept."""
+        key = fingerprint_entry(entry)
+        if key is None:
+            return False
+        with self._lock:
+            if (key[0] not in self._pending_groups
+                    and len(self._pending_groups) >= self.max_pending):
+                self.counters['uncounted'] += 1
+                return False
+            _collect(entry, key, self._pending_groups, self._pending_hours)
+            self.counters['suppressed'] += 1
+        return True
+
+    def take_suppressed(self) -> Tuple[Groups, Hours]:
+        """Hand the pending suppressed counts to a write; pass them back
+        to ``restore_suppressed`` if it fails."""
+        with self._lock:
+            pending = (self._pending_groups, self._pending_hours)
+            self._pending_groups, self._pending_hours = {}, {}
+        return pending
+
+    def restore_suppressed(self, pending: Tuple[Groups, Hours]):
+        with self._lock:
+            _merge(self._pending_groups, pending[0])
+            _merge(self._pending_hours, pending[1])
+
+    async def group(self, batch: List[Dict[str, Any]],
+                    suppressed: Optional[Tuple[Groups, Hours]] = None
+                    ) -> List[Dict[str, Any]]:
+        """Record the batch's error groups, plus any ``suppressed``
+        counts from ``take_suppressed``, and return the entries to write,
+        compacted where they belong to a group.
+
+        The batch itself is left untouched so a failed write can still
+        be spooled with its tracebacks.
+        """
+        from database import database
+
+        keys: List[Optional[str]] = []
+        groups: Groups = {}
+        hours: Hours = {}
+        for entry in batch:
+            key = fingerprint_entry(entry)
+            keys.append(key[0] if key else None)
+            if key is not None:
+                _collect(entry, key, groups, hours)
+        if suppressed:
+            _merge(groups, suppressed[0])
+            _merge(hours, suppressed[1])
+
+        if not groups:
+            return batch
+
+        # Sorted so concurrent writers lock rows in the same order
+        fingerprints = sorted(groups)
+        described = [groups[f] for f in fingerprints]
+        result = await database.fetch_all(
+            """INSERT INTO error_groups
+                (fingerprint, kind, error_type, message, module, function,
+                 traceback, sample_extra, occurrences, first_seen,
+                 last_seen)
+            SELECT * FROM unnest(
+                CAST(:fingerprints AS TEXT[]),
+                CAST(:kinds AS TEXT[]),
+                CAST(:error_types AS TEXT[]),
+                CAST(:messages AS TEXT[]),
+                CAST(:modules AS TEXT[]),
+                CAST(:functions AS TEXT[]),
+                CAST(:tracebacks AS TEXT[]),
+                CAST(:samples AS TEXT[]),
+                CAST(:occurrences AS BIGINT[]),
+                CAST(:first_seen AS TIMESTAMPTZ[]),
+                CAST(:last_seen AS TIMESTAMPTZ[]))
+            ON CONFLICT (fingerprint) DO UPDATE SET
+                occurrences = error_groups.occurrences
+                              + EXCLUDED.occurrences,
+                first_seen = LEAST(error_groups.first_seen,
+                                   EXCLUDED.first_seen),
+                last_seen = GREATEST(error_groups.last_seen,
+                                     EXCLUDED.last_seen)
+            RETURNING id, fingerprint""",
+            {
+                'fingerprints': fingerprints,
+                'kinds': [g['kind'] for g in described],
+                'error_types': [g['error_type'] for g in described],
+                'messages': [g['message'] for g in described],
+                'modules': [g['module'] for g in described],
+                'functions': [g['function'] for g in described],
+                'tracebacks': [g['traceback'] for g in described],
+                'samples': [g['sample_extra'] for g in described],
+                'occurrences': [g['occurrences'] for g in described],
+                'first_seen': [g['first_seen'] for g in described],
+                'last_seen': [g['last_seen'] for g in described]
+            }
+        )
+        ids = {row['fingerprint']: row['id'] for row in result}
+
+        buckets = sorted(hours)
+        await database.execute(
+            """INSERT INTO error_group_occurrences
+                (group_id, hour, occurrences, first_seen, last_seen)
+            SELECT * FROM unnest(
+                CAST(:group_ids AS INTEGER[]),
+                CAST(:hours AS TIMESTAMPTZ[]),
+                CAST(:occurrences AS BIGINT[]),
+                CAST(:first_seen AS TIMESTAMPTZ[]),
+                CAST(:last_seen AS TIMESTAMPTZ[]))
+            ON CONFLICT (group_id, hour) DO UPDATE SET
+                occurrences = error_group_occurrences.occurrences
+                              + EXCLUDED.occurrences,
+                first_seen = LEAST(error_group_occurrences.first_seen,
+                                   EXCLUDED.first_seen),
+                last_seen = GREATEST(error_group_occurrences.last_seen,
+                                     EXCLUDED.last_seen)""",
+            {
+                'group_ids': [ids[f] for f, _ in buckets],
+                'hours': [hour for _, hour in buckets],
+                'occurrences': [hours[b]['occurrences'] for b in buckets],
+                'first_seen': [hours[b]['first_seen'] for b in buckets],
+                'last_seen': [hours[b]['last_seen'] for b in buckets]
+            }
+        )
+        self.counters['upserts'] += 1
+        self.counters['grouped'] += sum(1 for key in keys if key)
+
+        return [compact(entry, ids[key]) if key else entry
+                for entry, key in zip(batch, keys)]
+
+    async def recent(self, limit: int = 50,
+                     sort: str = 'last_seen') -> List[Dict[str, Any]]:
+        """Groups for the logs UI with their last-24-hour counts; reads
+        ``limit`` groups through an index regardless of volume."""
+        from database import database
+
+        if sort not in SORT_COLUMNS:
+            sort = 'last_seen'
+        since = _hour(datetime.now(timezone.utc)) - timedelta(hours=23)
+        rows = await database.fetch_all(
+            f"""SELECT g.id, g.kind, g.error_type, g.message, g.module,
+                g.function, g.occurrences, g.first_seen, g.last_seen,
+                COALESCE((
+                    SELECT SUM(o.occurrences) FROM error_group_occurrences o
+                    WHERE o.group_id = g.id AND o.hour >= :since
+                ), 0) AS last_24h
+            FROM error_groups g
+            ORDER BY g.{sort} DESC
+            LIMIT :limit""",
+            {'since': since, 'limit': limit}
+        )
+        return [dict(row) for row in rows]
+
+    async def detail(self, group_id: int) -> Optional[Dict[str, Any]]:
+        """One group with its traceback, header sample and the hourly
+        counts for the last week."""
+        from database import database
+
+        group = await database.fetch_one(
+            "SELECT * FROM error_groups WHERE id = :id", {'id': group_id}
+        )
+        if group is None:
+            return None
+        since = _hour(datetime.now(timezone.utc)) - timedelta(days=7)
+        hours = await database.fetch_all(
+            """SELECT hour, occurrences, first_seen, last_seen
+            FROM error_group_occurrences
+            WHERE group_id = :id AND hour >= :since
+            ORDER BY hour""",
+            {'id': group_id, 'since': since}
+        )
+        result = dict(group)
+        result['sample_extra'] = (json.loads(result['sample_extra'])
+                                  if result['sample_extra'] else None)
+        result['hours'] = [dict(row) for row in hours]
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters)
+
+
+def _count(bucket: Dict[str, Any], timestamp: datetime):
+    bucket['occurrences'] += 1
+    bucket['first_seen'] = min(bucket['first_seen'], timestamp)
+    bucket['last_seen'] = max(bucket['last_seen'], timestamp)
+
+
+def _collect(entry: Dict[str, Any], key: Tuple[str, str, str],
+             groups: Groups, hours: Hours):
+    """Count one occurrence of ``entry`` on its group and hour."""
+    fingerprint, kind, error_type = key
+    timestamp = entry.get('timestamp') or datetime.now()
+    group = groups.get(fingerprint)
+    if group is None:
+        sample = {k: v for k, v in _extra(entry).items()
+                  if k in SAMPLE_EXTRA_KEYS}
+        group = groups[fingerprint] = {
+            'kind': kind,
+            'error_type': error_type,
+            'message': (entry.get('message') or '')[:MAX_MESSAGE_LENGTH],
+            'module': entry.get('module'),
+            'function': entry.get('function'),
+            'traceback': entry.get('traceback'),
+            'sample_extra': json.dumps(sample) if sample else None,
+            'occurrences': 0,
+            'first_seen': timestamp,
+            'last_seen': timestamp
+        }
+    _count(group, timestamp)
+    hour = hours.setdefault((fingerprint, _hour(timestamp)), {
+        'occurrences': 0,
+        'first_seen': timestamp,
+        'last_seen': timestamp
+    })
+    _count(hour, timestamp)
+
+
+def _merge(target: Dict[Any, Dict[str, Any]],
+           source: Dict[Any, Dict[str, Any]]):
+    """Add ``source`` buckets' counts into ``target``, leaving
+    ``source`` as it was."""
+    for key, bucket in source.items():
+        existing = target.get(key)
+        if existing is None:
+            target[key] = dict(bucket)
+            continue
+        existing['occurrences'] += bucket['occurrences']
+        existing['first_seen'] = min(existing['first_seen'],
+                                     bucket['first_seen'])
+        existing['last_seen'] = max(existing['last_seen'],
+                                    bucket['last_seen'])
+
+
+# Global error grouper
+error_groups = ErrorGroups()
@@ -0,0 +1,510 @@
+"""
+Heavy Hitters
+Streaming top-K tracking of pages, referrer domains and visitor IPs so
+the dashboard "top" widgets are answered from memory instead of a
+GROUP BY ... ORDER BY count DESC over the whole window.
+
+Each dimension keeps one Space-Saving summary for the current hour,
+updated in O(1) per page view (a stream-summary of count buckets), with
+a Count-Min sketch alongside it. Space-Saving over-estimates the counts
+of keys that replaced an evicted one; when the hour closes every count
+is tightened to the smaller of the two estimates and the hour is frozen
+as a plain ``{key: count}`` map. Windows (last hour, day, week, up to
+HEAVY_HITTERS_WINDOW_HOURS) sum the frozen hours plus the live one.
+
+State is per process and checkpointed to heavy_hitter_checkpoints on a
+timer and at shutdown. Without a checkpoint the tracker seeds itself
+from the hourly rollups. Readers fall back to SQL for windows that
+reach further back than the tracker covers.
+"""
+import asyncio
+import json
+import os
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from analytics_rollups import ROLLUPS, floor_hour, raw_source
+from database import database
+from log_capture import add_log
+from visitor_sketches import _normalize_ip, referrer_domain
+
+
+# Dimension -> (rollup name, rollup column) used for seeding
+DIMENSIONS = {
+    'pages': ('pages', 'page_path'),
+    'referrers': ('referrers', 'referrer_domain'),
+    'ips': ('visitors', 'ip_address'),
+}
+
+CHECKPOINT_NAME = 'dashboard'
+
+
+class CountMinSketch:
+    """Count-Min sketch over ``depth`` rows of ``width`` counters."""
+
+    def __init__(self, width: int = 1024, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('L', bytes(array('L').itemsize * width))
+                     for _ in range(depth)]
+
+    def _indexes(self, key: str) -> Iterable[int]:
+        # Double hashing from one 64-bit hash; never persisted, so the
+        # per-process salt of hash() is fine
+        hashed = hash(key) & 0xFFFFFFFFFFFFFFFF
+        first, second = hashed & 0xFFFFFFFF, (hashed >> 32) | 1
+        return ((first + i * second) % self.width for i in range(self.depth))
+
+    def add(self, key: str, count: int = 1):
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += count
+
+    def estimate(self, key: str) -> int:
+        return min(row[index]
+                   for row, index in zip(self.rows, self._indexes(key)))
+
+
+class SpaceSaving:
+    """Space-Saving summary with O(1) unit increments.
+
+    Keys sharing a count live in the same bucket, and the smallest
+    non-empty count is tracked, so an increment or an eviction only
+    moves one key between neighbouring buckets.
+    """
+
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        # count -> keys with that count (dict as an insertion-ordered set)
+        self._buckets: Dict[int, Dict[str, None]] = {}
+        self._min = 0
+
+    def _move(self, key: str, old: int, new: int):
+        if old:
+            bucket = self._buckets[old]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[old]
+                if old == self._min:
+                    self._min = new
+        self._buckets.setdefault(new, {})[key] = None
+        self.counts[key] = new
+
+    def add(self, key: str):
+        count = self.counts.get(key)
+        if count is not None:
+            self._move(key, count, count + 1)
+            return
+        if len(self.counts) < self.capacity:
+            self.errors[key] = 0
+            self._move(key, 0, 1)
+            self._min = 1
+            return
+        # Replace the oldest key among those with the smallest count
+        floor = self._min
+        victim = next(iter(self._buckets[floor]))
+        del self._buckets[floor][victim]
+        del self.counts[victim]
+        del self.errors[victim]
+        if not self._buckets[floor]:
+            del self._buckets[floor]
+            self._min = floor + 1
+        self.errors[key] = floor
+        self._move(key, 0, floor + 1)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+
+class HourSummary:
+    """Space-Saving plus Count-Min for the hour being written."""
+
+    def __init__(self, hour: datetime, capacity: int, width: int,
+                 depth: int):
+        self.hour = hour
+        self.summary = SpaceSaving(capacity)
+        self.sketch = CountMinSketch(width, depth)
+
+    def add(self, key: str):
+        self.summary.add(key)
+        self.sketch.add(key)
+
+    def snapshot(self) -> Dict[str, int]:
+        """Counts tightened by the Count-Min estimate."""
+        estimate = self.sketch.estimate
+        return {key: min(count, estimate(key))
+                for key, count in self.summary.counts.items()}
+
+
+def row_keys(row: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """``(dimension, key)`` pairs a page view counts towards."""
+    keys = []
+    if row.get('page_path'):
+        keys.append(('pages', row['page_path']))
+    domain = row.get('referrer_domain') or referrer_domain(row.get('referer'))
+    if domain:
+        keys.append(('referrers', domain))
+    ip = _normalize_ip(row.get('ip_address'))
+    if ip:
+        keys.append(('ips', ip))
+    return keys
+
+
+def _merge_counts(target: Dict[str, int], source: Dict[str, int]):
+    for key, count in source.items():
+        target[key] = target.get(key, 0) + count
+
+
+class HeavyHitters:
+    """Windowed top-K per dimension with periodic checkpoints."""
+
+    def __init__(self,
+                 capacity: Optional[int] = None,
+                 window_hours: Optional[int] = None,
+                 sketch_width: Optional[int] = None,
+                 sketch_depth: Optional[int] = None,
+                 checkpoint_interval: Optional[float] = None):
+        self.capacity = capacity or int(
+            os.getenv("HEAVY_HITTERS_CAPACITY", "200"))
+        self.window_hours = window_hours or int(
+            os.getenv("HEAVY_HITTERS_WINDOW_HOURS", "168"))
+        self.sketch_width = sketch_width or int(
+            os.getenv("HEAVY_HITTERS_SKETCH_WIDTH", "1024"))
+        self.sketch_depth = sketch_depth or int(
+            os.getenv("HEAVY_HITTERS_SKETCH_DEPTH", "4"))
+        self.checkpoint_interval = checkpoint_interval or float(
+            os.getenv("HEAVY_HITTERS_CHECKPOINT_INTERVAL", "300"))
+
+        self._live: Dict[str, HourSummary] = {}
+        # dimension -> hour -> frozen counts
+        self._closed: Dict[str, Dict[datetime, Dict[str, int]]] = {
+            dimension: {} for dimension in DIMENSIONS}
+        # (dimension, first hour) -> merged closed counts
+        self._totals_cache: Dict[Tuple[str, datetime], Dict[str, int]] = {}
+        self.covered_since: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self.counters = {
+            'observed': 0,
+            'checkpoints': 0,
+            'served': 0,
+            'fallbacks': 0
+        }
+        self.last_checkpoint: Optional[str] = None
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def _close(self, dimension: str):
+        live = self._live.pop(dimension, None)
+        if live is None:
+            return
+        _merge_counts(self._closed[dimension].setdefault(live.hour, {}),
+                      live.snapshot())
+        self._totals_cache.clear()
+
+    def _prune(self, dimension: str, current_hour: datetime):
+        closed = self._closed[dimension]
+        oldest = current_hour - timedelta(hours=self.window_hours)
+        expired = [hour for hour in closed if hour <= oldest]
+        for hour in expired:
+            del closed[hour]
+        if expired:
+            self._totals_cache.clear()
+
+    def _live_for(self, dimension: str, hour: datetime) -> HourSummary:
+        live = self._live.get(dimension)
+        if live is not None and hour <= live.hour:
+            # Late rows from the previous hour count towards this one
+            return live
+        self._close(dimension)
+        self._prune(dimension, hour)
+        live = self._live[dimension] = HourSummary(
+            hour, self.capacity, self.sketch_width, self.sketch_depth)
+        return live
+
+    def observe(self, rows: Sequence[Dict[str, Any]]):
+        """Count written page views; O(1) per dimension per row."""
+        for row in rows:
+            timestamp = row.get('timestamp')
+            if timestamp is None:
+                continue
+            hour = floor_hour(timestamp)
+            if self.covered_since is None:
+                self.covered_since = hour
+            for dimension, key in row_keys(row):
+                self._live_for(dimension, hour).add(key)
+            self.counters['observed'] += 1
+
+    # ------------------------------------------------------------------
+    # Read side
+    # ------------------------------------------------------------------
+
+    def _closed_totals(self, dimension: str,
+                       first_hour: datetime) -> Dict[str, int]:
+        key = (dimension, first_hour)
+        totals = self._totals_cache.get(key)
+        if totals is None:
+            totals = {}
+            for hour, counts in self._closed[dimension].items():
+                if hour >= first_hour:
+                    _merge_counts(totals, counts)
+            self._totals_cache[key] = totals
+        return totals
+
+    def top(self, dimension: str, since: datetime,
+            k: int = 10) -> Optional[List[Tuple[str, int]]]:
+        """Top ``k`` keys by count from the hour containing ``since``.
+
+        Returns None if the window reaches past what is tracked.
+        """
+        first_hour = floor_hour(since)
+        now_hour = floor_hour(datetime.now(timezone.utc))
+        if (self.covered_since is None or first_hour < self.covered_since
+                or first_hour < now_hour - timedelta(
+                    hours=self.window_hours - 1)):
+            self.counters['fallbacks'] += 1
+            return None
+
+        live = self._live.get(dimension)
+        if live is not None and live.hour < now_hour:
+            self._close(dimension)
+            live = None
+        self._prune(dimension, now_hour)
+
+        totals = self._closed_totals(dimension, first_hour)
+        if live is not None:
+            totals = dict(totals)
+            _merge_counts(totals, live.snapshot())
+        self.counters['served'] += 1
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    # ------------------------------------------------------------------
+    # Background job
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._stopping:
+            self._stopping.set()
+        if self._task:
+            try:
+                await self._task
+            except Exception as e:
+                print(f"Heavy hitter checkpointing stopped with error: {e}")
+            self._task = None
+        try:
+            await self.checkpoint()
+        except Exception as e:
+            print(f"Final heavy hitter checkpoint failed: {e}")
+
+    async def _run(self):
+        try:
+            if not await self.restore():
+                await self.seed()
+        except Exception as e:
+            add_log(
+                "ERROR", f"Could not restore or seed top-K state: {str(e)}",
+                module="heavy_hitters", function="_run"
+            )
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.checkpoint_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping.is_set():
+                break
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                add_log(
+                    "WARNING", f"Checkpoint failed: {str(e)}",
+                    module="heavy_hitters", function="_run"
+                )
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def to_payload(self) -> bytes:
+        """Compressed JSON of every tracked hour, live hours included."""
+        hours: Dict[str, Dict[str, Dict[str, int]]] = {}
+        for dimension in DIMENSIONS:
+            closed = {hour: dict(counts)
+                      for hour, counts in self._closed[dimension].items()}
+            live = self._live.get(dimension)
+            if live is not None:
+                _merge_counts(closed.setdefault(live.hour, {}),
+                              live.snapshot())
+            hours[dimension] = {hour.isoformat(): counts
+                                for hour, counts in closed.items()}
+        payload = {
+            'covered_since': (self.covered_since.isoformat()
+                              if self.covered_since else None),
+            'hours': hours
+        }
+        return zlib.compress(json.dumps(payload,
+                                        separators=(',', ':')).encode())
+
+    def load_payload(self, data: bytes):
+        payload = json.loads(zlib.decompress(bytes(data)))
+        self._live.clear()
+        self._totals_cache.clear()
+        for dimension in DIMENSIONS:
+            self._closed[dimension] = {
+                datetime.fromisoformat(hour): counts
+                for hour, counts in payload['hours'].get(dimension, {}).items()
+            }
+        covered = payload.get('covered_since')
+        self.covered_since = (datetime.fromisoformat(covered)
+                              if covered else None)
+
+    async def checkpoint(self):
+        if self.covered_since is None:
+            return
+        await database.execute(
+            """INSERT INTO heavy_hitter_checkpoints
+                (name, payload, checkpointed_at)
+            VALUES (:name, :payload, NOW())
+            ON CONFLICT (name) DO UPDATE SET
+                payload = EXCLUDED.payload,
+                checkpointed_at = EXCLUDED.checkpointed_at""",
+            {'name': CHECKPOINT_NAME, 'payload': self.to_payload()}
+        )
+        self.counters['checkpoints'] += 1
+        self.last_checkpoint = datetime.now(timezone.utc).isoformat()
+
+    async def restore(self) -> bool:
+        """Load the last checkpoint. Returns False if there is none.
+
+        Views written after the checkpoint was taken are missing from it,
+        so its hours from ``checkpointed_at`` on are read again from the
+        rollups and raw rows.
+        """
+        row = await database.fetch_one(
+            """SELECT payload, checkpointed_at FROM heavy_hitter_checkpoints
+            WHERE name = :name""",
+            {'name': CHECKPOINT_NAME}
+        )
+        if not row:
+            return False
+        pending = dict(self._live)
+        self.load_payload(row['payload'])
+        gap_start = floor_hour(row['checkpointed_at'])
+        try:
+            # Includes the views observed while the checkpoint was loading,
+            # which were written before they were observed
+            fresh = await self._read_hours(gap_start)
+        except Exception as e:
+            for dimension, live in pending.items():
+                _merge_counts(
+                    self._closed[dimension].setdefault(live.hour, {}),
+                    live.snapshot())
+            # Every window up to now misses the gap, so all of them fall
+            # back to SQL until the next hour starts fully observed
+            self.covered_since = (floor_hour(datetime.now(timezone.utc))
+                                  + timedelta(hours=1))
+            add_log(
+                "WARNING",
+                f"Could not re-read top-K hours since the checkpoint: "
+                f"{str(e)}",
+                module="heavy_hitters", function="restore"
+            )
+            return True
+        for dimension, hours in fresh.items():
+            closed = self._closed[dimension]
+            for hour in [hour for hour in closed if hour >= gap_start]:
+                del closed[hour]
+            for hour, counts in hours.items():
+                _merge_counts(closed.setdefault(hour, {}), counts)
+            self._live.pop(dimension, None)
+        self._totals_cache.clear()
+        return True
+
+    async def seed(self):
+        """Build the closed hours from the hourly rollups plus raw rows
+        past the rollup watermark."""
+        now = datetime.now(timezone.utc)
+        since = floor_hour(now) - timedelta(hours=self.window_hours - 1)
+        for dimension, hours in (await self._read_hours(since)).items():
+            for hour, counts in hours.items():
+                _merge_counts(self._closed[dimension].setdefault(hour, {}),
+                              counts)
+            # The raw part of the query re-reads anything already counted
+            # live, so start the live hour over
+            self._live.pop(dimension, None)
+        self._totals_cache.clear()
+        self.covered_since = since
+        add_log(
+            "INFO",
+            f"Seeded top-K state from rollups since {since.isoformat()}",
+            module="heavy_hitters", function="seed"
+        )
+
+    async def _read_hours(
+            self, since: datetime
+    ) -> Dict[str, Dict[datetime, Dict[str, int]]]:
+        """Top ``capacity`` keys per hour since ``since``, per dimension."""
+        result = {}
+        for dimension, (rollup, column) in DIMENSIONS.items():
+            spec = ROLLUPS[rollup]
+            raw_expr = dict(spec['dims'])[column]
+            rows = await database.fetch_all(
+                f"""SELECT bucket, key, views FROM (
+                    SELECT bucket, key, SUM(views) AS views,
+                           row_number() OVER (
+                               PARTITION BY bucket
+                               ORDER BY SUM(views) DESC) AS rn
+                    FROM (
+                        SELECT bucket, {column} AS key, views
+                        FROM analytics_hourly_{rollup}
+                        WHERE bucket >= :since
+                        UNION ALL
+                        SELECT date_trunc('hour', timestamp), {raw_expr}, 1
+                        FROM {raw_source(rollup)}
+                        WHERE timestamp >= GREATEST(:since, COALESCE(
+                            (SELECT MAX(bucket) + INTERVAL '1 hour'
+                             FROM analytics_hourly_{rollup}), :since))
+                        {spec['where']}
+                    ) source
+                    GROUP BY bucket, key
+                ) ranked
+                WHERE rn <= :capacity""",
+                {'since': since, 'capacity': self.capacity}
+            )
+            closed: Dict[datetime, Dict[str, int]] = {}
+            for row in rows:
+                if row['key'] is None:
+                    continue
+                closed.setdefault(floor_hour(row['bucket']), {})[
+                    row['key']] = int(row['views'])
+            result[dimension] = closed
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'capacity': self.capacity,
+            'window_hours': self.window_hours,
+            'covered_since': (self.covered_since.isoformat()
+                              if self.covered_since else None),
+            'hours_tracked': {dimension: len(hours)
+                              for dimension, hours in self._closed.items()},
+            'running': bool(self._task and not self._task.done()),
+            'last_checkpoint': self.last_checkpoint
+        }
+
+
+# Global top-K tracker
+heavy_hitters = HeavyHitters()
@@ -2,12 +2,13 @@
 IP Analysis Module for Enhanced Bot Detection
 Provides reverse DNS lookup, network classification, and visitor type detection
 """
-import socket
-import ipaddress
-import requests
-import asyncio
+import os
 from typing import Dict, Optional, Any
 from log_capture import add_log
+from cidr_matcher import CIDRMatcher, load_networks_file
+from signature_matcher import SignatureMatcher, load_crawler_user_agents
+from ip_asn_db import ip_asn_db
+from dns_resolver import dns_resolver, claimed_crawler, crawler_for_hostname
 
 
 class IPAnalyzer:
@@ -46,6 +47,18 @@ class IPAnalyzer:
             '149.28.0.0/16',     # Vultr
         ]
         
+        # Additional published crawler and cloud ranges shipped as files
+        self.bot_networks += load_networks_file(
+            os.getenv("BOT_NETWORKS_FILE", "data/bot_networks.txt"))
+        self.datacenter_networks = load_networks_file(
+            os.getenv("DATACENTER_NETWORKS_FILE",
+                      "data/datacenter_networks.txt"))
+        
+        # Compiled once into merged integer intervals for bisect lookups
+        self.bot_network_matcher = CIDRMatcher(self.bot_networks)
+        self.datacenter_network_matcher = CIDRMatcher(
+            self.datacenter_networks)
+        
         # Known bot hostname patterns
         self.bot_hostname_patterns = [
             'bot', 'crawler', 'spider', 'scraper', 'scanner',
@@ -61,88 +74,103 @@ class IPAnalyzer:
             'cloudflare', 'fastly', 'hosting', 'datacenter',
             'servers', 'vps', 'cloud', 'compute'
         ]
+        
+        # User agent bot signatures, optionally extended with a full
+        # crawler-user-agents dataset
+        self.bot_user_agent_patterns = [
+            'bot', 'crawler', 'spider', 'scraper'
+        ] + load_crawler_user_agents(
+            os.getenv("CRAWLER_USER_AGENTS_FILE",
+                      "data/crawler-user-agents.json"))
+        
+        # All signature lists compiled into one automaton so each string
+        # is scanned once for every category
+        self.signatures = SignatureMatcher({
+            'bot_hostname': self.bot_hostname_patterns,
+            'datacenter': self.datacenter_patterns,
+            'bot_user_agent': self.bot_user_agent_patterns
+        })
     
-    def get_reverse_dns(self, ip_address: str) -> Optional[str]:
-        """Get reverse DNS hostname for an IP address"""
-        try:
-            hostname = socket.gethostbyaddr(ip_address)[0]
-            return hostname.lower()
-        except (socket.herror, socket.gaierror, OSError):
+    async def get_reverse_dns(self, ip_address: str) -> Optional[str]:
+        """Get reverse DNS hostname for an IP address (cached, non-blocking)"""
+        return await dns_resolver.reverse(ip_address)
+
+    async def verify_crawler_claim(self,
+                                   ip_address: str,
+                                   user_agent: str,
+                                   reverse_dns: Optional[str]) -> Optional[str]:
+        """
+        Forward-confirm Googlebot/Bingbot claims from the user agent or PTR
+        Returns the verified crawler name, or None if there is no claim or
+        the claim does not verify
+        """
+        if not (claimed_crawler(user_agent) or
+                crawler_for_hostname(reverse_dns)):
             return None
+        return await dns_resolver.verify_crawler(ip_address, reverse_dns)
     
     def is_known_bot_network(self, ip_address: str) -> bool:
         """Check if IP belongs to a known bot/crawler network"""
-        try:
-            ip = ipaddress.ip_address(ip_address)
-            for network in self.bot_networks:
-                if ip in ipaddress.ip_network(network):
-                    return True
-            return False
-        except (ValueError, ipaddress.AddressValueError):
-            return False
+        return self.bot_network_matcher.contains(ip_address)
+    
+    def is_datacenter_network(self, ip_address: str) -> bool:
+        """Check if IP belongs to a published cloud/hosting range"""
+        return self.datacenter_network_matcher.contains(ip_address)
     
     def analyze_hostname(self, hostname: Optional[str]) -> Dict[str, bool]:
         """Analyze hostname for bot and datacenter indicators"""
         if not hostname:
             return {'is_bot_hostname': False, 'is_datacenter_hostname': False}
         
-        hostname_lower = hostname.lower()
-        
-        is_bot = any(pattern in hostname_lower for pattern in self.bot_hostname_patterns)
-        is_datacenter = any(pattern in hostname_lower for pattern in self.datacenter_patterns)
+        matches = self.signatures.match(hostname)
         
         return {
-            'is_bot_hostname': is_bot,
-            'is_datacenter_hostname': is_datacenter
+            'is_bot_hostname': 'bot_hostname' in matches,
+            'is_datacenter_hostname': 'datacenter' in matches
         }
     
-    async def get_ip_geolocation(self, ip_address: str) -> Optional[Dict[str, Any]]:
-        """Get IP geolocation and organization info using free API"""
+    def get_ip_network_info(self, ip_address: str) -> Optional[Dict[str, Any]]:
+        """Get ASN, organization and country from the local range table"""
         try:
-            # Using ipapi.co free tier (1000 requests/day)
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                lambda: requests.get(
-                    f"https://ipapi.co/{ip_address}/json/",
-                    timeout=5
-                )
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    'org': data.get('org', ''),
-                    'asn': data.get('asn', ''),
-                    'city': data.get('city', ''),
-                    'country': data.get('country_code', ''),
-                    'region': data.get('region', ''),
-                    'is_datacenter': self._is_datacenter_org(data.get('org', ''))
-                }
+            record = ip_asn_db.lookup(ip_address)
         except Exception as e:
-            add_log("WARNING", "ip_analyzer", 
-                   f"Failed to get geolocation for {ip_address}: {str(e)}")
-        
-        return None
+            add_log("WARNING",
+                    f"Failed ASN lookup for {ip_address}: {str(e)}",
+                    module="ip_analyzer")
+            return None
+
+        if not record:
+            return None
+
+        return {
+            'org': record['org'],
+            'asn': f"AS{record['asn']}",
+            'country': record['country'],
+            'is_datacenter': self._is_datacenter_org(record['org'])
+        }
     
     def _is_datacenter_org(self, org_name: str) -> bool:
         """Check if organization name indicates a datacenter/hosting provider"""
         if not org_name:
             return False
         
-        org_lower = org_name.lower()
-        return any(pattern in org_lower for pattern in self.datacenter_patterns)
+        return 'datacenter' in self.signatures.match(org_name)
     
     def classify_visitor(self, 
                         ip_address: str,
                         user_agent: str,
                         mouse_activity: bool,
                         reverse_dns: Optional[str] = None,
-                        geo_data: Optional[Dict] = None) -> str:
+                        geo_data: Optional[Dict] = None,
+                        verified_crawler: Optional[str] = None) -> str:
         """
         Classify visitor type based on multiple signals
         Returns: 'human', 'bot', 'suspicious', 'unknown'
         """
+        # Forward-confirmed crawlers need no further scoring
+        if verified_crawler:
+            return 'bot'
+
         bot_signals = 0
         
         # Mouse activity (strongest human signal)
@@ -150,9 +178,7 @@ class IPAnalyzer:
             bot_signals += 1
         
         # User agent analysis
-        user_agent_lower = user_agent.lower()
-        if any(bot_word in user_agent_lower for bot_word in 
-               ['bot', 'crawler', 'spider', 'scraper']):
+        if 'bot_user_agent' in self.signatures.match(user_agent):
             bot_signals += 3
         
         # Reverse DNS analysis
@@ -190,17 +216,23 @@ class IPAnalyzer:
         """
         try:
             # Reverse DNS lookup
-            reverse_dns = self.get_reverse_dns(ip_address)
+            reverse_dns = await self.get_reverse_dns(ip_address)
+            verified_crawler = await self.verify_crawler_claim(
+                ip_address, user_agent, reverse_dns
+            )
             
-            # Geolocation lookup (with rate limiting consideration)
-            geo_data = await self.get_ip_geolocation(ip_address)
+            # Local ASN/organization lookup (no network access)
+            geo_data = self.get_ip_network_info(ip_address)
             
             return {
                 'reverse_dns': reverse_dns,
+                'verified_crawler': verified_crawler,
                 'is_datacenter': (
-                    geo_data.get('is_datacenter', False) if geo_data 
-                    else self.analyze_hostname(reverse_dns).get(
-                        'is_datacenter_hostname', False)
+                    self.is_datacenter_network(ip_address) or (
+                        geo_data.get('is_datacenter', False) if geo_data
+                        else self.analyze_hostname(reverse_dns).get(
+                            'is_datacenter_hostname', False)
+                    )
                 ),
                 'asn': geo_data.get('asn') if geo_data else None,
                 'organization': geo_data.get('org') if geo_data else None,
@@ -212,6 +244,7 @@ class IPAnalyzer:
                     f"Failed basic IP analysis for {ip_address}: {str(e)}")
             return {
                 'reverse_dns': None,
+                'verified_crawler': None,
                 'is_datacenter': False,
                 'asn': None,
                 'organization': None,
@@ -228,22 +261,30 @@ class IPAnalyzer:
         """
         try:
             # Reverse DNS lookup
-            reverse_dns = self.get_reverse_dns(ip_address)
+            reverse_dns = await self.get_reverse_dns(ip_address)
+            verified_crawler = await self.verify_crawler_claim(
+                ip_address, user_agent, reverse_dns
+            )
             
-            # Geolocation lookup (with rate limiting consideration)
-            geo_data = await self.get_ip_geolocation(ip_address)
+            # Local ASN/organization lookup (no network access)
+            geo_data = self.get_ip_network_info(ip_address)
             
             # Visitor classification
             visitor_type = self.classify_visitor(
-                ip_address, user_agent, mouse_activity, reverse_dns, geo_data
+                ip_address, user_agent, mouse_activity, reverse_dns, geo_data,
+                verified_crawler=verified_crawler
             )
             
             return {
                 'reverse_dns': reverse_dns,
+                'verified_crawler': verified_crawler,
                 'visitor_type': visitor_type,
                 'is_datacenter': (
-                    geo_data.get('is_datacenter', False) if geo_data 
-                    else self.analyze_hostname(reverse_dns).get('is_datacenter_hostname', False)
+                    self.is_datacenter_network(ip_address) or (
+                        geo_data.get('is_datacenter', False) if geo_data
+                        else self.analyze_hostname(reverse_dns).get(
+                            'is_datacenter_hostname', False)
+                    )
                 ),
                 'asn': geo_data.get('asn') if geo_data else None,
                 'organization': geo_data.get('org') if geo_data else None,
@@ -255,6 +296,7 @@ class IPAnalyzer:
                    f"Failed to analyze IP {ip_address}: {str(e)}")
             return {
                 'reverse_dns': None,
+                'verified_crawler': None,
                 'visitor_type': 'unknown',
                 'is_datacenter': False,
                 'asn': None,
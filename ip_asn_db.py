@@ -0,0 +1,298 @@
+"""
+Offline IP-to-ASN Database
+Local ASN/organization/country enrichment from a range dataset so page
+view analysis never calls an external geolocation API.
+
+Source data is the iptoasn.com ``ip2asn-combined.tsv`` format (optionally
+gzipped)::
+
+    range_start<TAB>range_end<TAB>as_number<TAB>country<TAB>description
+
+The TSV is compiled once into a flat binary table of sorted integer ranges
+which is memory-mapped, so every worker process shares a single copy in the
+page cache. Lookups are a bisect over the range starts.
+
+Usage:
+    python ip_asn_db.py compile ip2asn-combined.tsv.gz data/ip2asn.bin
+    python ip_asn_db.py lookup data/ip2asn.bin 8.8.8.8
+"""
+import bisect
+import gzip
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from log_capture import add_log
+
+
+MAGIC = b'IPASN01\0'
+# magic, v4 range count, v6 range count, metadata record count, blob size
+HEADER = struct.Struct('<8sIIII')
+V6_WIDTH = 16
+
+
+class _V6Keys:
+    """Sequence view over packed 16-byte big-endian IPv6 keys.
+
+    Big-endian fixed-width bytes compare in numeric order, so ``bisect``
+    works directly on the slices without building int objects up front.
+    """
+
+    def __init__(self, buffer: memoryview, count: int):
+        self._buffer = buffer
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> bytes:
+        start = index * V6_WIDTH
+        return bytes(self._buffer[start:start + V6_WIDTH])
+
+
+class IPASNTable:
+    """Read-only view of a compiled range table."""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, v4_count, v6_count, meta_count, blob_size = \
+            HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a compiled IP-to-ASN table")
+
+        offset = HEADER.size
+
+        def take(size):
+            nonlocal offset
+            chunk = view[offset:offset + size]
+            offset += size
+            return chunk
+
+        self.v4_starts = take(4 * v4_count).cast('I')
+        self.v4_ends = take(4 * v4_count).cast('I')
+        self.v4_meta = take(4 * v4_count).cast('I')
+        self.v6_starts = _V6Keys(take(V6_WIDTH * v6_count), v6_count)
+        self.v6_ends = _V6Keys(take(V6_WIDTH * v6_count), v6_count)
+        self.v6_meta = take(4 * v6_count).cast('I')
+        self.meta_asn = take(4 * meta_count).cast('I')
+        self.meta_country = take(2 * meta_count)
+        self.meta_offsets = take(4 * (meta_count + 1)).cast('I')
+        self.blob = take(blob_size)
+
+        self.v4_count = v4_count
+        self.v6_count = v6_count
+        self.meta_count = meta_count
+
+    def lookup(self, ip_address: str) -> Optional[Dict[str, object]]:
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+
+        if ip.version == 4:
+            key = int(ip)
+            starts, ends, metas = self.v4_starts, self.v4_ends, self.v4_meta
+        else:
+            key = ip.packed
+            starts, ends, metas = self.v6_starts, self.v6_ends, self.v6_meta
+
+        index = bisect.bisect_right(starts, key) - 1
+        if index < 0 or ends[index] < key:
+            return None
+        return self._metadata(metas[index])
+
+    def _metadata(self, meta_index: int) -> Dict[str, object]:
+        start = self.meta_offsets[meta_index]
+        end = self.meta_offsets[meta_index + 1]
+        country = bytes(
+            self.meta_country[2 * meta_index:2 * meta_index + 2]
+        ).decode('ascii').strip('\0')
+        return {
+            'asn': self.meta_asn[meta_index],
+            'country': country,
+            'org': bytes(self.blob[start:end]).decode('utf-8', 'replace')
+        }
+
+
+class IPASNDatabase:
+    """Hot-reloadable, memory-mapped IP-to-ASN lookup service.
+
+    The compiled file is re-mapped when its mtime changes (checked at most
+    every ``check_interval`` seconds), so replacing the file on disk picks
+    up a new dataset without a restart.
+    """
+
+    def __init__(self, path: Optional[str] = None,
+                 check_interval: Optional[float] = None):
+        self.path = path or os.getenv("IP_ASN_DB_PATH", "data/ip2asn.bin")
+        self.check_interval = check_interval or float(
+            os.getenv("IP_ASN_DB_CHECK_INTERVAL", "60"))
+        self._table: Optional[IPASNTable] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._missing_logged = False
+
+    def lookup(self, ip_address: str) -> Optional[Dict[str, object]]:
+        """Return ``{'asn', 'country', 'org'}`` for an IP, or None."""
+        self._maybe_reload()
+        table = self._table
+        if table is None:
+            return None
+        return table.lookup(ip_address)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self._table is not None and \
+                now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if not self._missing_logged:
+                self._missing_logged = True
+                add_log(
+                    "WARNING", f"IP-to-ASN table not found at {self.path}; "
+                    "network enrichment disabled",
+                    module="ip_asn_db", function="_maybe_reload"
+                )
+            return
+
+        if mtime != self._mtime:
+            self.reload()
+
+    def reload(self):
+        """Map the current file and swap it in atomically."""
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                table = IPASNTable(mapped)
+                mtime = os.stat(self.path).st_mtime
+            except (OSError, ValueError, struct.error) as e:
+                add_log(
+                    "ERROR",
+                    f"Failed to load IP-to-ASN table {self.path}: {e}",
+                    module="ip_asn_db", function="reload"
+                )
+                return
+
+            # Old mappings are left to the garbage collector since
+            # in-flight lookups may still hold views into them
+            self._table, self._mmap, self._mtime = table, mapped, mtime
+            self._missing_logged = False
+            add_log(
+                "INFO", f"Loaded IP-to-ASN table: {table.v4_count} IPv4 and "
+                f"{table.v6_count} IPv6 ranges",
+                module="ip_asn_db", function="reload"
+            )
+
+    def stats(self) -> Dict[str, object]:
+        table = self._table
+        return {
+            'path': self.path,
+            'loaded': table is not None,
+            'v4_ranges': table.v4_count if table else 0,
+            'v6_ranges': table.v6_count if table else 0,
+            'organizations': table.meta_count if table else 0
+        }
+
+
+def _open_source(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def compile_table(source_path: str, output_path: str) -> Tuple[int, int]:
+    """Compile an ip2asn TSV into the binary range table format.
+
+    Writes to a temporary file and renames it into place so running
+    workers never map a half-written table.
+    """
+    v4: List[Tuple[int, int, int]] = []
+    v6: List[Tuple[bytes, bytes, int]] = []
+    meta_index: Dict[Tuple[int, str, str], int] = {}
+    metas: List[Tuple[int, str, str]] = []
+
+    with _open_source(source_path) as source:
+        for line in source:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 5:
+                continue
+            start_text, end_text, asn_text, country, org = parts[:5]
+            try:
+                asn = int(asn_text)
+                start = ipaddress.ip_address(start_text)
+                end = ipaddress.ip_address(end_text)
+            except ValueError:
+                continue
+            # AS0 marks unrouted space
+            if asn == 0:
+                continue
+
+            key = (asn, country[:2], org)
+            index = meta_index.get(key)
+            if index is None:
+                index = meta_index[key] = len(metas)
+                metas.append(key)
+
+            if start.version == 4:
+                v4.append((int(start), int(end), index))
+            else:
+                v6.append((start.packed, end.packed, index))
+
+    v4.sort()
+    v6.sort()
+
+    blob = bytearray()
+    offsets = array('I', [0])
+    for _, _, org in metas:
+        blob += org.encode('utf-8')
+        offsets.append(len(blob))
+
+    tmp_path = f"{output_path}.tmp"
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(tmp_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, len(v4), len(v6), len(metas), len(blob)))
+        for column in range(3):
+            out.write(array('I', (row[column] for row in v4)).tobytes())
+        out.write(b''.join(row[0] for row in v6))
+        out.write(b''.join(row[1] for row in v6))
+        out.write(array('I', (row[2] for row in v6)).tobytes())
+        out.write(array('I', (asn for asn, _, _ in metas)).tobytes())
+        out.write(b''.join(
+            country.encode('ascii', 'replace').ljust(2, b'\0')[:2]
+            for _, country, _ in metas
+        ))
+        out.write(offsets.tobytes())
+        out.write(bytes(blob))
+    os.replace(tmp_path, output_path)
+    return len(v4), len(v6)
+
+
+# Global database instance
+ip_asn_db = IPASNDatabase()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "compile":
+        v4_count, v6_count = compile_table(sys.argv[2], sys.argv[3])
+        print(f"Compiled {v4_count} IPv4 and {v6_count} IPv6 ranges "
+              f"into {sys.argv[3]}")
+    elif len(sys.argv) == 4 and sys.argv[1] == "lookup":
+        db = IPASNDatabase(sys.argv[2])
+        print(db.lookup(sys.argv[3]))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,208 @@
+"""
+Live Feed
+Shared ring buffer and Server-Sent Event loop behind the live analytics
+and log feeds.
+
+Writers publish events into a bounded in-process ring and never wait on
+readers. Every connection keeps only a cursor into the ring; a client
+that falls further behind than the ring holds skips ahead and is told
+how many events it missed, so a slow reader never blocks the writer or
+grows memory. Endpoints return ``response(stream)``, which reserves a
+client slot before anything is sent and gives it back when the response
+ends, even if the client is gone before the body starts.
+"""
+import asyncio
+import json
+from collections import deque
+from itertools import islice
+from typing import (
+    Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence,
+    Tuple
+)
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+def format_sse(data: Any, event: Optional[str] = None,
+               event_id: Optional[int] = None) -> str:
+    """Encode one Server-Sent Event."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    payload = json.dumps(data, separators=(',', ':'), default=str)
+    lines.append(f"data: {payload}")
+    return "\n".join(lines) + "\n\n"
+
+
+class FeedResponse(StreamingResponse):
+    """Event stream holding one client slot of a feed.
+
+    The slot is released when the response finishes, however it ends;
+    a stream generator that never started has no ``finally`` to run.
+    """
+
+    def __init__(self, feed: 'LiveFeed', stream: AsyncIterator[str]):
+        super().__init__(
+            stream,
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                # Stop nginx from buffering the stream
+                "X-Accel-Buffering": "no"
+            }
+        )
+        self._feed = feed
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._feed.release()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+class LiveFeed:
+    """Bounded ring of published events with async SSE readers.
+
+    Subclasses shape what they publish and set ``event_type``; events
+    are sent with their ring sequence as the SSE id unless
+    ``_event_id`` says otherwise.
+    """
+
+    event_type = 'message'
+
+    def __init__(self, size: int, max_clients: int, heartbeat: float):
+        self.size = size
+        self.max_clients = max_clients
+        self.heartbeat = heartbeat
+        # (ring sequence, event)
+        self._ring: Deque[Tuple[int, Dict[str, Any]]] = deque(
+            maxlen=self.size)
+        self._seq = 0
+        self._changed: Optional[asyncio.Event] = None
+        self.clients = 0
+        self.counters = {
+            'published': 0,
+            'sent': 0,
+            'skipped': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+
+    def _append(self, events: Sequence[Dict[str, Any]]):
+        """Append shaped events; never blocks."""
+        if not events:
+            return
+        for event in events:
+            self._seq += 1
+            self._ring.append((self._seq, event))
+        self.counters['published'] += len(events)
+        if self._changed is not None:
+            # Wake every waiting reader, then arm a fresh event
+            self._changed.set()
+            self._changed = None
+
+    # ------------------------------------------------------------------
+    # Consumer side
+    # ------------------------------------------------------------------
+
+    def read_after(self, cursor: int) -> Tuple[int, List[Tuple[int, Dict]]]:
+        """Return ``(missed, events)`` for everything newer than ring
+        sequence ``cursor``. ``missed`` counts events already pushed out
+        of the ring."""
+        if not self._ring or cursor >= self._seq:
+            return 0, []
+        oldest = self._ring[0][0]
+        missed = max(0, oldest - cursor - 1)
+        start = max(cursor + 1, oldest) - oldest
+        return missed, list(islice(self._ring, start, None))
+
+    async def wait(self, cursor: int, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for events newer than
+        ``cursor``."""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        if self._seq > cursor:
+            # Published between the caller's read and arming the event
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def acquire(self) -> bool:
+        """Reserve a client slot; False at ``max_clients``."""
+        if self.clients >= self.max_clients:
+            return False
+        self.clients += 1
+        return True
+
+    def release(self):
+        self.clients = max(0, self.clients - 1)
+
+    def response(self, stream: AsyncIterator[str]) -> Optional[FeedResponse]:
+        """Wrap a ``subscribe`` stream in a response that holds a client
+        slot until it ends, or None at ``max_clients``. Reserved in the
+        endpoint, so concurrent connects cannot pass the cap."""
+        if not self.acquire():
+            return None
+        return FeedResponse(self, stream)
+
+    def _event_id(self, seq: int, event: Dict[str, Any]) -> int:
+        return seq
+
+    def _frame(self, seq: int, event: Dict[str, Any]) -> str:
+        return format_sse(event, event=self.event_type,
+                          event_id=self._event_id(seq, event))
+
+    async def _stream(self,
+                      matches: Callable[[Dict[str, Any]], bool],
+                      is_disconnected: Callable[[], Any],
+                      cursor: int,
+                      replay: Optional[AsyncIterator[str]] = None
+                      ) -> AsyncIterator[str]:
+        """Yield SSE frames for events after ring sequence ``cursor``
+        until the client disconnects, after any ``replay`` frames for a
+        reconnecting client."""
+        yield "retry: 3000\n\n"
+        if replay is not None:
+            async for frame in replay:
+                yield frame
+        while True:
+            missed, events = self.read_after(cursor)
+            if missed:
+                self.counters['skipped'] += missed
+                yield format_sse({'missed': missed}, event='skipped')
+            for seq, event in events:
+                cursor = seq
+                if matches(event):
+                    self.counters['sent'] += 1
+                    yield self._frame(seq, event)
+            if events:
+                continue
+            if await is_disconnected():
+                break
+            if not await self.wait(cursor, self.heartbeat):
+                # Comment frame keeps proxies from timing out idle
+                # streams and surfaces disconnects
+                yield ": ping\n\n"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'clients': self.clients,
+            'max_clients': self.max_clients,
+            'buffered': len(self._ring),
+            'size': self.size
+        }
@@ -0,0 +1,401 @@
+"""
+Log Archive
+Compressed on-disk history for app_log partitions that have aged out of
+the retention window.
+
+Before the partition manager drops an expired app_log partition it asks
+the archiver to copy the partition's rows into one gzip NDJSON segment
+per UTC day, ``app_log-YYYYMMDD.ndjson.gz``. Each segment has a small
+JSON sidecar index: its time range, row counts per (portfolio, level,
+module) and a bloom filter of the lower-cased trigrams of the searchable
+text. Grouped errors are archived with their group's traceback, so
+segments stand alone.
+
+``search`` answers the logs grid's filters against the archive. Segments
+are pruned on the index alone: by time, by the counts for the requested
+level and module, and, for a search term, by whether every trigram of
+the term is in the bloom filter, which mirrors the pg_trgm index used
+for the hot table. Without a search term, totals and offsets come from
+the counts without opening a segment.
+"""
+import asyncio
+import base64
+import glob
+import gzip
+import hashlib
+import json
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from search_filters import normalize_search
+
+
+# Rows fetched per query while archiving
+CHUNK_SIZE = 5000
+
+# Target false-positive rate for the trigram bloom filters
+BLOOM_ERROR_RATE = 0.01
+
+# Keeps terms from matching across fields, as in search_filters
+_SEPARATOR = '\x1f'
+
+ARCHIVE_COLUMNS = (
+    'timestamp', 'level', 'message', 'module', 'function', 'line', 'user',
+    'extra', 'ip_address', 'traceback'
+)
+
+
+def searchable_text(row: Dict[str, Any]) -> str:
+    """Same fields as the app_log search expression."""
+    return _SEPARATOR.join(row.get(column) or ''
+                           for column in ('message', 'module', 'function'))
+
+
+def trigrams(text: str) -> Set[str]:
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class BloomFilter:
+    """Fixed-size bloom filter with blake2b double hashing, stable
+    across processes."""
+
+    def __init__(self, bits: int, hashes: int, data: Optional[bytes] = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data or bytes((bits + 7) // 8))
+
+    @classmethod
+    def for_items(cls, count: int,
+                  error_rate: float = BLOOM_ERROR_RATE) -> 'BloomFilter':
+        count = max(count, 1)
+        bits = max(64, math.ceil(-count * math.log(error_rate)
+                                 / math.log(2) ** 2))
+        hashes = max(1, round(bits / count * math.log(2)))
+        return cls(bits, hashes)
+
+    def _positions(self, item: str) -> Iterator[int]:
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.bits
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.data[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'data': base64.b64encode(bytes(self.data)).decode('ascii')
+        }
+
+    @classmethod
+    def from_dict(cls, value: Dict[str, Any]) -> 'BloomFilter':
+        return cls(value['bits'], value['hashes'],
+                   base64.b64decode(value['data']))
+
+
+def _count_key(portfolio_id: Any, level: Any, module: Any) -> str:
+    return f"{portfolio_id or ''}|{(level or '').upper()}|{module or ''}"
+
+
+def build_index(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sidecar index for a segment's rows."""
+    counts: Dict[str, int] = {}
+    grams: Set[str] = set()
+    for row in rows:
+        key = _count_key(row.get('portfolio_id'), row.get('level'),
+                         row.get('module'))
+        counts[key] = counts.get(key, 0) + 1
+        grams |= trigrams(searchable_text(row))
+    bloom = BloomFilter.for_items(len(grams))
+    for gram in grams:
+        bloom.add(gram)
+    timestamps = [row['timestamp'] for row in rows]
+    return {
+        'start': min(timestamps) if timestamps else None,
+        'end': max(timestamps) if timestamps else None,
+        'rows': len(rows),
+        'counts': counts,
+        'bloom': bloom.to_dict()
+    }
+
+
+class Segment:
+    """A segment's index, loaded once and kept for pruning."""
+
+    def __init__(self, path: str, index: Dict[str, Any]):
+        self.path = path
+        self.start = _parse_time(index['start'])
+        self.end = _parse_time(index['end'])
+        self.rows = index['rows']
+        self.counts: Dict[str, int] = index['counts']
+        self.bloom = BloomFilter.from_dict(index['bloom'])
+
+    def matching_count(self, portfolio_id: Any, level: Optional[str],
+                       module: Optional[str]) -> int:
+        """Rows matching the non-text filters, from the counts."""
+        total = 0
+        for key, count in self.counts.items():
+            portfolio, row_level, row_module = key.split('|', 2)
+            if portfolio_id is not None and portfolio != str(portfolio_id):
+                continue
+            if level and row_level != level.upper():
+                continue
+            if module and row_module != module:
+                continue
+            total += count
+        return total
+
+    def may_contain(self, term: str) -> bool:
+        return all(gram in self.bloom for gram in trigrams(term))
+
+    def read(self) -> List[Dict[str, Any]]:
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _iso(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+class LogArchive:
+    """Writes and searches app_log archive segments."""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.getenv("LOG_ARCHIVE_DIR",
+                                                "log_archive")
+        # segment path -> (index mtime, Segment)
+        self._segments: Dict[str, Tuple[float, Segment]] = {}
+        self.counters = {
+            'archived_rows': 0,
+            'segments_written': 0,
+            'searches': 0,
+            'segments_pruned': 0,
+            'segments_read': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def segment_path(self, day: datetime) -> str:
+        return os.path.join(self.directory,
+                            f"app_log-{day.strftime('%Y%m%d')}.ndjson.gz")
+
+    @staticmethod
+    def index_path(segment_path: str) -> str:
+        return segment_path[:-len('.ndjson.gz')] + '.idx.json'
+
+    async def archive_range(self, start: datetime, end: datetime) -> int:
+        """Archive every app_log row in [start, end), one segment per UTC
+        day. Returns the number of rows archived. Rewrites existing
+        segments for those days, so a retried run is safe."""
+        total = 0
+        day = start.astimezone(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        while day < end:
+            day_end = min(day + timedelta(days=1), end)
+            rows = await self._fetch(max(day, start), day_end)
+            if rows:
+                await asyncio.to_thread(self.write_segment, day, rows)
+                total += len(rows)
+            day += timedelta(days=1)
+        return total
+
+    async def _fetch(self, start: datetime,
+                     end: datetime) -> List[Dict[str, Any]]:
+        from database import database
+
+        rows: List[Dict[str, Any]] = []
+        after = (start, -1)
+        while True:
+            chunk = await database.fetch_all(
+                """SELECT l.id, l.portfolio_id, l.timestamp, l.level,
+                    l.message, l.module, l.function, l.line, l."user",
+                    l.extra, l.ip_address,
+                    COALESCE(l.traceback, g.traceback) AS traceback
+                FROM app_log l
+                LEFT JOIN error_groups g ON g.id = l.error_group_id
+                WHERE l.timestamp >= :start AND l.timestamp < :end
+                  AND (l.timestamp, l.id) > (:after_ts, :after_id)
+                ORDER BY l.timestamp, l.id
+                LIMIT :limit""",
+                {'start': start, 'end': end, 'after_ts': after[0],
+                 'after_id': after[1], 'limit': CHUNK_SIZE}
+            )
+            for row in chunk:
+                record = {column: row[column] for column in ARCHIVE_COLUMNS}
+                record['timestamp'] = _iso(row['timestamp'])
+                record['portfolio_id'] = (str(row['portfolio_id'])
+                                          if row['portfolio_id'] else None)
+                rows.append(record)
+            if len(chunk) < CHUNK_SIZE:
+                return rows
+            after = (chunk[-1]['timestamp'], chunk[-1]['id'])
+
+    def write_segment(self, day: datetime, rows: List[Dict[str, Any]]):
+        """Write a segment and then its index, each atomically; a
+        segment without an index is ignored by searches."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.segment_path(day)
+        temp = f"{path}.tmp"
+        with gzip.open(temp, 'wt', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str, separators=(',', ':')))
+                f.write('\n')
+        os.replace(temp, path)
+
+        index_path = self.index_path(path)
+        with open(f"{index_path}.tmp", 'w') as f:
+            json.dump(build_index(rows), f)
+        os.replace(f"{index_path}.tmp", index_path)
+
+        self._segments.pop(path, None)
+        self.counters['archived_rows'] += len(rows)
+        self.counters['segments_written'] += 1
+
+    def clear(self) -> int:
+        """Delete every segment and index. Returns the number of
+        segments removed."""
+        removed = 0
+        for path in glob.glob(os.path.join(self.directory, 'app_log-*')):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Could not remove archive file {path}: {e}")
+                continue
+            if path.endswith('.ndjson.gz'):
+                removed += 1
+        self._segments.clear()
+        return removed
+
+    # ------------------------------------------------------------------
+    # Searching
+    # ------------------------------------------------------------------
+
+    def segments(self) -> List[Segment]:
+        """Indexed segments, oldest first; indexes are cached until the
+        sidecar changes."""
+        found = []
+        for index_path in sorted(glob.glob(
+                os.path.join(self.directory, 'app_log-*.idx.json'))):
+            path = index_path[:-len('.idx.json')] + '.ndjson.gz'
+            try:
+                mtime = os.path.getmtime(index_path)
+                cached = self._segments.get(path)
+                if cached is None or cached[0] != mtime:
+                    with open(index_path) as f:
+                        cached = (mtime, Segment(path, json.load(f)))
+                    self._segments[path] = cached
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping archive segment {path}: {e}")
+                continue
+            if cached[1].rows and os.path.exists(path):
+                found.append(cached[1])
+        return found
+
+    def search(self,
+               portfolio_id: Any = None,
+               search: Optional[str] = None,
+               level: Optional[str] = None,
+               module: Optional[str] = None,
+               since: Optional[datetime] = None,
+               offset: int = 0,
+               limit: int = 50,
+               descending: bool = True) -> Tuple[List[Dict[str, Any]], int]:
+        """Archived rows matching the logs grid filters, ordered by
+        timestamp. Returns ``(rows, total)``; blocking, so async callers
+        run it in a thread."""
+        term = normalize_search(search)
+        self.counters['searches'] += 1
+
+        segments = self.segments()
+        candidates = [
+            segment for segment in segments
+            if (since is None or segment.end >= since)
+            and segment.matching_count(portfolio_id, level, module)
+            and (not term or segment.may_contain(term))
+        ]
+        self.counters['segments_pruned'] += len(segments) - len(candidates)
+        if descending:
+            candidates.reverse()
+
+        def matches(row: Dict[str, Any]) -> bool:
+            if (portfolio_id is not None
+                    and row.get('portfolio_id') != str(portfolio_id)):
+                return False
+            if level and (row.get('level') or '').upper() != level.upper():
+                return False
+            if module and row.get('module') != module:
+                return False
+            if since is not None and _parse_time(row['timestamp']) < since:
+                return False
+            if term and term.lower() not in searchable_text(row).lower():
+                return False
+            return True
+
+        rows: List[Dict[str, Any]] = []
+        total = 0
+        skip = offset
+        for segment in candidates:
+            # Exact without opening the segment when only counts filter it
+            exact = not term and (since is None or segment.start >= since)
+            if exact:
+                count = segment.matching_count(portfolio_id, level, module)
+                if skip >= count or len(rows) >= limit:
+                    total += count
+                    skip = max(0, skip - count)
+                    continue
+
+            self.counters['segments_read'] += 1
+            found = [row for row in segment.read() if matches(row)]
+            if descending:
+                found.reverse()
+            total += len(found)
+            if skip >= len(found):
+                skip -= len(found)
+                continue
+            rows.extend(found[skip:skip + limit - len(rows)])
+            skip = 0
+
+        for row in rows:
+            row.pop('portfolio_id', None)
+            row['error_group_id'] = None
+            row['archived'] = True
+        return rows, total
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self.segments()
+        return {
+            **self.counters,
+            'directory': self.directory,
+            'segments': len(segments),
+            'rows': sum(segment.rows for segment in segments),
+            'oldest': segments[0].start.isoformat() if segments else None,
+            'newest': segments[-1].end.isoformat() if segments else None
+        }
+
+
+# Global log archive
+log_archive = LogArchive()
@@ -3,6 +3,7 @@ Log capture module for writing application logs to the database
 """
 import asyncio
 import logging
+import sys
 import traceback
 from datetime import datetime
 from typing import Optional
@@ -10,6 +11,18 @@ import json
 
 from fastapi import Request
 
+from log_levels import log_levels
+from log_sink import log_sink
+
+_LEVEL_NUMBERS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'WARN': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL
+}
+
 
 def get_database():
     """Lazy import of database to avoid circular imports."""
@@ -48,93 +61,43 @@ def get_client_ip(request: Request) -> str:
 
 
 class DatabaseLogHandler(logging.Handler):
-    """Custom logging handler that writes logs to the database"""
+    """Logging handler that queues records for the batched log sink"""
     
     def __init__(self, database_url: str = None):
         super().__init__()
-        # Use the shared database instance instead of creating our own
-        self._portfolio_id = None
-    
-    def _get_default_portfolio_id(self):
-        """Get the default portfolio ID for logs"""
-        from database import PORTFOLIO_ID
-        return PORTFOLIO_ID
         
     def emit(self, record: logging.LogRecord):
-        """Emit a log record to the database"""
+        """Queue a log record for the database; never blocks"""
+        if not log_levels.enabled(record.levelno, record.name):
+            return
         try:
-            # Get or create event loop
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-            
-            # Run the async insert in the loop
-            if loop.is_running():
-                # If loop is already running, schedule the task
-                asyncio.create_task(self._insert_log(record))
-            else:
-                # If loop is not running, run it
-                loop.run_until_complete(self._insert_log(record))
-                
+            log_sink.enqueue(self._entry(record))
         except Exception as e:
-            # Fallback to print if database insert fails
-            print(f"Failed to insert log to database: {e}")
+            # Fallback to print if the record cannot be converted
+            print(f"Failed to queue log record: {e}")
             print(f"Log record: {record.getMessage()}")
     
-    async def _insert_log(self, record: logging.LogRecord):
-        """Insert log record into database"""
-        try:
-            # Database is already connected, no need to connect/disconnect
-            
-            # Extract traceback information
-            traceback_text = None
-            extra = {}
-            if hasattr(record, 'exc_info') and record.exc_info:
-                exc_info = record.exc_info
-                traceback_text = ''.join(
-                    traceback.format_exception(*exc_info)
-                )
-            
-            # Get user info if available
-            user = getattr(record, 'user', None)
-            # Get IP address if available
-            ip_address = getattr(record, 'ip_address', None)
-            
-            query = """
-                INSERT INTO app_log (portfolio_id, timestamp, level, message,
-                                   module, function, line, "user", extra,
-                                   ip_address, traceback)
-                VALUES (:portfolio_id, :timestamp, :level, :message, :module,
-                       :function, :line, :user, :extra, :ip_address,
-                       :traceback)
-            """
-            
-            values = {
-                'portfolio_id': self._get_default_portfolio_id(),
-                'timestamp': datetime.fromtimestamp(record.created),
-                'level': record.levelname,
-                'message': record.getMessage(),
-                'module': (record.module if hasattr(record, 'module')
-                           else record.name),
-                'function': record.funcName,
-                'line': record.lineno,
-                'user': user,
-                'extra': json.dumps(extra) if extra else None,
-                'ip_address': ip_address,
-                'traceback': traceback_text
-            }
-            
-            await get_database().execute(query, values)
-            
-        except Exception as e:
-            # Silently fail if database isn't available - don't spam logs
-            # Only print during startup/shutdown issues
-            if "pool is closing" not in str(e) and "DatabaseBackend is not running" not in str(e):
-                print(f"Database log insert failed: {e}")
-                print(f"Log record values: {values}")
-                print(f"Exception: {traceback.format_exc()}")
+    def _entry(self, record: logging.LogRecord) -> dict:
+        """Convert a log record into an app_log entry"""
+        traceback_text = None
+        if record.exc_info:
+            traceback_text = ''.join(
+                traceback.format_exception(*record.exc_info)
+            )
+        
+        return {
+            'timestamp': datetime.fromtimestamp(record.created),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'module': (record.module if hasattr(record, 'module')
+                       else record.name),
+            'function': record.funcName,
+            'line': record.lineno,
+            'user': getattr(record, 'user', None),
+            'extra': None,
+            'ip_address': getattr(record, 'ip_address', None),
+            'traceback': traceback_text
+        }
 
 
 # Global log handler instance
@@ -211,61 +174,37 @@ def add_log(level: str, message: str, module: str = "manual",
             function: str = "add_log", line: int = 0,
             user: Optional[str] = None, extra: Optional[dict] = None,
             ip_address: Optional[str] = None,
-            traceback_text: Optional[str] = None):
-    """Manually add a log entry to the database"""
-    
-    async def _add_log_async():
-        from database import database as db, PORTFOLIO_ID
+            traceback_text: Optional[str] = None,
+            args: tuple = ()):
+    """Queue a log entry for the database; never blocks
 
+    Entries below the calling module's runtime level (log_levels.py)
+    return before anything is formatted. Pass ``args`` to defer
+    ``message % args`` until the entry is known to be kept.
+    """
+    level = level.upper()
+    caller = sys._getframe(1).f_globals.get('__name__', module)
+    if not log_levels.enabled(_LEVEL_NUMBERS.get(level, logging.INFO),
+                              caller):
+        return
+    if args:
         try:
-            # Ensure database is connected
-            if not db.is_connected:
-                await db.connect()
-                
-            query = """
-                INSERT INTO app_log (portfolio_id, timestamp, level, message,
-                                   module, function, line, "user", extra,
-                                   ip_address, traceback)
-                VALUES (:portfolio_id, :timestamp, :level, :message, :module,
-                       :function, :line, :user, :extra, :ip_address,
-                       :traceback)
-            """
-
-            values = {
-                'portfolio_id': PORTFOLIO_ID,
-                'timestamp': datetime.now(),
-                'level': level.upper(),
-                'message': message,
-                'module': module,
-                'function': function,
-                'line': line,
-                'user': user,
-                'extra': json.dumps(extra) if extra else None,
-                'ip_address': ip_address,
-                'traceback': traceback_text
-            }
-
-            await db.execute(query, values)
-            # Don't disconnect - leave the connection open for reuse
-
-        except Exception as e:
-            print(f"Failed to add manual log entry: {e}")
-            # Don't disconnect on error either - let connection pool handle it
-
-    # Run the async function synchronously
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            # If loop is already running, schedule the task
-            asyncio.create_task(_add_log_async())
-        else:
-            # If loop is not running, run it
-            loop.run_until_complete(_add_log_async())
-    except RuntimeError:
-        # Create new loop if none exists
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(_add_log_async())
+            message = message % args
+        except (TypeError, ValueError):
+            message = f"{message} {args!r}"
+
+    log_sink.enqueue({
+        'timestamp': datetime.now(),
+        'level': level,
+        'message': message,
+        'module': module,
+        'function': function,
+        'line': line,
+        'user': user,
+        'extra': json.dumps(extra) if extra else None,
+        'ip_address': ip_address,
+        'traceback': traceback_text
+    })
 
 
 async def clear_logs():
@@ -0,0 +1,192 @@
+"""
+Log Live Feed
+Pushes application log entries to Server-Sent Event clients of the logs
+page from a bounded in-process ring buffer, so tailing logs during an
+incident adds no query load.
+
+The log sink publishes each batch once it is written, with the app_log
+ids the INSERT returned; those ids are the event ids. The ring and SSE
+loop are the shared ones in live_feed.py. A client that reconnects with a
+``Last-Event-ID`` older than the ring is caught up from app_log with one
+bounded query, by primary key, for just the gap. Each worker process
+has its own ring and sees the entries it wrote.
+"""
+import os
+from datetime import datetime, timezone
+from typing import (
+    Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+)
+
+from live_feed import LiveFeed, format_sse
+from search_filters import normalize_search, search_condition
+
+
+# app_log fields sent to clients; the same shape /logs/data returns
+FEED_FIELDS = ('timestamp', 'level', 'message', 'module', 'function', 'line',
+               'user', 'extra', 'ip_address', 'traceback', 'error_group_id')
+
+
+def log_event(entry: Dict[str, Any], log_id: int) -> Dict[str, Any]:
+    """Trim a written app_log entry down to what the feed shows."""
+    event = {field: entry.get(field) for field in FEED_FIELDS}
+    event['id'] = log_id
+    timestamp = event['timestamp']
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        event['timestamp'] = timestamp.isoformat()
+    return event
+
+
+def log_filter(level: Optional[str] = None,
+               module: Optional[str] = None,
+               search: Optional[str] = None
+               ) -> Callable[[Dict[str, Any]], bool]:
+    """Per-connection predicate matching the logs grid's filters."""
+    level = (level or '').upper()
+    term = (normalize_search(search) or '').lower()
+
+    def matches(event: Dict[str, Any]) -> bool:
+        if level and (event.get('level') or '').upper() != level:
+            return False
+        if module and event.get('module') != module:
+            return False
+        if term:
+            text = '\x1f'.join(event.get(field) or ''
+                               for field in ('message', 'module', 'function'))
+            if term not in text.lower():
+                return False
+        return True
+    return matches
+
+
+class LogFeed(LiveFeed):
+    """Bounded ring of recently written log entries with async readers."""
+
+    event_type = 'log'
+
+    def __init__(self,
+                 size: Optional[int] = None,
+                 max_clients: Optional[int] = None,
+                 heartbeat: Optional[float] = None,
+                 catch_up_limit: Optional[int] = None):
+        super().__init__(
+            size or int(os.getenv("LOG_FEED_SIZE", "2000")),
+            max_clients or int(os.getenv("LOG_FEED_MAX_CLIENTS", "10")),
+            heartbeat or float(os.getenv("LOG_FEED_HEARTBEAT", "15"))
+        )
+        self.catch_up_limit = catch_up_limit or int(
+            os.getenv("LOG_FEED_CATCH_UP", "500"))
+        self.counters['caught_up'] = 0
+
+    def publish(self, entries: Sequence[Dict[str, Any]],
+                ids: Sequence[int]):
+        """Append written entries with their app_log ids; never blocks.
+        Ring sequences still order the ring when a spool replay
+        publishes older ids."""
+        self._append([log_event(entry, log_id)
+                      for entry, log_id in zip(entries, ids)])
+
+    def _event_id(self, seq: int, event: Dict[str, Any]) -> int:
+        return event['id']
+
+    async def catch_up(self, after_id: int, before_id: Optional[int],
+                       level: Optional[str], module: Optional[str],
+                       search: Optional[str]) -> Tuple[bool, List[Dict]]:
+        """Matching app_log rows with ``after_id < id < before_id``, the
+        newest ``catch_up_limit`` of them oldest first. Returns
+        ``(truncated, events)``."""
+        from database import database, PORTFOLIO_ID
+
+        conditions = ["portfolio_id = :portfolio_id", "id > :after_id"]
+        params: Dict[str, Any] = {'portfolio_id': PORTFOLIO_ID,
+                                  'after_id': after_id,
+                                  'limit': self.catch_up_limit + 1}
+        if before_id is not None:
+            conditions.append("id < :before_id")
+            params['before_id'] = before_id
+        if level:
+            conditions.append("LOWER(level) = LOWER(:level)")
+            params['level'] = level
+        if module:
+            conditions.append("module = :module")
+            params['module'] = module
+        search_sql, search_params = search_condition('app_log', search)
+        if search_sql:
+            conditions.append(search_sql)
+            params.update(search_params)
+
+        # Filtered in app_log alone, as /logs/data does, so the search
+        # expression's columns are unambiguous
+        rows = await database.fetch_all(
+            f"""SELECT l.id, l.timestamp, l.level, l.message, l.module,
+                l.function, l.line, l."user", l.extra, l.ip_address,
+                COALESCE(l.traceback, g.traceback) AS traceback,
+                l.error_group_id
+            FROM (
+                SELECT id, timestamp, level, message, module, function,
+                       line, "user", extra, ip_address, traceback,
+                       error_group_id
+                FROM app_log WHERE {' AND '.join(conditions)}
+                ORDER BY id DESC
+                LIMIT :limit
+            ) l
+            LEFT JOIN error_groups g ON g.id = l.error_group_id
+            ORDER BY l.id DESC""",
+            params
+        )
+        truncated = len(rows) > self.catch_up_limit
+        events = [log_event(dict(row), row['id'])
+                  for row in reversed(rows[:self.catch_up_limit])]
+        self.counters['caught_up'] += len(events)
+        return truncated, events
+
+    def subscribe(self,
+                  is_disconnected: Callable[[], Any],
+                  level: Optional[str] = None,
+                  module: Optional[str] = None,
+                  search: Optional[str] = None,
+                  last_event_id: Optional[int] = None
+                  ) -> AsyncIterator[str]:
+        """SSE frames until the client disconnects; pass them to
+        ``response``.
+
+        Reconnecting clients pass ``Last-Event-ID``: entries after it
+        that are still in the ring come from the ring, and only the
+        older part of the gap is read from app_log.
+        """
+        matches = log_filter(level, module, search)
+        replay = None
+        if last_event_id is not None:
+            # Taken with the cursor, so the live loop sends only what
+            # is published after this snapshot
+            ring = [event for _, event in self._ring]
+            replay = self._replay(ring, last_event_id, matches,
+                                  level, module, search)
+        return self._stream(matches, is_disconnected, self._seq, replay)
+
+    async def _replay(self, ring: List[Dict[str, Any]], last_event_id: int,
+                      matches: Callable[[Dict[str, Any]], bool],
+                      level: Optional[str], module: Optional[str],
+                      search: Optional[str]) -> AsyncIterator[str]:
+        oldest = min((event['id'] for event in ring), default=None)
+        if oldest is None or oldest > last_event_id + 1:
+            truncated, events = await self.catch_up(
+                last_event_id, oldest, level, module, search)
+            if truncated:
+                yield format_sse({'missed': None}, event='skipped')
+            for event in events:
+                yield format_sse(event, event=self.event_type,
+                                 event_id=event['id'])
+        for event in ring:
+            if event['id'] > last_event_id and matches(event):
+                self.counters['sent'] += 1
+                yield format_sse(event, event=self.event_type,
+                                 event_id=event['id'])
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), 'catch_up_limit': self.catch_up_limit}
+
+
+# Global live log feed
+log_feed = LogFeed()
@@ -0,0 +1,142 @@
+"""
+Log Levels
+Runtime log-level registry for ``add_log`` and the database logging
+handler.
+
+Levels are set per Python module with dotted prefixes inheriting, so
+``app.routers`` covers ``app.routers.logs``; anything unset uses the
+default level (LOG_LEVEL, INFO unless configured). ``add_log`` asks the
+registry before it formats a message, so a suppressed call costs a
+frame lookup and a dict hit. Changes made from the logs page apply
+immediately and are persisted as JSON in site_config under
+``log_levels``; startup loads them back.
+
+Per-module emitted and suppressed counters show where log volume comes
+from.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+
+CONFIG_KEY = 'log_levels'
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+
+def level_number(level: str) -> int:
+    """Numeric level for a name; raises ValueError for unknown names."""
+    name = str(level).upper()
+    if name not in LEVELS:
+        raise ValueError(f"Unknown log level: {level}")
+    return getattr(logging, name)
+
+
+class LogLevelRegistry:
+    """Per-module minimum levels with emitted/suppressed counters."""
+
+    def __init__(self, default_level: Optional[str] = None):
+        self.default = level_number(
+            default_level or os.getenv("LOG_LEVEL", "INFO"))
+        self._levels: Dict[str, int] = {}
+        # module -> effective level, rebuilt after every change
+        self._resolved: Dict[str, int] = {}
+        # module -> [emitted, suppressed]
+        self._counts: Dict[str, list] = {}
+
+    def effective(self, module: str) -> int:
+        level = self._resolved.get(module)
+        if level is None:
+            level = self.default
+            name = module
+            while name:
+                if name in self._levels:
+                    level = self._levels[name]
+                    break
+                name = name.rpartition('.')[0]
+            self._resolved[module] = level
+        return level
+
+    def enabled(self, levelno: int, module: str) -> bool:
+        """Whether a message at ``levelno`` from ``module`` is logged;
+        counts the answer."""
+        emitted = levelno >= self.effective(module)
+        counts = self._counts.get(module)
+        if counts is None:
+            counts = self._counts[module] = [0, 0]
+        counts[0 if emitted else 1] += 1
+        return emitted
+
+    def set_level(self, level: str, module: Optional[str] = None):
+        """Set a module's level, or the default when ``module`` is None."""
+        levelno = level_number(level)
+        if module:
+            self._levels[module] = levelno
+        else:
+            self.default = levelno
+        self._resolved.clear()
+
+    def clear_level(self, module: str):
+        """Make a module inherit again."""
+        self._levels.pop(module, None)
+        self._resolved.clear()
+
+    def levels(self) -> Dict[str, Any]:
+        return {
+            'default': logging.getLevelName(self.default),
+            'modules': {module: logging.getLevelName(level)
+                        for module, level in sorted(self._levels.items())}
+        }
+
+    def apply(self, config: Dict[str, Any]):
+        """Replace all levels with a ``levels()``-shaped mapping."""
+        default = level_number(config.get('default') or 'INFO')
+        modules = {module: level_number(level) for module, level
+                   in (config.get('modules') or {}).items()}
+        self.default = default
+        self._levels = modules
+        self._resolved.clear()
+
+    async def load(self) -> bool:
+        """Restore the persisted levels. Returns False if none were
+        stored or they could not be read."""
+        from site_config import SiteConfigManager
+
+        try:
+            stored = await SiteConfigManager.get_config(CONFIG_KEY)
+            if not stored:
+                return False
+            self.apply(json.loads(stored))
+            return True
+        except Exception as e:
+            print(f"Could not load log levels: {e}")
+            return False
+
+    async def save(self) -> bool:
+        from site_config import SiteConfigManager
+
+        return await SiteConfigManager.set_config(
+            CONFIG_KEY, json.dumps(self.levels()),
+            "Runtime log levels by module (logs page)"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Levels plus counters, busiest modules first."""
+        modules = sorted(self._counts.items(),
+                         key=lambda item: -sum(item[1]))
+        return {
+            **self.levels(),
+            'counters': {
+                module: {
+                    'level': logging.getLevelName(self.effective(module)),
+                    'emitted': emitted,
+                    'suppressed': suppressed
+                }
+                for module, (emitted, suppressed) in modules
+            }
+        }
+
+
+# Global log level registry
+log_levels = LogLevelRegistry()
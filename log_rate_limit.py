@@ -0,0 +1,247 @@
+"""
+Log Rate Limiting
+Token buckets in front of the log sink so repeated messages (a scanner
+probing ``/wp-login.php`` produces one 404 entry per request) cannot
+flood app_log.
+
+Entries are keyed by (module, function, message template), where the
+template is the message with URLs, IPs, ids and numbers masked. Each key
+has its own bucket (``burst`` entries, refilled at ``rate`` per second)
+and every entry also spends from one global bucket, so the write volume
+is bounded by the global budget however many distinct keys an attack
+produces. Over the limit, entries are dropped and counted, except for a
+per-level sample (every Nth, from LOG_SAMPLE_RATES) that is still paid
+for from the global bucket. Once per ``summary_interval`` each key that
+dropped something gets one "Suppressed N similar messages" entry;
+past ``max_summaries`` keys, the rest are folded into a single entry.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+_TEMPLATE_PATTERNS = [
+    (re.compile(r'\b[a-z][a-z0-9+.-]*://\S+', re.I), '<url>'),
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}\b'), '<ip>'),
+    (re.compile(r'\b[0-9a-f]*:[0-9a-f:]{2,}\b', re.I), '<ip>'),
+    # Tokens of six or more characters containing a digit: error ids,
+    # hashes, UUIDs
+    (re.compile(r'\b(?=[\w-]*\d)[\w-]{6,}\b'), '<id>'),
+    (re.compile(r'\d+(?:\.\d+)?'), '<n>'),
+]
+
+# Keep this fraction of over-limit entries, by level
+DEFAULT_SAMPLE_RATES = {'CRITICAL': 1.0, 'ERROR': 0.1, 'WARNING': 0.01}
+
+Key = Tuple[str, str, str]
+
+
+def message_template(message: str) -> str:
+    """Message with its variable parts masked."""
+    template = message or ''
+    for pattern, replacement in _TEMPLATE_PATTERNS:
+        template = pattern.sub(replacement, template)
+    return template[:200]
+
+
+def parse_sample_rates(value: Optional[str]) -> Dict[str, float]:
+    """``"ERROR=0.1,WARNING=0.01"`` -> ``{'ERROR': 0.1, ...}``."""
+    if not value:
+        return dict(DEFAULT_SAMPLE_RATES)
+    rates = {}
+    for item in value.split(','):
+        level, _, rate = item.partition('=')
+        if level.strip() and rate.strip():
+            rates[level.strip().upper()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'over', 'suppressed', 'level',
+                 'first', 'last')
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        # Over-limit entries seen, sampled or not
+        self.over = 0
+        self.suppressed = 0
+        self.level = 'DEBUG'
+        self.first: Optional[datetime] = None
+        self.last: Optional[datetime] = None
+
+
+_LEVEL_ORDER = {'DEBUG': 0, 'INFO': 1, 'WARNING': 2, 'ERROR': 3,
+                'CRITICAL': 4}
+
+
+class LogRateLimiter:
+    """Per-key and global token buckets with suppression summaries."""
+
+    def __init__(self,
+                 rate: Optional[float] = None,
+                 burst: Optional[int] = None,
+                 global_rate: Optional[float] = None,
+                 global_burst: Optional[int] = None,
+                 summary_interval: Optional[float] = None,
+                 max_keys: Optional[int] = None,
+                 max_summaries: Optional[int] = None,
+                 sample_rates: Optional[Dict[str, float]] = None):
+        self.rate = rate or float(os.getenv("LOG_RATE_LIMIT_RATE", "0.2"))
+        self.burst = burst or int(os.getenv("LOG_RATE_LIMIT_BURST", "10"))
+        self.global_rate = global_rate or float(
+            os.getenv("LOG_GLOBAL_RATE", "20"))
+        self.global_burst = global_burst or int(
+            os.getenv("LOG_GLOBAL_BURST", "200"))
+        self.summary_interval = summary_interval or float(
+            os.getenv("LOG_SUMMARY_INTERVAL", "60"))
+        self.max_keys = max_keys or int(
+            os.getenv("LOG_RATE_LIMIT_KEYS", "2000"))
+        self.max_summaries = max_summaries or int(
+            os.getenv("LOG_MAX_SUMMARIES", "20"))
+        self.sample_rates = (
+            sample_rates if sample_rates is not None
+            else parse_sample_rates(os.getenv("LOG_SAMPLE_RATES")))
+
+        self._lock = threading.Lock()
+        self._buckets: 'OrderedDict[Key, _Bucket]' = OrderedDict()
+        now = time.monotonic()
+        self._global = _Bucket(float(self.global_burst), now)
+        # Suppressions of keys evicted before their summary
+        self._evicted = 0
+        self._last_summary = now
+        self.counters = {
+            'allowed': 0,
+            'suppressed': 0,
+            'sampled': 0,
+            'summaries': 0
+        }
+
+    @staticmethod
+    def _refill(bucket: _Bucket, rate: float, burst: int, now: float):
+        bucket.tokens = min(burst, bucket.tokens
+                            + (now - bucket.updated) * rate)
+        bucket.updated = now
+
+    def _bucket(self, key: Key, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                _, evicted = self._buckets.popitem(last=False)
+                self._evicted += evicted.suppressed
+            bucket = self._buckets[key] = _Bucket(float(self.burst), now)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def allow(self, entry: Dict[str, Any]) -> bool:
+        """Whether to write ``entry``; counts it against its key if not."""
+        key = (entry.get('module') or '', entry.get('function') or '',
+               message_template(entry.get('message')))
+        level = (entry.get('level') or 'INFO').upper()
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(key, now)
+            self._refill(bucket, self.rate, self.burst, now)
+            self._refill(self._global, self.global_rate,
+                         self.global_burst, now)
+            if bucket.tokens >= 1 and self._global.tokens >= 1:
+                bucket.tokens -= 1
+                self._global.tokens -= 1
+                self.counters['allowed'] += 1
+                return True
+
+            # Deterministic sample: the 1st, N+1th, ... over-limit entry
+            # of a key, still within the global budget
+            bucket.over += 1
+            rate = self.sample_rates.get(level, 0.0)
+            every = max(1, round(1 / rate)) if rate > 0 else 0
+            if (every and (bucket.over - 1) % every == 0
+                    and self._global.tokens >= 1):
+                self._global.tokens -= 1
+                self.counters['sampled'] += 1
+                return True
+
+            bucket.suppressed += 1
+            if _LEVEL_ORDER.get(level, 1) > _LEVEL_ORDER.get(bucket.level, 1):
+                bucket.level = level
+            timestamp = entry.get('timestamp') or datetime.now()
+            bucket.first = bucket.first or timestamp
+            bucket.last = timestamp
+            self.counters['suppressed'] += 1
+            return False
+
+    def summaries(self, force: bool = False) -> List[Dict[str, Any]]:
+        """Summary entries for suppressed messages, at most once per
+        ``summary_interval`` unless ``force``."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_summary < self.summary_interval:
+                return []
+            self._last_summary = now
+            pending = [(key, bucket) for key, bucket in self._buckets.items()
+                       if bucket.suppressed]
+            pending.sort(key=lambda item: -item[1].suppressed)
+
+            entries = []
+            for (module, function, template), bucket in (
+                    pending[:self.max_summaries]):
+                entries.append(self._summary(
+                    bucket.level, module, function,
+                    f"Suppressed {bucket.suppressed} similar messages: "
+                    f"{template}",
+                    {'suppressed': bucket.suppressed, 'template': template,
+                     'first': bucket.first, 'last': bucket.last}
+                ))
+            rest = self._evicted + sum(
+                bucket.suppressed
+                for _, bucket in pending[self.max_summaries:])
+            if rest:
+                keys = max(0, len(pending) - self.max_summaries)
+                entries.append(self._summary(
+                    'WARNING', 'log_rate_limit', 'summaries',
+                    f"Suppressed {rest} messages across {keys} more "
+                    f"message types",
+                    {'suppressed': rest, 'keys': keys}
+                ))
+            for _, bucket in pending:
+                bucket.suppressed = 0
+                bucket.level = 'DEBUG'
+                bucket.first = bucket.last = None
+            self._evicted = 0
+            self.counters['summaries'] += len(entries)
+            return entries
+
+    @staticmethod
+    def _summary(level: str, module: str, function: str, message: str,
+                 extra: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'timestamp': datetime.now(),
+            'level': level,
+            'message': message,
+            'module': module,
+            'function': function,
+            'line': 0,
+            'extra': json.dumps(extra, default=str)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = sum(bucket.suppressed
+                          for bucket in self._buckets.values())
+        return {
+            **self.counters,
+            'keys': len(self._buckets),
+            'pending_suppressed': pending + self._evicted,
+            'rate': self.rate,
+            'burst': self.burst,
+            'global_rate': self.global_rate,
+            'global_burst': self.global_burst,
+            'summary_interval': self.summary_interval,
+            'sample_rates': self.sample_rates
+        }
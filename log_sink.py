@@ -0,0 +1,346 @@
+"""
+Log Sink
+Buffers application log entries in memory and writes them to app_log in
+batches, so logging never schedules a task or an INSERT per call.
+
+``add_log``, ``log_with_context`` and both database logging handlers
+hand entries to ``log_sink.enqueue``, which never awaits. A single
+writer coroutine flushes them as one multi-row INSERT when
+``batch_size`` entries are waiting or ``flush_interval`` seconds have
+passed. Entries logged before the database is connected wait in the
+queue; the queue is bounded and counts what it drops.
+
+Repeated messages are rate limited before they are queued
+(log_rate_limit.py); the writer adds periodic summaries of what was
+suppressed. Errors are grouped on the way in (error_groups.py): each distinct
+traceback is stored once and its entries reference the group. Suppressed
+errors still count toward their group's occurrences.
+
+Batches that cannot be written, or that arrive while the database
+breaker is open, go to the ``app_log`` disk spool and are loaded later
+by the spool replayer. A batch the database refuses for its data is
+split until only the offending entries are dropped. Written entries are published, with their app_log
+ids, to the live log feed (log_feed.py).
+"""
+import asyncio
+import ipaddress
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from error_groups import error_groups
+from log_rate_limit import LogRateLimiter
+from spool import Spool, database_breaker, spool_replayer, write_isolating
+
+
+# app_log columns written for every entry
+LOG_COLUMNS = (
+    'portfolio_id', 'timestamp', 'level', 'message', 'module', 'function',
+    'line', 'user', 'extra', 'ip_address', 'traceback', 'error_group_id'
+)
+
+# app_log.ip_address is VARCHAR(45)
+MAX_IP_LENGTH = 45
+
+OVERFLOW_POLICIES = {'drop_newest', 'drop_oldest'}
+
+
+class LogSink:
+    """Bounded log queue with a single background batch writer."""
+
+    def __init__(self,
+                 max_size: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 overflow_policy: Optional[str] = None,
+                 limiter: Optional[LogRateLimiter] = None):
+        self.max_size = max_size or int(
+            os.getenv("LOG_QUEUE_SIZE", "5000"))
+        self.batch_size = batch_size or int(
+            os.getenv("LOG_BATCH_SIZE", "100"))
+        self.flush_interval = flush_interval or float(
+            os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+        # Keeping the oldest entries preserves the start of an error storm
+        policy = (overflow_policy or os.getenv(
+            "LOG_OVERFLOW_POLICY", "drop_newest")).lower()
+        self.overflow_policy = (
+            policy if policy in OVERFLOW_POLICIES else 'drop_newest'
+        )
+        self.limiter = limiter
+
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        # Handlers may run on executor threads
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.counters = {
+            'queued': 0,
+            'written': 0,
+            'dropped': 0,
+            'rate_limited': 0,
+            'rejected': 0,
+            'failed': 0,
+            'spooled': 0,
+            'batches': 0
+        }
+        self.last_flush_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    # ------------------------------------------------------------------
+    # Producer side (never awaits)
+    # ------------------------------------------------------------------
+
+    def enqueue(self, entry: Dict[str, Any]) -> bool:
+        """Queue one app_log entry. Returns False if it was dropped."""
+        if self.limiter is not None and not self.limiter.allow(entry):
+            self.counters['rate_limited'] += 1
+            error_groups.count_suppressed(entry)
+            return False
+        full = self._append(entry)
+        if full is None:
+            return False
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None and not self._running_on(loop):
+            # Scripts log without going through the app's startup hook
+            self.start()
+        if full:
+            self._wake()
+        return True
+
+    def _append(self, entry: Dict[str, Any]) -> Optional[bool]:
+        """Buffer an entry. Returns whether a batch is ready, or None if
+        the entry was dropped."""
+        with self._lock:
+            if self._closed:
+                self.counters['dropped'] += 1
+                return None
+            if len(self._buffer) >= self.max_size:
+                self.counters['dropped'] += 1
+                if self.overflow_policy == 'drop_newest':
+                    return None
+                self._buffer.popleft()
+            self._buffer.append(entry)
+            self.counters['queued'] += 1
+            return len(self._buffer) >= self.batch_size
+
+    def _queue_summaries(self, force: bool = False):
+        if self.limiter is not None:
+            for summary in self.limiter.summaries(force):
+                self._append(summary)
+
+    def _wake(self):
+        if self._wakeup is None or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # ------------------------------------------------------------------
+    # Writer
+    # ------------------------------------------------------------------
+
+    def _running_on(self, loop: asyncio.AbstractEventLoop) -> bool:
+        return bool(self._loop is loop and self._writer_task
+                    and not self._writer_task.done())
+
+    def start(self):
+        """Start the writer on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._running_on(loop):
+            return
+        self._closed = False
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        """Stop accepting entries and drain the queue."""
+        self._queue_summaries(force=True)
+        self._closed = True
+        if self._writer_task:
+            self._wake()
+            try:
+                await self._writer_task
+            except Exception as e:
+                print(f"Log writer stopped with error: {e}")
+            self._writer_task = None
+        while self._buffer:
+            if not await self.flush():
+                break
+        if self._buffer:
+            print(f"Discarding {len(self._buffer)} unwritten log entries")
+
+    async def _writer(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._queue_summaries()
+            while self._buffer and not self._closed:
+                if not await self.flush():
+                    break
+                if len(self._buffer) < self.batch_size:
+                    break
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            count = min(self.batch_size, len(self._buffer))
+            return [self._buffer.popleft() for _ in range(count)]
+
+    async def flush(self) -> bool:
+        """Write one batch. Returns False if nothing could be written."""
+        from database import database, PORTFOLIO_ID as portfolio_id
+
+        if not database.is_connected or portfolio_id is None:
+            # Entries wait until startup has connected the database
+            return False
+
+        batch = self._take_batch()
+        if not batch:
+            return True
+        if not database_breaker.allow():
+            return await self._spool(batch)
+        # A row the database refuses is dropped on its own instead of
+        # failing the rest of the batch
+        rejected, unwritten, error = await write_isolating(
+            self.write_batch, batch)
+        # Printed, not logged, so a broken sink cannot feed itself
+        if rejected:
+            self.counters['rejected'] += len(rejected)
+            print(f"Dropped {len(rejected)} log entries the database "
+                  f"rejected")
+        written = len(batch) - len(rejected) - len(unwritten)
+        if written:
+            self.counters['written'] += written
+            self.counters['batches'] += 1
+            self.last_flush_at = time.time()
+        if error is not None:
+            database_breaker.record_error(error)
+            if ("pool is closing" not in str(error)
+                    and "DatabaseBackend is not running" not in str(error)):
+                print(f"Failed to write {len(unwritten)} log entries: "
+                      f"{error}")
+            return await self._spool(unwritten)
+
+        database_breaker.record_success()
+        return True
+
+    async def write_batch(self, batch: List[Dict[str, Any]]):
+        """Group errors and insert the entries with one unnest INSERT;
+        also the replay path."""
+        from database import database, PORTFOLIO_ID as portfolio_id
+        from log_feed import log_feed
+
+        # Suppressed errors are counted in the same transaction, and kept
+        # for the next write if this one fails
+        suppressed = error_groups.take_suppressed()
+        try:
+            async with database.transaction():
+                rows = await error_groups.group(batch, suppressed)
+                inserted = await database.fetch_all(
+                    """INSERT INTO app_log (portfolio_id, timestamp, level,
+                        message, module, function, line, "user", extra,
+                        ip_address, traceback, error_group_id)
+                    SELECT * FROM unnest(
+                        CAST(:portfolio_id AS UUID[]),
+                        CAST(:timestamp AS TIMESTAMPTZ[]),
+                        CAST(:level AS TEXT[]),
+                        CAST(:message AS TEXT[]),
+                        CAST(:module AS TEXT[]),
+                        CAST(:function AS TEXT[]),
+                        CAST(:line AS INTEGER[]),
+                        CAST(:user AS TEXT[]),
+                        CAST(:extra AS TEXT[]),
+                        CAST(:ip_address AS TEXT[]),
+                        CAST(:traceback AS TEXT[]),
+                        CAST(:error_group_id AS INTEGER[]))
+                    RETURNING id""",
+                    _columns(rows, portfolio_id)
+                )
+        except Exception:
+            error_groups.restore_suppressed(suppressed)
+            raise
+
+        # Ids are drawn in row order; grouped entries keep their
+        # traceback for live viewers
+        log_feed.publish(
+            [{**row, 'traceback': entry.get('traceback')}
+             for entry, row in zip(batch, rows)],
+            sorted(record['id'] for record in inserted)
+        )
+
+    async def _spool(self, batch: List[Dict[str, Any]]) -> bool:
+        try:
+            spooled = await asyncio.to_thread(log_spool.append, batch)
+        except OSError as e:
+            print(f"Failed to spool {len(batch)} log entries: {e}")
+            spooled = 0
+        if not spooled:
+            self.counters['failed'] += len(batch)
+            return False
+        self.counters['spooled'] += spooled
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'pending': len(self._buffer),
+            'max_size': self.max_size,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'overflow_policy': self.overflow_policy,
+            'rate_limit': (self.limiter.stats()
+                           if self.limiter is not None else None),
+            'writer_running': bool(
+                self._writer_task and not self._writer_task.done()
+            ),
+            'last_flush_at': self.last_flush_at
+        }
+
+
+def _columns(batch: List[Dict[str, Any]],
+             portfolio_id: Any) -> Dict[str, List[Any]]:
+    """Column arrays for the unnest INSERT."""
+    values = {column: [entry.get(column) for entry in batch]
+              for column in LOG_COLUMNS}
+    values['portfolio_id'] = [str(value or portfolio_id)
+                              for value in values['portfolio_id']]
+    values['ip_address'] = [_ip_address(value)
+                            for value in values['ip_address']]
+    return values
+
+
+def _ip_address(value: Any) -> Optional[str]:
+    """Normalized address for the ip_address column, or None for
+    anything that is not one, such as a raw X-Forwarded-For list."""
+    if not value:
+        return None
+    try:
+        address = str(ipaddress.ip_address(str(value).strip()))
+    except ValueError:
+        return None
+    return address if len(address) <= MAX_IP_LENGTH else None
+
+
+# Global log sink; its spool replays through the same INSERT
+log_sink = LogSink(limiter=LogRateLimiter())
+log_spool = Spool('app_log')
+spool_replayer.register(log_spool, log_sink.write_batch)
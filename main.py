@@ -2,19 +2,20 @@
 # Restored to working state - ce98ca2 with full CRUD functionality
 
 # --- Standard Library Imports ---
+import json
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 import secrets
-import time
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 
 # --- Third-Party Imports ---
 from fastapi import (FastAPI, HTTPException, Request, Response, Depends)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import (HTMLResponse, JSONResponse)
+from fastapi.responses import (HTMLResponse, JSONResponse,
+                               StreamingResponse)
 from fastapi.security import HTTPBasic
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -22,7 +23,7 @@ from starlette.middleware.sessions import SessionMiddleware
 from strawberry.fastapi import GraphQLRouter
 
 # --- Local Application Imports ---
-from analytics_middleware import AnalyticsMiddleware
+from request_instrumentation import RequestInstrumentationMiddleware
 from app.resolvers import schema
 from app.routers import contact, contact_admin, projects, work, showcase, logs, sql, smtp_config
 from app.routers.oauth import router as google_oauth_router
@@ -31,9 +32,24 @@ from app.routers.site_config_migration import (
     router as site_config_migration_router
 )
 from analytics import analytics
+from analytics_export import (
+    EXPORT_FORMATS, build_export_query, export_rows, gzip_stream
+)
+from analytics_feed import analytics_feed, event_filter
+from analytics_ingest import mouse_activity_queue, page_view_queue
+from analytics_rollups import analytics_rollups
+from heavy_hitters import heavy_hitters
+from partition_manager import partition_manager
+from referrer_domains import referrer_domains
+from spool import spool_replayer
+from user_agents import user_agents
+from visitor_reclassifier import visitor_reclassifier
+from visitor_sketches import visitor_sketches
 from auth import require_admin_auth
 from database import close_database, database, init_database, get_portfolio_id
 from log_capture import add_log
+from log_levels import log_levels
+from log_sink import log_sink
 from ttw_oauth_manager import TTWOAuthManager
 from memhunt.browser.views import DebugView
 
@@ -61,8 +77,8 @@ app.add_middleware(
     secret_key=os.getenv("SESSION_SECRET_KEY", "a-secure-secret-key")
 )
 
-# Analytics middleware for automatic page view tracking
-app.add_middleware(AnalyticsMiddleware)
+# Request timing, non-200 logging and automatic page view tracking
+app.add_middleware(RequestInstrumentationMiddleware)
 
 # Initialize OAuth client
 # The oauth object is now imported from oauth_client.py
@@ -150,118 +166,6 @@ class DatabaseLoggingHandler(logging.Handler):
 ttw_oauth_manager = TTWOAuthManager()
 
 
-# Add middleware to log all 500 responses
-@app.middleware("http")
-async def log_non_200_responses(request: Request, call_next):
-    """Middleware to log all non-200 responses for monitoring"""
-    import traceback
-    try:
-        response = await call_next(request)
-
-        # Log any response that is not 200 OK
-        if response.status_code != 200:
-            error_id = secrets.token_urlsafe(8)
-
-            # Determine log level based on status code
-            if response.status_code >= 500:
-                log_level = "ERROR"
-                logger_level = "error"
-            elif response.status_code >= 400:
-                log_level = "WARNING"
-                logger_level = "warning"
-            else:
-                log_level = "INFO"
-                logger_level = "info"
-
-            # Try to capture response body for error analysis
-            response_body = ""
-            try:
-                # For streaming responses, we can't easily capture the body
-                # But for regular responses, we can try
-                if hasattr(response, 'body'):
-                    response_body = str(response.body)[:1000]
-            except Exception:
-                response_body = "Unable to capture response body"
-
-            log_message = (
-                f"{response.status_code} RESPONSE [{error_id}] "
-                f"for {request.url}"
-            )
-            getattr(logger, logger_level)(log_message)
-
-            # Log to database with enhanced details
-            try:
-                client_ip = get_client_ip(request)
-                add_log(
-                    level=log_level,
-                    module="middleware",
-                    message=(
-                        f"[{error_id}] {response.status_code} response for "
-                        f"{request.url}"
-                    ),
-                    function="log_non_200_responses",
-                    ip_address=client_ip,
-                    extra={
-                        "error_id": error_id,
-                        "status_code": response.status_code,
-                        "url": str(request.url),
-                        "method": request.method,
-                        "headers": dict(request.headers),
-                        "response_headers": dict(response.headers),
-                        "response_body_preview": response_body,
-                        "client_ip": client_ip
-                    }
-                )
-            except Exception as log_error:
-                logger.error(
-                    f"Failed to log {response.status_code} response to "
-                    f"database: {log_error}"
-                )
-                logger.error(
-                    "Database logging error traceback: "
-                    f"{traceback.format_exc()}"
-                )
-
-        return response
-
-    except Exception as e:
-        # This should be caught by the global exception handler, but just in
-        # case
-        error_id = secrets.token_urlsafe(8)
-        full_traceback = traceback.format_exc()
-        logger.error(f"MIDDLEWARE ERROR [{error_id}]: {str(e)}")
-        logger.error(f"Middleware error traceback: {full_traceback}")
-
-        try:
-            client_ip = get_client_ip(request)
-            add_log(
-                level="ERROR",
-                module="middleware",
-                message=f"[{error_id}] Middleware error: {str(e)}",
-                function="log_non_200_responses",
-                ip_address=client_ip,
-                extra={
-                    "error_id": error_id,
-                    "url": str(request.url),
-                    "method": request.method,
-                    "error_type": type(e).__name__,
-                    "client_ip": client_ip
-                },
-                traceback_text=full_traceback
-            )
-        except Exception as log_error:
-            logger.error(
-                f"Failed to log middleware error to database: {log_error}"
-            )
-            logger.error(
-                "Database logging error traceback: "
-                f"{traceback.format_exc()}"
-            )
-
-        # Re-raise to let global exception handler deal with it
-        raise
-
-
 # Global Exception Handlers for Error Logging and Clean Error Pages
 
 @app.exception_handler(Exception)
@@ -288,12 +192,12 @@ async def global_exception_handler(request: Request, exc: Exception):
     try:
         client_ip = get_client_ip(request)
 
-        # Format the message without traceback for the database log
+        # Format the message without traceback or headers for the database
+        # log; both are stored once on the entry's error group
         detailed_message = (
             f"[{error_id}] {error_type}: {error_message}\n"
             f"URL: {request.url} | Method: {request.method}\n"
-            f"Client IP: {client_ip}\n"
-            f"Headers: {dict(request.headers)}"
+            f"Client IP: {client_ip}"
         )
 
         # Build extra data for the log entry
@@ -448,33 +352,6 @@ app.add_middleware(
 logger.info("CORS middleware configured")
 
 
-# Add request logging middleware
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    method = request.method
-    url = str(request.url)
-    client_ip = request.client.host if request.client else "unknown"
-
-    logger.info("=== Incoming Request ===")
-    logger.info(f"Method: {method}")
-    logger.info(f"URL: {url}")
-    logger.info(f"Client IP: {client_ip}")
-    logger.info(f"Headers: {dict(request.headers)}")
-
-    try:
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        logger.info(f"Response status: {response.status_code}")
-        logger.info(f"Process time: {process_time:.4f}s")
-        return response
-    except Exception as e:
-        process_time = time.time() - start_time
-        logger.error(f"Request failed: {str(e)}", exc_info=True)
-        logger.info(f"Process time: {process_time:.4f}s")
-        raise
-
-
 # GraphQL router
 logger.info("=== GraphQL Configuration ===")
 try:
@@ -812,6 +689,11 @@ async def demo_erd_complex(clean: bool = False):
 # Database initialization
 @app.on_event("startup")
 async def startup_event():
+    # Log entries queue from here on and are written once the database
+    # is connected
+    log_sink.start()
+    # Replays spooled batches whenever the database is reachable
+    spool_replayer.start()
     logger.info("=== Application Startup ===")
     try:
         logger.info("Initializing database connection...")
@@ -830,6 +712,24 @@ async def startup_event():
 
         # Database logging is now handled directly by add_log function
         logger.info("Database logging ready via add_log function")
+        # Runtime levels set from the logs page survive restarts
+        if await log_levels.load():
+            logger.info(f"Log levels restored: {log_levels.levels()}")
+
+        # Start the batched page view and mouse activity writers, the
+        # rollup job and partition maintenance
+        page_view_queue.start()
+        mouse_activity_queue.start()
+        analytics_rollups.start()
+        partition_manager.start()
+        visitor_reclassifier.start()
+        visitor_sketches.start()
+        heavy_hitters.start()
+        logger.info(
+            "Analytics ingest writers, rollup job, partition manager, "
+            "visitor re-classification, sketch writer and top-K tracker "
+            "started"
+        )
 
     except Exception as e:
         logger.error(f"❌ Startup error: {str(e)}", exc_info=True)
@@ -839,6 +739,17 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Drain buffered page views while the database is still connected
+    await page_view_queue.stop()
+    await mouse_activity_queue.stop()
+    await visitor_reclassifier.stop()
+    await visitor_sketches.stop()
+    await heavy_hitters.stop()
+    await analytics_rollups.stop()
+    await partition_manager.stop()
+    await spool_replayer.stop()
+    # Last, so entries logged by the jobs above are drained too
+    await log_sink.stop()
     await close_database()
 
 
@@ -1034,10 +945,15 @@ async def analytics_admin(
 async def analytics_api(
     request: Request, 
     days: int = 30, 
+    exact: bool = False,
     admin: dict = Depends(require_admin_auth)
 ):
-    """Analytics API endpoint - requires admin authentication"""
-    return await analytics.get_summary(days=days)
+    """Analytics API endpoint - requires admin authentication.
+
+    Pass exact=true to count unique visitors from raw rows instead of
+    the daily sketches.
+    """
+    return await analytics.get_summary(days=days, exact=exact)
 
 
 @app.get("/admin/analytics/recent-visits", response_class=JSONResponse)
@@ -1049,11 +965,12 @@ async def analytics_recent_visits_api(
     search: str = None,
     sort_field: str = 'timestamp',
     sort_order: str = 'desc',
+    cursor: str = None,
     admin: dict = Depends(require_admin_auth)
 ):
     """Paginated recent visits API endpoint with search and sorting - requires admin authentication"""
     return await analytics.get_recent_visits_paginated(
-        offset, limit, days, search, sort_field, sort_order
+        offset, limit, days, search, sort_field, sort_order, cursor
     )
 
 
@@ -1061,30 +978,149 @@ async def analytics_recent_visits_api(
 async def analytics_unique_visitors_api(
     request: Request,
     days: int = 7,
+    limit: int = 100,
+    cursor: str = None,
     admin: dict = Depends(require_admin_auth)
 ):
-    """Get unique visitors with view counts and last visit times"""
-    return await analytics.get_unique_visitors(days)
+    """Get a page of unique visitors with view counts and last visit
+    times; pass next_cursor to continue"""
+    return await analytics.get_unique_visitors(days, limit, cursor)
+
+
+@app.get("/admin/analytics/stream")
+async def analytics_stream_api(
+    request: Request,
+    path_prefix: str = None,
+    visitor_type: str = None,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Push page views as Server-Sent Events. ``visitor_type`` takes a
+    comma-separated list."""
+    try:
+        last_event_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_event_id = None
+    matches = event_filter(
+        path_prefix, (visitor_type or "").split(","))
+    response = analytics_feed.response(analytics_feed.subscribe(
+        matches, request.is_disconnected, last_event_id))
+    if response is None:
+        raise HTTPException(status_code=503,
+                            detail="Too many live analytics clients")
+    return response
+
+
+@app.get("/admin/analytics/export")
+async def analytics_export_api(
+    request: Request,
+    format: str = 'ndjson',
+    days: int = 7,
+    since: str = None,
+    until: str = None,
+    page_path: str = None,
+    visitor_type: str = None,
+    ip_address: str = None,
+    gzip: bool = False,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Stream page views as NDJSON or CSV. ``since``/``until`` are ISO
+    timestamps and override ``days``; ``ip_address`` accepts a CIDR."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400,
+                            detail="format must be ndjson or csv")
+    try:
+        start = (datetime.fromisoformat(since) if since
+                 else datetime.utcnow() - timedelta(days=days))
+        end = datetime.fromisoformat(until) if until else None
+        query, params = build_export_query(
+            start, end, page_path, visitor_type, ip_address)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = (f"analytics-{start:%Y%m%d}-"
+                f"{(end or datetime.utcnow()):%Y%m%d}.{format}")
+    body = export_rows(query, params, format)
+    media_type = EXPORT_FORMATS[format]
+    if gzip:
+        body = gzip_stream(body)
+        filename += '.gz'
+        media_type = 'application/gzip'
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-store'
+        }
+    )
 
 
 @app.get("/admin/analytics/top-referrers", response_class=JSONResponse)
 async def analytics_top_referrers_api(
     request: Request,
     days: int = 7,
+    exact: bool = False,
+    hours: int = None,
     admin: dict = Depends(require_admin_auth)
 ):
-    """Get top referrers with visit counts"""
-    return await analytics.get_top_referrers(days)
+    """Get top referrers with visit counts; hours overrides days"""
+    return await analytics.get_top_referrers(days, exact, hours)
 
 
 @app.get("/admin/analytics/top-ips", response_class=JSONResponse)
 async def analytics_top_ips_api(
     request: Request,
     days: int = 7,
+    hours: int = None,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Get top IP addresses with visit counts; hours overrides days"""
+    return await analytics.get_top_ips(days, hours)
+
+
+@app.get("/admin/analytics/ingest-stats", response_class=JSONResponse)
+async def analytics_ingest_stats_api(
+    request: Request,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Get queued, flushed and dropped counters for the ingest writers"""
+    return {
+        **page_view_queue.stats(),
+        'mouse_activity': mouse_activity_queue.stats(),
+        'sketches': visitor_sketches.stats(),
+        'live_feed': analytics_feed.stats(),
+        'heavy_hitters': heavy_hitters.stats(),
+        'referrer_domains': referrer_domains.stats(),
+        'user_agents': user_agents.stats(),
+        'spool': spool_replayer.stats()
+    }
+
+
+@app.get("/admin/analytics/reclassify", response_class=JSONResponse)
+async def analytics_reclassify_stats_api(
+    request: Request,
+    admin: dict = Depends(require_admin_auth)
+):
+    """Get settings and last-run throughput of the re-classification job"""
+    return visitor_reclassifier.stats()
+
+
+@app.post("/admin/analytics/reclassify", response_class=JSONResponse)
+async def analytics_reclassify_backfill_api(
+    request: Request,
+    since: str = None,
     admin: dict = Depends(require_admin_auth)
 ):
-    """Get top IP addresses with visit counts"""
-    return await analytics.get_top_ips(days)
+    """Start a background backfill that scores all pending page views"""
+    try:
+        start = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400,
+                            detail="since must be an ISO timestamp")
+    if not visitor_reclassifier.start_backfill(start):
+        raise HTTPException(status_code=409,
+                            detail="A backfill is already running")
+    return {"status": "started", "since": since}
 
 
 @app.get("/admin/memory", response_class=HTMLResponse)
@@ -1130,13 +1166,15 @@ async def memory_admin(
 async def track_mouse_activity(request: Request):
     """Public endpoint to track mouse activity for bot filtering"""
     try:
-        # Parse the JSON body
-        body = await request.json()
-        page_path = body.get('page_path', request.url.path)
-        
-        # Track the mouse activity
-        await analytics.track_mouse_activity(request, page_path)
-        
+        # sendBeacon may post the JSON body as text/plain, so parse the
+        # raw bytes rather than relying on the content type
+        body = json.loads(await request.body() or b'{}')
+        view_token = body.get('view_token') if isinstance(body, dict) else None
+
+        # Queue the beacon; it is applied to the page view in a batch
+        if not analytics.track_mouse_activity(view_token):
+            return {"status": "ignored", "message": "Unknown page view"}
+
         return {"status": "success", "message": "Mouse activity tracked"}
         
     except Exception as e:
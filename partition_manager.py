@@ -0,0 +1,333 @@
+"""
+Partition Manager
+Keeps the range-partitioned page_analytics and app_log tables supplied
+with partitions ahead of time and drops partitions once they fall out of
+the retention window configured in site config.
+
+Dropping a partition is a catalog operation, so retention never has to
+DELETE rows. Raw page views are only dropped after the rollup watermark
+has passed the end of their partition, so the hourly and daily rollups
+keep the downsampled history. Log partitions are copied into the
+compressed log archive before they are dropped.
+"""
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from analytics_rollups import analytics_rollups
+from database import database
+from log_archive import log_archive
+from log_capture import add_log
+from site_config import SiteConfigManager
+
+
+# Parent table -> retention config key, default retention in days, and
+# whether rows must be rolled up or archived before a partition may be
+# dropped
+PARTITIONED_TABLES: Dict[str, Dict[str, Any]] = {
+    'page_analytics': {
+        'retention_key': 'analytics_retention_days',
+        'default_retention': 90,
+        'requires_rollup': True,
+        'requires_archive': False
+    },
+    'app_log': {
+        'retention_key': 'log_retention_days',
+        'default_retention': 30,
+        'requires_rollup': False,
+        'requires_archive': True
+    },
+}
+
+GRANULARITIES = {'daily', 'monthly'}
+
+# Distinct from the rollup job's lock key
+ADVISORY_LOCK_KEY = 736_201_907
+
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+Range = Tuple[datetime, datetime]
+
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def period_start(value: datetime, granularity: str) -> datetime:
+    start = _utc(value).replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'monthly':
+        start = start.replace(day=1)
+    return start
+
+
+def next_period(start: datetime, granularity: str) -> datetime:
+    if granularity == 'monthly':
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    return start + timedelta(days=1)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return f"{table}_p{start.strftime('%Y%m%d')}"
+
+
+def parse_partition_bound(expression: str) -> Optional[Range]:
+    """Parse ``pg_get_expr(relpartbound)`` output into a UTC range.
+
+    Returns None for the DEFAULT partition or unbounded ranges.
+    """
+    match = _BOUND.search(expression or '')
+    if not match:
+        return None
+    bounds = []
+    for text in match.groups():
+        # PostgreSQL prints "+00" style offsets
+        if re.search(r'[+-]\d\d$', text):
+            text += ':00'
+        try:
+            bounds.append(_utc(datetime.fromisoformat(text)))
+        except ValueError:
+            return None
+    return bounds[0], bounds[1]
+
+
+def plan_partitions(existing: List[Range], granularity: str,
+                    start: datetime, end: datetime) -> List[Range]:
+    """Return the partition ranges needed to cover ``[start, end)``.
+
+    Ranges follow period boundaries but are clipped around existing
+    partitions, so changing the granularity never produces overlaps.
+    """
+    occupied = list(existing)
+    planned: List[Range] = []
+    cursor = period_start(start, granularity)
+    while cursor < end:
+        period_end = next_period(cursor, granularity)
+        gap_start = cursor
+        while gap_start < period_end:
+            covering = [high for low, high in occupied
+                        if low <= gap_start < high]
+            if covering:
+                gap_start = max(covering)
+                continue
+            gap_end = min([period_end] + [low for low, _ in occupied
+                                          if gap_start < low < period_end])
+            planned.append((gap_start, gap_end))
+            occupied.append((gap_start, gap_end))
+            gap_start = gap_end
+        cursor = period_end
+    return planned
+
+
+def expired_partitions(partitions: List[Tuple[str, datetime, datetime]],
+                       cutoff: datetime) -> List[Tuple[str, datetime, datetime]]:
+    """Partitions whose whole range ends at or before ``cutoff``."""
+    return [p for p in partitions if p[2] <= cutoff]
+
+
+class PartitionManager:
+    """Creates upcoming partitions and drops expired ones on a timer."""
+
+    def __init__(self,
+                 interval: Optional[float] = None,
+                 premake_days: Optional[int] = None):
+        self.interval = interval or float(
+            os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+        self.premake_days = premake_days or int(
+            os.getenv("PARTITION_PREMAKE_DAYS", "7"))
+        self.granularity = {}
+        for table in PARTITIONED_TABLES:
+            value = os.getenv(
+                f"PARTITION_GRANULARITY_{table.upper()}", "daily").lower()
+            self.granularity[table] = (
+                value if value in GRANULARITIES else 'daily')
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    # ------------------------------------------------------------------
+    # Background job
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._stopping:
+            self._stopping.set()
+        if self._task:
+            try:
+                await self._task
+            except Exception as e:
+                print(f"Partition manager stopped with error: {e}")
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.maintain()
+            except Exception as e:
+                add_log(
+                    "ERROR", f"Partition maintenance failed: {str(e)}",
+                    module="partition_manager", function="_run"
+                )
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    async def maintain(self) -> Dict[str, Any]:
+        """Create missing partitions and drop expired ones for every
+        partitioned table."""
+        summary = {}
+        for table in PARTITIONED_TABLES:
+            summary[table] = await self.maintain_table(table)
+        self.last_run = {
+            'tables': summary,
+            'at': datetime.now(timezone.utc).isoformat()
+        }
+        return summary
+
+    async def maintain_table(self, table: str) -> Dict[str, Any]:
+        retention = await self.retention_days(table)
+        result = {'created': [], 'dropped': [], 'kept': [],
+                  'retention_days': retention}
+
+        # A session lock, held on one pooled connection for the whole
+        # pass, so no other worker creates, archives or drops partitions
+        # until the archive files are written and the DROPs are done
+        async with database.connection():
+            locked = await database.fetch_one(
+                "SELECT pg_try_advisory_lock(:key) AS locked",
+                {'key': ADVISORY_LOCK_KEY}
+            )
+            if not locked or not locked['locked']:
+                # Another worker is maintaining partitions right now
+                return result
+            try:
+                await self._maintain_locked(table, retention, result)
+            finally:
+                await database.execute(
+                    "SELECT pg_advisory_unlock(:key)",
+                    {'key': ADVISORY_LOCK_KEY}
+                )
+
+        if result['created'] or result['dropped']:
+            add_log(
+                "INFO", f"{table}: created {len(result['created'])}, dropped "
+                f"{len(result['dropped'])} partitions",
+                module="partition_manager", function="maintain_table"
+            )
+        return result
+
+    async def _maintain_locked(self, table: str, retention: int,
+                               result: Dict[str, Any]):
+        spec = PARTITIONED_TABLES[table]
+        granularity = self.granularity[table]
+        now = datetime.now(timezone.utc)
+
+        async with database.transaction():
+            partitions = await self.existing_partitions(table)
+            ranges = [(start, end) for _, start, end in partitions]
+            for start, end in plan_partitions(
+                    ranges, granularity, now,
+                    now + timedelta(days=self.premake_days)):
+                name = partition_name(table, start)
+                # DDL takes no bind parameters; bounds are generated
+                # datetimes, never user input
+                await database.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" '
+                    f'PARTITION OF "{table}" FOR VALUES '
+                    f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+                result['created'].append(name)
+
+        if retention <= 0:
+            return
+        cutoff = period_start(now - timedelta(days=retention), 'daily')
+        watermark = None
+        for name, start, end in expired_partitions(partitions, cutoff):
+            if spec['requires_rollup']:
+                if watermark is None or watermark < end:
+                    watermark = await self._rollup_watermark(end)
+                if watermark is None or watermark < end:
+                    # Not downsampled yet; try again next run
+                    result['kept'].append(name)
+                    continue
+            if spec['requires_archive']:
+                try:
+                    await log_archive.archive_range(start, end)
+                except Exception as e:
+                    # Keep the rows until they are safely on disk
+                    add_log(
+                        "ERROR", f"Archiving {name} failed: {e}",
+                        module="partition_manager", function="maintain_table"
+                    )
+                    result['kept'].append(name)
+                    continue
+            await database.execute(f'DROP TABLE IF EXISTS "{name}"')
+            result['dropped'].append(name)
+
+    async def existing_partitions(
+            self, table: str) -> List[Tuple[str, datetime, datetime]]:
+        """List ``(name, start, end)`` for the table's range partitions."""
+        rows = await database.fetch_all(
+            """SELECT child.relname AS name,
+                      pg_get_expr(child.relpartbound, child.oid) AS bound
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table""",
+            {'table': table}
+        )
+        partitions = []
+        for row in rows:
+            bound = parse_partition_bound(row['bound'])
+            if bound:
+                partitions.append((row['name'], bound[0], bound[1]))
+        return sorted(partitions, key=lambda p: p[1])
+
+    async def retention_days(self, table: str) -> int:
+        """Retention from site config; 0 or less keeps everything."""
+        spec = PARTITIONED_TABLES[table]
+        value = await SiteConfigManager.get_config(
+            spec['retention_key'], str(spec['default_retention']))
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return spec['default_retention']
+
+    async def _rollup_watermark(self, needed: datetime) -> Optional[datetime]:
+        """Return the rollup watermark, refreshing once if it is behind."""
+        watermark = await analytics_rollups.get_watermark()
+        if watermark is None or watermark < needed:
+            await analytics_rollups.refresh()
+            watermark = await analytics_rollups.get_watermark()
+        return watermark
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'interval': self.interval,
+            'premake_days': self.premake_days,
+            'granularity': self.granularity,
+            'running': bool(self._task and not self._task.done()),
+            'last_run': self.last_run
+        }
+
+
+# Global partition manager
+partition_manager = PartitionManager()
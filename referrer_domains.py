@@ -0,0 +1,85 @@
+"""
+Referrer Domains
+Normalizes referrers at ingest into the referrer_domains dimension table
+(domain, first_seen, last_seen, views), so page views carry a compact
+integer referrer_domain_id and referrer reports group by that key
+instead of parsing full referer URLs.
+
+``assign`` runs inside the ingest transaction: one upsert per flushed
+batch creates unseen domains, bumps the counters of known ones and
+returns their ids.
+"""
+from collections import Counter
+from typing import Any, Dict, List
+
+from database import database
+from visitor_sketches import referrer_domain
+
+
+class ReferrerDomains:
+    """Maps referrer domains to dimension ids for the ingest writer."""
+
+    def __init__(self):
+        self.counters = {
+            'assigned': 0,
+            'upserts': 0
+        }
+
+    async def assign(self, rows: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Set ``referrer_domain`` and ``referrer_domain_id`` on each row.
+
+        Returns the domain -> id mapping used for the batch.
+        """
+        views: Counter = Counter()
+        last_seen: Dict[str, Any] = {}
+        first_seen: Dict[str, Any] = {}
+        for row in rows:
+            domain = referrer_domain(row.get('referer'))
+            row['referrer_domain'] = domain
+            if domain is None:
+                continue
+            views[domain] += 1
+            timestamp = row['timestamp']
+            if domain not in first_seen or timestamp < first_seen[domain]:
+                first_seen[domain] = timestamp
+            if domain not in last_seen or timestamp > last_seen[domain]:
+                last_seen[domain] = timestamp
+
+        ids: Dict[str, int] = {}
+        if views:
+            domains = sorted(views)
+            # Sorted so concurrent writers lock rows in the same order
+            result = await database.fetch_all(
+                """INSERT INTO referrer_domains
+                    (domain, first_seen, last_seen, views)
+                SELECT * FROM unnest(
+                    CAST(:domains AS TEXT[]),
+                    CAST(:first_seen AS TIMESTAMPTZ[]),
+                    CAST(:last_seen AS TIMESTAMPTZ[]),
+                    CAST(:views AS BIGINT[]))
+                ON CONFLICT (domain) DO UPDATE SET
+                    last_seen = GREATEST(referrer_domains.last_seen,
+                                         EXCLUDED.last_seen),
+                    views = referrer_domains.views + EXCLUDED.views
+                RETURNING id, domain""",
+                {
+                    'domains': domains,
+                    'first_seen': [first_seen[d] for d in domains],
+                    'last_seen': [last_seen[d] for d in domains],
+                    'views': [views[d] for d in domains]
+                }
+            )
+            ids = {row['domain']: row['id'] for row in result}
+            self.counters['upserts'] += 1
+            self.counters['assigned'] += sum(views.values())
+
+        for row in rows:
+            row['referrer_domain_id'] = ids.get(row['referrer_domain'])
+        return ids
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters)
+
+
+# Global referrer dimension
+referrer_domains = ReferrerDomains()
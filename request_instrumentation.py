@@ -0,0 +1,302 @@
+"""
+Request Instrumentation Middleware
+Single pure-ASGI layer that times every request, captures the response
+status, hands page views to analytics and logs non-200 responses.
+
+It replaces three stacked HTTP middlewares (the analytics
+BaseHTTPMiddleware plus the non-200 and request logging functions), each
+of which re-wrapped the response stream. Here the response messages are
+only observed on their way out; bodies are never buffered or re-chunked.
+"""
+import logging
+import os
+import secrets
+import time
+import traceback
+from typing import Dict, Iterable, Optional
+
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from analytics import analytics
+from log_capture import add_log
+
+
+logger = logging.getLogger('portfoliosite')
+
+# Routes excluded from analytics tracking
+EXCLUDED_PATHS = {
+    '/admin/analytics/api',
+    '/admin/analytics/recent-visits',
+    '/analytics/mouse-activity',
+    '/logs/data',
+    '/admin/logs',
+    '/admin/sql',
+    '/assets',
+    '/favicon.ico',
+    '/robots.txt',
+    '/sitemap.xml'
+}
+
+# Paths starting with any of these are excluded from analytics tracking
+EXCLUDED_PREFIXES = {
+    '/assets/',
+    '/admin/analytics/',
+    '/analytics/',
+    '/logs/',
+    '/admin/logs/',
+    '/admin/sql/',
+    '/static/',
+    '/_next/',
+    '/api/'
+}
+
+# Response content types that are never counted as page views
+STATIC_CONTENT_TYPES = (
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/",
+    "font/",
+    "application/font",
+    "text/plain"
+)
+
+BODY_PREVIEW_BYTES = 1000
+# Only these headers are copied into non-200 log entries; anything else
+# (cookies, authorization, set-cookie) must never reach app_log
+LOGGED_REQUEST_HEADERS = frozenset({'user-agent', 'referer'})
+LOGGED_RESPONSE_HEADERS = frozenset({'content-type', 'content-length',
+                                     'location'})
+# 12 random bytes -> 16 URL-safe characters
+VIEW_TOKEN_BYTES = 12
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() == "true"
+
+
+class PathMatcher:
+    """Exact-path set plus a character trie of prefixes.
+
+    Both are built once, so a check is one set lookup and at most one
+    dict step per character of the path instead of a loop over every
+    prefix.
+    """
+
+    _END = ''
+
+    def __init__(self, exact: Iterable[str] = (),
+                 prefixes: Iterable[str] = ()):
+        self.exact = frozenset(exact)
+        self._trie: Dict[str, dict] = {}
+        for prefix in prefixes:
+            node = self._trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[self._END] = True
+
+    def matches(self, path: str) -> bool:
+        if path in self.exact:
+            return True
+        node = self._trie
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+
+class RequestInstrumentationMiddleware:
+    """Pure ASGI middleware for timing, access/error logging and analytics.
+
+    Each feature can be switched off through the environment:
+    REQUEST_TRACK_ANALYTICS, REQUEST_LOG_NON_200, REQUEST_ACCESS_LOG and
+    REQUEST_TIMING_HEADER (adds ``Server-Timing`` to responses).
+    """
+
+    def __init__(self, app: ASGIApp,
+                 track_analytics: Optional[bool] = None,
+                 log_non_200: Optional[bool] = None,
+                 access_log: Optional[bool] = None,
+                 timing_header: Optional[bool] = None,
+                 excluded: Optional[PathMatcher] = None):
+        self.app = app
+        self.track_analytics = (
+            _env_flag("REQUEST_TRACK_ANALYTICS", "true")
+            if track_analytics is None else track_analytics)
+        self.log_non_200 = (
+            _env_flag("REQUEST_LOG_NON_200", "true")
+            if log_non_200 is None else log_non_200)
+        self.access_log = (
+            _env_flag("REQUEST_ACCESS_LOG", "true")
+            if access_log is None else access_log)
+        self.timing_header = (
+            _env_flag("REQUEST_TIMING_HEADER", "false")
+            if timing_header is None else timing_header)
+        self.excluded = excluded or PathMatcher(EXCLUDED_PATHS,
+                                                EXCLUDED_PREFIXES)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+
+        # Pages that may be tracked get a view token, exposed to templates
+        # as request.state.view_token so activity beacons can name the
+        # exact page view they belong to
+        view_token = None
+        if (self.track_analytics and scope["method"] == "GET"
+                and not self.excluded.matches(scope["path"])):
+            view_token = secrets.token_urlsafe(VIEW_TOKEN_BYTES)
+            scope.setdefault("state", {})["view_token"] = view_token
+
+        state = {'status': None, 'content_type': b'', 'headers': None,
+                 'body': b''}
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                state['status'] = status
+                for name, value in message.get("headers", ()):
+                    if name == b"content-type":
+                        state['content_type'] = value
+                        break
+                if status != 200 and self.log_non_200:
+                    state['headers'] = message.get("headers", ())
+                if self.timing_header:
+                    elapsed = (time.perf_counter() - start_time) * 1000
+                    message["headers"] = list(message.get("headers", ())) + [
+                        (b"server-timing", f"app;dur={elapsed:.1f}".encode())
+                    ]
+            elif (message["type"] == "http.response.body"
+                  and state['headers'] is not None
+                  and len(state['body']) < BODY_PREVIEW_BYTES):
+                state['body'] += message.get("body", b"")[
+                    :BODY_PREVIEW_BYTES - len(state['body'])]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            elapsed = time.perf_counter() - start_time
+            self._log_exception(scope, e, elapsed)
+            raise
+
+        elapsed = time.perf_counter() - start_time
+        status = state['status'] or 500
+
+        if self.access_log:
+            logger.info(f"{scope['method']} {scope['path']} {status} "
+                        f"{elapsed * 1000:.1f}ms")
+
+        if status != 200 and self.log_non_200:
+            self._log_non_200(scope, status, state)
+
+        if (view_token and 200 <= status < 400
+                and not self._is_static_content(state['content_type'])):
+            try:
+                # Queue the page view; the ingest writer stores it
+                await analytics.track_page_view(
+                    Request(scope), scope["path"], view_token=view_token)
+            except Exception as e:
+                # Don't let analytics errors break the site
+                add_log(
+                    "WARNING",
+                    f"Failed to track analytics for {scope['path']}: {str(e)}",
+                    module="request_instrumentation", function="__call__"
+                )
+
+    @staticmethod
+    def _is_static_content(content_type: bytes) -> bool:
+        """Check if the response is static content that shouldn't be tracked"""
+        return content_type.decode('latin-1').startswith(STATIC_CONTENT_TYPES)
+
+    def _log_non_200(self, scope: Scope, status: int, state: Dict):
+        """Log any response that is not 200 OK for monitoring"""
+        request = Request(scope)
+        error_id = secrets.token_urlsafe(8)
+
+        if status >= 500:
+            log_level, logger_level = "ERROR", "error"
+        elif status >= 400:
+            log_level, logger_level = "WARNING", "warning"
+        else:
+            log_level, logger_level = "INFO", "info"
+
+        getattr(logger, logger_level)(
+            f"{status} RESPONSE [{error_id}] for {request.url}")
+
+        try:
+            client_ip = _client_ip(request)
+            add_log(
+                level=log_level,
+                module="middleware",
+                message=f"[{error_id}] {status} response for {request.url}",
+                function="log_non_200_responses",
+                ip_address=client_ip,
+                extra={
+                    "error_id": error_id,
+                    "status_code": status,
+                    "url": str(request.url),
+                    "method": request.method,
+                    "headers": {
+                        name: value
+                        for name, value in request.headers.items()
+                        if name in LOGGED_REQUEST_HEADERS
+                    },
+                    "response_headers": {
+                        name.decode('latin-1'): value.decode('latin-1')
+                        for name, value in state['headers'] or ()
+                        if name.decode('latin-1').lower()
+                        in LOGGED_RESPONSE_HEADERS
+                    },
+                    "response_body_preview": state['body'].decode(
+                        'utf-8', errors='replace'),
+                    "client_ip": client_ip
+                }
+            )
+        except Exception as log_error:
+            logger.error(
+                f"Failed to log {status} response to database: {log_error}")
+
+    def _log_exception(self, scope: Scope, exc: Exception, elapsed: float):
+        """Record an unhandled error before the exception handler runs"""
+        request = Request(scope)
+        error_id = secrets.token_urlsafe(8)
+        full_traceback = traceback.format_exc()
+        logger.error(f"Request failed [{error_id}] after {elapsed:.4f}s: "
+                     f"{str(exc)}")
+
+        try:
+            client_ip = _client_ip(request)
+            add_log(
+                level="ERROR",
+                module="middleware",
+                message=f"[{error_id}] Middleware error: {str(exc)}",
+                function="log_non_200_responses",
+                ip_address=client_ip,
+                extra={
+                    "error_id": error_id,
+                    "url": str(request.url),
+                    "method": request.method,
+                    "error_type": type(exc).__name__,
+                    "client_ip": client_ip
+                },
+                traceback_text=full_traceback
+            )
+        except Exception as log_error:
+            logger.error(
+                f"Failed to log middleware error to database: {log_error}")
+
+
+def _client_ip(request: Request) -> str:
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
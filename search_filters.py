@@ -0,0 +1,64 @@
+"""
+Search Filters
+Substring search for the admin grids, backed by pg_trgm GIN indexes.
+
+Each searchable table has one trigram index over a single expression
+that joins its searchable columns with a unit separator. Search terms
+are rewritten into ``<expression> ILIKE '%term%'`` against exactly that
+expression, so PostgreSQL answers the search with one bitmap index scan
+instead of OR-ing ILIKEs over every column with a sequential scan.
+
+The expressions below must stay the same as the indexed ones in
+sql/14_add_trigram_search_indexes.sql, or the planner will not match
+the index.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+from analytics_rollups import IP_TEXT
+
+
+# Trigram indexes cannot narrow patterns with fewer than three
+# characters; the grids ignore shorter terms
+MIN_SEARCH_LENGTH = 3
+
+# Keeps terms from matching across column boundaries
+_SEPARATOR = "chr(31)"
+
+
+def _joined(*columns: str) -> str:
+    return f" || {_SEPARATOR} || ".join(
+        f"COALESCE({column}, '')" for column in columns)
+
+
+SEARCH_EXPRESSIONS = {
+    'page_analytics': _joined('page_path', IP_TEXT, 'user_agent', 'referer'),
+    'app_log': _joined('message', 'module', 'function'),
+    'contact_messages': _joined('name', 'email', 'subject', 'message'),
+}
+
+
+def escape_like(term: str) -> str:
+    """Escape LIKE wildcards so the term matches literally."""
+    return (term.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+def normalize_search(term: Optional[str]) -> Optional[str]:
+    """Return the trimmed term, or None if it is too short to search."""
+    term = (term or '').strip()
+    return term if len(term) >= MIN_SEARCH_LENGTH else None
+
+
+def search_condition(table: str, term: Optional[str],
+                     param: str = 'search'
+                     ) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Build the indexed substring condition for ``table``.
+
+    Returns ``(None, {})`` when the term is missing or too short.
+    """
+    term = normalize_search(term)
+    if term is None:
+        return None, {}
+    condition = f"({SEARCH_EXPRESSIONS[table]}) ILIKE :{param}"
+    return condition, {param: f"%{escape_like(term)}%"}
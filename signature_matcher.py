@@ -0,0 +1,147 @@
+"""
+Signature Matcher
+Aho-Corasick automaton that finds every bot, datacenter and user-agent
+signature category in a string with one pass over its characters
+"""
+import json
+import os
+import re
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from log_capture import add_log
+from ttl_cache import TTLCache
+
+
+# Regex metacharacters that make a crawler-user-agents pattern non-literal
+_REGEX_META = re.compile(r'(?<!\\)[\[\](){}.*+?^$|]')
+
+
+class SignatureMatcher:
+    """Case-insensitive multi-pattern matcher over named categories.
+
+    All patterns from all categories are compiled into a single automaton,
+    so matching cost depends on the length of the input string rather
+    than on the number of signatures. Verdicts for repeated strings (user
+    agents and hostnames repeat heavily) are memoized in a bounded LRU.
+    """
+
+    def __init__(self, categories: Dict[str, Iterable[str]],
+                 cache_size: Optional[int] = None):
+        self.category_names: List[str] = list(categories)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[int] = [0]
+        self.pattern_count = 0
+
+        for bit, name in enumerate(self.category_names):
+            for pattern in categories[name]:
+                self._add(pattern.lower(), 1 << bit)
+        self._build_failure_links()
+
+        self._all_bits = (1 << len(self.category_names)) - 1
+        self._cache = TTLCache(max_entries=cache_size or int(
+            os.getenv("SIGNATURE_CACHE_SIZE", "20000")))
+
+    def _add(self, pattern: str, bit: int):
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(0)
+            state = next_state
+        self._output[state] |= bit
+        self.pattern_count += 1
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] |= self._output[
+                    self._fail[next_state]]
+
+    def match_bits(self, text: str) -> int:
+        """Return a bitmask of matched categories (uncached)."""
+        goto, fail, output = self._goto, self._fail, self._output
+        all_bits = self._all_bits
+        state = 0
+        found = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+                if found == all_bits:
+                    break
+        return found
+
+    def match(self, text: Optional[str]) -> FrozenSet[str]:
+        """Return the set of category names with at least one signature
+        occurring in ``text``."""
+        if not text:
+            return frozenset()
+
+        found, categories = self._cache.lookup(text)
+        if found:
+            return categories
+
+        bits = self.match_bits(text)
+        categories = frozenset(
+            name for bit, name in enumerate(self.category_names)
+            if bits & (1 << bit)
+        )
+        self._cache.set(text, categories)
+        return categories
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'categories': self.category_names,
+            'patterns': self.pattern_count,
+            'states': len(self._goto),
+            'cache': self._cache.stats()
+        }
+
+
+def load_crawler_user_agents(path: Optional[str]) -> List[str]:
+    """Load literal signatures from a crawler-user-agents style JSON file.
+
+    Entries are objects with a ``pattern`` field holding a regex. Only
+    patterns that are plain literals once escapes are removed are used,
+    since the automaton matches substrings, not regular expressions.
+    """
+    if not path or not os.path.exists(path):
+        return []
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        add_log("WARNING",
+                f"Failed to read crawler user agents {path}: {str(e)}",
+                module="signature_matcher",
+                function="load_crawler_user_agents")
+        return []
+
+    patterns = []
+    for entry in entries:
+        pattern = entry.get('pattern') if isinstance(entry, dict) else entry
+        if not isinstance(pattern, str) or _REGEX_META.search(pattern):
+            continue
+        literal = re.sub(r'\\(.)', r'\1', pattern).strip().lower()
+        if len(literal) >= 3:
+            patterns.append(literal)
+    return patterns
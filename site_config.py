@@ -99,7 +99,11 @@ class SiteConfigManager:
             
             # Service configuration
             'service_description': 'Professional Portfolio FastAPI Application',
-            'service_user': 'portfolio'
+            'service_user': 'portfolio',
+            
+            # Data retention in days (0 keeps everything)
+            'analytics_retention_days': '90',
+            'log_retention_days': '30'
         }
         
         if fill_missing_only:
@@ -0,0 +1,436 @@
+"""
+Database Spool
+Local fallback for the batched writers (page views and app_log) when
+PostgreSQL is down or out of connections.
+
+Writers append failed batches to an append-only spool: segment files of
+length-prefixed, CRC-checked JSON records, fsynced once per batch. A
+replayer job bulk-loads sealed segments through the same write path once
+the database is healthy again and deletes them.
+
+A circuit breaker shared by the writers trips after consecutive
+connection failures; errors caused by the rows themselves do not count.
+While it is open, batches go straight to the spool without a connection
+attempt; after ``reset_timeout`` one probe write is let through to
+decide whether to close it again. Rows the database refuses are set
+aside in ``.failed`` files instead of blocking the rest of a batch or
+segment.
+"""
+import asyncio
+import glob
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import date, datetime
+from typing import (
+    Any, Awaitable, Callable, Dict, List, Optional, Tuple
+)
+
+import asyncpg
+
+
+# Record header: payload length and CRC32 of the payload
+_HEADER = struct.Struct('>II')
+
+# Rows replayed per write call
+REPLAY_CHUNK = 500
+
+# Failures that mean the database is unreachable or saturated; only
+# these count toward the breaker
+CONNECTION_ERRORS = (
+    OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+    asyncpg.TooManyConnectionsError
+)
+
+# Failures caused by the rows themselves; writing the batch again
+# cannot succeed, so it is split to find the offending rows
+DATA_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    return str(value)
+
+
+def _decode_object(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1:
+        if '$datetime' in obj:
+            return datetime.fromisoformat(obj['$datetime'])
+        if '$date' in obj:
+            return date.fromisoformat(obj['$date'])
+    return obj
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    payload = json.dumps(record, separators=(',', ':'),
+                         default=_encode_value).encode()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_records(data: bytes) -> Tuple[List[Dict[str, Any]], bool]:
+    """Decode a segment. Returns ``(records, complete)``; ``complete`` is
+    False if it ends in a torn or corrupt record, which is skipped."""
+    records = []
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return records, False
+        records.append(json.loads(payload, object_hook=_decode_object))
+        offset = start + length
+    return records, offset == len(data)
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self,
+                 failure_threshold: Optional[int] = None,
+                 reset_timeout: Optional[float] = None):
+        self.failure_threshold = failure_threshold or int(
+            os.getenv("DB_BREAKER_FAILURES", "3"))
+        self.reset_timeout = reset_timeout or float(
+            os.getenv("DB_BREAKER_RESET_TIMEOUT", "30"))
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.counters = {
+            'opened': 0,
+            'rejected': 0
+        }
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Whether a database write should be attempted now."""
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self._probing:
+            self._probing = True
+            return True
+        self.counters['rejected'] += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                self.counters['opened'] += 1
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def record_error(self, error: Exception):
+        """Record a failed write. Only connection errors count toward
+        opening the breaker; any other error means the database answered."""
+        if isinstance(error, CONNECTION_ERRORS):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'state': self.state,
+            'failures': self.failures,
+            'failure_threshold': self.failure_threshold,
+            'reset_timeout': self.reset_timeout
+        }
+
+
+class Spool:
+    """Append-only segment files for one writer."""
+
+    def __init__(self, name: str,
+                 directory: Optional[str] = None,
+                 max_bytes: Optional[int] = None):
+        self.name = name
+        self.directory = directory or os.getenv("SPOOL_DIR", "spool")
+        self.max_bytes = max_bytes or int(
+            os.getenv("SPOOL_MAX_BYTES", str(100 * 1024 * 1024)))
+        self._file = None
+        self._lock = threading.Lock()
+        self.counters = {
+            'spooled': 0,
+            'replayed': 0,
+            'dropped': 0,
+            'rejected': 0,
+            'corrupt_segments': 0,
+            'failed_segments': 0
+        }
+
+    def _segments(self, suffix: str = '.spool') -> List[str]:
+        return sorted(glob.glob(
+            os.path.join(self.directory, f"{self.name}-*{suffix}")))
+
+    def size(self) -> int:
+        total = 0
+        for path in self._segments():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def append(self, records: List[Dict[str, Any]]) -> int:
+        """Append records with one fsync. Returns how many were kept;
+        blocking, so async callers run it in a thread."""
+        if not records:
+            return 0
+        data = b''.join(encode_record(record) for record in records)
+        with self._lock:
+            if self.size() + len(data) > self.max_bytes:
+                self.counters['dropped'] += len(records)
+                return 0
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(
+                    self.directory, f"{self.name}-{time.time_ns()}.spool")
+                self._file = open(path, 'ab')
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.counters['spooled'] += len(records)
+        return len(records)
+
+    def seal(self) -> List[str]:
+        """Close the open segment and return every segment to replay,
+        oldest first. Later appends start a new segment."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            return self._segments()
+
+    def read(self, path: str) -> List[Dict[str, Any]]:
+        with open(path, 'rb') as f:
+            records, complete = decode_records(f.read())
+        if not complete:
+            self.counters['corrupt_segments'] += 1
+        return records
+
+    def rewrite(self, path: str, records: List[Dict[str, Any]]):
+        """Replace a sealed segment with the records not yet replayed."""
+        temp = f"{path}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(b''.join(encode_record(record) for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    def quarantine(self, path: str):
+        """Set aside a segment that keeps failing to replay."""
+        os.replace(path, path[:-len('.spool')] + '.failed')
+        self.counters['failed_segments'] += 1
+
+    def reject(self, records: List[Dict[str, Any]]):
+        """Set aside records the database refused, in a ``.failed`` file
+        that is never replayed."""
+        if not records:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory, f"{self.name}-{time.time_ns()}.failed")
+        with open(path, 'wb') as f:
+            f.write(b''.join(encode_record(record) for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        self.counters['rejected'] += len(records)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'segments': len(self._segments()),
+            'bytes': self.size(),
+            'max_bytes': self.max_bytes
+        }
+
+
+Writer = Callable[[List[Dict[str, Any]]], Awaitable[Any]]
+
+
+async def write_isolating(
+        write: Writer, records: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[Exception]]:
+    """Write ``records``, halving any chunk that fails with a data error
+    until the rows that cannot be written are isolated.
+
+    Returns ``(rejected, unwritten, error)``: the single rows the
+    database refused, and, if another error stopped the write, the rows
+    not yet written (in order) with that error.
+    """
+    rejected: List[Dict[str, Any]] = []
+    # Chunks still to write, the next one last
+    pending = [records]
+    while pending:
+        chunk = pending.pop()
+        try:
+            await write(chunk)
+        except DATA_ERRORS:
+            if len(chunk) == 1:
+                rejected.extend(chunk)
+                continue
+            middle = len(chunk) // 2
+            pending.append(chunk[middle:])
+            pending.append(chunk[:middle])
+        except Exception as e:
+            unwritten = list(chunk)
+            for rest in reversed(pending):
+                unwritten.extend(rest)
+            return rejected, unwritten, e
+    return rejected, [], None
+
+
+class SpoolReplayer:
+    """Background job that loads spooled batches back into PostgreSQL."""
+
+    def __init__(self,
+                 breaker: CircuitBreaker,
+                 interval: Optional[float] = None,
+                 max_attempts: Optional[int] = None):
+        self.breaker = breaker
+        self.interval = interval or float(
+            os.getenv("SPOOL_REPLAY_INTERVAL", "10"))
+        self.max_attempts = max_attempts or int(
+            os.getenv("SPOOL_MAX_REPLAY_ATTEMPTS", "5"))
+        self._spools: List[Tuple[Spool, Writer]] = []
+        self._attempts: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self.last_replay: Optional[Dict[str, Any]] = None
+
+    def register(self, spool: Spool, write: Writer):
+        """Replay ``spool`` through ``write``, the writer's own bulk
+        insert."""
+        self._spools.append((spool, write))
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._stopping:
+            self._stopping.set()
+        if self._task:
+            try:
+                await self._task
+            except Exception as e:
+                print(f"Spool replayer stopped with error: {e}")
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.replay()
+            except Exception as e:
+                print(f"Spool replay failed: {e}")
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def replay(self) -> int:
+        """Replay every sealed segment while the database accepts
+        writes. Returns the number of records loaded."""
+        from database import database
+
+        loaded = 0
+        for spool, write in self._spools:
+            for path in await asyncio.to_thread(spool.seal):
+                if not database.is_connected or not self.breaker.allow():
+                    return loaded
+                count, available = await self._replay_segment(
+                    spool, write, path)
+                loaded += count
+                if not available:
+                    return loaded
+
+        if loaded:
+            from log_capture import add_log
+            add_log(
+                "INFO", f"Replayed {loaded} spooled records",
+                module="spool", function="replay"
+            )
+            self.last_replay = {
+                'records': loaded,
+                'at': datetime.now().isoformat()
+            }
+        return loaded
+
+    async def _replay_segment(self, spool: Spool, write: Writer,
+                              path: str) -> Tuple[int, bool]:
+        """Replay one segment. Returns ``(loaded, available)``;
+        ``available`` is False if the database could not be reached, which
+        ends this pass."""
+        records = await asyncio.to_thread(spool.read, path)
+        rejected: List[Dict[str, Any]] = []
+        remaining: List[Dict[str, Any]] = []
+        error = None
+        for start in range(0, len(records), REPLAY_CHUNK):
+            chunk_rejected, unwritten, error = await write_isolating(
+                write, records[start:start + REPLAY_CHUNK])
+            rejected.extend(chunk_rejected)
+            if error is not None:
+                remaining = unwritten + records[start + REPLAY_CHUNK:]
+                break
+        # Poison rows are set aside so they never block the segment
+        await asyncio.to_thread(spool.reject, rejected)
+        loaded = len(records) - len(rejected) - len(remaining)
+        spool.counters['replayed'] += loaded
+
+        if error is None:
+            self.breaker.record_success()
+            self._attempts.pop(path, None)
+            await asyncio.to_thread(os.remove, path)
+            return loaded, True
+
+        self.breaker.record_error(error)
+        attempts = self._attempts.get(path, 0) + 1
+        self._attempts[path] = attempts
+        print(f"Replaying {path} failed after {loaded} records: {error}")
+        if len(remaining) < len(records):
+            # Keep only what is left so nothing is loaded twice
+            await asyncio.to_thread(spool.rewrite, path, remaining)
+        elif attempts >= self.max_attempts:
+            await asyncio.to_thread(spool.quarantine, path)
+            self._attempts.pop(path, None)
+        # Later segments are still tried unless the database is down
+        return loaded, not isinstance(error, CONNECTION_ERRORS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'interval': self.interval,
+            'running': bool(self._task and not self._task.done()),
+            'breaker': self.breaker.stats(),
+            'spools': {spool.name: spool.stats()
+                       for spool, _ in self._spools},
+            'last_replay': self.last_replay
+        }
+
+
+# Shared by every batched writer: one dead database trips them all
+database_breaker = CircuitBreaker()
+spool_replayer = SpoolReplayer(database_breaker)
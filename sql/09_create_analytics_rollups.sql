@@ -0,0 +1,70 @@
+-- Hourly and daily rollups of page_analytics for the analytics dashboard
+-- Maintained by analytics_rollups.py; dashboard queries read these for
+-- complete hours and only scan raw page_analytics rows past the watermark
+
+-- Views per page path
+CREATE TABLE IF NOT EXISTS analytics_hourly_pages (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    page_path TEXT NOT NULL,
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, page_path)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_daily_pages (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    page_path TEXT NOT NULL,
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, page_path)
+);
+
+-- One row per visitor IP and classification, so distinct-IP counts stay
+-- exact when buckets are merged
+CREATE TABLE IF NOT EXISTS analytics_hourly_visitors (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    ip_address VARCHAR(45) NOT NULL,
+    visitor_type VARCHAR(20) NOT NULL DEFAULT '',
+    is_datacenter BOOLEAN NOT NULL DEFAULT FALSE,
+    mouse_activity BOOLEAN NOT NULL DEFAULT FALSE,
+    organization VARCHAR(255) NOT NULL DEFAULT '',
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, ip_address, visitor_type, is_datacenter,
+                 mouse_activity, organization)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_daily_visitors (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    ip_address VARCHAR(45) NOT NULL,
+    visitor_type VARCHAR(20) NOT NULL DEFAULT '',
+    is_datacenter BOOLEAN NOT NULL DEFAULT FALSE,
+    mouse_activity BOOLEAN NOT NULL DEFAULT FALSE,
+    organization VARCHAR(255) NOT NULL DEFAULT '',
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, ip_address, visitor_type, is_datacenter,
+                 mouse_activity, organization)
+);
+
+-- Referrer domains with the visiting IP for unique-visitor counts
+CREATE TABLE IF NOT EXISTS analytics_hourly_referrers (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    referrer_domain VARCHAR(255) NOT NULL,
+    ip_address VARCHAR(45) NOT NULL,
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, referrer_domain, ip_address)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_daily_referrers (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    referrer_domain VARCHAR(255) NOT NULL,
+    ip_address VARCHAR(45) NOT NULL,
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, referrer_domain, ip_address)
+);
+
+-- Rollup watermark: everything before rolled_up_to is in the rollup tables
+CREATE TABLE IF NOT EXISTS analytics_rollup_state (
+    name VARCHAR(50) PRIMARY KEY,
+    rolled_up_to TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+COMMENT ON TABLE analytics_rollup_state IS 'High-water mark of complete hours copied from page_analytics into the rollup tables';
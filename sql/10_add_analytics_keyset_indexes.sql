@@ -0,0 +1,20 @@
+-- Keyset pagination indexes for the analytics recent-visits grid
+-- Each index matches a sort key in analytics.RECENT_VISITS_SORT_KEYS with
+-- id as the tiebreak, so "(key, id) < (:value, :id) ORDER BY key, id
+-- LIMIT n" reads n index entries regardless of how deep the page is
+
+CREATE INDEX IF NOT EXISTS idx_page_analytics_timestamp_id
+    ON page_analytics (timestamp, id);
+
+CREATE INDEX IF NOT EXISTS idx_page_analytics_page_path_id
+    ON page_analytics (page_path, id);
+
+CREATE INDEX IF NOT EXISTS idx_page_analytics_ip_text_id
+    ON page_analytics ((COALESCE(split_part(ip_address::text, '/', 1), '')), id);
+
+-- Free-text keys are truncated to keep index entries under the btree limit
+CREATE INDEX IF NOT EXISTS idx_page_analytics_user_agent_id
+    ON page_analytics ((left(COALESCE(user_agent, ''), 256)), id);
+
+CREATE INDEX IF NOT EXISTS idx_page_analytics_referer_id
+    ON page_analytics ((left(COALESCE(referer, ''), 256)), id);
@@ -0,0 +1,10 @@
+-- Per-page-view token so mouse-activity beacons update exactly the view
+-- that rendered the page, instead of every recent row from the same IP
+ALTER TABLE page_analytics
+ADD COLUMN IF NOT EXISTS view_token VARCHAR(32);
+
+CREATE INDEX IF NOT EXISTS idx_page_analytics_view_token
+    ON page_analytics (view_token)
+    WHERE view_token IS NOT NULL;
+
+COMMENT ON COLUMN page_analytics.view_token IS 'Random token rendered into the page and echoed by the mouse-activity beacon';
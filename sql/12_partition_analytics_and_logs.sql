@@ -0,0 +1,178 @@
+-- Convert page_analytics and app_log into timestamp range-partitioned
+-- tables so retention drops whole partitions instead of deleting rows.
+--
+-- Existing rows are copied into monthly partitions covering their history.
+-- partition_manager.py creates future partitions ahead of time and drops
+-- expired ones. Indexes are defined once on the parent; PostgreSQL builds
+-- them on every partition, including ones created later. The primary key
+-- has to include the partition key, so it becomes (id, timestamp).
+--
+-- Run in one transaction; both tables are locked while rows are copied.
+
+BEGIN;
+
+-- Creates monthly partitions named <table>_pYYYYMMDD covering [from, to)
+CREATE OR REPLACE FUNCTION create_monthly_partitions(
+    parent TEXT, from_ts TIMESTAMPTZ, to_ts TIMESTAMPTZ
+) RETURNS VOID AS $$
+DECLARE
+    month_start TIMESTAMPTZ := date_trunc('month', from_ts AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+BEGIN
+    WHILE month_start < to_ts LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            parent || '_p' || to_char(month_start AT TIME ZONE 'UTC', 'YYYYMMDD'),
+            parent,
+            month_start,
+            month_start + INTERVAL '1 month'
+        );
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- ---------------------------------------------------------------------
+-- page_analytics
+-- ---------------------------------------------------------------------
+
+ALTER TABLE page_analytics RENAME TO page_analytics_unpartitioned;
+ALTER TABLE page_analytics_unpartitioned
+    RENAME CONSTRAINT page_analytics_pkey TO page_analytics_unpartitioned_pkey;
+ALTER SEQUENCE page_analytics_id_seq OWNED BY NONE;
+
+DROP INDEX IF EXISTS idx_page_analytics_timestamp;
+DROP INDEX IF EXISTS idx_page_analytics_page_path;
+DROP INDEX IF EXISTS idx_page_analytics_ip;
+DROP INDEX IF EXISTS idx_page_analytics_mouse_activity;
+DROP INDEX IF EXISTS idx_page_analytics_visitor_type;
+DROP INDEX IF EXISTS idx_page_analytics_is_datacenter;
+DROP INDEX IF EXISTS idx_page_analytics_reverse_dns;
+DROP INDEX IF EXISTS idx_page_analytics_asn;
+DROP INDEX IF EXISTS idx_page_analytics_timestamp_id;
+DROP INDEX IF EXISTS idx_page_analytics_page_path_id;
+DROP INDEX IF EXISTS idx_page_analytics_ip_text_id;
+DROP INDEX IF EXISTS idx_page_analytics_user_agent_id;
+DROP INDEX IF EXISTS idx_page_analytics_referer_id;
+DROP INDEX IF EXISTS idx_page_analytics_view_token;
+
+CREATE TABLE page_analytics (
+    id INTEGER NOT NULL DEFAULT nextval('page_analytics_id_seq'),
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    page_path TEXT NOT NULL,
+    ip_address INET,
+    user_agent TEXT,
+    referer TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    mouse_activity BOOLEAN DEFAULT FALSE,
+    reverse_dns VARCHAR(255),
+    visitor_type VARCHAR(20) DEFAULT 'unknown',
+    is_datacenter BOOLEAN DEFAULT FALSE,
+    asn VARCHAR(50),
+    organization VARCHAR(255),
+    view_token VARCHAR(32),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE page_analytics_id_seq OWNED BY page_analytics.id;
+
+-- Catches rows outside every range partition (e.g. clock skew) so inserts
+-- never fail if the partition manager falls behind
+CREATE TABLE page_analytics_default PARTITION OF page_analytics DEFAULT;
+
+SELECT create_monthly_partitions(
+    'page_analytics',
+    COALESCE((SELECT MIN(COALESCE(timestamp, created_at, NOW()))
+              FROM page_analytics_unpartitioned), NOW()),
+    NOW() + INTERVAL '1 day'
+);
+
+INSERT INTO page_analytics (
+    id, timestamp, page_path, ip_address, user_agent, referer, created_at,
+    mouse_activity, reverse_dns, visitor_type, is_datacenter, asn,
+    organization, view_token
+)
+SELECT id, COALESCE(timestamp, created_at, NOW()), page_path, ip_address,
+       user_agent, referer, created_at, mouse_activity, reverse_dns,
+       visitor_type, is_datacenter, asn, organization, view_token
+FROM page_analytics_unpartitioned;
+
+DROP TABLE page_analytics_unpartitioned;
+
+CREATE INDEX idx_page_analytics_timestamp ON page_analytics (timestamp);
+CREATE INDEX idx_page_analytics_page_path ON page_analytics (page_path);
+CREATE INDEX idx_page_analytics_ip ON page_analytics (ip_address);
+CREATE INDEX idx_page_analytics_mouse_activity ON page_analytics (mouse_activity);
+CREATE INDEX idx_page_analytics_visitor_type ON page_analytics (visitor_type);
+CREATE INDEX idx_page_analytics_is_datacenter ON page_analytics (is_datacenter);
+CREATE INDEX idx_page_analytics_reverse_dns ON page_analytics (reverse_dns);
+CREATE INDEX idx_page_analytics_asn ON page_analytics (asn);
+CREATE INDEX idx_page_analytics_timestamp_id ON page_analytics (timestamp, id);
+CREATE INDEX idx_page_analytics_page_path_id ON page_analytics (page_path, id);
+CREATE INDEX idx_page_analytics_ip_text_id
+    ON page_analytics ((COALESCE(split_part(ip_address::text, '/', 1), '')), id);
+CREATE INDEX idx_page_analytics_user_agent_id
+    ON page_analytics ((left(COALESCE(user_agent, ''), 256)), id);
+CREATE INDEX idx_page_analytics_referer_id
+    ON page_analytics ((left(COALESCE(referer, ''), 256)), id);
+CREATE INDEX idx_page_analytics_view_token
+    ON page_analytics (view_token)
+    WHERE view_token IS NOT NULL;
+
+
+-- ---------------------------------------------------------------------
+-- app_log
+-- ---------------------------------------------------------------------
+
+ALTER TABLE app_log RENAME TO app_log_unpartitioned;
+ALTER TABLE app_log_unpartitioned
+    RENAME CONSTRAINT app_log_pkey TO app_log_unpartitioned_pkey;
+ALTER SEQUENCE app_log_id_seq OWNED BY NONE;
+
+DROP INDEX IF EXISTS idx_app_log_portfolio_id;
+DROP INDEX IF EXISTS idx_app_log_timestamp;
+
+CREATE TABLE app_log (
+    id INTEGER NOT NULL DEFAULT nextval('app_log_id_seq'),
+    portfolio_id UUID NOT NULL REFERENCES portfolios(portfolio_id) ON DELETE CASCADE,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    level TEXT NOT NULL,
+    message TEXT NOT NULL,
+    module TEXT,
+    function TEXT,
+    line INTEGER,
+    "user" TEXT,
+    extra TEXT,
+    ip_address VARCHAR(45),
+    user_agent TEXT,
+    traceback TEXT,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE app_log_id_seq OWNED BY app_log.id;
+
+CREATE TABLE app_log_default PARTITION OF app_log DEFAULT;
+
+SELECT create_monthly_partitions(
+    'app_log',
+    COALESCE((SELECT MIN(timestamp) FROM app_log_unpartitioned), NOW()),
+    NOW() + INTERVAL '1 day'
+);
+
+INSERT INTO app_log (
+    id, portfolio_id, timestamp, level, message, module, function, line,
+    "user", extra, ip_address, user_agent, traceback
+)
+SELECT id, portfolio_id, COALESCE(timestamp, NOW()), level, message,
+       module, function, line, "user", extra, ip_address, user_agent,
+       traceback
+FROM app_log_unpartitioned;
+
+DROP TABLE app_log_unpartitioned;
+
+CREATE INDEX idx_app_log_portfolio_id ON app_log (portfolio_id);
+CREATE INDEX idx_app_log_timestamp ON app_log (timestamp DESC);
+
+DROP FUNCTION create_monthly_partitions(TEXT, TIMESTAMPTZ, TIMESTAMPTZ);
+
+COMMIT;
@@ -0,0 +1,25 @@
+-- Daily HyperLogLog sketches of visitor IPs, maintained by
+-- visitor_sketches.py. Dashboard unique counts merge one sketch per day
+-- instead of counting distinct IPs over raw page views.
+--
+-- dimension is one of all, human, visitor_type, datacenter, page or
+-- referrer; dim_value holds the visitor type, page path or referrer
+-- domain and is '' for the others. registers is the serialized sketch
+-- (sparse or dense, see HyperLogLog.to_bytes).
+--
+-- The table starts empty; the sketch job rebuilds history from raw page
+-- views on first start and records the first covered day in
+-- analytics_rollup_state under 'visitor_sketches'. Until then the
+-- dashboard falls back to exact counts.
+
+CREATE TABLE IF NOT EXISTS visitor_sketches (
+    day DATE NOT NULL,
+    dimension VARCHAR(20) NOT NULL,
+    dim_value TEXT NOT NULL DEFAULT '',
+    registers BYTEA NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (day, dimension, dim_value)
+);
+
+CREATE INDEX IF NOT EXISTS idx_visitor_sketches_dimension_day
+    ON visitor_sketches (dimension, day);
@@ -0,0 +1,35 @@
+-- Trigram indexes for the substring search boxes in the analytics, logs
+-- and contact-submission grids.
+--
+-- Each table gets one GIN index over its searchable columns joined with
+-- chr(31), and search_filters.py rewrites searches into
+-- "<same expression> ILIKE '%term%'" so the planner can use it. Keep the
+-- expressions here and in search_filters.SEARCH_EXPRESSIONS identical.
+--
+-- page_analytics and app_log are partitioned; indexes created on the
+-- parent cascade to every existing and future partition.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_page_analytics_search_trgm
+    ON page_analytics USING gin ((
+        COALESCE(page_path, '') || chr(31) ||
+        COALESCE(split_part(ip_address::text, '/', 1), '') || chr(31) ||
+        COALESCE(user_agent, '') || chr(31) ||
+        COALESCE(referer, '')
+    ) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_app_log_search_trgm
+    ON app_log USING gin ((
+        COALESCE(message, '') || chr(31) ||
+        COALESCE(module, '') || chr(31) ||
+        COALESCE(function, '')
+    ) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_contact_messages_search_trgm
+    ON contact_messages USING gin ((
+        COALESCE(name, '') || chr(31) ||
+        COALESCE(email, '') || chr(31) ||
+        COALESCE(subject, '') || chr(31) ||
+        COALESCE(message, '')
+    ) gin_trgm_ops);
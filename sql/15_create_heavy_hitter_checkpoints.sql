@@ -0,0 +1,13 @@
+-- Checkpoints of the in-memory top-K tracker (heavy_hitters.py) that
+-- serves the dashboard top pages, referrers and IPs widgets.
+--
+-- payload is zlib-compressed JSON holding, per dimension, one
+-- {key: count} map for each tracked hour. The tracker writes it every
+-- HEAVY_HITTERS_CHECKPOINT_INTERVAL seconds and at shutdown, and loads
+-- it on start; with no row it seeds itself from the hourly rollups.
+
+CREATE TABLE IF NOT EXISTS heavy_hitter_checkpoints (
+    name VARCHAR(50) PRIMARY KEY,
+    payload BYTEA NOT NULL,
+    checkpointed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
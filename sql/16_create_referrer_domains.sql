@@ -0,0 +1,53 @@
+-- Referrer domain dimension. The ingest writer (referrer_domains.py)
+-- normalizes each referer to its lower-cased host, upserts it here and
+-- stores the integer id on the page view; the referrer rollups and
+-- reports group by that id instead of parsing referer URLs in SQL.
+--
+-- views counts page views recorded per domain since first_seen and is
+-- not reduced when old page_analytics partitions are dropped.
+
+CREATE TABLE IF NOT EXISTS referrer_domains (
+    id SERIAL PRIMARY KEY,
+    domain VARCHAR(253) NOT NULL UNIQUE,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    views BIGINT NOT NULL DEFAULT 0
+);
+
+ALTER TABLE page_analytics
+    ADD COLUMN IF NOT EXISTS referrer_domain_id INTEGER
+        REFERENCES referrer_domains (id);
+
+-- Backfill existing page views with the same normalization as
+-- analytics_rollups.REFERRER_DOMAIN: the lower-cased host without
+-- userinfo, for hosts within the DNS length limits
+INSERT INTO referrer_domains (domain, first_seen, last_seen, views)
+SELECT domain,
+       MIN(timestamp), MAX(timestamp), COUNT(*)
+FROM (
+    SELECT timestamp, btrim(lower(substring(referer from
+        '^[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^/?#]*@)?(\[[^]/?#]*\]|[^/?#:]+)')),
+        '[]') AS domain
+    FROM page_analytics
+    WHERE referer IS NOT NULL AND referer != '' AND referer != 'Direct'
+) hosts
+WHERE length(domain) <= 253 AND domain !~ '[^.]{64}'
+GROUP BY domain
+ON CONFLICT (domain) DO NOTHING;
+
+UPDATE page_analytics p
+SET referrer_domain_id = d.id
+FROM referrer_domains d
+WHERE p.referrer_domain_id IS NULL
+  AND p.referer IS NOT NULL AND p.referer != '' AND p.referer != 'Direct'
+  AND d.domain = btrim(lower(substring(p.referer from
+        '^[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^/?#]*@)?(\[[^]/?#]*\]|[^/?#:]+)')),
+        '[]');
+
+-- Covers the referrer rollup refresh and the raw rows past the
+-- watermark with index-only scans. page_analytics is partitioned, so
+-- this cascades to every partition.
+CREATE INDEX IF NOT EXISTS idx_page_analytics_referrer_domain
+    ON page_analytics (timestamp, referrer_domain_id)
+    INCLUDE (ip_address)
+    WHERE referrer_domain_id IS NOT NULL;
@@ -0,0 +1,30 @@
+-- User agent dimension. The ingest writer (user_agents.py) stores each
+-- distinct agent once, keyed by sha256(convert_to(user_agent, 'UTF8')),
+-- with its parsed browser/OS/device family and bot verdict, and page
+-- views reference it through user_agent_id.
+--
+-- After applying this file, encode existing page views and print the
+-- storage report with:
+--     python user_agents.py backfill
+-- Hashing and parsing live in Python so backfilled and newly ingested
+-- agents get identical rows.
+
+CREATE TABLE IF NOT EXISTS user_agents (
+    id SERIAL PRIMARY KEY,
+    ua_hash BYTEA NOT NULL UNIQUE,
+    user_agent TEXT NOT NULL,
+    browser_family VARCHAR(50) NOT NULL DEFAULT 'Other',
+    os_family VARCHAR(50) NOT NULL DEFAULT 'Other',
+    device_family VARCHAR(20) NOT NULL DEFAULT 'other',
+    is_bot BOOLEAN NOT NULL DEFAULT FALSE,
+    first_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE page_analytics
+    ADD COLUMN IF NOT EXISTS user_agent_id INTEGER
+        REFERENCES user_agents (id);
+
+-- Lets the backfill find unencoded rows day by day
+CREATE INDEX IF NOT EXISTS idx_page_analytics_user_agent_pending
+    ON page_analytics (timestamp)
+    WHERE user_agent_id IS NULL AND user_agent IS NOT NULL;
@@ -0,0 +1,48 @@
+-- Error groups. The log writer (error_groups.py) fingerprints every
+-- app_log entry that carries a traceback, or an HTTP error status, by
+-- exception type plus normalized frame stack (status, method and path
+-- for HTTP errors). Each distinct fingerprint is stored once here with
+-- its traceback and a sample of the request headers; app_log rows keep
+-- only error_group_id and drop the repeated text.
+--
+-- error_group_occurrences holds one compact row per group per hour, so
+-- the grouped logs view and its trend lines read a bounded number of
+-- rows however many times an error has occurred.
+
+CREATE TABLE IF NOT EXISTS error_groups (
+    id SERIAL PRIMARY KEY,
+    fingerprint CHAR(40) NOT NULL UNIQUE,
+    kind VARCHAR(16) NOT NULL,
+    error_type TEXT NOT NULL,
+    message TEXT NOT NULL,
+    module TEXT,
+    function TEXT,
+    traceback TEXT,
+    sample_extra TEXT,
+    occurrences BIGINT NOT NULL DEFAULT 0,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_error_groups_last_seen
+    ON error_groups (last_seen DESC);
+CREATE INDEX IF NOT EXISTS idx_error_groups_occurrences
+    ON error_groups (occurrences DESC);
+
+CREATE TABLE IF NOT EXISTS error_group_occurrences (
+    group_id INTEGER NOT NULL REFERENCES error_groups (id) ON DELETE CASCADE,
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    occurrences BIGINT NOT NULL DEFAULT 0,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (group_id, hour)
+);
+
+-- app_log is partitioned, so this cascades to every partition
+ALTER TABLE app_log
+    ADD COLUMN IF NOT EXISTS error_group_id INTEGER
+        REFERENCES error_groups (id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS idx_app_log_error_group
+    ON app_log (error_group_id, timestamp DESC)
+    WHERE error_group_id IS NOT NULL;
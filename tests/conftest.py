@@ -5,6 +5,7 @@ import os
 import sys
 import pytest
 import asyncio
+import tempfile
 from typing import AsyncGenerator, Generator
 from unittest.mock import AsyncMock
 
@@ -22,7 +23,9 @@ os.environ.update({
     'SESSION_SECRET_KEY': 'test-session-secret',
     'GOOGLE_CLIENT_ID': 'test-google-client-id',
     'GOOGLE_CLIENT_SECRET': 'test-google-client-secret',
-    'AUTHORIZED_EMAILS': 'test@example.com,admin@blackburnsystems.com'
+    'AUTHORIZED_EMAILS': 'test@example.com,admin@blackburnsystems.com',
+    # Spools created at import time must never write into the working tree
+    'SPOOL_DIR': tempfile.mkdtemp(prefix='portfolio-spool-')
 })
 
 # Import application modules after setting environment
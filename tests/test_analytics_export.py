@@ -0,0 +1,99 @@
+"""
+Tests for the streaming analytics export.
+"""
+import csv
+import gzip
+import io
+import json
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from analytics_export import (
+    BATCH_ROWS, EXPORT_COLUMNS, build_export_query, export_rows, gzip_stream
+)
+
+
+def make_row(i):
+    row = {column: None for column in EXPORT_COLUMNS}
+    row.update(id=i, page_path=f'/p{i}', ip_address='203.0.113.10',
+               timestamp=datetime(2026, 10, 1, tzinfo=timezone.utc))
+    return row
+
+
+class FakeDatabase:
+    """Yields rows one at a time like a server-side cursor."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    async def iterate(self, query, values=None):
+        self.calls.append((query, values))
+        for row in self.rows:
+            yield row
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.unit
+class TestExportQuery:
+    """Test filter handling in the export query."""
+
+    def test_filters_become_bind_params(self):
+        query, params = build_export_query(
+            datetime(2026, 10, 1), datetime(2026, 10, 2),
+            page_path='/about', visitor_type='human',
+            ip_address='203.0.113.0/24')
+
+        assert query.endswith('ORDER BY timestamp, id')
+        assert 'ip_address <<= CAST(:ip_address AS INET)' in query
+        assert params['ip_address'] == '203.0.113.0/24'
+        assert params['page_path'] == '/about'
+        assert 'until' in params
+
+    def test_rejects_invalid_ip(self):
+        with pytest.raises(ValueError):
+            build_export_query(datetime(2026, 10, 1),
+                               ip_address="1.2.3.4' OR 1=1")
+
+
+@pytest.mark.unit
+class TestExportStream:
+    """Test encoding, batching and compression of the stream."""
+
+    async def test_ndjson_is_batched(self):
+        fake = FakeDatabase([make_row(i) for i in range(BATCH_ROWS + 1)])
+        with patch('analytics_export.database', fake):
+            chunks = await collect(export_rows('SELECT', {}, 'ndjson'))
+
+        assert len(chunks) == 2
+        lines = b''.join(chunks).decode().splitlines()
+        assert len(lines) == BATCH_ROWS + 1
+        first = json.loads(lines[0])
+        assert first['timestamp'] == '2026-10-01T00:00:00+00:00'
+        assert list(first) == list(EXPORT_COLUMNS)
+
+    async def test_csv_has_header_and_neutralizes_formulas(self):
+        row = make_row(1)
+        row['user_agent'] = '=HYPERLINK("http://evil")'
+        fake = FakeDatabase([row])
+        with patch('analytics_export.database', fake):
+            chunks = await collect(export_rows('SELECT', {}, 'csv'))
+
+        records = list(csv.reader(io.StringIO(b''.join(chunks).decode())))
+        assert records[0] == list(EXPORT_COLUMNS)
+        agent = records[1][EXPORT_COLUMNS.index('user_agent')]
+        assert agent.startswith("'=")
+
+    async def test_gzip_stream_decompresses(self):
+        fake = FakeDatabase([make_row(i) for i in range(10)])
+        with patch('analytics_export.database', fake):
+            plain = b''.join(await collect(
+                export_rows('SELECT', {}, 'ndjson')))
+            compressed = b''.join(await collect(
+                gzip_stream(export_rows('SELECT', {}, 'ndjson'))))
+
+        assert gzip.decompress(compressed) == plain
@@ -0,0 +1,126 @@
+"""
+Tests for the live analytics feed ring buffer.
+"""
+import asyncio
+import json
+import pytest
+from datetime import datetime
+
+from analytics_feed import AnalyticsFeed, event_filter
+from live_feed import format_sse
+
+
+def make_row(path='/', visitor_type='pending'):
+    return {'timestamp': datetime(2026, 10, 16, 12, 0), 'page_path': path,
+            'ip_address': '203.0.113.10', 'visitor_type': visitor_type,
+            'referer': 'https://github.com/x'}
+
+
+def frame_data(frame):
+    return json.loads(frame.split('data: ', 1)[1])
+
+
+async def never_disconnected():
+    return False
+
+
+@pytest.mark.unit
+class TestAnalyticsFeed:
+    """Test publishing, filtering and slow-reader handling."""
+
+    def test_format_sse(self):
+        frame = format_sse({'a': 1}, event='pageview', event_id=7)
+        assert frame == 'id: 7\nevent: pageview\ndata: {"a":1}\n\n'
+
+    def test_ring_is_bounded_and_reports_missed(self):
+        feed = AnalyticsFeed(size=3)
+        feed.publish([make_row(f'/{i}') for i in range(5)])
+
+        missed, events = feed.read_after(0)
+        assert missed == 2
+        assert [seq for seq, _ in events] == [3, 4, 5]
+        assert events[0][1]['referrer'] == 'github.com'
+        assert events[0][1]['timestamp'].endswith('+00:00')
+        assert feed.read_after(5) == (0, [])
+
+    def test_filter_by_prefix_and_type(self):
+        matches = event_filter('/blog', ['human', 'bot'])
+        assert matches({'page_path': '/blog/a', 'visitor_type': 'human'})
+        assert not matches({'page_path': '/blog/a', 'visitor_type': 'pending'})
+        assert not matches({'page_path': '/work', 'visitor_type': 'bot'})
+        assert event_filter(None, [''])({'page_path': '/', 'visitor_type': ''})
+
+    async def test_subscriber_receives_matching_events(self):
+        feed = AnalyticsFeed(size=10, heartbeat=5)
+        stream = feed.subscribe(event_filter('/blog'), never_disconnected)
+
+        assert await stream.__anext__() == 'retry: 3000\n\n'
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        feed.publish([make_row('/work'), make_row('/blog/post')])
+
+        frame = await asyncio.wait_for(pending, timeout=1)
+        assert frame.startswith('id: 2\nevent: pageview\n')
+        assert frame_data(frame)['page_path'] == '/blog/post'
+        await stream.aclose()
+
+    def test_response_enforces_the_cap_before_streaming(self):
+        feed = AnalyticsFeed(max_clients=2)
+
+        # Concurrent connects reserve before any stream has started
+        responses = [feed.response(feed.subscribe(event_filter(),
+                                                  never_disconnected))
+                     for _ in range(3)]
+
+        assert [r is not None for r in responses] == [True, True, False]
+        assert responses[0].media_type == 'text/event-stream'
+        responses[0].release()
+        responses[0].release()
+        assert feed.clients == 1
+
+    async def test_slot_is_released_when_the_body_never_starts(self):
+        feed = AnalyticsFeed(max_clients=1)
+        response = feed.response(feed.subscribe(event_filter(),
+                                                never_disconnected))
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            # The client is gone before the response starts
+            await asyncio.Event().wait()
+
+        await response({'type': 'http'}, receive, send)
+
+        assert feed.clients == 0
+        assert feed.response(feed.subscribe(event_filter(),
+                                            never_disconnected))
+
+    async def test_slot_is_released_when_sending_fails(self):
+        feed = AnalyticsFeed(max_clients=1)
+        response = feed.response(feed.subscribe(event_filter(),
+                                                never_disconnected))
+
+        async def send(message):
+            raise OSError("connection reset")
+
+        with pytest.raises(Exception):
+            await response({'type': 'http', 'asgi': {'spec_version': '2.4'}},
+                           never_disconnected, send)
+
+        assert feed.clients == 0
+
+    async def test_slow_reader_skips_ahead(self):
+        feed = AnalyticsFeed(size=2, heartbeat=5)
+        feed.publish([make_row('/old')])
+        stream = feed.subscribe(event_filter(), never_disconnected,
+                                last_event_id=0)
+        await stream.__anext__()
+
+        # Reader was away while four more views arrived
+        feed.publish([make_row(f'/{i}') for i in range(4)])
+        skipped = await stream.__anext__()
+        assert skipped.startswith('event: skipped')
+        assert frame_data(skipped) == {'missed': 3}
+        assert frame_data(await stream.__anext__())['page_path'] == '/2'
+        await stream.aclose()
@@ -0,0 +1,206 @@
+"""
+Tests for the buffered page view ingestion pipeline.
+"""
+import asyncpg
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+from analytics_ingest import (
+    MouseActivityQueue, PageViewIngestQueue, build_multi_row_insert
+)
+from spool import CircuitBreaker, Spool
+
+
+def make_event(path="/", view_token=None):
+    return {
+        'timestamp': datetime.utcnow(),
+        'page_path': path,
+        'ip_address': '203.0.113.10',
+        'user_agent': 'Mozilla/5.0',
+        'referer': '',
+        'view_token': view_token
+    }
+
+
+def spool_in(tmp_path):
+    return patch('analytics_ingest.page_view_spool',
+                 Spool('page_analytics', directory=str(tmp_path)))
+
+
+@pytest.mark.unit
+class TestPageViewIngestQueue:
+    """Test queue bounds, overflow policies and batching."""
+
+    def test_drop_newest_rejects_when_full(self):
+        queue = PageViewIngestQueue(max_size=2, batch_size=10,
+                                    overflow_policy='drop_newest')
+        assert queue.enqueue(make_event('/a'))
+        assert queue.enqueue(make_event('/b'))
+        assert not queue.enqueue(make_event('/c'))
+
+        assert len(queue) == 2
+        assert queue.counters['queued'] == 2
+        assert queue.counters['dropped'] == 1
+
+    def test_drop_oldest_keeps_latest_events(self):
+        queue = PageViewIngestQueue(max_size=2, batch_size=10,
+                                    overflow_policy='drop_oldest')
+        for path in ('/a', '/b', '/c'):
+            queue.enqueue(make_event(path))
+
+        paths = [event['page_path'] for event in queue._buffer]
+        assert paths == ['/b', '/c']
+        assert queue.counters['dropped'] == 1
+
+    def test_build_multi_row_insert(self):
+        query, values = build_multi_row_insert(
+            'page_analytics', ('page_path', 'ip_address'),
+            [{'page_path': '/a', 'ip_address': '1.1.1.1'},
+             {'page_path': '/b', 'ip_address': '2.2.2.2'}]
+        )
+        assert query.count('(:page_path_') == 2
+        assert values['page_path_1'] == '/b'
+        assert values['ip_address_0'] == '1.1.1.1'
+
+    @patch('analytics_ingest.user_agents')
+    @patch('analytics_ingest.database')
+    async def test_stop_drains_in_batches(self, mock_db, mock_agents,
+                                          tmp_path):
+        mock_db.execute = AsyncMock(return_value=None)
+        mock_agents.assign = AsyncMock()
+        queue = PageViewIngestQueue(max_size=100, batch_size=2)
+        queue._enrich = AsyncMock(side_effect=lambda batch: batch)
+
+        for i in range(5):
+            queue.enqueue(make_event(f"/{i}"))
+        with spool_in(tmp_path):
+            await queue.stop()
+
+        assert len(queue) == 0
+        assert mock_db.execute.call_count == 3
+        assert queue.counters['flushed'] == 5
+        assert not queue.enqueue(make_event())
+
+    @patch('analytics_ingest.analytics_feed')
+    @patch('analytics_ingest.heavy_hitters')
+    @patch('analytics_ingest.visitor_sketches')
+    @patch('analytics_ingest.page_view_spool')
+    async def test_failed_write_is_spooled(self, mock_spool, mock_sketches,
+                                           mock_hitters, mock_feed):
+        mock_spool.append.return_value = 2
+        queue = PageViewIngestQueue(max_size=10, batch_size=10)
+        queue._enrich = AsyncMock(side_effect=lambda batch: batch)
+        queue._write_rows = AsyncMock(side_effect=OSError("down"))
+        queue.enqueue(make_event('/a'))
+        queue.enqueue(make_event('/b'))
+
+        with patch('analytics_ingest.database_breaker',
+                   CircuitBreaker(failure_threshold=1, reset_timeout=60)
+                   ) as breaker:
+            assert await queue.flush()
+            queue.enqueue(make_event('/c'))
+            assert await queue.flush()
+
+        # The second batch skipped the database entirely
+        queue._write_rows.assert_awaited_once()
+        assert mock_spool.append.call_count == 2
+        assert breaker.state == 'open'
+        assert queue.counters['spooled'] == 4
+        assert queue.counters['failed'] == 0
+        mock_sketches.observe.assert_called()
+
+    @patch('analytics_ingest.analytics_feed')
+    @patch('analytics_ingest.heavy_hitters')
+    @patch('analytics_ingest.visitor_sketches')
+    @patch('analytics_ingest.page_view_spool')
+    async def test_rejected_row_is_dropped_alone(self, mock_spool,
+                                                 mock_sketches, mock_hitters,
+                                                 mock_feed):
+        async def write(rows):
+            if any(row['page_path'] == '/bad' for row in rows):
+                raise asyncpg.DataError("value too long")
+
+        queue = PageViewIngestQueue(max_size=10, batch_size=10)
+        queue._enrich = AsyncMock(side_effect=lambda batch: batch)
+        queue._write_rows = AsyncMock(side_effect=write)
+        for path in ('/a', '/bad', '/c'):
+            queue.enqueue(make_event(path))
+
+        with patch('analytics_ingest.database_breaker',
+                   CircuitBreaker(failure_threshold=1)) as breaker:
+            assert await queue.flush()
+
+        mock_spool.append.assert_not_called()
+        assert breaker.state == 'closed'
+        assert queue.counters['flushed'] == 2
+        assert queue.counters['rejected'] == 1
+        observed = mock_sketches.observe.call_args[0][0]
+        assert [row['page_path'] for row in observed] == ['/a', '/c']
+
+
+@pytest.mark.unit
+class TestMouseActivityQueue:
+    """Test that beacons are applied by token without per-event scans."""
+
+    def test_buffered_view_is_flagged_in_memory(self):
+        page_views = PageViewIngestQueue(max_size=10, batch_size=10)
+        page_views.enqueue(make_event('/a', view_token='tok-a'))
+        beacons = MouseActivityQueue(page_views)
+
+        assert beacons.enqueue('tok-a')
+        assert page_views._buffer[0]['mouse_activity'] is True
+        assert beacons.stats()['pending'] == 0
+
+    @patch('analytics_ingest.visitor_sketches')
+    @patch('analytics_ingest.database')
+    async def test_flush_updates_by_id_then_token(self, mock_db,
+                                                  mock_sketches):
+        by_id = [{'ip_address': '203.0.113.10',
+                  'timestamp': datetime.utcnow()}]
+        by_token = [{'view_token': 'tok-b', 'ip_address': '203.0.113.11',
+                     'timestamp': datetime.utcnow()}]
+        mock_db.fetch_all = AsyncMock(side_effect=[by_id, by_token])
+        page_views = PageViewIngestQueue(max_size=10, batch_size=10)
+        page_views.view_ids.set('tok-a', 41)
+        beacons = MouseActivityQueue(page_views)
+
+        for token in ('tok-a', 'tok-b', 'tok-a', 'tok-c'):
+            beacons.enqueue(token)
+        assert await beacons.flush()
+
+        id_call, token_call = mock_db.fetch_all.call_args_list
+        assert id_call[0][1]['ids'] == [41]
+        assert 'timestamp >= :since' in id_call[0][0]
+        assert sorted(token_call[0][1]['tokens']) == ['tok-b', 'tok-c']
+        # Both updates feed the human sketches
+        assert mock_sketches.observe_activity.call_count == 2
+        # tok-c matched nothing yet and is retried on the next flush
+        assert list(beacons._pending) == ['tok-c']
+
+    @patch('analytics_ingest.database')
+    async def test_unmatched_tokens_expire(self, mock_db):
+        mock_db.fetch_all = AsyncMock(return_value=[])
+        beacons = MouseActivityQueue(
+            PageViewIngestQueue(max_size=10), max_attempts=2)
+        beacons.enqueue('tok-x')
+
+        await beacons.flush()
+        await beacons.flush()
+
+        assert beacons.stats()['pending'] == 0
+        assert beacons.counters['expired'] == 1
+
+    @patch('analytics_ingest.user_agents')
+    @patch('analytics_ingest.database')
+    async def test_written_rows_register_view_ids(self, mock_db,
+                                                  mock_agents):
+        mock_db.fetch_all = AsyncMock(
+            return_value=[{'id': 7, 'view_token': 'tok-a'}])
+        mock_agents.assign = AsyncMock()
+        queue = PageViewIngestQueue(max_size=10)
+
+        await queue._write_rows([make_event('/a', view_token='tok-a')])
+
+        assert 'RETURNING id, view_token' in mock_db.fetch_all.call_args[0][0]
+        assert queue.view_ids.get('tok-a') == 7
@@ -0,0 +1,149 @@
+"""
+Tests for recent-visits keyset cursors in analytics.
+"""
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+from analytics import Analytics, encode_cursor, decode_cursor
+
+
+@pytest.mark.unit
+class TestCursors:
+    """Test cursor round trips and validation."""
+
+    def test_timestamp_round_trip(self):
+        value = datetime(2026, 10, 1, 12, 30, 5, 123456, tzinfo=timezone.utc)
+        cursor = encode_cursor('timestamp', 'desc', value, 42)
+        assert '=' not in cursor
+        assert decode_cursor(cursor, 'timestamp', 'desc') == (value, 42)
+
+    def test_text_round_trip(self):
+        cursor = encode_cursor('user_agent', 'asc', 'Mozilla/5.0 "x"', 7)
+        assert decode_cursor(cursor, 'user_agent', 'asc') == (
+            'Mozilla/5.0 "x"', 7)
+
+    def test_rejects_cursor_for_other_sort(self):
+        cursor = encode_cursor('page_path', 'asc', '/about', 3)
+        with pytest.raises(ValueError):
+            decode_cursor(cursor, 'page_path', 'desc')
+        with pytest.raises(ValueError):
+            decode_cursor(cursor, 'referer', 'asc')
+
+    def test_rejects_garbage(self):
+        with pytest.raises(ValueError):
+            decode_cursor('not-a-cursor!', 'timestamp', 'desc')
+
+
+@pytest.mark.unit
+class TestRecentVisitsPagination:
+    """Test that pages are keyed on the last row instead of an offset."""
+
+    def _rows(self, count, start_id=100):
+        return [
+            {'id': start_id - i, 'timestamp': datetime(
+                2026, 10, 1, 12, i, tzinfo=timezone.utc),
+             'page_path': '/', 'sort_value': f'/p{i}'}
+            for i in range(count)
+        ]
+
+    async def test_next_cursor_points_at_last_returned_row(self):
+        analytics = Analytics()
+        rows = self._rows(4)
+        with patch('analytics.database') as db:
+            db.fetch_all = AsyncMock(return_value=rows)
+            db.fetch_one = AsyncMock(return_value={'total': 4})
+            result = await analytics.get_recent_visits_paginated(
+                limit=3, sort_field='page_path', sort_order='asc')
+
+        assert result['has_more'] is True
+        assert len(result['visits']) == 3
+        assert 'sort_value' not in result['visits'][0]
+        assert decode_cursor(result['next_cursor'], 'page_path', 'asc') == (
+            '/p2', 98)
+        assert result['total_count'] == 4
+        assert result['total_is_estimate'] is False
+
+    async def test_cursor_page_skips_offset_and_count(self):
+        analytics = Analytics()
+        cursor = encode_cursor('page_path', 'asc', '/p2', 98)
+        with patch('analytics.database') as db:
+            db.fetch_all = AsyncMock(return_value=self._rows(1))
+            db.fetch_one = AsyncMock()
+            result = await analytics.get_recent_visits_paginated(
+                limit=3, sort_field='page_path', sort_order='asc',
+                cursor=cursor)
+
+        query, params = db.fetch_all.call_args[0]
+        assert 'OFFSET' not in query
+        assert '(page_path, id) > (:cursor_value, :cursor_id)' in query
+        assert params['cursor_value'] == '/p2'
+        assert params['cursor_id'] == 98
+        db.fetch_one.assert_not_called()
+        assert result['has_more'] is False
+        assert result['next_cursor'] is None
+        assert result['total_count'] is None
+
+    async def test_total_falls_back_to_estimate_at_cap(self):
+        analytics = Analytics()
+        analytics.count_cap = 10
+        plan = '[{"Plan": {"Plan Rows": 123456}}]'
+        with patch('analytics.database') as db:
+            db.fetch_all = AsyncMock(return_value=[])
+            db.fetch_one = AsyncMock(side_effect=[{'total': 10}, (plan,)])
+            result = await analytics.get_recent_visits_paginated()
+
+        assert result['total_count'] == 123456
+        assert result['total_is_estimate'] is True
+
+
+@pytest.mark.unit
+class TestUniqueVisitorsPagination:
+    """Test that unique visitors come back in bounded keyset pages."""
+
+    @patch('analytics.visitor_sketches')
+    @patch('analytics.analytics_rollups')
+    async def test_first_page_is_bounded(self, mock_rollups, mock_sketches):
+        mock_rollups.source_sql = AsyncMock(return_value=('(visitors)', {}))
+        mock_sketches.estimate = AsyncMock(
+            return_value={('all', ''): 1234})
+        rows = [{'ip_address': f'203.0.113.{i}', 'total_views': 10 - i}
+                for i in range(3)]
+        last_visit = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+        with patch('analytics.database') as db:
+            db.fetch_all = AsyncMock(side_effect=[
+                rows, [{'ip_address': '203.0.113.0',
+                        'last_visit': last_visit}]])
+            result = await Analytics().get_unique_visitors(days=7, limit=2)
+
+        query, params = db.fetch_all.call_args_list[0][0]
+        assert params['limit'] == 3
+        assert 'HAVING' not in query
+        assert len(result['visitors']) == 2
+        assert result['visitors'][0]['last_visit'] == '2026-10-01 12:00:00'
+        assert result['visitors'][1]['last_visit'] is None
+        assert result['has_more'] is True
+        assert result['total_unique'] == 1234
+        assert result['total_is_estimate'] is True
+        assert decode_cursor(result['next_cursor'], 'total_views',
+                             'desc')[0] == [9, '203.0.113.1']
+
+    @patch('analytics.visitor_sketches')
+    @patch('analytics.analytics_rollups')
+    async def test_cursor_page_continues_after_last_ip(self, mock_rollups,
+                                                       mock_sketches):
+        mock_rollups.source_sql = AsyncMock(return_value=('(visitors)', {}))
+        mock_sketches.estimate = AsyncMock()
+        cursor = encode_cursor('total_views', 'desc', [9, '203.0.113.1'], 0)
+        with patch('analytics.database') as db:
+            db.fetch_all = AsyncMock(return_value=[])
+            result = await Analytics().get_unique_visitors(
+                days=7, limit=10000, cursor=cursor)
+
+        query, params = db.fetch_all.call_args[0]
+        assert 'HAVING' in query
+        assert params['cursor_views'] == 9
+        assert params['cursor_ip'] == '203.0.113.1'
+        assert params['limit'] == 501
+        assert result['total_unique'] is None
+        mock_sketches.estimate.assert_not_awaited()
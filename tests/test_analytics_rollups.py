@@ -0,0 +1,56 @@
+"""
+Tests for rollup range selection in analytics_rollups.
+"""
+import pytest
+from datetime import datetime, timezone
+
+from analytics_rollups import build_source_sql
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.unit
+class TestBuildSourceSql:
+    """Test that rollup and raw ranges tile the window without overlap."""
+
+    def test_without_watermark_reads_raw_rows_only(self):
+        since = utc(2026, 10, 1, 12, 30)
+        sql, params = build_source_sql('pages', since, None)
+        assert 'analytics_hourly_pages' not in sql
+        assert 'analytics_daily_pages' not in sql
+        assert params == {'pages_raw_start': since}
+
+    def test_multi_day_window_uses_daily_buckets(self):
+        since = utc(2026, 10, 1, 12, 30)
+        watermark = utc(2026, 10, 5, 9)
+        sql, params = build_source_sql('visitors', since, watermark)
+
+        assert sql.count('analytics_hourly_visitors') == 2
+        assert sql.count('analytics_daily_visitors') == 1
+        assert params['visitors_start_0'] == utc(2026, 10, 1, 12)
+        assert params['visitors_end_0'] == utc(2026, 10, 2)
+        assert params['visitors_start_1'] == utc(2026, 10, 2)
+        assert params['visitors_end_1'] == utc(2026, 10, 5)
+        assert params['visitors_start_2'] == utc(2026, 10, 5)
+        assert params['visitors_end_2'] == watermark
+        assert params['visitors_raw_start'] == watermark
+
+    def test_same_day_window_uses_hourly_only(self):
+        since = utc(2026, 10, 5, 3, 15)
+        watermark = utc(2026, 10, 5, 9)
+        sql, params = build_source_sql('referrers', since, watermark)
+
+        assert 'analytics_daily_referrers' not in sql
+        assert params['referrers_start_0'] == utc(2026, 10, 5, 3)
+        assert params['referrers_end_0'] == watermark
+
+    def test_day_aligned_window_skips_empty_hourly_range(self):
+        since = utc(2026, 10, 1)
+        watermark = utc(2026, 10, 3)
+        sql, params = build_source_sql('pages', since, watermark)
+
+        assert 'analytics_hourly_pages' not in sql
+        assert params['pages_start_1'] == since
+        assert params['pages_end_1'] == watermark
@@ -0,0 +1,41 @@
+"""
+Tests for the compiled CIDR matcher.
+"""
+import pytest
+
+from cidr_matcher import CIDRMatcher, load_networks_file
+
+
+@pytest.mark.unit
+class TestCIDRMatcher:
+    """Test interval merging and IPv4/IPv6 membership."""
+
+    def test_membership(self):
+        matcher = CIDRMatcher(['66.249.64.0/19', '2001:4860::/32'])
+        assert matcher.contains('66.249.66.1')
+        assert not matcher.contains('66.249.96.0')
+        assert matcher.contains('2001:4860:4860::8888')
+        assert not matcher.contains('2001:db8::1')
+        assert not matcher.contains('garbage')
+
+    def test_overlapping_and_adjacent_ranges_merge(self):
+        matcher = CIDRMatcher([
+            '10.0.0.0/24', '10.0.1.0/24', '10.0.0.128/25', '52.0.0.0/8'
+        ])
+        assert matcher.v4_starts == [0x0A000000, 0x34000000]
+        assert matcher.contains('10.0.1.255')
+        assert not matcher.contains('10.0.2.0')
+
+    def test_invalid_entries_are_skipped(self):
+        matcher = CIDRMatcher(['not-a-network', '192.0.2.0/24'])
+        assert matcher.invalid == ['not-a-network']
+        assert matcher.contains('192.0.2.10')
+
+    def test_load_networks_file(self, tmp_path):
+        path = tmp_path / "networks.txt"
+        path.write_text("# crawler ranges\n66.249.64.0/19  # googlebot\n\n"
+                        "157.55.39.0/24\n")
+        assert load_networks_file(str(path)) == [
+            '66.249.64.0/19', '157.55.39.0/24'
+        ]
+        assert load_networks_file(str(tmp_path / "missing.txt")) == []
@@ -0,0 +1,81 @@
+"""
+Tests for the non-blocking reverse DNS resolver.
+"""
+import asyncio
+import socket
+import time
+import pytest
+from unittest.mock import patch
+
+from dns_resolver import AsyncDNSResolver, claimed_crawler
+
+
+@pytest.mark.unit
+class TestAsyncDNSResolver:
+    """Test caching, coalescing, timeouts and crawler verification."""
+
+    async def test_concurrent_lookups_are_coalesced(self):
+        resolver = AsyncDNSResolver(timeout=2.0)
+        calls = []
+
+        def slow_lookup(ip):
+            calls.append(ip)
+            time.sleep(0.05)
+            return ('Crawl-66-249-66-1.GoogleBot.com', [], [ip])
+
+        with patch('dns_resolver.socket.gethostbyaddr', slow_lookup):
+            results = await asyncio.gather(
+                *(resolver.reverse('66.249.66.1') for _ in range(5))
+            )
+            cached = await resolver.reverse('66.249.66.1')
+
+        assert len(calls) == 1
+        assert set(results) == {'crawl-66-249-66-1.googlebot.com'}
+        assert cached == 'crawl-66-249-66-1.googlebot.com'
+        assert resolver.counters['coalesced'] == 4
+
+    async def test_negative_results_are_cached(self):
+        resolver = AsyncDNSResolver()
+        calls = []
+
+        def failing_lookup(ip):
+            calls.append(ip)
+            raise socket.herror("no PTR")
+
+        with patch('dns_resolver.socket.gethostbyaddr', failing_lookup):
+            assert await resolver.reverse('198.51.100.7') is None
+            assert await resolver.reverse('198.51.100.7') is None
+
+        assert len(calls) == 1
+
+    async def test_timeout_budget(self):
+        resolver = AsyncDNSResolver(timeout=0.05)
+
+        def hanging_lookup(ip):
+            time.sleep(0.3)
+            return ('late.example.com', [], [ip])
+
+        with patch('dns_resolver.socket.gethostbyaddr', hanging_lookup):
+            assert await resolver.reverse('192.0.2.1') is None
+        assert resolver.counters['timeouts'] == 1
+
+    async def test_verify_crawler_requires_forward_match(self):
+        resolver = AsyncDNSResolver()
+
+        async def confirms(hostname, ip):
+            return ip == '66.249.66.1'
+
+        resolver.forward_confirms = confirms
+        assert await resolver.verify_crawler(
+            '66.249.66.1', 'crawl-66-249-66-1.googlebot.com') == 'googlebot'
+        assert await resolver.verify_crawler(
+            '203.0.113.9', 'fake.googlebot.com') is None
+        assert await resolver.verify_crawler(
+            '203.0.113.10', 'host.example.net') is None
+
+    def test_claimed_crawler(self):
+        assert claimed_crawler(
+            'Mozilla/5.0 (compatible; Googlebot/2.1)') == 'googlebot'
+        assert claimed_crawler('Mozilla/5.0 (compatible; bingbot/2.0)') \
+            == 'bingbot'
+        assert claimed_crawler('Mozilla/5.0 (X11; Linux x86_64)') is None
@@ -0,0 +1,186 @@
+"""
+Tests for error fingerprinting and grouped traceback storage.
+"""
+import json
+import os
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from error_groups import (
+    ErrorGroups, compact, exception_type, fingerprint_entry, frame_stack,
+    normalize_url_path
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_traceback(prefix="/srv/app", line=42, error="ValueError: bad id 7"):
+    return (
+        "Traceback (most recent call last):\n"
+        f'  File "{prefix}/lib/python3.11/site-packages/starlette/routing.py",'
+        f" line 677, in __call__\n"
+        "    await route.handle(scope, receive, send)\n"
+        f'  File "{ROOT}/analytics.py", line {line}, in get_summary\n'
+        "    raise ValueError(message)\n"
+        f"{error}\n"
+    )
+
+
+def error_entry(message="boom", **overrides):
+    entry = {
+        'timestamp': datetime(2026, 5, 1, 12, 30),
+        'level': 'ERROR',
+        'message': message,
+        'module': 'global_exception_handler',
+        'function': 'global_exception_handler',
+        'extra': json.dumps({'error_id': 'abc',
+                             'request_headers': {'user-agent': 'x'}}),
+        'traceback': make_traceback()
+    }
+    entry.update(overrides)
+    return entry
+
+
+def mock_database(ids):
+    db = MagicMock()
+    db.fetch_all = AsyncMock(return_value=[
+        {'id': group_id, 'fingerprint': fingerprint}
+        for fingerprint, group_id in ids.items()
+    ])
+    db.execute = AsyncMock(return_value=None)
+    return db
+
+
+@pytest.mark.unit
+class TestFingerprints:
+    """Test which differences split a group."""
+
+    def test_frames_drop_line_numbers_and_install_prefixes(self):
+        frames = frame_stack(make_traceback())
+
+        assert frames[0] == 'starlette/routing.py:__call__'
+        assert frames[1] == 'analytics.py:get_summary'
+        assert exception_type(make_traceback()) == 'ValueError'
+
+    def test_same_stack_shares_a_fingerprint(self):
+        first = fingerprint_entry(error_entry())
+        moved = fingerprint_entry(error_entry(
+            message='other', traceback=make_traceback(
+                prefix='/opt/venv', line=99,
+                error='ValueError: bad id 8')))
+
+        assert first == moved
+        assert first[1:] == ('exception', 'ValueError')
+
+    def test_exception_type_splits_groups(self):
+        first = fingerprint_entry(error_entry())
+        other = fingerprint_entry(error_entry(
+            traceback=make_traceback(error='KeyError: 7')))
+
+        assert first[0] != other[0]
+
+    def test_http_errors_mask_ids_in_paths(self):
+        def http_entry(url):
+            return {
+                'message': 'not found',
+                'function': 'log_non_200_responses',
+                'extra': json.dumps({'status_code': 404, 'method': 'GET',
+                                     'url': url})
+            }
+
+        first = fingerprint_entry(http_entry('https://x.test/projects/12'))
+        second = fingerprint_entry(http_entry('https://x.test/projects/34'))
+
+        assert first == second
+        assert first[2] == 'HTTP 404'
+        assert normalize_url_path(
+            'https://x.test/a/0d8e7a5c-4b1f-4c4e-9f0a-1b2c3d4e5f60?q=1'
+        ) == '/a/:id'
+
+    def test_plain_entries_are_not_grouped(self):
+        assert fingerprint_entry({'message': 'hi', 'extra': None}) is None
+        assert fingerprint_entry(
+            {'message': 'ok', 'extra': json.dumps({'status_code': 302})}
+        ) is None
+
+    def test_compact_moves_headers_to_the_group(self):
+        row = compact(error_entry(), 5)
+
+        assert row['traceback'] is None
+        assert row['error_group_id'] == 5
+        assert json.loads(row['extra']) == {'error_id': 'abc'}
+
+
+@pytest.mark.unit
+class TestErrorGroups:
+    """Test the batched group upsert."""
+
+    async def test_batch_upserts_each_group_once(self):
+        entries = [error_entry(), error_entry(),
+                   {'message': 'info', 'level': 'INFO'}]
+        fingerprint = fingerprint_entry(entries[0])[0]
+        db = mock_database({fingerprint: 9})
+        groups = ErrorGroups()
+
+        with patch('database.database', db):
+            rows = await groups.group(entries)
+
+        db.fetch_all.assert_awaited_once()
+        values = db.fetch_all.call_args[0][1]
+        assert values['fingerprints'] == [fingerprint]
+        assert values['occurrences'] == [2]
+        assert values['tracebacks'] == [make_traceback()]
+        assert json.loads(values['samples'][0]) == {
+            'request_headers': {'user-agent': 'x'}}
+
+        hours = db.execute.call_args[0][1]
+        assert hours['group_ids'] == [9]
+        assert hours['hours'] == [datetime(2026, 5, 1, 12)]
+        assert hours['occurrences'] == [2]
+
+        assert [row.get('error_group_id') for row in rows] == [9, 9, None]
+        assert rows[0]['traceback'] is None
+        # The originals still carry their tracebacks for the spool
+        assert entries[0]['traceback'] == make_traceback()
+        assert groups.counters['grouped'] == 2
+
+    async def test_batch_without_errors_skips_the_database(self):
+        db = mock_database({})
+        entries = [{'message': 'info', 'level': 'INFO'}]
+
+        with patch('database.database', db):
+            rows = await ErrorGroups().group(entries)
+
+        assert rows is entries
+        db.fetch_all.assert_not_called()
+        db.execute.assert_not_called()
+
+    async def test_suppressed_occurrences_join_the_next_upsert(self):
+        fingerprint = fingerprint_entry(error_entry())[0]
+        db = mock_database({fingerprint: 9})
+        groups = ErrorGroups()
+        for _ in range(3):
+            assert groups.count_suppressed(error_entry())
+        assert not groups.count_suppressed({'message': 'info'})
+
+        pending = groups.take_suppressed()
+        groups.restore_suppressed(pending)
+        pending = groups.take_suppressed()
+        with patch('database.database', db):
+            rows = await groups.group([{'message': 'info'}], pending)
+
+        assert rows[0].get('error_group_id') is None
+        assert db.fetch_all.call_args[0][1]['occurrences'] == [3]
+        assert db.execute.call_args[0][1]['occurrences'] == [3]
+        assert groups.take_suppressed() == ({}, {})
+        # Restoring left the counts handed to the write untouched
+        assert pending[0][fingerprint]['occurrences'] == 3
+
+    def test_pending_groups_are_bounded(self):
+        groups = ErrorGroups(max_pending=1)
+
+        assert groups.count_suppressed(error_entry())
+        assert not groups.count_suppressed(
+            error_entry(traceback=make_traceback(error="KeyError: 'x'")))
+        assert groups.counters['uncounted'] == 1
@@ -0,0 +1,226 @@
+"""
+Tests for the in-memory top-K tracker.
+"""
+import pytest
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+
+from analytics_rollups import floor_hour
+from heavy_hitters import (
+    CountMinSketch, HeavyHitters, SpaceSaving, row_keys
+)
+
+
+def view(page_path='/', ip='10.0.0.1', referer=None, timestamp=None):
+    return {
+        'timestamp': timestamp or datetime.now(timezone.utc),
+        'page_path': page_path,
+        'ip_address': ip,
+        'referer': referer
+    }
+
+
+def zipf_stream(keys, total):
+    """Deterministic skewed stream: key i appears about total/(i+1)
+    times, interleaved."""
+    weights = [total // (i + 1) for i in range(keys)]
+    stream = []
+    while any(weights):
+        for i, remaining in enumerate(weights):
+            if remaining:
+                stream.append(f"/page/{i}")
+                weights[i] -= 1
+    return stream
+
+
+@pytest.mark.unit
+class TestSpaceSaving:
+    """Test the stream-summary bookkeeping and its guarantees."""
+
+    def test_exact_below_capacity(self):
+        summary = SpaceSaving(10)
+        for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+            summary.add(key)
+
+        assert summary.counts == {'a': 3, 'b': 2, 'c': 1}
+        assert set(summary.errors.values()) == {0}
+
+    def test_eviction_replaces_smallest_count(self):
+        summary = SpaceSaving(2)
+        for key in ['a', 'a', 'b', 'c']:
+            summary.add(key)
+
+        # c replaced b (count 1) and inherits its count as error
+        assert summary.counts == {'a': 2, 'c': 2}
+        assert summary.errors['c'] == 1
+
+    def test_counts_bound_true_frequency(self):
+        stream = zipf_stream(300, 200)
+        truth = Counter(stream)
+        summary = SpaceSaving(50)
+        for key in stream:
+            summary.add(key)
+
+        assert len(summary) == 50
+        for key, count in summary.counts.items():
+            assert count - summary.errors[key] <= truth[key] <= count
+        # Every key above n/k is guaranteed to be tracked
+        for key, count in truth.items():
+            if count > len(stream) / 50:
+                assert key in summary.counts
+
+
+@pytest.mark.unit
+class TestCountMinSketch:
+    """Test that estimates never undercount."""
+
+    def test_estimate_is_upper_bound(self):
+        sketch = CountMinSketch(64, 4)
+        truth = Counter(zipf_stream(200, 50))
+        for key, count in truth.items():
+            sketch.add(key, count)
+
+        for key, count in truth.items():
+            assert sketch.estimate(key) >= count
+
+
+@pytest.mark.unit
+class TestRowKeys:
+    """Test which dimensions a page view counts towards."""
+
+    def test_keys(self):
+        keys = row_keys(view('/about', '10.0.0.1',
+                             'https://News.Example.com/item?id=1'))
+        assert keys == [('pages', '/about'),
+                        ('referrers', 'news.example.com'),
+                        ('ips', '10.0.0.1')]
+
+    def test_direct_and_invalid_ip_skipped(self):
+        assert row_keys(view('/', 'not-an-ip', 'Direct')) == [('pages', '/')]
+
+
+@pytest.mark.unit
+class TestHeavyHitters:
+    """Test windowed queries, rotation and checkpoints."""
+
+    def test_top_pages_from_live_hour(self):
+        tracker = HeavyHitters(capacity=50)
+        tracker.observe([view(path) for path in zipf_stream(100, 40)])
+
+        top = tracker.top('pages', datetime.now(timezone.utc), k=3)
+        assert top == [('/page/0', 40), ('/page/1', 20), ('/page/2', 13)]
+
+    def test_window_spans_closed_hours(self):
+        tracker = HeavyHitters(capacity=20, window_hours=24)
+        now = datetime.now(timezone.utc)
+        old = now - timedelta(hours=5)
+        tracker.observe([view('/old', timestamp=old)] * 5)
+        tracker.observe([view('/new', timestamp=now)] * 2)
+
+        assert tracker.top('pages', now) == [('/new', 2)]
+        assert tracker.top('pages', now - timedelta(hours=5)) == [
+            ('/old', 5), ('/new', 2)]
+
+    def test_window_past_coverage_falls_back(self):
+        tracker = HeavyHitters(window_hours=24)
+        now = datetime.now(timezone.utc)
+        assert tracker.top('pages', now) is None
+
+        tracker.observe([view('/')])
+        assert tracker.top('pages', now - timedelta(hours=2)) is None
+        assert tracker.top('pages', now - timedelta(days=2)) is None
+        assert tracker.counters['fallbacks'] == 3
+
+    def test_hours_outside_window_are_dropped(self):
+        tracker = HeavyHitters(window_hours=3)
+        now = datetime.now(timezone.utc)
+        tracker.observe([view('/old', timestamp=now - timedelta(hours=5))])
+        tracker.observe([view('/new', timestamp=now)])
+
+        assert floor_hour(now - timedelta(hours=5)) not in \
+            tracker._closed['pages']
+
+    def test_checkpoint_round_trip(self):
+        tracker = HeavyHitters(capacity=20)
+        now = datetime.now(timezone.utc)
+        tracker.observe([view('/a', '10.0.0.1', 'https://a.example/')] * 3)
+        tracker.observe([view('/b', '10.0.0.2')])
+
+        restored = HeavyHitters(capacity=20)
+        restored.load_payload(tracker.to_payload())
+
+        for dimension in ('pages', 'referrers', 'ips'):
+            assert restored.top(dimension, now) == tracker.top(
+                dimension, now)
+        assert restored.covered_since == tracker.covered_since
+
+    async def test_restore_rereads_hours_since_the_checkpoint(self):
+        saved = HeavyHitters()
+        saved.observe([view('/a')] * 2)
+        payload = saved.to_payload()
+        now = datetime.now(timezone.utc)
+        hour = floor_hour(now)
+
+        tracker = HeavyHitters()
+        # Observed while loading; the re-read includes it
+        tracker.observe([view('/a')])
+        with patch('heavy_hitters.database') as mock_db:
+            mock_db.fetch_one = AsyncMock(return_value={
+                'payload': payload,
+                'checkpointed_at': now - timedelta(minutes=1)})
+            mock_db.fetch_all = AsyncMock(side_effect=[
+                [{'bucket': hour, 'key': '/a', 'views': 5}], [], []])
+            assert await tracker.restore() is True
+
+        assert mock_db.fetch_all.call_args_list[0][0][1]['since'] == hour
+        # Replaced, not added to the checkpoint's partial hour
+        assert tracker.top('pages', now) == [('/a', 5)]
+        assert tracker.covered_since == saved.covered_since
+
+    async def test_restore_falls_back_when_the_gap_cannot_be_read(self):
+        saved = HeavyHitters()
+        saved.observe([view('/a')] * 2)
+        now = datetime.now(timezone.utc)
+
+        tracker = HeavyHitters()
+        with patch('heavy_hitters.database') as mock_db, \
+                patch('heavy_hitters.add_log'):
+            mock_db.fetch_one = AsyncMock(return_value={
+                'payload': saved.to_payload(),
+                'checkpointed_at': now - timedelta(minutes=10)})
+            mock_db.fetch_all = AsyncMock(side_effect=OSError("down"))
+            assert await tracker.restore() is True
+
+        assert tracker.top('pages', now) is None
+        assert tracker.covered_since > now
+
+    async def test_seed_from_rollups(self):
+        tracker = HeavyHitters(window_hours=24)
+        hour = floor_hour(datetime.now(timezone.utc)) - timedelta(hours=2)
+        with patch('heavy_hitters.database') as mock_db:
+            mock_db.fetch_all = AsyncMock(side_effect=[
+                [{'bucket': hour, 'key': '/a', 'views': 4},
+                 {'bucket': hour, 'key': '/b', 'views': 7}],
+                [{'bucket': hour, 'key': 'a.example', 'views': 1}],
+                [{'bucket': hour, 'key': '10.0.0.1', 'views': 11}],
+            ])
+            await tracker.seed()
+
+        since = datetime.now(timezone.utc) - timedelta(hours=20)
+        assert tracker.top('pages', since) == [('/b', 7), ('/a', 4)]
+        assert tracker.top('ips', since) == [('10.0.0.1', 11)]
+        seed_sql = mock_db.fetch_all.call_args_list[0][0][0]
+        assert 'analytics_hourly_pages' in seed_sql
+
+    async def test_checkpoint_skipped_before_coverage(self):
+        tracker = HeavyHitters()
+        with patch('heavy_hitters.database') as mock_db:
+            mock_db.execute = AsyncMock()
+            await tracker.checkpoint()
+            mock_db.execute.assert_not_called()
+
+            tracker.observe([view('/')])
+            await tracker.checkpoint()
+            assert mock_db.execute.await_count == 1
+        assert tracker.stats()['checkpoints'] == 1
@@ -0,0 +1,58 @@
+"""
+Tests for the offline IP-to-ASN range table.
+"""
+import os
+import pytest
+
+from ip_asn_db import IPASNDatabase, compile_table
+
+
+SAMPLE_TSV = (
+    "1.0.0.0\t1.0.0.255\t13335\tUS\tCLOUDFLARENET\n"
+    "8.8.8.0\t8.8.8.255\t15169\tUS\tGOOGLE\n"
+    "10.0.0.0\t10.255.255.255\t0\tNone\tNot routed\n"
+    "52.0.0.0\t52.79.255.255\t16509\tUS\tAMAZON-02\n"
+    "2001:4860::\t2001:4860:ffff:ffff:ffff:ffff:ffff:ffff\t15169\tUS\tGOOGLE\n"
+)
+
+
+@pytest.fixture
+def asn_db(tmp_path):
+    source = tmp_path / "ip2asn.tsv"
+    source.write_text(SAMPLE_TSV)
+    output = tmp_path / "ip2asn.bin"
+    compile_table(str(source), str(output))
+    return IPASNDatabase(str(output))
+
+
+@pytest.mark.unit
+class TestIPASNDatabase:
+    """Test compilation, bisect lookups and hot reload."""
+
+    def test_ipv4_lookup(self, asn_db):
+        assert asn_db.lookup('8.8.8.8') == {
+            'asn': 15169, 'country': 'US', 'org': 'GOOGLE'
+        }
+        assert asn_db.lookup('52.10.1.1')['org'] == 'AMAZON-02'
+
+    def test_gaps_and_unrouted_space_miss(self, asn_db):
+        assert asn_db.lookup('8.8.9.1') is None
+        assert asn_db.lookup('10.1.2.3') is None
+        assert asn_db.lookup('0.0.0.1') is None
+        assert asn_db.lookup('not-an-ip') is None
+
+    def test_ipv6_lookup(self, asn_db):
+        assert asn_db.lookup('2001:4860:4860::8888')['asn'] == 15169
+        assert asn_db.lookup('2001:db8::1') is None
+
+    def test_hot_reload_on_file_change(self, asn_db, tmp_path):
+        assert asn_db.lookup('9.9.9.9') is None
+
+        source = tmp_path / "ip2asn-new.tsv"
+        source.write_text(SAMPLE_TSV + "9.9.9.0\t9.9.9.255\t19281\tUS\tQUAD9\n")
+        compile_table(str(source), asn_db.path)
+        stat = os.stat(asn_db.path)
+        os.utime(asn_db.path, (stat.st_atime, stat.st_mtime + 10))
+        asn_db._checked_at = 0.0
+
+        assert asn_db.lookup('9.9.9.9')['org'] == 'QUAD9'
@@ -0,0 +1,158 @@
+"""
+Tests for the compressed app_log archive and its pruned search.
+"""
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+
+from log_archive import BloomFilter, LogArchive, build_index, trigrams
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def record(day, minute, message="request served", level="INFO",
+           module="middleware", portfolio="1"):
+    return {
+        'portfolio_id': portfolio,
+        'timestamp': utc(2026, 1, day, 12, minute).isoformat(),
+        'level': level,
+        'message': message,
+        'module': module,
+        'function': 'dispatch',
+        'line': 10,
+        'user': None,
+        'extra': None,
+        'ip_address': None,
+        'traceback': None
+    }
+
+
+def archive_with(tmp_path, days=3, per_day=4):
+    archive = LogArchive(directory=str(tmp_path))
+    for day in range(1, days + 1):
+        rows = [record(day, minute) for minute in range(per_day)]
+        rows.append(record(day, 59, message=f"database timeout on day {day}",
+                           level="ERROR", module="database"))
+        archive.write_segment(utc(2026, 1, day), rows)
+    return archive
+
+
+@pytest.mark.unit
+class TestIndex:
+    """Test the sidecar index and bloom filter."""
+
+    def test_bloom_has_no_false_negatives(self):
+        grams = {f"g{i:03d}" for i in range(500)}
+        bloom = BloomFilter.for_items(len(grams))
+        for gram in grams:
+            bloom.add(gram)
+
+        restored = BloomFilter.from_dict(bloom.to_dict())
+
+        assert all(gram in restored for gram in grams)
+        misses = sum(f"x{i:03d}" in restored for i in range(1000))
+        assert misses < 50
+
+    def test_index_counts_by_portfolio_level_and_module(self):
+        index = build_index([record(1, 0), record(1, 1),
+                             record(1, 2, level="error", module="database")])
+
+        assert index['rows'] == 3
+        assert index['counts'] == {'1|INFO|middleware': 2,
+                                   '1|ERROR|database': 1}
+        assert index['start'] < index['end']
+        assert trigrams("Time") == {'tim', 'ime'}
+
+
+@pytest.mark.unit
+class TestSearch:
+    """Test pruning, ordering and paging over segments."""
+
+    def test_newest_first_pages_across_segments(self, tmp_path):
+        archive = archive_with(tmp_path)
+
+        first, total = archive.search(portfolio_id=1, limit=6)
+        second, _ = archive.search(portfolio_id=1, offset=6, limit=6)
+
+        assert total == 15
+        timestamps = [row['timestamp'] for row in first + second]
+        assert timestamps == sorted(timestamps, reverse=True)
+        assert len(set(timestamps)) == 12
+        assert all(row['archived'] for row in first)
+        assert 'portfolio_id' not in first[0]
+
+    def test_counts_answer_unsearched_pages_without_reading(self, tmp_path):
+        archive = archive_with(tmp_path)
+
+        rows, total = archive.search(portfolio_id=1, level="error",
+                                     offset=1, limit=1, descending=False)
+
+        assert total == 3
+        assert rows[0]['message'] == "database timeout on day 2"
+        # Only the segment holding the requested row is opened
+        assert archive.counters['segments_read'] == 1
+
+    def test_search_term_prunes_segments_by_bloom(self, tmp_path):
+        archive = archive_with(tmp_path)
+
+        rows, total = archive.search(portfolio_id=1, search="ON DAY 2")
+
+        assert total == 1
+        assert rows[0]['message'] == "database timeout on day 2"
+        assert archive.counters['segments_read'] == 1
+        assert archive.counters['segments_pruned'] == 2
+
+    def test_since_and_portfolio_filter(self, tmp_path):
+        archive = archive_with(tmp_path)
+
+        _, recent = archive.search(portfolio_id=1, since=utc(2026, 1, 3))
+        _, other = archive.search(portfolio_id=2)
+
+        assert recent == 5
+        assert other == 0
+
+    def test_clear_removes_segments_and_indexes(self, tmp_path):
+        archive = archive_with(tmp_path)
+        archive.search(portfolio_id=1)
+        (tmp_path / "unrelated.txt").write_text("kept")
+
+        assert archive.clear() == 3
+
+        assert archive.search() == ([], 0)
+        assert [path.name for path in tmp_path.iterdir()] == ['unrelated.txt']
+
+    def test_segment_without_index_is_ignored(self, tmp_path):
+        archive = archive_with(tmp_path, days=1)
+        (tmp_path / "app_log-20260101.idx.json").unlink()
+
+        assert archive.search() == ([], 0)
+
+
+@pytest.mark.unit
+class TestArchiveRange:
+    """Test copying expired rows from app_log."""
+
+    @patch('database.database')
+    async def test_writes_one_segment_per_day(self, mock_db, tmp_path):
+        archive = LogArchive(directory=str(tmp_path))
+        rows = []
+        for day in (1, 2):
+            row = record(day, 5)
+            row.update(id=day, portfolio_id=1,
+                       timestamp=utc(2026, 1, day, 12, 5))
+            rows.append(row)
+        mock_db.fetch_all = AsyncMock(side_effect=[[rows[0]], [rows[1]]])
+
+        archived = await archive.archive_range(utc(2026, 1, 1),
+                                               utc(2026, 1, 1) +
+                                               timedelta(days=2))
+
+        assert archived == 2
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            'app_log-20260101.idx.json', 'app_log-20260101.ndjson.gz',
+            'app_log-20260102.idx.json', 'app_log-20260102.ndjson.gz']
+        found, total = archive.search(portfolio_id=1, descending=False)
+        assert total == 2
+        assert found[0]['timestamp'] == '2026-01-01T12:05:00+00:00'
@@ -0,0 +1,147 @@
+"""
+Tests for the live log feed and its reconnect catch-up.
+"""
+import asyncio
+import json
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from log_feed import LogFeed, log_filter
+
+
+def entry(message="request served", level="INFO", module="middleware"):
+    return {'timestamp': datetime(2026, 10, 16, 12, 0), 'level': level,
+            'message': message, 'module': module, 'function': 'dispatch',
+            'line': 10, 'portfolio_id': 'p1'}
+
+
+def frame_data(frame):
+    return json.loads(frame.split('data: ', 1)[1])
+
+
+async def never_disconnected():
+    return False
+
+
+@pytest.mark.unit
+class TestLogFeed:
+    """Test publishing, server-side filters and slow readers."""
+
+    def test_ring_is_bounded_and_keeps_app_log_ids(self):
+        feed = LogFeed(size=2)
+        feed.publish([entry(str(i)) for i in range(3)], [11, 12, 13])
+
+        missed, events = feed.read_after(0)
+
+        assert missed == 1
+        assert [event['id'] for _, event in events] == [12, 13]
+        assert events[0][1]['timestamp'].endswith('+00:00')
+        assert 'portfolio_id' not in events[0][1]
+
+    def test_filter_by_level_module_and_substring(self):
+        matches = log_filter('error', 'database', 'TIMEOUT')
+
+        assert matches(entry("query timeout", "ERROR", "database"))
+        assert not matches(entry("query timeout", "WARNING", "database"))
+        assert not matches(entry("query timeout", "ERROR", "middleware"))
+        assert not matches(entry("query failed", "ERROR", "database"))
+        # Too short to search, as in the grid
+        assert log_filter(search='ab')(entry())
+
+    async def test_subscriber_receives_matching_entries(self):
+        feed = LogFeed(size=10, heartbeat=5)
+        stream = feed.subscribe(never_disconnected, level='error')
+
+        assert await stream.__anext__() == 'retry: 3000\n\n'
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        feed.publish([entry(), entry("boom", "ERROR")], [40, 41])
+
+        frame = await asyncio.wait_for(pending, timeout=1)
+        assert frame.startswith('id: 41\nevent: log\n')
+        assert frame_data(frame)['message'] == 'boom'
+        await stream.aclose()
+
+    def test_response_enforces_the_cap(self):
+        feed = LogFeed(max_clients=1)
+
+        first = feed.response(feed.subscribe(never_disconnected))
+
+        assert first is not None
+        assert feed.response(feed.subscribe(never_disconnected)) is None
+        assert feed.stats()['clients'] == 1
+
+    async def test_slow_reader_skips_ahead(self):
+        feed = LogFeed(size=2, heartbeat=5)
+        stream = feed.subscribe(never_disconnected)
+        await stream.__anext__()
+
+        feed.publish([entry(str(i)) for i in range(5)], range(1, 6))
+        skipped = await stream.__anext__()
+
+        assert frame_data(skipped) == {'missed': 3}
+        assert frame_data(await stream.__anext__())['message'] == '3'
+        await stream.aclose()
+
+
+@pytest.mark.unit
+class TestReconnect:
+    """Test that reconnects read only the gap the ring cannot cover."""
+
+    async def test_resume_inside_ring_runs_no_query(self):
+        feed = LogFeed(size=10, heartbeat=5)
+        feed.publish([entry(str(i)) for i in range(3)], [5, 6, 7])
+        feed.catch_up = AsyncMock()
+        stream = feed.subscribe(never_disconnected, last_event_id=5)
+
+        await stream.__anext__()
+        frames = [await stream.__anext__() for _ in range(2)]
+
+        feed.catch_up.assert_not_called()
+        assert [frame_data(f)['id'] for f in frames] == [6, 7]
+        await stream.aclose()
+
+    @patch('database.PORTFOLIO_ID', 'p1')
+    async def test_gap_before_ring_is_read_from_app_log(self):
+        feed = LogFeed(size=10, heartbeat=5, catch_up_limit=2)
+        feed.publish([entry("newest")], [50])
+        db = MagicMock()
+        db.fetch_all = AsyncMock(return_value=[
+            {**entry("c"), 'id': 49}, {**entry("b"), 'id': 48},
+            {**entry("a"), 'id': 47}])
+        stream = feed.subscribe(never_disconnected, search='dispatch',
+                                last_event_id=30)
+
+        with patch('database.database', db):
+            await stream.__anext__()
+            frames = [await stream.__anext__() for _ in range(4)]
+
+        query, params = db.fetch_all.call_args[0]
+        assert 'ORDER BY id DESC' in query
+        assert params['after_id'] == 30
+        assert params['before_id'] == 50
+        assert params['limit'] == 3
+        assert frame_data(frames[0]) == {'missed': None}
+        assert [frame_data(f)['message'] for f in frames[1:]] == [
+            'b', 'c', 'newest']
+        await stream.aclose()
+
+    async def test_unstarted_reconnect_releases_its_slot(self):
+        feed = LogFeed(size=10, heartbeat=5, max_clients=1)
+        feed.catch_up = AsyncMock()
+        response = feed.response(feed.subscribe(never_disconnected,
+                                                last_event_id=30))
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            # The client is gone before the response starts
+            await asyncio.Event().wait()
+
+        await response({'type': 'http'}, receive, send)
+
+        # No gap query for a stream nobody read
+        feed.catch_up.assert_not_called()
+        assert feed.clients == 0
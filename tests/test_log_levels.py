@@ -0,0 +1,100 @@
+"""
+Tests for the runtime log-level registry and level-gated add_log.
+"""
+import json
+import logging
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from log_capture import add_log
+from log_levels import LogLevelRegistry
+
+
+class Expensive:
+    """Counts how often it is formatted."""
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "expensive"
+
+
+@pytest.mark.unit
+class TestLogLevelRegistry:
+    """Test per-module levels and counters."""
+
+    def test_modules_inherit_from_dotted_prefixes(self):
+        registry = LogLevelRegistry(default_level='WARNING')
+        registry.set_level('DEBUG', 'app.routers')
+
+        assert registry.effective('app.routers.logs') == logging.DEBUG
+        assert registry.effective('app.other') == logging.WARNING
+
+        registry.clear_level('app.routers')
+        assert registry.effective('app.routers.logs') == logging.WARNING
+
+    def test_counts_emitted_and_suppressed_per_module(self):
+        registry = LogLevelRegistry(default_level='INFO')
+        registry.enabled(logging.DEBUG, 'ttw_oauth_manager')
+        registry.enabled(logging.DEBUG, 'ttw_oauth_manager')
+        registry.enabled(logging.ERROR, 'ttw_oauth_manager')
+
+        counts = registry.stats()['counters']['ttw_oauth_manager']
+        assert counts == {'level': 'INFO', 'emitted': 1, 'suppressed': 2}
+
+    def test_unknown_level_is_rejected(self):
+        registry = LogLevelRegistry()
+
+        with pytest.raises(ValueError):
+            registry.set_level('LOUD', 'tests')
+
+    async def test_levels_round_trip_through_site_config(self):
+        registry = LogLevelRegistry(default_level='INFO')
+        registry.set_level('ERROR')
+        registry.set_level('DEBUG', 'analytics')
+
+        with patch('site_config.SiteConfigManager') as manager:
+            manager.set_config = AsyncMock(return_value=True)
+            assert await registry.save()
+            key, stored = manager.set_config.call_args[0][:2]
+
+            manager.get_config = AsyncMock(return_value=stored)
+            restored = LogLevelRegistry(default_level='INFO')
+            assert await restored.load()
+
+        assert key == 'log_levels'
+        assert json.loads(stored)['modules'] == {'analytics': 'DEBUG'}
+        assert restored.levels() == registry.levels()
+
+
+@pytest.mark.unit
+class TestGatedAddLog:
+    """Test that suppressed add_log calls do no formatting."""
+
+    @patch('log_capture.log_sink')
+    def test_suppressed_call_formats_nothing(self, mock_sink):
+        registry = LogLevelRegistry(default_level='INFO')
+        value = Expensive()
+
+        with patch('log_capture.log_levels', registry):
+            add_log("DEBUG", "value: %s", "tests", args=(value,))
+
+        mock_sink.enqueue.assert_not_called()
+        assert value.formatted == 0
+        # Keyed by the calling module, not the module argument
+        assert registry.stats()['counters'][__name__]['suppressed'] == 1
+
+    @patch('log_capture.log_sink')
+    def test_emitted_call_formats_lazily(self, mock_sink):
+        registry = LogLevelRegistry(default_level='INFO')
+        registry.set_level('DEBUG', __name__)
+        value = Expensive()
+
+        with patch('log_capture.log_levels', registry):
+            add_log("DEBUG", "value: %s", "tests", args=(value,))
+
+        queued = mock_sink.enqueue.call_args[0][0]
+        assert queued['message'] == 'value: expensive'
+        assert value.formatted == 1
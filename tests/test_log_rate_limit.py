@@ -0,0 +1,158 @@
+"""
+Tests for repeated-message rate limiting in front of the log sink.
+"""
+import json
+import pytest
+from unittest.mock import patch
+
+from error_groups import ErrorGroups
+from log_capture import add_log
+from log_rate_limit import LogRateLimiter, message_template
+from log_sink import LogSink
+
+
+def entry(message="[Xy3kQ9aB] 404 response for https://x.test/wp-login.php",
+          level="WARNING", module="middleware",
+          function="log_non_200_responses"):
+    return {'level': level, 'message': message, 'module': module,
+            'function': function}
+
+
+def limiter(**overrides):
+    options = dict(rate=0.5, burst=3, global_rate=100, global_burst=1000,
+                   summary_interval=60, max_keys=100, max_summaries=5,
+                   sample_rates={})
+    options.update(overrides)
+    return LogRateLimiter(**options)
+
+
+@pytest.mark.unit
+class TestMessageTemplate:
+    """Test which parts of a message are masked."""
+
+    def test_ids_urls_and_numbers_are_masked(self):
+        first = message_template(entry()['message'])
+        second = message_template(
+            "[pQ7zz01x] 404 response for https://x.test/.env")
+
+        assert first == second == "[<id>] <n> response for <url>"
+        assert message_template("from 203.0.113.9 in 12.5ms") == \
+            "from <ip> in <n>ms"
+
+
+@pytest.mark.unit
+class TestLogRateLimiter:
+    """Test per-key buckets, the global budget and summaries."""
+
+    @patch('log_rate_limit.time')
+    def test_key_is_limited_and_refills(self, mock_time):
+        mock_time.monotonic.return_value = 0.0
+        limits = limiter()
+
+        results = [limits.allow(entry()) for _ in range(5)]
+        other = limits.allow(entry(message="startup complete",
+                                   function="startup"))
+
+        assert results == [True, True, True, False, False]
+        assert other
+        mock_time.monotonic.return_value = 2.0
+        assert limits.allow(entry())
+        assert not limits.allow(entry())
+        assert limits.counters['suppressed'] == 3
+
+    @patch('log_rate_limit.time')
+    def test_global_budget_bounds_distinct_keys(self, mock_time):
+        mock_time.monotonic.return_value = 0.0
+        limits = limiter(global_rate=1, global_burst=10)
+
+        allowed = sum(limits.allow(entry(function=f"probe_{i}"))
+                      for i in range(100))
+
+        assert allowed == 10
+
+    @patch('log_rate_limit.time')
+    def test_errors_are_sampled_over_the_limit(self, mock_time):
+        mock_time.monotonic.return_value = 0.0
+        limits = limiter(burst=1, sample_rates={'ERROR': 0.25})
+
+        results = [limits.allow(entry(level='ERROR')) for _ in range(9)]
+
+        # One from the bucket, then every 4th over-limit entry
+        assert results == [True, True, False, False, False,
+                           True, False, False, False]
+        assert limits.counters['sampled'] == 2
+        assert limits.counters['suppressed'] == 6
+
+    @patch('log_rate_limit.time')
+    def test_summaries_report_and_reset_suppressions(self, mock_time):
+        mock_time.monotonic.return_value = 0.0
+        limits = limiter(burst=1, max_summaries=1)
+        for _ in range(4):
+            limits.allow(entry())
+        for _ in range(2):
+            limits.allow(entry(message="slow query", function="fetch"))
+
+        assert limits.summaries() == []
+        mock_time.monotonic.return_value = 61.0
+        summaries = limits.summaries()
+
+        assert len(summaries) == 2
+        assert summaries[0]['message'].startswith(
+            "Suppressed 3 similar messages: [<id>]")
+        assert summaries[0]['function'] == 'log_non_200_responses'
+        assert summaries[0]['level'] == 'WARNING'
+        assert json.loads(summaries[1]['extra']) == {'suppressed': 1,
+                                                     'keys': 1}
+        assert limits.summaries(force=True) == []
+
+
+@pytest.mark.unit
+class TestRateLimitedSink:
+    """Test the limiter in front of the sink."""
+
+    @patch('log_rate_limit.time')
+    def test_suppressed_entries_are_summarized_on_stop(self, mock_time):
+        mock_time.monotonic.return_value = 0.0
+        sink = LogSink(batch_size=100, limiter=limiter(burst=2))
+
+        results = [sink.enqueue(entry()) for _ in range(10)]
+        sink._queue_summaries(force=True)
+
+        assert results.count(True) == 2
+        assert sink.counters['rate_limited'] == 8
+        assert len(sink) == 3
+        assert sink._buffer[-1]['message'].startswith("Suppressed 8")
+
+    @patch('log_rate_limit.time')
+    def test_suppressed_errors_still_count_on_their_group(self, mock_time):
+        mock_time.monotonic.return_value = 0.0
+        sink = LogSink(batch_size=100, limiter=limiter(burst=2))
+        http_error = {**entry(), 'extra': json.dumps(
+            {'status_code': 404, 'method': 'GET',
+             'url': 'https://x.test/wp-login.php'})}
+
+        with patch('log_sink.error_groups', ErrorGroups()) as groups:
+            for _ in range(10):
+                sink.enqueue(dict(http_error))
+            pending, hours = groups.take_suppressed()
+
+        assert sink.counters['rate_limited'] == 8
+        [group] = pending.values()
+        assert group['occurrences'] == 8
+        assert group['error_type'] == 'HTTP 404'
+
+    @patch('log_rate_limit.time')
+    def test_add_log_storm_collapses_to_one_key(self, mock_time):
+        mock_time.monotonic.return_value = 0.0
+        sink = LogSink(max_size=2000, batch_size=2000,
+                       limiter=limiter(burst=20))
+
+        with patch('log_capture.log_sink', sink):
+            for i in range(1000):
+                add_log("WARNING", f"Failed to flush {i} page views: timeout",
+                        module="analytics_ingest", function="flush")
+
+        assert len(sink) == 20
+        assert sink.counters['rate_limited'] == 980
+        assert sink.limiter.stats()['keys'] == 1
+        assert sink._buffer[0]['module'] == 'analytics_ingest'
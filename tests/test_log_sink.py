@@ -0,0 +1,242 @@
+"""
+Tests for the batched database log sink.
+"""
+import logging
+import sys
+import asyncpg
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from log_capture import DatabaseLogHandler, add_log
+from log_sink import LogSink, _columns
+from spool import CircuitBreaker, Spool
+
+
+PORTFOLIO = "3fc521ad-660c-4067-b416-17dc388e66eb"
+
+
+def entry(message="hello", level="INFO"):
+    return {'level': level, 'message': message, 'module': 'tests'}
+
+
+def inserted_ids(query, values):
+    return [{'id': 100 + i} for i in range(len(values['message']))]
+
+
+def connected_db():
+    db = MagicMock()
+    db.is_connected = True
+    db.fetch_all = AsyncMock(side_effect=inserted_ids)
+    return db
+
+
+def spool_in(tmp_path):
+    return patch('log_sink.log_spool',
+                 Spool('app_log', directory=str(tmp_path)))
+
+
+@pytest.mark.unit
+class TestLogSinkQueue:
+    """Test queue bounds and overflow policies."""
+
+    def test_drop_newest_keeps_first_entries(self):
+        sink = LogSink(max_size=2, batch_size=10,
+                       overflow_policy='drop_newest')
+        results = [sink.enqueue(entry(m)) for m in ('a', 'b', 'c')]
+
+        assert results == [True, True, False]
+        assert [e['message'] for e in sink._buffer] == ['a', 'b']
+        assert sink.counters['dropped'] == 1
+
+    def test_drop_oldest_keeps_latest_entries(self):
+        sink = LogSink(max_size=2, batch_size=10,
+                       overflow_policy='drop_oldest')
+        for message in ('a', 'b', 'c'):
+            sink.enqueue(entry(message))
+
+        assert [e['message'] for e in sink._buffer] == ['b', 'c']
+        assert sink.counters['dropped'] == 1
+
+    @patch('log_capture.log_sink')
+    def test_add_log_only_enqueues(self, mock_sink):
+        add_log("warning", "disk almost full", module="tests",
+                extra={'free': 3})
+
+        queued = mock_sink.enqueue.call_args[0][0]
+        assert queued['level'] == 'WARNING'
+        assert queued['message'] == 'disk almost full'
+        assert queued['extra'] == '{"free": 3}'
+
+    @patch('log_capture.log_sink')
+    def test_handler_queues_record_with_traceback(self, mock_sink):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.LogRecord(
+                'tests', logging.ERROR, __file__, 10, "failed %s", ('x',),
+                sys.exc_info())
+        DatabaseLogHandler().emit(record)
+
+        queued = mock_sink.enqueue.call_args[0][0]
+        assert queued['message'] == 'failed x'
+        assert queued['level'] == 'ERROR'
+        assert 'ValueError: boom' in queued['traceback']
+
+
+@pytest.mark.unit
+class TestLogSinkWriter:
+    """Test batched writes and draining."""
+
+    @patch('database.PORTFOLIO_ID', PORTFOLIO)
+    async def test_flush_writes_one_multi_row_insert(self, tmp_path):
+        db = connected_db()
+        sink = LogSink(batch_size=10)
+        for message in ('a', 'b', 'c'):
+            sink.enqueue(entry(message))
+
+        with patch('database.database', db), spool_in(tmp_path), \
+                patch('log_feed.log_feed') as feed:
+            assert await sink.flush()
+            await sink.stop()
+
+        db.fetch_all.assert_awaited_once()
+        query, values = db.fetch_all.call_args[0]
+        assert 'unnest' in query
+        assert values['message'] == ['a', 'b', 'c']
+        assert values['portfolio_id'] == [PORTFOLIO] * 3
+        assert sink.counters['written'] == 3
+        entries, ids = feed.publish.call_args[0]
+        assert [e['message'] for e in entries] == ['a', 'b', 'c']
+        assert ids == [100, 101, 102]
+
+    @patch('database.PORTFOLIO_ID', PORTFOLIO)
+    async def test_entries_wait_for_database(self, tmp_path):
+        db = connected_db()
+        db.is_connected = False
+        sink = LogSink(batch_size=10)
+        sink.enqueue(entry())
+
+        with patch('database.database', db), spool_in(tmp_path):
+            assert not await sink.flush()
+            assert len(sink) == 1
+            await sink.stop()
+
+        db.fetch_all.assert_not_called()
+
+    @patch('database.PORTFOLIO_ID', PORTFOLIO)
+    async def test_stop_drains_in_batches(self, tmp_path):
+        db = connected_db()
+        sink = LogSink(max_size=100, batch_size=2)
+        with patch('database.database', db), spool_in(tmp_path):
+            for i in range(5):
+                sink.enqueue(entry(str(i)))
+            await sink.stop()
+
+        assert len(sink) == 0
+        assert db.fetch_all.await_count == 3
+        assert sink.counters['written'] == 5
+        assert not sink.enqueue(entry())
+
+    @patch('log_sink.database_breaker', CircuitBreaker(failure_threshold=5))
+    @patch('database.PORTFOLIO_ID', PORTFOLIO)
+    async def test_failed_write_keeps_suppressed_error_counts(self,
+                                                               tmp_path):
+        groups = MagicMock()
+        groups.take_suppressed.return_value = ({'f': {}}, {})
+        groups.group = AsyncMock(side_effect=OSError("down"))
+        sink = LogSink(batch_size=10)
+
+        with patch('log_sink.error_groups', groups), spool_in(tmp_path), \
+                patch('database.database', connected_db()):
+            with pytest.raises(OSError):
+                await sink.write_batch([entry()])
+
+        groups.restore_suppressed.assert_called_once_with(({'f': {}}, {}))
+
+    @patch('log_sink.database_breaker', CircuitBreaker(failure_threshold=5))
+    @patch('database.PORTFOLIO_ID', PORTFOLIO)
+    async def test_rejected_entry_does_not_fail_the_batch(self):
+        def insert(query, values):
+            if 'bad' in values['message']:
+                raise asyncpg.DataError("value too long")
+            return inserted_ids(query, values)
+
+        db = connected_db()
+        db.fetch_all = AsyncMock(side_effect=insert)
+        sink = LogSink(batch_size=10)
+        for message in ('a', 'bad', 'c', 'd'):
+            sink.enqueue(entry(message))
+
+        with patch('database.database', db), \
+                patch('log_feed.log_feed'), \
+                patch('log_sink.log_spool') as spool:
+            assert await sink.flush()
+            await sink.stop()
+
+        spool.append.assert_not_called()
+        assert sink.counters['written'] == 3
+        assert sink.counters['rejected'] == 1
+
+    def test_columns_keep_only_valid_ip_addresses(self):
+        batch = [{'ip_address': ' 203.0.113.7'},
+                 {'ip_address': '203.0.113.7, 10.0.0.1, 10.0.0.2'},
+                 {'ip_address': '2001:DB8::1'},
+                 {'ip_address': 'unknown'},
+                 {}]
+
+        values = _columns(batch, PORTFOLIO)
+
+        assert values['ip_address'] == [
+            '203.0.113.7', None, '2001:db8::1', None, None]
+
+    @patch('log_sink.database_breaker', CircuitBreaker(failure_threshold=5))
+    @patch('database.PORTFOLIO_ID', PORTFOLIO)
+    async def test_failed_batch_is_spooled(self):
+        db = connected_db()
+        db.fetch_all = AsyncMock(side_effect=Exception("boom"))
+        sink = LogSink(batch_size=10)
+        sink.enqueue(entry())
+
+        with patch('database.database', db), \
+                patch('log_sink.log_spool') as spool:
+            spool.append.return_value = 1
+            assert await sink.flush()
+            await sink.stop()
+
+        spool.append.assert_called_once()
+        assert sink.counters['spooled'] == 1
+        assert sink.counters['failed'] == 0
+
+    @patch('database.PORTFOLIO_ID', PORTFOLIO)
+    async def test_open_breaker_skips_the_database(self):
+        db = connected_db()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        sink = LogSink(batch_size=10)
+        sink.enqueue(entry())
+
+        with patch('database.database', db), \
+                patch('log_sink.database_breaker', breaker), \
+                patch('log_sink.log_spool') as spool:
+            spool.append.return_value = 1
+            assert await sink.flush()
+            await sink.stop()
+
+        db.fetch_all.assert_not_called()
+        assert sink.counters['spooled'] == 1
+
+    @patch('database.PORTFOLIO_ID', PORTFOLIO)
+    async def test_unspoolable_batch_is_counted(self):
+        db = connected_db()
+        db.fetch_all = AsyncMock(side_effect=Exception("boom"))
+        sink = LogSink(batch_size=10)
+        sink.enqueue(entry())
+
+        with patch('database.database', db), \
+                patch('log_sink.database_breaker', CircuitBreaker()), \
+                patch('log_sink.log_spool') as spool:
+            spool.append.return_value = 0
+            assert not await sink.flush()
+            await sink.stop()
+
+        assert sink.counters['failed'] == 1
@@ -0,0 +1,164 @@
+"""
+Tests for partition planning and retention in partition_manager.
+"""
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+from partition_manager import (
+    PartitionManager, expired_partitions, parse_partition_bound,
+    partition_name, plan_partitions
+)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.unit
+class TestPartitionPlanning:
+    """Test that planned ranges cover the window without overlaps."""
+
+    def test_daily_partitions_ahead(self):
+        planned = plan_partitions([], 'daily', utc(2026, 10, 16, 13),
+                                  utc(2026, 10, 19, 13))
+        assert planned == [
+            (utc(2026, 10, 16), utc(2026, 10, 17)),
+            (utc(2026, 10, 17), utc(2026, 10, 18)),
+            (utc(2026, 10, 18), utc(2026, 10, 19)),
+            (utc(2026, 10, 19), utc(2026, 10, 20)),
+        ]
+
+    def test_existing_partitions_are_skipped(self):
+        existing = [(utc(2026, 10, 16), utc(2026, 10, 17))]
+        planned = plan_partitions(existing, 'daily', utc(2026, 10, 16, 1),
+                                  utc(2026, 10, 17, 1))
+        assert planned == [(utc(2026, 10, 17), utc(2026, 10, 18))]
+
+    def test_monthly_after_daily_is_clipped(self):
+        existing = [(utc(2026, 10, 1), utc(2026, 11, 1)),
+                    (utc(2026, 12, 1), utc(2026, 12, 2))]
+        planned = plan_partitions(existing, 'monthly', utc(2026, 10, 20),
+                                  utc(2026, 12, 5))
+        assert planned == [
+            (utc(2026, 11, 1), utc(2026, 12, 1)),
+            (utc(2026, 12, 2), utc(2027, 1, 1)),
+        ]
+
+    def test_partition_name(self):
+        assert partition_name('app_log', utc(2026, 1, 5)) == 'app_log_p20260105'
+
+
+@pytest.mark.unit
+class TestPartitionBounds:
+    """Test parsing of pg_get_expr partition bounds."""
+
+    def test_parses_range(self):
+        bound = parse_partition_bound(
+            "FOR VALUES FROM ('2026-10-16 00:00:00+00') "
+            "TO ('2026-10-17 00:00:00+00')")
+        assert bound == (utc(2026, 10, 16), utc(2026, 10, 17))
+
+    def test_normalises_session_time_zone(self):
+        bound = parse_partition_bound(
+            "FOR VALUES FROM ('2026-10-15 20:00:00-04') "
+            "TO ('2026-10-16 20:00:00-04')")
+        assert bound[0] == utc(2026, 10, 16)
+
+    def test_default_partition(self):
+        assert parse_partition_bound("DEFAULT") is None
+
+    def test_expired_partitions(self):
+        partitions = [('a', utc(2026, 9, 1), utc(2026, 9, 2)),
+                      ('b', utc(2026, 9, 2), utc(2026, 9, 3))]
+        assert expired_partitions(partitions, utc(2026, 9, 2, 12)) == [
+            partitions[0]]
+
+
+@pytest.mark.unit
+class TestRetention:
+    """Test retention settings and rollup-gated drops."""
+
+    @patch('partition_manager.SiteConfigManager')
+    async def test_invalid_retention_falls_back(self, mock_config):
+        mock_config.get_config = AsyncMock(return_value='forever')
+        assert await PartitionManager().retention_days('app_log') == 30
+
+    @patch('partition_manager.analytics_rollups')
+    @patch('partition_manager.database')
+    async def test_keeps_partitions_not_yet_rolled_up(self, mock_db,
+                                                      mock_rollups):
+        manager = PartitionManager(premake_days=1)
+        manager.retention_days = AsyncMock(return_value=30)
+        old_end = utc(2020, 1, 2)
+        manager.existing_partitions = AsyncMock(return_value=[
+            ('page_analytics_p20200101', utc(2020, 1, 1), old_end)])
+        mock_db.transaction.return_value.__aenter__ = AsyncMock()
+        mock_db.transaction.return_value.__aexit__ = AsyncMock(
+            return_value=False)
+        mock_db.fetch_one = AsyncMock(return_value={'locked': True})
+        mock_db.execute = AsyncMock()
+        mock_rollups.get_watermark = AsyncMock(return_value=utc(2020, 1, 1))
+        mock_rollups.refresh = AsyncMock()
+
+        result = await manager.maintain_table('page_analytics')
+
+        assert result['kept'] == ['page_analytics_p20200101']
+        assert result['dropped'] == []
+        mock_rollups.refresh.assert_awaited_once()
+        assert not any('DROP TABLE' in call.args[0]
+                       for call in mock_db.execute.call_args_list)
+
+    @patch('partition_manager.log_archive')
+    @patch('partition_manager.add_log')
+    @patch('partition_manager.database')
+    async def test_keeps_log_partitions_that_fail_to_archive(
+            self, mock_db, mock_add_log, mock_archive):
+        manager = PartitionManager(premake_days=1)
+        manager.retention_days = AsyncMock(return_value=30)
+        manager.existing_partitions = AsyncMock(return_value=[
+            ('app_log_p20200101', utc(2020, 1, 1), utc(2020, 1, 2)),
+            ('app_log_p20200102', utc(2020, 1, 2), utc(2020, 1, 3))])
+        mock_db.transaction.return_value.__aenter__ = AsyncMock()
+        mock_db.transaction.return_value.__aexit__ = AsyncMock(
+            return_value=False)
+        mock_db.fetch_one = AsyncMock(return_value={'locked': True})
+        mock_db.execute = AsyncMock()
+        mock_archive.archive_range = AsyncMock(
+            side_effect=[OSError("disk full"), 10])
+
+        result = await manager.maintain_table('app_log')
+
+        assert result['kept'] == ['app_log_p20200101']
+        assert result['dropped'] == ['app_log_p20200102']
+        mock_archive.archive_range.assert_any_await(
+            utc(2020, 1, 1), utc(2020, 1, 2))
+
+    @patch('partition_manager.database')
+    async def test_session_lock_spans_the_pass_and_is_released(self, mock_db):
+        manager = PartitionManager(premake_days=1)
+        manager.retention_days = AsyncMock(return_value=30)
+        manager.existing_partitions = AsyncMock(
+            side_effect=RuntimeError("catalog"))
+        mock_db.fetch_one = AsyncMock(return_value={'locked': True})
+        mock_db.execute = AsyncMock()
+
+        with pytest.raises(RuntimeError):
+            await manager.maintain_table('app_log')
+
+        assert 'pg_try_advisory_lock' in mock_db.fetch_one.call_args[0][0]
+        assert 'pg_advisory_unlock' in mock_db.execute.call_args[0][0]
+
+    @patch('partition_manager.database')
+    async def test_busy_lock_skips_the_pass(self, mock_db):
+        manager = PartitionManager(premake_days=1)
+        manager.retention_days = AsyncMock(return_value=30)
+        manager.existing_partitions = AsyncMock()
+        mock_db.fetch_one = AsyncMock(return_value={'locked': False})
+        mock_db.execute = AsyncMock()
+
+        result = await manager.maintain_table('app_log')
+
+        assert result['created'] == [] and result['dropped'] == []
+        manager.existing_partitions.assert_not_called()
+        mock_db.execute.assert_not_called()
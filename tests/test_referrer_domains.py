@@ -0,0 +1,61 @@
+"""
+Tests for ingest-time referrer normalization.
+"""
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+from analytics_rollups import build_source_sql
+from referrer_domains import ReferrerDomains
+
+
+def row(referer, minute=0):
+    return {
+        'timestamp': datetime(2026, 10, 5, 12, minute),
+        'referer': referer
+    }
+
+
+@pytest.mark.unit
+class TestReferrerDomains:
+    """Test domain resolution and counter upserts."""
+
+    @patch('referrer_domains.database')
+    async def test_assign_upserts_each_domain_once(self, mock_db):
+        mock_db.fetch_all = AsyncMock(return_value=[
+            {'id': 7, 'domain': 'news.example.com'},
+            {'id': 3, 'domain': 'www.google.com'},
+        ])
+        rows = [
+            row('https://www.google.com/search?q=a', 5),
+            row('https://WWW.Google.com/search?q=b', 1),
+            row('https://news.example.com/item?id=1', 2),
+            row('Direct'),
+            row(''),
+        ]
+
+        await ReferrerDomains().assign(rows)
+
+        assert [r['referrer_domain_id'] for r in rows] == [3, 3, 7, None, None]
+        assert rows[0]['referrer_domain'] == 'www.google.com'
+        params = mock_db.fetch_all.call_args[0][1]
+        assert params['domains'] == ['news.example.com', 'www.google.com']
+        assert params['views'] == [1, 2]
+        assert params['first_seen'][1] == datetime(2026, 10, 5, 12, 1)
+        assert params['last_seen'][1] == datetime(2026, 10, 5, 12, 5)
+
+    @patch('referrer_domains.database')
+    async def test_no_query_without_referrers(self, mock_db):
+        mock_db.fetch_all = AsyncMock()
+        rows = [row(None), row('Direct')]
+
+        assert await ReferrerDomains().assign(rows) == {}
+        mock_db.fetch_all.assert_not_called()
+        assert rows[0]['referrer_domain_id'] is None
+
+    def test_referrer_rollup_reads_dimension(self):
+        sql, _ = build_source_sql('referrers', datetime(2026, 10, 5), None)
+
+        assert 'JOIN referrer_domains rd' in sql
+        assert 'rd.domain AS referrer_domain' in sql
+        assert 'substring(referer' not in sql
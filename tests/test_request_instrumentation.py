@@ -0,0 +1,175 @@
+"""
+Tests for the pure-ASGI request instrumentation middleware.
+"""
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from request_instrumentation import (
+    EXCLUDED_PATHS, EXCLUDED_PREFIXES, PathMatcher,
+    RequestInstrumentationMiddleware
+)
+
+
+MATCHER = PathMatcher(EXCLUDED_PATHS, EXCLUDED_PREFIXES)
+
+
+def make_scope(path='/', method='GET'):
+    return {
+        'type': 'http', 'method': method, 'path': path, 'raw_path': path.encode(),
+        'root_path': '', 'scheme': 'http', 'query_string': b'',
+        'server': ('testserver', 80), 'client': ('203.0.113.7', 1234),
+        'headers': [(b'host', b'testserver'), (b'user-agent', b'test')]
+    }
+
+
+def make_app(status=200, content_type=b'text/html; charset=utf-8',
+             chunks=(b'<html>', b'</html>')):
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type)]})
+        for i, chunk in enumerate(chunks):
+            await send({'type': 'http.response.body', 'body': chunk,
+                        'more_body': i < len(chunks) - 1})
+    return app
+
+
+async def call(middleware, scope):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope, receive, send)
+    return sent
+
+
+@pytest.mark.unit
+class TestPathMatcher:
+    """Test exact and prefix exclusion matching."""
+
+    def test_exact_paths(self):
+        assert MATCHER.matches('/favicon.ico')
+        assert MATCHER.matches('/assets')
+        assert not MATCHER.matches('/favicon.ico.bak')
+
+    def test_prefixes(self):
+        assert MATCHER.matches('/assets/css/site.css')
+        assert MATCHER.matches('/admin/analytics/top-ips')
+        assert not MATCHER.matches('/admin/analytics')
+        assert not MATCHER.matches('/admin/')
+        assert not MATCHER.matches('/')
+
+    def test_agrees_with_linear_scan(self):
+        paths = ['/', '/projects', '/api', '/api/x', '/logs', '/logs/data',
+                 '/static/a.js', '/_next/b', '/analyticsx', '/admin/sql/q']
+        for path in paths:
+            expected = path in EXCLUDED_PATHS or any(
+                path.startswith(prefix) for prefix in EXCLUDED_PREFIXES)
+            assert MATCHER.matches(path) == expected, path
+
+
+@pytest.mark.unit
+class TestRequestInstrumentationMiddleware:
+    """Test analytics hand-off and logging in a single pass."""
+
+    async def test_tracks_html_page_view_and_passes_body_through(self):
+        middleware = RequestInstrumentationMiddleware(
+            make_app(), access_log=False, log_non_200=True)
+        with patch('request_instrumentation.analytics') as mock_analytics:
+            mock_analytics.track_page_view = AsyncMock()
+            sent = await call(middleware, make_scope('/projects'))
+
+        assert [m.get('body') for m in sent[1:]] == [b'<html>', b'</html>']
+        mock_analytics.track_page_view.assert_awaited_once()
+        assert mock_analytics.track_page_view.call_args[0][1] == '/projects'
+
+    async def test_view_token_is_exposed_and_tracked(self):
+        seen = {}
+
+        async def app(scope, receive, send):
+            seen['token'] = scope['state']['view_token']
+            await make_app()(scope, receive, send)
+
+        middleware = RequestInstrumentationMiddleware(app, access_log=False)
+        with patch('request_instrumentation.analytics') as mock_analytics:
+            mock_analytics.track_page_view = AsyncMock()
+            await call(middleware, make_scope('/projects'))
+
+        assert len(seen['token']) == 16
+        assert mock_analytics.track_page_view.call_args.kwargs[
+            'view_token'] == seen['token']
+
+    async def test_skips_excluded_and_static_responses(self):
+        with patch('request_instrumentation.analytics') as mock_analytics:
+            mock_analytics.track_page_view = AsyncMock()
+            await call(RequestInstrumentationMiddleware(
+                make_app(), access_log=False), make_scope('/assets/x.png'))
+            await call(RequestInstrumentationMiddleware(
+                make_app(content_type=b'application/json'), access_log=False),
+                make_scope('/projects'))
+            await call(RequestInstrumentationMiddleware(
+                make_app(), access_log=False), make_scope('/', method='POST'))
+
+        mock_analytics.track_page_view.assert_not_called()
+
+    async def test_logs_non_200_with_body_preview(self):
+        middleware = RequestInstrumentationMiddleware(
+            make_app(status=404, chunks=(b'not ', b'found')),
+            access_log=False, track_analytics=False)
+        with patch('request_instrumentation.add_log') as mock_add_log:
+            await call(middleware, make_scope('/missing'))
+
+        extra = mock_add_log.call_args.kwargs['extra']
+        assert mock_add_log.call_args.kwargs['level'] == 'WARNING'
+        assert extra['status_code'] == 404
+        assert extra['response_body_preview'] == 'not found'
+        assert extra['response_headers']['content-type'].startswith(
+            'text/html')
+
+    async def test_non_200_log_keeps_only_whitelisted_headers(self):
+        async def app(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 302,
+                        'headers': [(b'location', b'/login'),
+                                    (b'set-cookie', b'session=secret')]})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        scope = make_scope('/admin')
+        scope['headers'] += [(b'cookie', b'session=secret'),
+                             (b'authorization', b'Bearer secret'),
+                             (b'referer', b'https://example.com/')]
+        middleware = RequestInstrumentationMiddleware(
+            app, access_log=False, track_analytics=False)
+        with patch('request_instrumentation.add_log') as mock_add_log:
+            await call(middleware, scope)
+
+        extra = mock_add_log.call_args.kwargs['extra']
+        assert extra['headers'] == {'user-agent': 'test',
+                                    'referer': 'https://example.com/'}
+        assert extra['response_headers'] == {'location': '/login'}
+
+    async def test_feature_toggles(self):
+        middleware = RequestInstrumentationMiddleware(
+            make_app(status=500), access_log=False, log_non_200=False,
+            track_analytics=False, timing_header=True)
+        with patch('request_instrumentation.add_log') as mock_add_log:
+            sent = await call(middleware, make_scope('/'))
+
+        mock_add_log.assert_not_called()
+        header_names = [name for name, _ in sent[0]['headers']]
+        assert b'server-timing' in header_names
+
+    async def test_logs_and_reraises_exceptions(self):
+        async def failing_app(scope, receive, send):
+            raise RuntimeError("boom")
+
+        middleware = RequestInstrumentationMiddleware(
+            failing_app, access_log=False, track_analytics=False)
+        with patch('request_instrumentation.add_log') as mock_add_log:
+            with pytest.raises(RuntimeError):
+                await call(middleware, make_scope('/'))
+
+        assert mock_add_log.call_args.kwargs['level'] == 'ERROR'
+        assert mock_add_log.call_args.kwargs['traceback_text']
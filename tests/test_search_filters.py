@@ -0,0 +1,45 @@
+"""
+Tests for trigram-indexed search rewriting.
+"""
+import os
+import re
+import pytest
+
+from search_filters import (
+    MIN_SEARCH_LENGTH, SEARCH_EXPRESSIONS, escape_like, search_condition
+)
+
+
+MIGRATION = os.path.join(os.path.dirname(__file__), '..', 'sql',
+                         '14_add_trigram_search_indexes.sql')
+
+
+def squash(text):
+    return re.sub(r'\s+', '', text)
+
+
+@pytest.mark.unit
+class TestSearchCondition:
+    """Test that searches are rewritten onto the indexed expression."""
+
+    def test_condition_uses_indexed_expression(self):
+        condition, params = search_condition('app_log', '  timeout ')
+        assert condition == f"({SEARCH_EXPRESSIONS['app_log']}) ILIKE :search"
+        assert params == {'search': '%timeout%'}
+
+    def test_short_terms_are_ignored(self):
+        assert search_condition('app_log', 'ab') == (None, {})
+        assert search_condition('app_log', None) == (None, {})
+        assert MIN_SEARCH_LENGTH == 3
+
+    def test_wildcards_match_literally(self):
+        assert escape_like('100%_off\\') == '100\\%\\_off\\\\'
+        _, params = search_condition('page_analytics', '50%', 'q')
+        assert params == {'q': '%50\\%%'}
+
+    def test_migration_indexes_the_same_expressions(self):
+        with open(MIGRATION) as f:
+            migration = squash(f.read())
+        for table, expression in SEARCH_EXPRESSIONS.items():
+            assert f"ON{table}USINGgin(({squash(expression)})gin_trgm_ops)" \
+                in migration, table
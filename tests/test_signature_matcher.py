@@ -0,0 +1,63 @@
+"""
+Tests for the single-pass signature matcher.
+"""
+import json
+import random
+import pytest
+
+from signature_matcher import SignatureMatcher, load_crawler_user_agents
+
+
+CATEGORIES = {
+    'bot': ['bot', 'crawler', 'spider', 'googlebot', 'slurp'],
+    'datacenter': ['amazon', 'aws', 'google', 'cloud', 'compute', 'ovh'],
+}
+
+
+def brute_force(text):
+    lowered = text.lower()
+    return frozenset(
+        name for name, patterns in CATEGORIES.items()
+        if any(pattern in lowered for pattern in patterns)
+    )
+
+
+@pytest.mark.unit
+class TestSignatureMatcher:
+    """Test that the automaton agrees with naive substring scans."""
+
+    def test_overlapping_signatures_all_match(self):
+        matcher = SignatureMatcher(CATEGORIES)
+        assert matcher.match('crawl-66-249-66-1.GoogleBot.com') == \
+            frozenset({'bot', 'datacenter'})
+        assert matcher.match('ec2-1-2-3-4.compute-1.amazonaws.com') == \
+            frozenset({'datacenter'})
+        assert matcher.match('Mozilla/5.0 (Windows NT 10.0)') == frozenset()
+        assert matcher.match(None) == frozenset()
+
+    def test_matches_brute_force_on_random_strings(self):
+        rng = random.Random(3)
+        alphabet = 'abcdeglortuswpnm.-'
+        matcher = SignatureMatcher(CATEGORIES)
+        for _ in range(500):
+            text = ''.join(rng.choice(alphabet)
+                           for _ in range(rng.randint(0, 40)))
+            assert matcher.match(text) == brute_force(text), text
+
+    def test_repeated_strings_are_memoized(self):
+        matcher = SignatureMatcher(CATEGORIES, cache_size=2)
+        matcher.match('Googlebot/2.1')
+        matcher.match('Googlebot/2.1')
+        assert matcher.stats()['cache']['hits'] == 1
+
+    def test_load_crawler_user_agents(self, tmp_path):
+        path = tmp_path / "crawler-user-agents.json"
+        path.write_text(json.dumps([
+            {"pattern": "Googlebot\\/"},
+            {"pattern": "AhrefsBot"},
+            {"pattern": "^Java\\/"},
+            {"pattern": "[wW]get"},
+        ]))
+        assert load_crawler_user_agents(str(path)) == [
+            'googlebot/', 'ahrefsbot'
+        ]
@@ -0,0 +1,274 @@
+"""
+Tests for the database outage spool, circuit breaker and replayer.
+"""
+import os
+import asyncpg
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import spool as spool_module
+from spool import (
+    CircuitBreaker, Spool, SpoolReplayer, decode_records, encode_record,
+    write_isolating
+)
+
+
+def row(i=0):
+    return {
+        'page_path': f"/{i}",
+        'timestamp': datetime(2026, 5, 1, 12, i, tzinfo=timezone.utc),
+        'asn': 13335,
+        'mouse_activity': False,
+        'reverse_dns': None
+    }
+
+
+def connected_db():
+    db = MagicMock()
+    db.is_connected = True
+    return db
+
+
+@pytest.mark.unit
+class TestRecords:
+    """Test the length-prefixed record format."""
+
+    def test_round_trip_keeps_datetimes(self):
+        data = b''.join(encode_record(row(i)) for i in range(3))
+
+        records, complete = decode_records(data)
+
+        assert complete
+        assert records == [row(i) for i in range(3)]
+
+    def test_torn_tail_is_skipped(self):
+        data = encode_record(row(0)) + encode_record(row(1))[:-3]
+
+        records, complete = decode_records(data)
+
+        assert records == [row(0)]
+        assert not complete
+
+    def test_corrupt_payload_stops_decoding(self):
+        data = bytearray(encode_record(row(0)) + encode_record(row(1)))
+        data[-2] ^= 0xFF
+
+        records, complete = decode_records(bytes(data))
+
+        assert records == [row(0)]
+        assert not complete
+
+
+@pytest.mark.unit
+class TestCircuitBreaker:
+    """Test open, half-open and close transitions."""
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        assert breaker.allow()
+
+        breaker.record_failure()
+
+        assert breaker.state == 'open'
+        assert not breaker.allow()
+        assert breaker.counters['rejected'] == 1
+
+    def test_only_connection_errors_count(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+
+        breaker.record_error(asyncpg.DataError("value too long"))
+        assert breaker.state == 'closed'
+        breaker.record_error(asyncpg.TooManyConnectionsError("full"))
+        assert breaker.state == 'open'
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        assert breaker.state == 'closed'
+
+    @patch('spool.time')
+    def test_half_open_lets_one_probe_through(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+
+        mock_time.monotonic.return_value = 131.0
+        assert breaker.state == 'half_open'
+        assert breaker.allow()
+        assert not breaker.allow()
+
+        breaker.record_failure()
+        assert breaker.state == 'open'
+        assert breaker.counters['opened'] == 2
+
+        mock_time.monotonic.return_value = 162.0
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == 'closed'
+
+
+@pytest.mark.unit
+class TestSpool:
+    """Test segment files on disk."""
+
+    def test_append_seal_and_read(self, tmp_path):
+        spool = Spool('page_analytics', directory=str(tmp_path))
+        assert spool.append([row(0), row(1)]) == 2
+        assert spool.append([row(2)]) == 1
+
+        segments = spool.seal()
+        spool.append([row(3)])
+
+        assert len(segments) == 1
+        assert spool.read(segments[0]) == [row(0), row(1), row(2)]
+        assert len(spool.seal()) == 2
+        assert spool.counters['spooled'] == 4
+
+    def test_full_spool_drops_batches(self, tmp_path):
+        spool = Spool('app_log', directory=str(tmp_path), max_bytes=50)
+
+        assert spool.append([row(0), row(1)]) == 0
+        assert spool.counters['dropped'] == 2
+        assert spool.seal() == []
+
+
+@pytest.mark.unit
+class TestWriteIsolating:
+    """Test splitting batches that the database refuses."""
+
+    async def test_only_the_bad_row_is_rejected(self):
+        written = []
+
+        async def write(records):
+            if row(3) in records:
+                raise asyncpg.DataError("value too long")
+            written.extend(records)
+
+        rejected, unwritten, error = await write_isolating(
+            write, [row(i) for i in range(8)])
+
+        assert rejected == [row(3)]
+        assert unwritten == [] and error is None
+        assert written == [row(i) for i in range(8) if i != 3]
+
+    async def test_other_errors_return_what_is_left(self):
+        calls = []
+
+        async def write(records):
+            calls.append(records)
+            if len(calls) == 1:
+                raise asyncpg.DataError("value too long")
+            if len(calls) == 3:
+                raise OSError("connection reset")
+
+        rejected, unwritten, error = await write_isolating(
+            write, [row(i) for i in range(4)])
+
+        assert rejected == []
+        assert unwritten == [row(2), row(3)]
+        assert isinstance(error, OSError)
+
+
+@pytest.mark.unit
+class TestSpoolReplayer:
+    """Test replaying spooled batches through the writers."""
+
+    async def test_replay_loads_and_removes_segments(self, tmp_path):
+        spool = Spool('page_analytics', directory=str(tmp_path))
+        spool.append([row(i) for i in range(3)])
+        write = AsyncMock()
+        breaker = CircuitBreaker(failure_threshold=1)
+        replayer = SpoolReplayer(breaker, interval=1)
+        replayer.register(spool, write)
+
+        with patch('database.database', connected_db()), \
+                patch('log_capture.add_log'):
+            loaded = await replayer.replay()
+
+        assert loaded == 3
+        assert write.await_args[0][0] == [row(i) for i in range(3)]
+        assert spool.seal() == []
+        assert spool.counters['replayed'] == 3
+
+    async def test_partial_failure_keeps_the_remainder(self, tmp_path):
+        spool = Spool('page_analytics', directory=str(tmp_path))
+        spool.append([row(i) for i in range(5)])
+        write = AsyncMock(side_effect=[None, OSError("down")])
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        replayer = SpoolReplayer(breaker, interval=1)
+        replayer.register(spool, write)
+
+        with patch.object(spool_module, 'REPLAY_CHUNK', 2), \
+                patch('database.database', connected_db()):
+            loaded = await replayer.replay()
+
+        assert loaded == 2
+        assert breaker.state == 'open'
+        [segment] = spool.seal()
+        assert spool.read(segment) == [row(i) for i in range(2, 5)]
+
+    async def test_open_breaker_defers_replay(self, tmp_path):
+        spool = Spool('app_log', directory=str(tmp_path))
+        spool.append([row(0)])
+        write = AsyncMock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        replayer = SpoolReplayer(breaker, interval=1)
+        replayer.register(spool, write)
+
+        with patch('database.database', connected_db()):
+            assert await replayer.replay() == 0
+
+        write.assert_not_called()
+        assert len(spool.seal()) == 1
+
+    async def test_poison_segment_is_quarantined(self, tmp_path):
+        spool = Spool('app_log', directory=str(tmp_path))
+        spool.append([row(0)])
+        write = AsyncMock(side_effect=Exception("bad row"))
+        breaker = CircuitBreaker(failure_threshold=10)
+        replayer = SpoolReplayer(breaker, interval=1, max_attempts=2)
+        replayer.register(spool, write)
+
+        with patch('database.database', connected_db()):
+            await replayer.replay()
+            await replayer.replay()
+
+        assert spool.seal() == []
+        assert spool.counters['failed_segments'] == 1
+        assert [name for name in os.listdir(tmp_path)
+                if name.endswith('.failed')]
+
+    async def test_poison_rows_do_not_block_later_segments(self, tmp_path):
+        spool = Spool('app_log', directory=str(tmp_path))
+        spool.append([row(i) for i in range(4)])
+        spool.seal()
+        spool.append([row(4)])
+        written = []
+
+        async def write(records):
+            if row(1) in records:
+                raise asyncpg.DataError("value too long")
+            written.extend(records)
+
+        breaker = CircuitBreaker(failure_threshold=1)
+        replayer = SpoolReplayer(breaker, interval=1)
+        replayer.register(spool, write)
+
+        with patch('database.database', connected_db()), \
+                patch('log_capture.add_log'):
+            loaded = await replayer.replay()
+
+        assert loaded == 4
+        assert written == [row(0), row(2), row(3), row(4)]
+        assert breaker.state == 'closed'
+        assert spool.seal() == []
+        [failed] = [name for name in os.listdir(tmp_path)
+                    if name.endswith('.failed')]
+        assert spool.read(os.path.join(tmp_path, failed)) == [row(1)]
+        assert spool.counters['rejected'] == 1
@@ -0,0 +1,91 @@
+"""
+Tests for the dictionary-encoded user agent dimension.
+"""
+import hashlib
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from user_agents import UserAgentDimension, describe, parse_user_agent, ua_hash
+
+
+CHROME_WINDOWS = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/126.0.0.0 Safari/537.36")
+SAFARI_IPHONE = ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) "
+                 "AppleWebKit/605.1.15 (KHTML, like Gecko) "
+                 "Version/17.5 Mobile/15E148 Safari/604.1")
+EDGE_MAC = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+            "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 "
+            "Safari/537.36 Edg/126.0.0.0")
+ANDROID_TABLET = ("Mozilla/5.0 (Linux; Android 14; SM-X710) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/126.0.0.0 Safari/537.36")
+GOOGLEBOT = ("Mozilla/5.0 (compatible; Googlebot/2.1; "
+             "+http://www.google.com/bot.html)")
+
+
+def returning(agents):
+    """Rows the upsert returns for ``agents`` with ids from 1."""
+    return [{'id': i, 'ua_hash': ua_hash(agent), 'inserted': True}
+            for i, agent in enumerate(agents, start=1)]
+
+
+@pytest.mark.unit
+class TestParseUserAgent:
+    """Test browser, OS and device families."""
+
+    def test_families(self):
+        for user_agent, families in [
+            (CHROME_WINDOWS, ('Chrome', 'Windows', 'desktop')),
+            (SAFARI_IPHONE, ('Safari', 'iOS', 'mobile')),
+            (EDGE_MAC, ('Edge', 'macOS', 'desktop')),
+            (ANDROID_TABLET, ('Chrome', 'Android', 'tablet')),
+            ('curl/8.5.0', ('curl', 'Other', 'other')),
+        ]:
+            parsed = parse_user_agent(user_agent)
+            assert (parsed['browser_family'], parsed['os_family'],
+                    parsed['device_family']) == families, user_agent
+
+    def test_bot_verdict(self):
+        assert describe(GOOGLEBOT)['is_bot'] is True
+        assert describe(GOOGLEBOT)['device_family'] == 'bot'
+        assert describe(CHROME_WINDOWS)['is_bot'] is False
+
+    def test_hash_matches_postgres_sha256(self):
+        assert ua_hash(SAFARI_IPHONE) == hashlib.sha256(
+            SAFARI_IPHONE.encode('utf-8')).digest()
+
+
+@pytest.mark.unit
+class TestUserAgentDimension:
+    """Test id assignment and the LRU in front of the table."""
+
+    @patch('user_agents.database')
+    async def test_assign_upserts_unseen_agents_once(self, mock_db):
+        mock_db.fetch_all = AsyncMock(
+            return_value=returning([CHROME_WINDOWS, GOOGLEBOT]))
+        dimension = UserAgentDimension(cache_size=10)
+        rows = [{'user_agent': CHROME_WINDOWS}, {'user_agent': GOOGLEBOT},
+                {'user_agent': CHROME_WINDOWS}, {'user_agent': None}]
+
+        await dimension.assign(rows)
+
+        assert [row['user_agent_id'] for row in rows] == [1, 2, 1, None]
+        params = mock_db.fetch_all.call_args[0][1]
+        assert len(params['hashes']) == 2
+        assert params['bots'][params['hashes'].index(
+            ua_hash(GOOGLEBOT))] is True
+
+    @patch('user_agents.database')
+    async def test_cached_agents_skip_the_database(self, mock_db):
+        mock_db.fetch_all = AsyncMock(
+            return_value=returning([CHROME_WINDOWS]))
+        dimension = UserAgentDimension(cache_size=10)
+        await dimension.assign([{'user_agent': CHROME_WINDOWS}])
+
+        rows = [{'user_agent': CHROME_WINDOWS}]
+        await dimension.assign(rows)
+
+        assert mock_db.fetch_all.await_count == 1
+        assert rows[0]['user_agent_id'] == 1
+        assert dimension.stats()['cache']['hits'] >= 1
@@ -0,0 +1,145 @@
+"""
+Tests for batch visitor scoring in visitor_reclassifier.
+"""
+import ipaddress
+import pytest
+from unittest.mock import AsyncMock, patch
+
+import visitor_reclassifier
+from ip_analysis import IPAnalyzer
+from visitor_reclassifier import BatchVisitorScorer, VisitorReclassifier
+
+
+ANALYZER = IPAnalyzer()
+
+
+def make_row(ip='203.0.113.10', user_agent='Mozilla/5.0', reverse_dns=None,
+             organization=None, mouse_activity=False, row_id=1):
+    parsed = ipaddress.ip_address(ip)
+    return {
+        'id': row_id,
+        'timestamp': None,
+        'ip_address': ip,
+        'ip_int': int(parsed) if parsed.version == 4 else None,
+        'user_agent': user_agent,
+        'reverse_dns': reverse_dns,
+        'organization': organization,
+        'mouse_activity': mouse_activity
+    }
+
+
+ROWS = [
+    make_row(),
+    make_row(mouse_activity=True),
+    make_row(ip='66.249.66.1', user_agent='Googlebot/2.1',
+             reverse_dns='crawl-66-249-66-1.googlebot.com'),
+    make_row(ip='54.1.2.3', organization='Amazon Technologies'),
+    make_row(ip='54.1.2.3', reverse_dns='ec2.compute.amazonaws.com',
+             mouse_activity=True),
+    make_row(ip='2001:db8::1', user_agent='curl spider'),
+    make_row(ip='104.131.0.5', user_agent=None, reverse_dns='vps.hosting'),
+]
+
+
+def expected(rows):
+    return [
+        ANALYZER.classify_visitor(
+            row['ip_address'], row['user_agent'] or '',
+            row['mouse_activity'], row['reverse_dns'],
+            {'is_datacenter': ANALYZER._is_datacenter_org(
+                row['organization'])} if row['organization'] else None)
+        for row in rows
+    ]
+
+
+@pytest.mark.unit
+class TestBatchVisitorScorer:
+    """Test that batch scoring matches classify_visitor row by row."""
+
+    def test_vectorized_matches_classify_visitor(self):
+        pytest.importorskip('numpy')
+        scorer = BatchVisitorScorer(ANALYZER)
+        assert scorer.vectorized
+        assert scorer.score(ROWS) == expected(ROWS)
+
+    def test_stored_user_agent_verdict_is_used(self):
+        pytest.importorskip('numpy')
+        scorer = BatchVisitorScorer(ANALYZER)
+        rows = [dict(row, ua_is_bot='bot_user_agent' in
+                     ANALYZER.signatures.match(row['user_agent'] or ''))
+                for row in ROWS[:3]] + ROWS[3:]
+
+        with patch.object(scorer, '_match_column',
+                          wraps=scorer._match_column) as match:
+            assert scorer.score(rows) == expected(ROWS)
+        # Only rows without a stored verdict had their agent matched
+        ua_calls = [call for call in match.call_args_list
+                    if call[0][1] == 'user_agent']
+        assert len(ua_calls[0][0][0]) == len(ROWS) - 3
+
+    def test_scalar_fallback_matches_classify_visitor(self):
+        with patch.object(visitor_reclassifier, 'np', None):
+            scorer = BatchVisitorScorer(ANALYZER)
+            assert not scorer.vectorized
+            assert scorer.score(ROWS) == expected(ROWS)
+
+    def test_empty_chunk(self):
+        assert BatchVisitorScorer(ANALYZER).score([]) == []
+
+
+@pytest.mark.unit
+class TestVisitorReclassifier:
+    """Test chunked fetch and single-statement write back."""
+
+    @patch('visitor_reclassifier.analytics_rollups')
+    @patch('visitor_reclassifier.database')
+    async def test_backfill_walks_chunks_and_refreshes_rollups(
+            self, mock_db, mock_rollups):
+        from datetime import datetime, timezone
+        rows = [dict(make_row(row_id=i), timestamp=datetime(
+            2026, 1, 1, 0, i, tzinfo=timezone.utc)) for i in range(3)]
+        mock_db.fetch_all = AsyncMock(side_effect=[rows[:2], rows[2:]])
+        mock_db.execute = AsyncMock()
+        mock_rollups.refresh = AsyncMock()
+
+        worker = VisitorReclassifier(chunk_size=2)
+        worker._scorer = BatchVisitorScorer(ANALYZER)
+        result = await worker.run_once(backfill=True)
+
+        assert result['rows'] == 3
+        assert result['chunks'] == 2
+        assert mock_db.execute.await_count == 2
+        second_fetch = mock_db.fetch_all.call_args_list[1][0][1]
+        assert second_fetch['after_id'] == 1
+        update_params = mock_db.execute.call_args_list[0][0][1]
+        assert update_params['ids'] == [0, 1]
+        assert len(update_params['visitor_types']) == 2
+        mock_rollups.refresh.assert_awaited_once_with(since=rows[0]['timestamp'])
+
+    async def test_second_backfill_is_refused_and_stop_awaits_it(self):
+        import asyncio
+        worker = VisitorReclassifier()
+        release = asyncio.Event()
+        calls = []
+
+        async def slow_pass(backfill, since):
+            calls.append(backfill)
+            await release.wait()
+            return {}
+
+        worker._run_once = slow_pass
+        assert worker.start_backfill()
+        assert not worker.start_backfill()
+        await asyncio.sleep(0)
+
+        # The periodic pass waits for the backfill
+        periodic = asyncio.ensure_future(worker.run_once())
+        await asyncio.sleep(0)
+        assert calls == [True]
+
+        release.set()
+        await periodic
+        await worker.stop()
+        assert calls == [True, False]
+        assert worker._backfill_task is None
+        assert not worker.stats()['backfill_running']
@@ -0,0 +1,174 @@
+"""
+Tests for the HyperLogLog visitor sketches.
+"""
+import pytest
+from datetime import date, datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from analytics import sketch_visitor_counts
+from visitor_sketches import (
+    HyperLogLog, VisitorSketches, referrer_domain, relative_error,
+    sketch_keys
+)
+
+
+def filled(precision, values):
+    sketch = HyperLogLog(precision)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def ips(start, count):
+    return [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+            for i in range(start, start + count)]
+
+
+@pytest.mark.unit
+class TestHyperLogLog:
+    """Test estimates, merging and serialization."""
+
+    def test_estimate_within_error_bound(self):
+        for count in (50, 1000, 20000):
+            estimate = filled(12, ips(0, count)).estimate()
+            # Four standard errors keeps this deterministic test stable
+            assert abs(estimate - count) <= 4 * relative_error(12) * count
+
+    def test_duplicates_are_not_counted(self):
+        assert filled(12, ips(0, 100) * 5).estimate() == \
+            filled(12, ips(0, 100)).estimate()
+
+    def test_merge_matches_union(self):
+        left = filled(12, ips(0, 3000))
+        right = filled(12, ips(2000, 3000))
+        union = filled(12, ips(0, 5000))
+
+        assert left.merge(right).registers == union.registers
+
+    def test_merge_folds_to_lower_precision(self):
+        high = filled(14, ips(0, 3000))
+        low = filled(12, ips(0, 3000))
+
+        assert high.folded(12).registers == low.registers
+        assert high.merge(filled(12, [])).precision == 12
+
+    def test_sparse_and_dense_round_trip(self):
+        small = filled(12, ips(0, 10))
+        large = filled(12, ips(0, 20000))
+
+        assert len(small.to_bytes()) < 64
+        assert len(large.to_bytes()) == 3 + 4096
+        for sketch in (small, large):
+            restored = HyperLogLog.from_bytes(sketch.to_bytes())
+            assert restored.registers == sketch.registers
+
+    def test_rejects_malformed_bytes(self):
+        with pytest.raises(ValueError):
+            HyperLogLog.from_bytes(b'\x01\x0c\x00abc')
+
+
+@pytest.mark.unit
+class TestSketchDimensions:
+    """Test which sketches a page view updates."""
+
+    def test_keys_for_classified_view(self):
+        keys = sketch_keys({
+            'page_path': '/projects',
+            'visitor_type': 'bot',
+            'is_datacenter': True,
+            'mouse_activity': False,
+            'referer': 'https://News.Example.com/item?id=1'
+        })
+        assert keys == [
+            ('all', ''), ('visitor_type', 'bot'), ('datacenter', ''),
+            ('page', '/projects'), ('referrer', 'news.example.com')
+        ]
+
+    def test_pending_and_direct_are_skipped(self):
+        keys = sketch_keys({'page_path': '/', 'visitor_type': 'pending',
+                            'referer': 'Direct'})
+        assert keys == [('all', ''), ('page', '/')]
+        assert referrer_domain('not a url') is None
+
+    def test_referrer_domain_drops_userinfo_and_bounds_hosts(self):
+        assert referrer_domain('https://user:pw@Evil.com:8080/') == 'evil.com'
+        assert referrer_domain('http://[::1]:80/') == '::1'
+        assert referrer_domain('http://[::1/') is None
+        assert referrer_domain(f"https://{'a' * 64}.com/") is None
+        long_host = '.'.join(['a' * 63] * 4)
+        assert referrer_domain(f"https://{long_host}/") is None
+
+    def test_observe_buffers_per_day(self):
+        sketches = VisitorSketches(precision=10)
+        sketches.observe([
+            {'timestamp': datetime(2026, 10, 16, 23), 'page_path': '/',
+             'ip_address': '203.0.113.10'},
+            {'timestamp': datetime(2026, 10, 17, 1), 'page_path': '/',
+             'ip_address': '203.0.113.10'},
+            {'timestamp': datetime(2026, 10, 17, 2), 'page_path': '/',
+             'ip_address': 'unknown'},
+        ])
+
+        assert (date(2026, 10, 16), 'all', '') in sketches._pending
+        assert (date(2026, 10, 17), 'page', '/') in sketches._pending
+        assert sketches.counters['observed'] == 2
+
+    def test_summary_shape(self):
+        counts, types = sketch_visitor_counts({
+            ('all', ''): 120, ('visitor_type', 'bot'): 30,
+            ('visitor_type', 'human'): 60, ('datacenter', ''): 25
+        })
+        assert counts['unique'] == 120
+        assert counts['human'] == 0
+        assert [row['visitor_type'] for row in types] == ['human', 'bot']
+
+
+@pytest.mark.unit
+class TestSketchPersistence:
+    """Test merging into the table and reading ranges back."""
+
+    @patch('visitor_sketches.database')
+    async def test_flush_merges_with_stored_sketch(self, mock_db):
+        stored = filled(10, ips(0, 500))
+        mock_db.transaction = MagicMock()
+        mock_db.execute = AsyncMock(return_value=None)
+        mock_db.fetch_all = AsyncMock(return_value=[{
+            'day': date(2026, 10, 16), 'dimension': 'all',
+            'dim_value': '', 'registers': stored.to_bytes()
+        }])
+        sketches = VisitorSketches(precision=10)
+        sketches._add(date(2026, 10, 16), [('all', '')], '203.0.113.10')
+
+        assert await sketches.flush()
+
+        upsert = mock_db.execute.call_args[0][1]
+        written = HyperLogLog.from_bytes(upsert['registers'][0])
+        expected = filled(10, ips(0, 500) + ['203.0.113.10'])
+        assert written.registers == expected.registers
+        assert len(sketches) == 0
+
+    @patch('visitor_sketches.database')
+    async def test_failed_flush_keeps_updates(self, mock_db):
+        mock_db.transaction = MagicMock()
+        mock_db.execute = AsyncMock(side_effect=RuntimeError("down"))
+        sketches = VisitorSketches(precision=10)
+        sketches._add(date(2026, 10, 16), [('all', '')], '203.0.113.10')
+
+        assert not await sketches.flush()
+        assert len(sketches) == 1
+
+    @patch('visitor_sketches.database')
+    async def test_estimate_requires_coverage(self, mock_db):
+        mock_db.fetch_one = AsyncMock(return_value={
+            'rolled_up_to': datetime(2026, 10, 10, tzinfo=timezone.utc)})
+        mock_db.fetch_all = AsyncMock(return_value=[
+            {'dimension': 'all', 'dim_value': '',
+             'registers': filled(10, ips(0, 300)).to_bytes()},
+            {'dimension': 'all', 'dim_value': '',
+             'registers': filled(10, ips(200, 300)).to_bytes()},
+        ])
+        sketches = VisitorSketches(precision=10)
+
+        assert await sketches.estimate(datetime(2026, 10, 1), ['all']) is None
+        estimates = await sketches.estimate(datetime(2026, 10, 12), ['all'])
+        assert abs(estimates[('all', '')] - 500) <= 4 * relative_error(10) * 500
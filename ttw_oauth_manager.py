@@ -49,7 +49,8 @@ class TTWOAuthManager:
                 LIMIT 1
             """
             params = {"portfolio_id": portfolio_id, "provider": provider}
-            add_log("DEBUG", f"{provider}_oauth_config_query", f"Executing {provider} OAuth config query")
+            add_log("DEBUG", "Executing %s OAuth config query",
+                    "oauth_config_query", args=(provider,))
             result = await database.fetch_one(query, params)
             
             if not result:
@@ -163,10 +164,10 @@ class TTWOAuthManager:
                 raise TTWOAuthManagerError("LinkedIn OAuth app not configured. Please configure it first.")
 
             # Debug: Log config details (without secrets)
-            add_log("DEBUG", "linkedin_auth_url_config_check",
-                    f"OAuth config found - client_id present: "
-                    f"{bool(config.get('client_id'))}, "
-                    f"redirect_uri: {config.get('redirect_uri', 'None')}")
+            add_log("DEBUG", "OAuth config found - client_id present: %s, "
+                    "redirect_uri: %s", "linkedin_auth_url_config_check",
+                    args=(bool(config.get('client_id')),
+                          config.get('redirect_uri', 'None')))
 
             if not requested_scopes:
                 requested_scopes = await self.get_default_scopes()
@@ -197,8 +198,8 @@ class TTWOAuthManager:
                         f"{param_string}")
 
             # Log successful URL generation
-            add_log("DEBUG", "linkedin_auth_url_success",
-                    f"LinkedIn auth URL generated, scopes: {requested_scopes}")
+            add_log("DEBUG", "LinkedIn auth URL generated, scopes: %s",
+                    "linkedin_auth_url_success", args=(requested_scopes,))
 
             logger.info(f"Generated LinkedIn auth URL with scopes: {requested_scopes}")
             return auth_url, state
@@ -702,20 +703,15 @@ class TTWOAuthManager:
                 LIMIT 1
             """
             params = {"portfolio_id": portfolio_id}
-            add_log("DEBUG", "google_oauth_config_query", f"Executing Google OAuth config query")
-            add_log("DEBUG", "google_oauth_config_params", f"Portfolio ID: {portfolio_id}")
-            add_log("DEBUG", "google_oauth_config_sql", f"SQL: SELECT client_id, redirect_uri, scopes, created_at, updated_at FROM oauth_apps WHERE portfolio_id = '{portfolio_id}' AND provider = 'google'")
+            add_log("DEBUG", "Executing Google OAuth config query for "
+                    "portfolio %s", "google_oauth_config_query",
+                    args=(portfolio_id,))
             result = await database.fetch_one(query, params)
             
-            add_log("DEBUG", "google_oauth_config_result", f"Raw result: {result}")
-            add_log("DEBUG", "google_oauth_config_result_type", f"Result type: {type(result)}")
+            add_log("DEBUG", "Raw result: %s", "google_oauth_config_result",
+                    args=(result,))
             
             if result:
-                add_log("DEBUG", "google_oauth_config_found", f"Found Google OAuth config")
-                # Try different ways to access the data
-                add_log("DEBUG", "google_oauth_config_items", f"Result items: {dict(result) if hasattr(result, 'items') else 'No items method'}")
-                add_log("DEBUG", "google_oauth_config_keys", f"Result keys: {list(result.keys()) if hasattr(result, 'keys') else 'No keys method'}")
-                
                 config = {
                     "client_id": result["client_id"] if "client_id" in result else "",
                     "redirect_uri": result["redirect_uri"] if "redirect_uri" in result else "",
@@ -723,7 +719,8 @@ class TTWOAuthManager:
                     "configured_at": result["created_at"] if "created_at" in result else None,
                     "updated_at": result["updated_at"] if "updated_at" in result else None
                 }
-                add_log("DEBUG", "google_oauth_config_final", f"Final config: {config}")
+                add_log("DEBUG", "Final config: %s", "google_oauth_config_final",
+                        args=(config,))
                 return config
             
             add_log("DEBUG", "google_oauth_config_none", "No Google OAuth config found")
@@ -746,13 +743,11 @@ class TTWOAuthManager:
                 LIMIT 1
             """
             params = {"portfolio_id": portfolio_id}
-            add_log("DEBUG", "google_oauth_credentials_query", f"Executing Google OAuth credentials query during startup")
-            add_log("DEBUG", "google_oauth_credentials_params", f"Portfolio ID: {portfolio_id}")
-            add_log("DEBUG", "google_oauth_credentials_sql", f"SQL: SELECT client_id, client_secret, redirect_uri FROM oauth_apps WHERE portfolio_id = '{portfolio_id}' AND provider = 'google'")
+            add_log("DEBUG", "Executing Google OAuth credentials query for "
+                    "portfolio %s", "google_oauth_credentials_query",
+                    args=(portfolio_id,))
             result = await database.fetch_one(query, params)
 
-            add_log("DEBUG", "google_oauth_creds_result", f"Credentials raw result: {result}")
-            
             if result:
                 add_log("INFO", "google_oauth_credentials_found", f"Found Google OAuth credentials")
                 credentials = {
@@ -760,7 +755,10 @@ class TTWOAuthManager:
                     "client_secret": result["client_secret"] if "client_secret" in result else "",
                     "redirect_uri": result["redirect_uri"] if "redirect_uri" in result else ""
                 }
-                add_log("DEBUG", "google_oauth_creds_final", f"Final credentials: {credentials}")
+                # The secret stays out of the log
+                add_log("DEBUG", "Credentials loaded for client %s",
+                        "google_oauth_creds_final",
+                        args=(credentials["client_id"],))
                 return credentials
             else:
                 add_log("WARNING", "google_oauth_credentials_missing", f"No Google OAuth credentials found")
@@ -0,0 +1,291 @@
+"""
+User Agent Dimension
+Dictionary-encodes page view user agents into the user_agents table,
+keyed by the SHA-256 of the string, with the browser, OS and device
+family and the bot verdict parsed once per distinct agent. Page views
+reference it through user_agent_id, and the re-classification worker
+reads the stored verdict instead of matching the string again.
+
+An in-process LRU maps agent strings to ids, so the ingest writer only
+touches the table for agents this worker has not seen recently.
+
+Usage:
+    python user_agents.py backfill
+"""
+import asyncio
+import hashlib
+import os
+import re
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import database
+from log_capture import add_log
+from ttl_cache import TTLCache
+
+
+# (family, pattern) checked in order; the first match wins, so more
+# specific tokens come before the engines they embed
+BROWSER_FAMILIES: List[Tuple[str, re.Pattern]] = [
+    (family, re.compile(pattern)) for family, pattern in (
+        ('Edge', r'Edg(e|A|iOS)?/'),
+        ('Opera', r'OPR/|Opera'),
+        ('Samsung Internet', r'SamsungBrowser/'),
+        ('Firefox', r'Firefox/|FxiOS/'),
+        ('Chrome', r'Chrome/|CriOS/'),
+        ('Safari', r'Version/[\d.]+.*Safari/'),
+        ('curl', r'^curl/'),
+        ('Wget', r'^Wget/'),
+        ('python-requests', r'python-requests/'),
+        ('Go-http-client', r'Go-http-client/'),
+    )
+]
+
+OS_FAMILIES: List[Tuple[str, re.Pattern]] = [
+    (family, re.compile(pattern)) for family, pattern in (
+        ('iOS', r'iPhone|iPad|iPod'),
+        ('Android', r'Android'),
+        ('Windows', r'Windows'),
+        ('Chrome OS', r'CrOS'),
+        ('macOS', r'Mac OS X|Macintosh'),
+        ('Linux', r'Linux|X11'),
+    )
+]
+
+_TABLET = re.compile(r'iPad|Tablet|Android(?!.*Mobile)')
+_MOBILE = re.compile(r'Mobi|iPhone|iPod|Android')
+_DESKTOP_OS = {'Windows', 'macOS', 'Linux', 'Chrome OS'}
+
+# Longest agent stored in the dimension; longer strings are hashed whole
+MAX_USER_AGENT_LENGTH = 1024
+
+
+def ua_hash(user_agent: str) -> bytes:
+    """Dimension key; matches ``sha256(convert_to(user_agent, 'UTF8'))``."""
+    return hashlib.sha256(user_agent.encode('utf-8')).digest()
+
+
+def _first_match(patterns: List[Tuple[str, re.Pattern]], text: str) -> str:
+    for family, pattern in patterns:
+        if pattern.search(text):
+            return family
+    return 'Other'
+
+
+def parse_user_agent(user_agent: str,
+                     is_bot: bool = False) -> Dict[str, str]:
+    """Browser, OS and device family of a user agent string."""
+    os_family = _first_match(OS_FAMILIES, user_agent)
+    if is_bot:
+        device = 'bot'
+    elif _TABLET.search(user_agent):
+        device = 'tablet'
+    elif _MOBILE.search(user_agent):
+        device = 'mobile'
+    elif os_family in _DESKTOP_OS:
+        device = 'desktop'
+    else:
+        device = 'other'
+    return {
+        'browser_family': _first_match(BROWSER_FAMILIES, user_agent),
+        'os_family': os_family,
+        'device_family': device
+    }
+
+
+def _is_bot(user_agent: str) -> bool:
+    from ip_analysis import ip_analyzer
+    return 'bot_user_agent' in ip_analyzer.signatures.match(user_agent)
+
+
+def describe(user_agent: str) -> Dict[str, Any]:
+    """Dimension row for a user agent string."""
+    is_bot = _is_bot(user_agent)
+    return {
+        'ua_hash': ua_hash(user_agent),
+        'user_agent': user_agent[:MAX_USER_AGENT_LENGTH],
+        'is_bot': is_bot,
+        **parse_user_agent(user_agent, is_bot)
+    }
+
+
+class UserAgentDimension:
+    """Resolves user agent strings to dimension ids."""
+
+    def __init__(self, cache_size: Optional[int] = None):
+        self.cache = TTLCache(max_entries=cache_size or int(
+            os.getenv("USER_AGENT_CACHE_SIZE", "5000")))
+        self.counters = {
+            'resolved': 0,
+            'inserted': 0,
+            'upserts': 0
+        }
+
+    async def assign(self, rows: List[Dict[str, Any]]):
+        """Set ``user_agent_id`` on each row, upserting unseen agents.
+
+        Runs in its own statement rather than the page view transaction:
+        dimension rows are immutable, so an id cached here stays valid
+        even if the page view INSERT later rolls back.
+        """
+        missing = {}
+        for row in rows:
+            user_agent = row.get('user_agent')
+            if user_agent and user_agent not in missing:
+                found, _ = self.cache.lookup(user_agent)
+                if not found:
+                    missing[user_agent] = describe(user_agent)
+
+        if missing:
+            await self._upsert(list(missing.items()))
+
+        for row in rows:
+            user_agent = row.get('user_agent')
+            row['user_agent_id'] = (self.cache.get(user_agent)
+                                    if user_agent else None)
+        self.counters['resolved'] += len(rows)
+
+    async def _upsert(self, agents: List[Tuple[str, Dict[str, Any]]]):
+        # Sorted by hash so concurrent writers lock keys in the same order
+        agents.sort(key=lambda item: item[1]['ua_hash'])
+        described = [entry for _, entry in agents]
+        # The no-op update makes RETURNING include existing rows
+        result = await database.fetch_all(
+            """INSERT INTO user_agents
+                (ua_hash, user_agent, browser_family, os_family,
+                 device_family, is_bot)
+            SELECT * FROM unnest(
+                CAST(:hashes AS BYTEA[]),
+                CAST(:user_agents AS TEXT[]),
+                CAST(:browsers AS TEXT[]),
+                CAST(:systems AS TEXT[]),
+                CAST(:devices AS TEXT[]),
+                CAST(:bots AS BOOLEAN[]))
+            ON CONFLICT (ua_hash) DO UPDATE SET ua_hash = EXCLUDED.ua_hash
+            RETURNING id, ua_hash, (xmax = 0) AS inserted""",
+            {
+                'hashes': [entry['ua_hash'] for entry in described],
+                'user_agents': [entry['user_agent'] for entry in described],
+                'browsers': [entry['browser_family'] for entry in described],
+                'systems': [entry['os_family'] for entry in described],
+                'devices': [entry['device_family'] for entry in described],
+                'bots': [entry['is_bot'] for entry in described]
+            }
+        )
+        ids = {bytes(row['ua_hash']): row['id'] for row in result}
+        for user_agent, entry in agents:
+            if entry['ua_hash'] in ids:
+                self.cache.set(user_agent, ids[entry['ua_hash']])
+        self.counters['upserts'] += 1
+        self.counters['inserted'] += sum(1 for row in result
+                                         if row['inserted'])
+
+    async def backfill(self, chunk_size: int = 1000) -> Dict[str, Any]:
+        """Encode existing page views and report the storage involved.
+
+        Distinct agents are upserted in chunks, then page views are
+        pointed at them one partition-friendly day at a time.
+        """
+        total = 0
+        last = ''
+        while True:
+            rows = await database.fetch_all(
+                """SELECT DISTINCT user_agent FROM page_analytics
+                WHERE user_agent > :last AND user_agent_id IS NULL
+                ORDER BY user_agent
+                LIMIT :limit""",
+                {'last': last, 'limit': chunk_size}
+            )
+            if not rows:
+                break
+            agents = [row['user_agent'] for row in rows]
+            await self._upsert([(agent, describe(agent)) for agent in agents])
+            total += len(agents)
+            last = agents[-1]
+
+        days = await database.fetch_all(
+            """SELECT date_trunc('day', timestamp) AS day
+            FROM page_analytics
+            WHERE user_agent_id IS NULL AND user_agent IS NOT NULL
+            GROUP BY 1 ORDER BY 1"""
+        )
+        updated = 0
+        for row in days:
+            result = await database.fetch_one(
+                """WITH updated AS (
+                    UPDATE page_analytics p
+                    SET user_agent_id = ua.id
+                    FROM user_agents ua
+                    WHERE p.timestamp >= :day
+                      AND p.timestamp < :day + INTERVAL '1 day'
+                      AND p.user_agent_id IS NULL
+                      AND p.user_agent IS NOT NULL
+                      AND ua.ua_hash = sha256(convert_to(p.user_agent,
+                                                         'UTF8'))
+                    RETURNING 1
+                )
+                SELECT COUNT(*) AS count FROM updated""",
+                {'day': row['day']}
+            )
+            updated += result['count'] if result else 0
+
+        report = await self.storage_report()
+        report.update({'agents': total, 'page_views': updated})
+        add_log(
+            "INFO",
+            f"Encoded {updated} page views against {total} user agents; "
+            f"{report['raw_bytes']} bytes of agent strings vs "
+            f"{report['encoded_bytes']} bytes encoded",
+            module="user_agents", function="backfill"
+        )
+        return report
+
+    async def storage_report(self) -> Dict[str, Any]:
+        """Bytes the raw agent strings take in page_analytics against
+        the integer references plus the dimension table."""
+        row = await database.fetch_one(
+            """SELECT
+                COALESCE(SUM(pg_column_size(user_agent)), 0) AS raw_bytes,
+                COUNT(user_agent_id) * 4 AS reference_bytes,
+                pg_total_relation_size('user_agents') AS dimension_bytes
+            FROM page_analytics"""
+        )
+        raw = int(row['raw_bytes'])
+        encoded = int(row['reference_bytes']) + int(row['dimension_bytes'])
+        return {
+            'raw_bytes': raw,
+            'encoded_bytes': encoded,
+            'saved_bytes': raw - encoded
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'cache': self.cache.stats()
+        }
+
+
+# Global user agent dimension
+user_agents = UserAgentDimension()
+
+
+async def _backfill():
+    await database.connect()
+    try:
+        report = await user_agents.backfill()
+        print(f"Encoded {report['page_views']} page views against "
+              f"{report['agents']} user agents")
+        print(f"Agent strings: {report['raw_bytes']:,} bytes; "
+              f"ids + dimension: {report['encoded_bytes']:,} bytes; "
+              f"saved once the raw column is dropped: "
+              f"{report['saved_bytes']:,} bytes")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "backfill":
+        asyncio.run(_backfill())
+    else:
+        print(__doc__)
+        sys.exit(1)
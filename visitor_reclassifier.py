@@ -0,0 +1,398 @@
+"""
+Visitor Re-classification Worker
+Scores page views still marked ``visitor_type = 'pending'`` in bulk and
+writes the verdicts back with one UPDATE per chunk.
+
+Scoring follows ``IPAnalyzer.classify_visitor`` signal for signal, but
+works on whole chunks: IPv4 addresses arrive from PostgreSQL as integers
+and are matched against the compiled bot-network intervals with numpy
+``searchsorted``; user agents, hostnames and organizations repeat
+heavily, so each distinct string is matched once and the flags are
+gathered back to rows by index. User agents already in the user_agents
+dimension use its stored bot verdict. Without numpy the worker falls back to
+``classify_visitor`` per row.
+
+Usage:
+    python visitor_reclassifier.py backfill [YYYY-MM-DD]
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised when numpy is absent
+    np = None
+
+from analytics_rollups import analytics_rollups
+from database import database
+from log_capture import add_log
+from visitor_sketches import visitor_sketches
+
+
+# Score thresholds from IPAnalyzer.classify_visitor
+BOT_THRESHOLD = 4
+SUSPICIOUS_THRESHOLD = 2
+
+
+class BatchVisitorScorer:
+    """Vectorized equivalent of ``IPAnalyzer.classify_visitor``."""
+
+    def __init__(self, analyzer=None):
+        if analyzer is None:
+            from ip_analysis import ip_analyzer
+            analyzer = ip_analyzer
+        self.analyzer = analyzer
+        matcher = analyzer.bot_network_matcher
+        if np is not None:
+            self.v4_starts = np.array(matcher.v4_starts, dtype=np.int64)
+            self.v4_ends = np.array(matcher.v4_ends, dtype=np.int64)
+
+    @property
+    def vectorized(self) -> bool:
+        return np is not None
+
+    def score(self, rows: Sequence[Dict[str, Any]]) -> List[str]:
+        """Return a visitor type for every row.
+
+        Rows need ``ip_address``, ``ip_int`` (IPv4 as an integer, else
+        None), ``user_agent``, ``reverse_dns``, ``organization`` and
+        ``mouse_activity``, and may carry ``ua_is_bot``.
+        """
+        if not rows:
+            return []
+        if np is None:
+            return [self._score_row(row) for row in rows]
+
+        mouse = np.fromiter((bool(row['mouse_activity']) for row in rows),
+                            dtype=bool, count=len(rows))
+
+        hostnames = self._match_column(rows, 'reverse_dns')
+        organizations = self._match_column(rows, 'organization')
+
+        signals = np.where(mouse, 0, 1)
+        signals += 3 * self._user_agent_flags(rows)
+        signals += np.where(_flags(hostnames, 'bot_hostname'), 3,
+                            np.where(_flags(hostnames, 'datacenter'), 1, 0))
+        signals += 2 * self._bot_network_flags(rows)
+        signals += _flags(organizations, 'datacenter')
+
+        visitor_types = np.where(
+            signals >= BOT_THRESHOLD, 'bot',
+            np.where(signals >= SUSPICIOUS_THRESHOLD, 'suspicious',
+                     np.where(mouse & (signals == 0), 'human', 'unknown')))
+        return visitor_types.tolist()
+
+    def _match_column(self, rows, column: str):
+        """Match each distinct string in a column once.
+
+        Returns ``(inverse, matches)`` where ``matches[inverse[i]]`` is
+        the category set for row ``i``.
+        """
+        codes: Dict[str, int] = {}
+        inverse = np.fromiter(
+            (codes.setdefault(row[column] or '', len(codes)) for row in rows),
+            dtype=np.int64, count=len(rows))
+        match = self.analyzer.signatures.match
+        return inverse, [match(text) for text in codes]
+
+    def _user_agent_flags(self, rows) -> 'np.ndarray':
+        """Bot user agent flag per row. Rows carrying the verdict stored
+        in the user_agents dimension (``ua_is_bot``) skip matching."""
+        flags = np.fromiter((bool(row.get('ua_is_bot')) for row in rows),
+                            dtype=bool, count=len(rows))
+        unknown = [i for i, row in enumerate(rows)
+                   if row.get('ua_is_bot') is None]
+        if unknown:
+            flags[unknown] = _flags(
+                self._match_column([rows[i] for i in unknown], 'user_agent'),
+                'bot_user_agent')
+        return flags
+
+    def _bot_network_flags(self, rows) -> 'np.ndarray':
+        is_v4 = np.fromiter((row['ip_int'] is not None for row in rows),
+                            dtype=bool, count=len(rows))
+        ips = np.fromiter(
+            (row['ip_int'] if row['ip_int'] is not None else -1
+             for row in rows),
+            dtype=np.int64, count=len(rows))
+
+        flags = np.zeros(len(rows), dtype=bool)
+        if len(self.v4_starts):
+            index = np.searchsorted(self.v4_starts, ips, side='right') - 1
+            safe = np.maximum(index, 0)
+            flags = is_v4 & (index >= 0) & (ips <= self.v4_ends[safe])
+
+        # IPv6 does not fit in int64; those rows use the bisect matcher
+        for i in np.flatnonzero(~is_v4):
+            if rows[i]['ip_address']:
+                flags[i] = self.analyzer.is_known_bot_network(
+                    rows[i]['ip_address'])
+        return flags
+
+    def _score_row(self, row: Dict[str, Any]) -> str:
+        analyzer = self.analyzer
+        organization = row['organization']
+        return analyzer.classify_visitor(
+            row['ip_address'] or '', row['user_agent'] or '',
+            bool(row['mouse_activity']), row['reverse_dns'],
+            {'is_datacenter': analyzer._is_datacenter_org(organization)}
+            if organization else None
+        )
+
+
+def _flags(column_matches, category: str) -> 'np.ndarray':
+    """Gather a per-row flag for one category from ``_match_column``."""
+    inverse, matches = column_matches
+    unique_flags = np.fromiter((category in m for m in matches),
+                               dtype=bool, count=len(matches))
+    return unique_flags[inverse]
+
+
+class VisitorReclassifier:
+    """Periodically scores pending page views in chunks."""
+
+    def __init__(self,
+                 interval: Optional[float] = None,
+                 chunk_size: Optional[int] = None,
+                 min_age: Optional[float] = None,
+                 lookback_hours: Optional[int] = None):
+        self.interval = interval or float(
+            os.getenv("RECLASSIFY_INTERVAL", "60"))
+        self.chunk_size = chunk_size or int(
+            os.getenv("RECLASSIFY_CHUNK_SIZE", "5000"))
+        # Give mouse-activity beacons time to arrive before scoring
+        self.min_age = min_age or float(
+            os.getenv("RECLASSIFY_MIN_AGE", "300"))
+        self.lookback_hours = lookback_hours or int(
+            os.getenv("RECLASSIFY_LOOKBACK_HOURS", "48"))
+        self._scorer: Optional[BatchVisitorScorer] = None
+        self._task: Optional[asyncio.Task] = None
+        self._backfill_task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        # One pass at a time, so a backfill and the periodic run never
+        # score and write the same pending rows concurrently
+        self._pass_lock = asyncio.Lock()
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    @property
+    def scorer(self) -> BatchVisitorScorer:
+        if self._scorer is None:
+            self._scorer = BatchVisitorScorer()
+        return self._scorer
+
+    # ------------------------------------------------------------------
+    # Background job
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._stopping:
+            self._stopping.set()
+        for task in (self._task, self._backfill_task):
+            if task is None:
+                continue
+            try:
+                # Both stop between chunks once stopping is set
+                await task
+            except Exception as e:
+                print(f"Visitor re-classification stopped with error: {e}")
+        self._task = None
+        self._backfill_task = None
+
+    def start_backfill(self, since: Optional[datetime] = None) -> bool:
+        """Start a backfill in the background. Returns False if one is
+        already running."""
+        if self._backfill_task and not self._backfill_task.done():
+            return False
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        self._backfill_task = asyncio.create_task(
+            self.run_once(backfill=True, since=since))
+        self._backfill_task.add_done_callback(self._backfill_done)
+        return True
+
+    @staticmethod
+    def _backfill_done(task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        add_log(
+            "ERROR", f"Backfill failed: {task.exception()}",
+            module="visitor_reclassifier", function="start_backfill"
+        )
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.run_once()
+            except Exception as e:
+                add_log(
+                    "ERROR", f"Re-classification failed: {str(e)}",
+                    module="visitor_reclassifier", function="_run"
+                )
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    # ------------------------------------------------------------------
+    # Batch scoring
+    # ------------------------------------------------------------------
+
+    async def run_once(self, backfill: bool = False,
+                       since: Optional[datetime] = None) -> Dict[str, Any]:
+        """Score every eligible pending row, one chunk at a time.
+
+        The regular run only looks back ``lookback_hours`` so it touches
+        the newest partitions. ``backfill`` walks all history (or from
+        ``since``) and refreshes the rollups over the rows it changed.
+        """
+        async with self._pass_lock:
+            return await self._run_once(backfill, since)
+
+    async def _run_once(self, backfill: bool,
+                        since: Optional[datetime]) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        if since is None and not backfill:
+            since = now - timedelta(hours=self.lookback_hours)
+        until = now - timedelta(seconds=self.min_age)
+
+        started = time.perf_counter()
+        rows_scored = 0
+        chunks = 0
+        earliest: Optional[datetime] = None
+        after = (since or datetime(1970, 1, 1, tzinfo=timezone.utc), 0)
+
+        while True:
+            if self._stopping is not None and self._stopping.is_set():
+                break
+            rows = await self._fetch_chunk(after, until)
+            if not rows:
+                break
+            visitor_types = self.scorer.score(rows)
+            await self._write_chunk(rows, visitor_types)
+            visitor_sketches.observe_verdicts(rows, visitor_types)
+
+            rows_scored += len(rows)
+            chunks += 1
+            if earliest is None:
+                earliest = rows[0]['timestamp']
+            after = (rows[-1]['timestamp'], rows[-1]['id'])
+            if len(rows) < self.chunk_size:
+                break
+            # Let request handlers run between chunks
+            await asyncio.sleep(0)
+
+        elapsed = time.perf_counter() - started
+        if backfill and earliest is not None:
+            await analytics_rollups.refresh(since=earliest)
+
+        self.last_run = {
+            'mode': 'backfill' if backfill else 'incremental',
+            'rows': rows_scored,
+            'chunks': chunks,
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(rows_scored / elapsed, 1) if elapsed else 0,
+            'vectorized': self.scorer.vectorized,
+            'at': now.isoformat()
+        }
+        if rows_scored:
+            add_log(
+                "INFO", f"Classified {rows_scored} pending page views in "
+                f"{elapsed:.2f}s ({self.last_run['rows_per_sec']} rows/sec)",
+                module="visitor_reclassifier", function="run_once"
+            )
+        return self.last_run
+
+    async def _fetch_chunk(self, after, until: datetime):
+        """Next chunk of pending rows in (timestamp, id) order."""
+        return await database.fetch_all(
+            """SELECT p.id, p.timestamp,
+                      split_part(p.ip_address::text, '/', 1) AS ip_address,
+                      CASE WHEN family(p.ip_address) = 4
+                           THEN p.ip_address - '0.0.0.0'::inet END AS ip_int,
+                      p.user_agent, p.reverse_dns, p.organization,
+                      COALESCE(p.mouse_activity, FALSE) AS mouse_activity,
+                      ua.is_bot AS ua_is_bot
+            FROM page_analytics p
+            LEFT JOIN user_agents ua ON ua.id = p.user_agent_id
+            WHERE p.visitor_type = 'pending'
+              AND p.timestamp < :until
+              AND (p.timestamp, p.id) > (:after_timestamp, :after_id)
+            ORDER BY p.timestamp, p.id
+            LIMIT :chunk_size""",
+            {
+                'until': until,
+                'after_timestamp': after[0],
+                'after_id': after[1],
+                'chunk_size': self.chunk_size
+            }
+        )
+
+    async def _write_chunk(self, rows, visitor_types: List[str]):
+        """Apply a whole chunk of verdicts with a single UPDATE."""
+        await database.execute(
+            """UPDATE page_analytics AS p
+            SET visitor_type = v.visitor_type
+            FROM unnest(CAST(:ids AS INTEGER[]),
+                        CAST(:timestamps AS TIMESTAMPTZ[]),
+                        CAST(:visitor_types AS TEXT[]))
+                 AS v(id, timestamp, visitor_type)
+            WHERE p.id = v.id
+              AND p.timestamp = v.timestamp
+              AND p.visitor_type = 'pending'""",
+            {
+                'ids': [row['id'] for row in rows],
+                'timestamps': [row['timestamp'] for row in rows],
+                'visitor_types': visitor_types
+            }
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'interval': self.interval,
+            'chunk_size': self.chunk_size,
+            'min_age': self.min_age,
+            'lookback_hours': self.lookback_hours,
+            'numpy': np is not None,
+            'running': bool(self._task and not self._task.done()),
+            'backfill_running': bool(self._backfill_task
+                                     and not self._backfill_task.done()),
+            'last_run': self.last_run
+        }
+
+
+# Global re-classification worker
+visitor_reclassifier = VisitorReclassifier()
+
+
+async def _backfill(since: Optional[datetime]):
+    await database.connect()
+    try:
+        result = await visitor_reclassifier.run_once(backfill=True,
+                                                     since=since)
+        print(result)
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "backfill":
+        start = (datetime.fromisoformat(sys.argv[2]).replace(
+            tzinfo=timezone.utc) if len(sys.argv) == 3 else None)
+        asyncio.run(_backfill(start))
+    else:
+        print(__doc__)
+        sys.exit(1)